@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""bench_write_intermediate.py — time the read / blend / write phases of the writers.
+
+Generates synthetic ERA5 and CC-signal files (see ``fixtures.py``) for the
+requested grid size, runs the stages of the WRF or CRYOWRF writer on them
+day by day (:func:`read_day`, :func:`blend_timestep`, :func:`write_timestep`,
+as :func:`process_day` does) and times each phase separately:
+
+- ``read``: iterating :func:`read_day`, i.e. reading the ERA5 fields and the
+  anomaly months of every timestep (throughput in MB of ERA5 files read);
+- ``blend``: adding the anomalies (MB of float32 fields produced);
+- ``write``: writing the intermediate files (MB written).
+
+The results, with timesteps/s and MB/s per phase and the peak RSS of the
+benchmark process, are printed and can be saved as JSON; ``--baseline``
+compares them with a previous JSON result to spot regressions between
+versions.
+
+Usage
+-----
+    python benchmarks/bench_write_intermediate.py --grid toy
+    python benchmarks/bench_write_intermediate.py --grid full --days 1 --output full.json
+    python benchmarks/bench_write_intermediate.py --grid small --baseline small-v0.1.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+
+from pgw4era import __version__
+from pgw4era.anomalies import AnomalyStore
+from pgw4era.blend import Blender
+from pgw4era.config import load_config
+from pgw4era.utils import compute_dtype
+
+_HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(_HERE))
+from fixtures import GRIDS, STEPS_PER_DAY  # noqa: E402
+
+PHASES = ("read", "blend", "write")
+
+
+def ensure_fixtures(root: Path, nlat: int, nlon: int, days: int) -> Path:
+    """Return the config of the fixtures for this grid, generating them if needed.
+
+    Fixtures are generated in a separate process so that the memory used to
+    write them does not count towards the peak RSS of the benchmark.
+    """
+    data = root / f"{nlat}x{nlon}x{days}d"
+    config = data / "pgw4era.toml"
+    if not config.exists():
+        print(f"Generating {nlat} x {nlon} fixtures for {days} day(s) in {data}")
+        subprocess.run(
+            [sys.executable, str(_HERE / "fixtures.py"), "--out", str(data)]
+            + ["--nlat", str(nlat), "--nlon", str(nlon), "--days", str(days)],
+            check=True,
+        )
+    return config
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss / 1024**2 if sys.platform == "darwin" else maxrss / 1024
+
+
+def run_once(cfg, profile: str, days: list[dt.date], outdir: Path) -> dict[str, dict]:
+    """Run the writer stages over *days* and return the time and volume of each phase."""
+    if profile == "wrf":
+        from pgw4era.wrf import write_intermediate as module
+    else:
+        from pgw4era.cryowrf import write_intermediate as module
+
+    with nc.Dataset(Path(cfg.ERA5netcdf_dir) / cfg.ERA5_sfc_ref_file) as ref:
+        lat = ref.variables["latitude"][:]
+        lon = ref.variables["longitude"][:]
+
+    writer = module.load_writer(cfg.writer_backend)
+    blender = Blender(compute_dtype(cfg.precision))
+    seconds = dict.fromkeys(PHASES, 0.0)
+    nbytes = dict.fromkeys(PHASES, 0)
+    ntimesteps = 0
+
+    cwd = os.getcwd()
+    os.chdir(outdir)
+    try:
+        with AnomalyStore.from_config(cfg) as anoms, contextlib.redirect_stdout(io.StringIO()):
+            for date in days:
+                for kind in ("pl", "sfc"):
+                    path = Path(cfg.ERA5netcdf_dir) / f"era5_daily_{kind}_{date:%Y%m%d}.nc"
+                    nbytes["read"] += path.stat().st_size
+                steps = module.read_day(date, cfg, anoms, overwrite_file=True)
+                out = None
+                while True:
+                    t0 = time.perf_counter()
+                    step = next(steps, None)
+                    t1 = time.perf_counter()
+                    seconds["read"] += t1 - t0
+                    if step is None:
+                        break
+                    out = module.blend_timestep(step, cfg, lat, lon, blender, out)
+                    t2 = time.perf_counter()
+                    module.write_timestep(writer, step.filedate, *out, lat, lon)
+                    t3 = time.perf_counter()
+                    seconds["blend"] += t2 - t1
+                    seconds["write"] += t3 - t2
+                    nbytes["blend"] += sum(fields.nbytes for fields in out)
+                    ntimesteps += 1
+        nbytes["write"] = sum(path.stat().st_size for path in outdir.iterdir())
+    finally:
+        os.chdir(cwd)
+
+    return {
+        phase: {
+            "seconds": seconds[phase],
+            "timesteps": ntimesteps,
+            "timesteps_per_s": ntimesteps / seconds[phase] if seconds[phase] else None,
+            "mb": nbytes[phase] / 1024**2,
+            "mb_per_s": nbytes[phase] / 1024**2 / seconds[phase] if seconds[phase] else None,
+        }
+        for phase in PHASES
+    }
+
+
+def git_commit() -> str | None:
+    """Commit of the working tree, if it is a git checkout."""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=_HERE,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def benchmark(args: argparse.Namespace) -> dict:
+    """Run the benchmark described by the command-line *args* and return its result."""
+    nlat, nlon = GRIDS[args.grid]
+    nlat = args.nlat or nlat
+    nlon = args.nlon or nlon
+
+    root = Path(args.workdir) if args.workdir else Path(tempfile.gettempdir()) / "pgw4era-bench"
+    config = ensure_fixtures(root, nlat, nlon, args.days)
+    cfg = load_config(config, args.profile)
+    cfg.writer_backend = args.writer_backend
+    cfg.precision = args.precision
+    cfg.era5_window_mb = args.era5_window_mb
+
+    first_day = dt.date(cfg.syear, cfg.smonth, 1)
+    days = [first_day + dt.timedelta(days=n) for n in range(args.days)]
+
+    runs = []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory(dir=root) as outdir:
+            runs.append(run_once(cfg, args.profile, days, Path(outdir)))
+    # Best of the repeats, phase by phase
+    phases = {phase: min((r[phase] for r in runs), key=lambda p: p["seconds"]) for phase in PHASES}
+    total = sum(phases[phase]["seconds"] for phase in PHASES)
+
+    return {
+        "benchmark": "write_intermediate",
+        "created": dt.datetime.now().isoformat(timespec="seconds"),
+        "pgw4era_version": __version__,
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "netCDF4": nc.__version__,
+        "platform": platform.platform(),
+        "parameters": {
+            "profile": args.profile,
+            "nlat": nlat,
+            "nlon": nlon,
+            "days": args.days,
+            "timesteps": args.days * STEPS_PER_DAY,
+            "writer_backend": args.writer_backend,
+            "precision": args.precision,
+            "era5_window_mb": args.era5_window_mb,
+            "repeat": args.repeat,
+        },
+        "phases": phases,
+        "total": {
+            "seconds": total,
+            "timesteps_per_s": phases["read"]["timesteps"] / total if total else None,
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def report(result: dict, baseline: dict | None = None) -> None:
+    """Print a result table, with the speed-up over *baseline* if given."""
+    params = result["parameters"]
+    print(
+        f"{params['profile']} {params['nlat']} x {params['nlon']} grid, "
+        f"{params['timesteps']} timesteps, writer {params['writer_backend']}, "
+        f"precision {params['precision']}"
+    )
+    header = f"{'phase':<8}{'seconds':>10}{'steps/s':>10}{'MB/s':>10}"
+    if baseline:
+        header += f"{'speed-up':>10}"
+    print(header)
+    rows = [(phase, result["phases"][phase]) for phase in PHASES]
+    rows.append(("total", result["total"]))
+    for name, stats in rows:
+        mb_per_s = stats.get("mb_per_s")
+        line = f"{name:<8}{stats['seconds']:>10.3f}{stats['timesteps_per_s'] or 0:>10.2f}"
+        line += f"{mb_per_s:>10.1f}" if mb_per_s is not None else f"{'':>10}"
+        if baseline:
+            base = baseline["total"] if name == "total" else baseline["phases"][name]
+            line += f"{base['seconds'] / stats['seconds']:>9.2f}x" if stats["seconds"] else ""
+        print(line)
+    print(f"peak RSS: {result['peak_rss_mb']:.1f} MiB", end="")
+    if baseline:
+        print(f" (baseline {baseline['peak_rss_mb']:.1f} MiB)", end="")
+    print()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the read / blend / write phases of the intermediate-file writers.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--profile", choices=["wrf", "cryowrf"], default="wrf")
+    parser.add_argument("--grid", choices=list(GRIDS), default="toy", help="Named grid size.")
+    parser.add_argument("--nlat", type=int, help="Number of latitudes (overrides --grid).")
+    parser.add_argument("--nlon", type=int, help="Number of longitudes (overrides --grid).")
+    parser.add_argument("--days", type=int, default=1, help="Number of ERA5 days to process.")
+    parser.add_argument("--repeat", type=int, default=1, help="Repeats; the best is kept.")
+    parser.add_argument("--writer-backend", choices=["auto", "fortran", "numpy"], default="auto")
+    parser.add_argument("--precision", choices=["float32", "float64"], default="float32")
+    parser.add_argument("--era5-window-mb", type=float, default=None)
+    parser.add_argument(
+        "--workdir",
+        help="Directory for the fixtures (reused across runs) and outputs "
+        "(default: <tmp>/pgw4era-bench).",
+    )
+    parser.add_argument("--output", help="Write the result to this JSON file.")
+    parser.add_argument("--baseline", help="Previous JSON result to compare with.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    result = benchmark(args)
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    report(result, baseline)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2) + "\n")
+        print(f"Result written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""fixtures.py — synthetic ERA5 and CMIP6 CC-signal files for the benchmarks.
+
+Writes, for a regular 0.3° latitude-longitude grid of any size, the inputs
+read by the WRF and CRYOWRF writers:
+
+- ``era5_daily_pl_YYYYMMDD.nc``: ``r``, ``t``, ``u``, ``v``, ``z`` on the 37
+  ERA5 pressure levels (ascending, as downloaded from the CDS), packed int16;
+- ``era5_daily_sfc_YYYYMMDD.nc``: ``d2m``, ``t2m``, ``u10``, ``v10``, ``sp``,
+  ``msl``, ``skt``, ``sd``, ``rsn``, packed int16;
+- ``<var>_<periods>_<experiments>_CC_signal_pinterp.nc`` (3-D) and
+  ``..._CC_signal.nc`` (2-D): 12 monthly float32 anomalies;
+- ``pgw4era.toml``: a configuration with ``wrf`` and ``cryowrf`` profiles
+  pointing at them.
+
+Fields are written one timestep (or month) at a time, so even the full
+1200 x 601 x 37 ERA5 grid is generated with little memory.
+
+Usage
+-----
+    python benchmarks/fixtures.py --grid toy --out /tmp/pgw4era-bench/toy
+    python benchmarks/fixtures.py --nlat 601 --nlon 1200 --days 2 --out /scratch/bench
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+
+#: Named grid sizes ``(nlat, nlon)``; ``full`` is the global 0.3° ERA5 grid.
+GRIDS: dict[str, tuple[int, int]] = {
+    "toy": (7, 9),
+    "small": (61, 120),
+    "medium": (201, 400),
+    "full": (601, 1200),
+}
+
+#: ERA5 pressure levels (hPa), in the ascending order of the CDS files.
+LEVELS = [
+    1, 2, 3, 5, 7, 10, 20, 30, 50, 70, 100, 125, 150, 175, 200, 225, 250, 300, 350,
+    400, 450, 500, 550, 600, 650, 700, 750, 775, 800, 825, 850, 875, 900, 925, 950,
+    975, 1000,
+]  # fmt: skip
+
+# (ERA5 code, typical value, spread) of the generated fields
+_PL_FIELDS = [("r", 50.0, 30.0), ("t", 250.0, 30.0), ("u", 0.0, 10.0), ("v", 0.0, 10.0),
+              ("z", 50000.0, 30000.0)]  # fmt: skip
+_SFC_FIELDS = [("d2m", 270.0, 10.0), ("t2m", 285.0, 10.0), ("u10", 0.0, 5.0), ("v10", 0.0, 5.0),
+               ("sp", 95000.0, 3000.0), ("msl", 101000.0, 1000.0), ("skt", 285.0, 10.0),
+               ("sd", 0.1, 0.1), ("rsn", 250.0, 50.0)]  # fmt: skip
+
+VARS3D = ["ta", "ua", "va", "zg", "hur"]
+VARS2D = ["hurs", "tas", "ps", "ts", "vas", "uas", "psl"]
+
+PERIODS = [[2004, 2023], [2031, 2050]]
+EXPERIMENTS = ["historical", "ssp585"]
+RESOLUTION = 0.3
+STEPS_PER_DAY = 8
+
+
+def _pattern(rng: np.random.Generator, nlat: int, nlon: int) -> np.ndarray:
+    """Smooth-ish float32 field in [-1, 1] with some small-scale noise."""
+    lat = np.linspace(-np.pi / 2, np.pi / 2, nlat, dtype="float32")[:, None]
+    lon = np.linspace(0, 2 * np.pi, nlon, endpoint=False, dtype="float32")[None, :]
+    noise = rng.uniform(-0.1, 0.1, size=(nlat, nlon)).astype("float32")
+    return np.clip(0.9 * np.sin(2 * lat) * np.cos(3 * lon) + noise, -1, 1)
+
+
+def _create_grid(ds: nc.Dataset, nlat: int, nlon: int, lat_name: str, lon_name: str) -> None:
+    ds.createDimension(lon_name, nlon)
+    ds.createDimension(lat_name, nlat)
+    ds.createVariable(lon_name, "f4", (lon_name,))[:] = np.arange(nlon) * RESOLUTION
+    ds.createVariable(lat_name, "f4", (lat_name,))[:] = 90.0 - np.arange(nlat) * RESOLUTION
+
+
+def write_era5_day(out: Path, date: dt.date, nlat: int, nlon: int, seed: int = 0) -> None:
+    """Write the pressure-level and surface ERA5 files of one day."""
+    rng = np.random.default_rng(seed + date.toordinal())
+    pattern = _pattern(rng, nlat, nlon)
+    hours0 = (dt.datetime(date.year, date.month, date.day) - dt.datetime(1900, 1, 1)).days * 24
+
+    for kind, fields in (("pl", _PL_FIELDS), ("sfc", _SFC_FIELDS)):
+        with nc.Dataset(out / f"era5_daily_{kind}_{date:%Y%m%d}.nc", "w") as ds:
+            _create_grid(ds, nlat, nlon, "latitude", "longitude")
+            ds.createDimension("time", None)
+            time = ds.createVariable("time", "i4", ("time",))
+            time.units = "hours since 1900-01-01 00:00:00.0"
+            time.calendar = "gregorian"
+            time[:] = hours0 + np.arange(STEPS_PER_DAY) * 24 // STEPS_PER_DAY
+            dims = ("time", "latitude", "longitude")
+            if kind == "pl":
+                ds.createDimension("level", len(LEVELS))
+                ds.createVariable("level", "i4", ("level",))[:] = LEVELS
+                dims = ("time", "level", "latitude", "longitude")
+            for code, base, spread in fields:
+                var = ds.createVariable(code, "i2", dims)
+                var.scale_factor = spread / 10000.0
+                var.add_offset = base
+                for nt in range(STEPS_PER_DAY):
+                    field = base + spread * np.roll(pattern, nt, axis=1)
+                    if kind == "pl":
+                        scale = np.linspace(0.5, 1.0, len(LEVELS), dtype="float32")
+                        field = base + (field - base) * scale[:, None, None]
+                    var[nt] = field
+
+
+def write_anomalies(out: Path, nlat: int, nlon: int, seed: int = 0) -> None:
+    """Write the 12-month CC-signal files of every variable."""
+    rng = np.random.default_rng(seed)
+    pattern = _pattern(rng, nlat, nlon)
+    stem = f"{PERIODS[0][0]}-{PERIODS[0][1]}_{PERIODS[1][0]}-{PERIODS[1][1]}"
+    stem += f"_{EXPERIMENTS[0]}-{EXPERIMENTS[1]}"
+
+    for var in VARS3D + VARS2D:
+        is3d = var in VARS3D
+        suffix = "CC_signal_pinterp" if is3d else "CC_signal"
+        with nc.Dataset(out / f"{var}_{stem}_{suffix}.nc", "w") as ds:
+            ds.createDimension("time", None)
+            dims = ["time"]
+            if is3d:
+                ds.createDimension("plev", len(LEVELS))
+                ds.createVariable("plev", "f8", ("plev",))[:] = np.array(LEVELS) * 100.0
+                dims.append("plev")
+            _create_grid(ds, nlat, nlon, "lat", "lon")
+            dims += ["lat", "lon"]
+            anom = ds.createVariable(var, "f4", dims, fill_value=1e20)
+            for month in range(12):
+                field = (1.0 + month / 12.0) * np.roll(pattern, month, axis=0)
+                if is3d:
+                    field = np.broadcast_to(field, (len(LEVELS), nlat, nlon))
+                anom[month] = field
+
+
+def write_config(out: Path, first_day: dt.date) -> Path:
+    """Write a configuration with ``wrf`` and ``cryowrf`` profiles for the fixtures."""
+    next_month = (first_day.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+    lines = []
+    for profile in ("wrf", "cryowrf"):
+        lines += [
+            f"[{profile}]",
+            f'ERA5netcdf_dir = "{out}"',
+            f'ERA5_sfc_ref_file = "era5_daily_sfc_{first_day:%Y%m%d}.nc"',
+            'ERA5_pl_ref_file = "./era5_plev.nc"',
+            f'CMIP6_monthly_dir = "{out}"',
+            f'CMIP6anom_dir = "{out}"',
+            f"syear = {first_day.year}",
+            f"eyear = {next_month.year}",
+            f"smonth = {first_day.month}",
+            f"emonth = {next_month.month}",
+            f"experiments = {EXPERIMENTS!r}".replace("'", '"'),
+            f"periods = {PERIODS!r}",
+            f"variables_2d = {VARS2D!r}".replace("'", '"'),
+            f"variables_3d = {VARS3D!r}".replace("'", '"'),
+        ]
+        if profile == "cryowrf":
+            lines.append("one_timestep_files = false")
+        lines.append("")
+    path = out / "pgw4era.toml"
+    path.write_text("\n".join(lines))
+    return path
+
+
+def make_fixtures(
+    out: str | Path,
+    nlat: int,
+    nlon: int,
+    days: int = 1,
+    first_day: dt.date = dt.date(2009, 12, 1),
+    seed: int = 0,
+) -> Path:
+    """Write a complete set of benchmark inputs into *out*.
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the generated configuration file.
+    """
+    out = Path(out).resolve()
+    out.mkdir(parents=True, exist_ok=True)
+    for n in range(days):
+        write_era5_day(out, first_day + dt.timedelta(days=n), nlat, nlon, seed)
+    write_anomalies(out, nlat, nlon, seed)
+    return write_config(out, first_day)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic ERA5 / CMIP6 CC-signal files for the benchmarks.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--out", required=True, help="Output directory.")
+    parser.add_argument("--grid", choices=list(GRIDS), default="toy", help="Named grid size.")
+    parser.add_argument("--nlat", type=int, help="Number of latitudes (overrides --grid).")
+    parser.add_argument("--nlon", type=int, help="Number of longitudes (overrides --grid).")
+    parser.add_argument("--days", type=int, default=1, help="Number of ERA5 days.")
+    parser.add_argument(
+        "--first-day",
+        type=dt.date.fromisoformat,
+        default=dt.date(2009, 12, 1),
+        help="First ERA5 day (YYYY-MM-DD).",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    nlat, nlon = GRIDS[args.grid]
+    nlat = args.nlat or nlat
+    nlon = args.nlon or nlon
+    config = make_fixtures(args.out, nlat, nlon, args.days, args.first_day, args.seed)
+    print(f"Wrote {args.days} day(s) of {nlat} x {nlon} fixtures; config: {config}")
+
+
+if __name__ == "__main__":
+    main()
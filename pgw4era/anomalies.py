@@ -0,0 +1,872 @@
+"""pgw4era.anomalies — cached access to the CMIP6 climate-change signal files.
+
+The WRF and CRYOWRF writers need, for every output timestep, the anomaly of
+two consecutive months (``i1`` and ``i2``) for every variable.  Opening the
+``*_CC_signal_pinterp.nc`` / ``*_CC_signal.nc`` files and re-reading those
+months at every timestep dominates the I/O of a long run, so
+:class:`AnomalyStore` opens each file once and keeps recently used months in
+memory, evicting the least recently used month when the memory budget is
+exceeded.
+
+The level reversal, NaN sanitizing and float32 conversion of the anomalies
+do not depend on the timestep either.  :func:`compile_anomaly_pack` does them
+once, writing all variables into a single binary "anomaly pack" that
+:class:`AnomalyPack` memory-maps, so that every month of every variable is a
+zero-copy view of the file.
+
+Between two mid-months the writers interpolate the anomaly linearly in time,
+with weights that only depend on the calendar (common or leap year) and the
+time of year.  In the day-of-year mode (``anomaly_mode = "doy"``)
+:func:`compile_anomaly_cube` interpolates the anomalies of every output time
+of both calendars once, and :class:`AnomalyCube` serves them to every year of
+the run, leaving a single addition per field and timestep.  The weights are
+identical to those of the exact mode, so the two modes differ only by the
+storage of the interpolated anomaly as float32: not at all with
+``precision = "float32"``, by at most one float32 rounding of the anomaly
+before the final rounding with ``precision = "float64"``.
+"""
+
+from __future__ import annotations
+
+import calendar
+import datetime as dt
+import json
+import os
+import struct
+from collections import OrderedDict
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from types import SimpleNamespace
+
+import netCDF4 as nc
+import numpy as np
+
+from pgw4era.blend import Blender
+from pgw4era.domain import GridWindow
+from pgw4era.ensemble import statistic_suffix
+from pgw4era.era5 import unpack
+from pgw4era.utils import calc_interp_weights, compute_dtype
+
+
+def anomaly_path(cfg: SimpleNamespace, var: str, is3d: bool) -> str:
+    """Return the path of the CC-signal file of *var* for the configured periods.
+
+    3-D variables are read from the files interpolated to ERA5 pressure levels
+    (``*_CC_signal_pinterp.nc``), 2-D variables from ``*_CC_signal.nc``.  The
+    files of the ensemble statistic ``cfg.cc_signal_statistic`` are used
+    (e.g. ``*_CC_signal_median.nc``), by default the ensemble mean.
+    """
+    syearp, eyearp = cfg.periods[0]
+    syearf, eyearf = cfg.periods[1]
+    statistic = getattr(cfg, "cc_signal_statistic", "mean")
+    suffix = "CC_signal" + statistic_suffix(statistic) + ("_pinterp" if is3d else "")
+    return (
+        f"{cfg.CMIP6anom_dir}/{var}_{syearp}-{eyearp}_{syearf}-{eyearf}"
+        f"_{cfg.experiments[0]}-{cfg.experiments[1]}_{suffix}.nc"
+    )
+
+
+def _check_grid(
+    cfg: SimpleNamespace,
+    window: GridWindow | None,
+    grid: tuple[np.ndarray, np.ndarray] | None,
+) -> None:
+    """Refuse CC-signal files whose grid, restricted to *window*, is not *grid*.
+
+    *grid* holds the latitudes and longitudes processed by the writers: the
+    ERA5 grid, or the coordinates of *window* on it.  The window is built
+    from the ERA5 grid, so CC-signal files on another grid (e.g. regridded
+    to the global ERA5 grid while ERA5 was downloaded for a region) would be
+    read at the wrong points.  Nothing is checked if *grid* is ``None``, and
+    missing files are left to the caller.
+
+    Raises
+    ------
+    ValueError
+        If a CC-signal file is on another grid.
+    """
+    if grid is None:
+        return
+    lat, lon = (np.asarray(coord, dtype=float) for coord in grid)
+    for var in cfg.variables_3d + cfg.variables_2d:
+        path = anomaly_path(cfg, var, var in cfg.variables_3d)
+        if not os.path.exists(path):
+            continue
+        with nc.Dataset(path) as ds:
+            variable = ds.variables[var]
+            nlat, nlon = variable.shape[-2:]
+            shape = (nlat, nlon) if window is None else window.shape(nlat, nlon)
+            if shape != (len(lat), len(lon)):
+                problem = f"{shape[0]} x {shape[1]} points, not {len(lat)} x {len(lon)}"
+            else:
+                # Coordinate variables share the names of the dimensions
+                coords = [ds.variables.get(dim) for dim in variable.dimensions[-2:]]
+                if any(coord is None for coord in coords):
+                    continue
+                var_lat, var_lon = coords[0][:], coords[1][:]
+                if window is not None:
+                    var_lat, var_lon = window.coords(var_lat, var_lon)
+                dlon = (np.asarray(var_lon, dtype=float) - lon + 180.0) % 360.0 - 180.0
+                if np.allclose(var_lat, lat, atol=1e-3) and np.allclose(dlon, 0.0, atol=1e-3):
+                    continue
+                problem = "other coordinates"
+        raise ValueError(
+            f"CC signal {path} does not match the ERA5 grid being processed ({problem}); "
+            "regrid it to the ERA5 grid (regrid_grid)"
+        )
+
+
+class AnomalyStore:
+    """Serve monthly anomaly fields from CC-signal files opened once per run.
+
+    A month is loaded for all variables at once the first time it is
+    requested.  Up to ``memory_budget_mb`` worth of months is kept in memory
+    (never fewer than two, so a pair of consecutive months is always served
+    from memory); beyond that the least recently used month is evicted.
+
+    3-D fields are returned with the level axis reversed, i.e. in the same
+    order as the ERA5 levels written to the intermediate files.  Missing
+    (masked) values are returned as NaN.
+
+    Parameters
+    ----------
+    files3d, files2d:
+        Mapping of variable name → CC-signal file path.
+    memory_budget_mb:
+        Maximum size of the month cache in MiB.  ``None`` keeps the whole
+        annual cycle in memory.
+    window:
+        Latitude-longitude window to read (see :mod:`pgw4era.domain`).
+        ``None`` reads the whole grid.
+    dtype:
+        Working dtype of the fields: the files are read without netCDF4
+        auto-masking and converted to it (see :func:`pgw4era.era5.unpack`).
+        ``None`` keeps the file dtype and netCDF4's default masked reads.
+    """
+
+    def __init__(
+        self,
+        files3d: dict[str, str],
+        files2d: dict[str, str],
+        memory_budget_mb: float | None = None,
+        window: GridWindow | None = None,
+        dtype: np.dtype | str | None = None,
+    ) -> None:
+        self.vars3d = list(files3d)
+        self.window = window
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.vars2d = list(files2d)
+        self._datasets: dict[str, nc.Dataset] = {}
+        self._cache: OrderedDict[int, dict[str, np.ndarray]] = OrderedDict()
+        try:
+            for var, path in {**files3d, **files2d}.items():
+                self._datasets[var] = nc.Dataset(path, "r")
+                if self.dtype is not None:
+                    self._datasets[var].set_auto_maskandscale(False)
+        except Exception:
+            self.close()
+            raise
+
+        self.month_nbytes = 0
+        for var, ds in self._datasets.items():
+            shape = ds.variables[var].shape[1:]
+            if window is not None:
+                shape = (*shape[:-2], *window.shape(*shape[-2:]))
+            itemsize = (self.dtype or ds.variables[var].dtype).itemsize
+            self.month_nbytes += int(np.prod(shape)) * itemsize
+        if memory_budget_mb is None:
+            self.max_months = 12
+        else:
+            budget = int(memory_budget_mb * 1024**2)
+            self.max_months = min(12, max(2, budget // max(self.month_nbytes, 1)))
+        self.nreads = 0
+
+    @classmethod
+    def from_config(
+        cls,
+        cfg: SimpleNamespace,
+        window: GridWindow | None = None,
+        grid: tuple[np.ndarray, np.ndarray] | None = None,
+    ) -> AnomalyStore:
+        """Build a store for the variables and periods of a configuration profile.
+
+        If *grid*, the ERA5 latitudes and longitudes processed (those of
+        *window*), is given, the CC-signal files must be on it.
+
+        Raises
+        ------
+        ValueError
+            If a CC-signal file is not on *grid*.
+        """
+        _check_grid(cfg, window, grid)
+        files3d = {var: anomaly_path(cfg, var, True) for var in cfg.variables_3d}
+        files2d = {var: anomaly_path(cfg, var, False) for var in cfg.variables_2d}
+        return cls(
+            files3d,
+            files2d,
+            getattr(cfg, "anomaly_cache_mb", None),
+            window,
+            compute_dtype(getattr(cfg, "precision", "float32")),
+        )
+
+    def _read(self, var: str, *index) -> np.ndarray:
+        variable = self._datasets[var].variables[var]
+        if self.window is None:
+            data = variable[(*index, slice(None), slice(None))]
+        else:
+            data = self.window.read(variable, *index)
+        if self.dtype is None:
+            return np.ma.filled(data, np.nan)
+        return unpack(variable, data, self.dtype)
+
+    def _load(self, month: int) -> dict[str, np.ndarray]:
+        fields: dict[str, np.ndarray] = {}
+        for var in self.vars3d:
+            fields[var] = self._read(var, month, slice(None, None, -1))
+        for var in self.vars2d:
+            fields[var] = self._read(var, month)
+        self.nreads += 1
+        return fields
+
+    def month(self, var: str, month: int) -> np.ndarray:
+        """Return the anomaly of *var* for *month* (0-based, January = 0).
+
+        The returned array is shared with the cache and must not be modified
+        in place.
+        """
+        if month in self._cache:
+            self._cache.move_to_end(month)
+        else:
+            self._cache[month] = self._load(month)
+            while len(self._cache) > self.max_months:
+                self._cache.popitem(last=False)
+        return self._cache[month][var]
+
+    @property
+    def cached_months(self) -> list[int]:
+        """Months currently held in memory, least recently used first."""
+        return list(self._cache)
+
+    def close(self) -> None:
+        """Close all anomaly files and drop the cache."""
+        for ds in self._datasets.values():
+            ds.close()
+        self._datasets.clear()
+        self._cache.clear()
+
+    def __enter__(self) -> AnomalyStore:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class SharedAnomalyStore:
+    """Whole anomaly annual cycle held in shared memory for worker processes.
+
+    The parent process builds it once with :meth:`from_store`; worker
+    processes attach to the same blocks with :meth:`attach` using the
+    picklable :attr:`handle`, so the anomalies are loaded once per run
+    whatever the number of workers.  :meth:`month` has the same semantics as
+    :meth:`AnomalyStore.month`, without any disk access.
+
+    Parameters
+    ----------
+    blocks:
+        Mapping of variable name → shared memory block.
+    handle:
+        Mapping of variable name → ``(block name, shape, dtype)``.
+    owner:
+        Whether this instance created the blocks and must unlink them on
+        :meth:`close`.
+    """
+
+    def __init__(
+        self,
+        blocks: dict[str, SharedMemory],
+        handle: dict[str, tuple[str, tuple[int, ...], str]],
+        owner: bool,
+    ) -> None:
+        self._blocks = blocks
+        self.handle = handle
+        self._owner = owner
+        self._cycle = {
+            var: np.ndarray(shape, dtype=dtype, buffer=blocks[var].buf)
+            for var, (_, shape, dtype) in handle.items()
+        }
+
+    @classmethod
+    def from_store(cls, store: AnomalyStore) -> SharedAnomalyStore:
+        """Copy the 12 months of every variable of *store* into shared memory."""
+        blocks: dict[str, SharedMemory] = {}
+        handle: dict[str, tuple[str, tuple[int, ...], str]] = {}
+        cycle: dict[str, np.ndarray] = {}
+        try:
+            for month in range(12):
+                for var in store.vars3d + store.vars2d:
+                    field = store.month(var, month)
+                    if var not in blocks:
+                        shape = (12, *field.shape)
+                        nbytes = int(np.prod(shape)) * field.dtype.itemsize
+                        blocks[var] = SharedMemory(create=True, size=max(nbytes, 1))
+                        handle[var] = (blocks[var].name, shape, field.dtype.str)
+                        cycle[var] = np.ndarray(shape, dtype=field.dtype, buffer=blocks[var].buf)
+                    cycle[var][month] = field
+        except Exception:
+            cycle.clear()
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+            raise
+        cycle.clear()
+        return cls(blocks, handle, owner=True)
+
+    @classmethod
+    def attach(
+        cls, handle: dict[str, tuple[str, tuple[int, ...], str]], track: bool = True
+    ) -> SharedAnomalyStore:
+        """Attach to blocks created by another process's :meth:`from_store`.
+
+        Pass ``track=False`` in processes that were not forked from the
+        owner, so that their resource tracker does not unlink the blocks when
+        they exit.
+        """
+        blocks = {}
+        for var, (name, _, _) in handle.items():
+            blocks[var] = SharedMemory(name=name)
+            if not track:
+                resource_tracker.unregister(blocks[var]._name, "shared_memory")
+        return cls(blocks, handle, owner=False)
+
+    def month(self, var: str, month: int) -> np.ndarray:
+        """Return the anomaly of *var* for *month* (0-based, January = 0).
+
+        The returned array is a read-only view of shared memory.
+        """
+        field = self._cycle[var][month]
+        field.flags.writeable = False
+        return field
+
+    def close(self) -> None:
+        """Detach from the shared blocks, unlinking them if this is the owner."""
+        self._cycle.clear()
+        for block in self._blocks.values():
+            block.close()
+            if self._owner:
+                block.unlink()
+        self._blocks.clear()
+
+    def __enter__(self) -> SharedAnomalyStore:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# Layout of anomaly packs and cubes: magic, header length (uint64 little-endian),
+# JSON header, then records of float32 fields (the months of a pack, the
+# time-of-year slots of a cube), each record holding every variable in turn
+_PACK_MAGIC = b"PGWPACK1"
+_CUBE_MAGIC = b"PGWCUBE1"
+_PACK_ALIGN = 4096
+_FIELD_ALIGN = 64
+
+# Reference years of the two calendars of a cube
+_CUBE_YEARS = {False: 2001, True: 2004}
+
+
+def _align(offset: int, alignment: int) -> int:
+    return -(-offset // alignment) * alignment
+
+
+def _source_stamp(path: str) -> dict:
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _layout(shapes: dict[str, tuple[tuple[int, ...], bool]]) -> tuple[list[dict], int]:
+    """Entries of the variables within a record, and the size of a record."""
+    variables = []
+    nbytes = 0
+    for var, (shape, is3d) in shapes.items():
+        variables.append({"name": var, "is3d": is3d, "shape": list(shape), "offset": nbytes})
+        nbytes = _align(nbytes + 4 * int(np.prod(shape)), _FIELD_ALIGN)
+    return variables, nbytes
+
+
+def _create(part: Path, magic: bytes, header: dict, nrecords: int) -> np.memmap:
+    """Create a pack or cube file of *nrecords* records; return them mapped for writing."""
+    encoded = json.dumps(header).encode()
+    data_offset = _align(len(magic) + 8 + len(encoded), _PACK_ALIGN)
+    with open(part, "wb") as fh:
+        fh.write(magic + struct.pack("<Q", len(encoded)) + encoded)
+        fh.truncate(data_offset + nrecords * header["record_nbytes"])
+    return np.memmap(
+        part, dtype="u1", mode="r+", offset=data_offset, shape=(nrecords, header["record_nbytes"])
+    )
+
+
+def _open(path: Path, magic: bytes, kind: str, nrecords_key: str) -> tuple[dict, np.memmap]:
+    """Header and read-only records of a pack or cube file."""
+    with open(path, "rb") as fh:
+        found, length = fh.read(len(magic)), fh.read(8)
+        if found != magic or len(length) != 8:
+            raise ValueError(f"{path} is not an {kind}")
+        length = struct.unpack("<Q", length)[0]
+        header = json.loads(fh.read(length))
+    data = np.memmap(
+        path,
+        dtype="u1",
+        mode="r",
+        offset=_align(len(magic) + 8 + length, _PACK_ALIGN),
+        shape=(header[nrecords_key], header["record_nbytes"]),
+    )
+    return header, data
+
+
+def _fields(data: np.ndarray, variables: list[dict]) -> dict[str, np.ndarray]:
+    """Float32 views ``(record, *shape)`` of every variable of the records *data*."""
+    fields = {}
+    for entry in variables:
+        nbytes = 4 * int(np.prod(entry["shape"]))
+        block = data[:, entry["offset"] : entry["offset"] + nbytes]
+        fields[entry["name"]] = block.view("<f4").reshape(len(data), *entry["shape"])
+    return fields
+
+
+def _check_sources(cfg: SimpleNamespace, header: dict, kind: str, path: Path) -> None:
+    """Refuse a pack or cube lacking a configured variable or older than its sources."""
+    found = {entry["name"]: entry["is3d"] for entry in header["variables"]}
+    missing = [
+        var
+        for var in cfg.variables_3d + cfg.variables_2d
+        if found.get(var) != (var in cfg.variables_3d)
+    ]
+    stale = [
+        var
+        for var, stamp in header["sources"].items()
+        if os.path.exists(stamp["path"]) and _source_stamp(stamp["path"]) != stamp
+    ]
+    if missing or stale:
+        problem = (
+            f"lacks {', '.join(missing)}"
+            if missing
+            else f"is older than the CC signal of {', '.join(stale)}"
+        )
+        raise ValueError(f"{kind.capitalize()} {path} {problem}; recompile it")
+
+
+def _window_spec(window: GridWindow | None) -> dict | None:
+    if window is None:
+        return None
+    return {
+        "lat": [window.lat.start, window.lat.stop],
+        "lon": [[piece.start, piece.stop] for piece in window.lon],
+    }
+
+
+def compile_anomaly_pack(cfg: SimpleNamespace, path: str | Path) -> Path:
+    """Compile the CC-signal files of a configuration into an anomaly pack.
+
+    Every variable of ``cfg.variables_3d`` and ``cfg.variables_2d`` is read
+    from its file (see :func:`anomaly_path`) one month at a time, the levels
+    of the 3-D variables are reversed to the ERA5 order, missing values are
+    set to zero as the writers would, and the fields are stored as float32.
+    The pack is written under a temporary name and renamed once complete.
+
+    Returns
+    -------
+    pathlib.Path
+        The path of the pack.
+    """
+    path = Path(path)
+    files = {var: (anomaly_path(cfg, var, True), True) for var in cfg.variables_3d}
+    files.update({var: (anomaly_path(cfg, var, False), False) for var in cfg.variables_2d})
+
+    shapes = {}
+    for var, (source, is3d) in files.items():
+        with nc.Dataset(source) as ds:
+            shapes[var] = (ds.variables[var].shape[1:], is3d)
+    variables, record_nbytes = _layout(shapes)
+    header = {
+        "dtype": "<f4",
+        "months": 12,
+        "record_nbytes": record_nbytes,
+        "variables": variables,
+        "sources": {var: _source_stamp(source) for var, (source, _) in files.items()},
+    }
+
+    part = path.with_name(f"{path.name}.part")
+    try:
+        data = _create(part, _PACK_MAGIC, header, 12)
+        fields = _fields(data, variables)
+        for entry in variables:
+            var = entry["name"]
+            with nc.Dataset(files[var][0]) as ds:
+                variable = ds.variables[var]
+                for month in range(12):
+                    index = (month, slice(None, None, -1)) if entry["is3d"] else (month,)
+                    field = np.ma.filled(variable[index], np.nan)
+                    np.nan_to_num(field, copy=False)
+                    fields[var][month] = field
+        data.flush()
+        del fields, data
+    except Exception:
+        part.unlink(missing_ok=True)
+        raise
+    os.replace(part, path)
+    return path
+
+
+class AnomalyPack:
+    """Memory-mapped anomaly pack written by :func:`compile_anomaly_pack`.
+
+    :meth:`month` has the semantics of :meth:`AnomalyStore.month`, except
+    that fields are float32 and missing values are zero; the pages of the
+    pack are shared by all processes mapping it.
+
+    Parameters
+    ----------
+    path:
+        Path of the pack.
+    window:
+        Latitude-longitude window to serve (see :mod:`pgw4era.domain`).
+        ``None`` serves the whole grid.
+
+    Raises
+    ------
+    ValueError
+        If *path* is not an anomaly pack.
+    """
+
+    def __init__(self, path: str | Path, window: GridWindow | None = None) -> None:
+        self.path = Path(path)
+        self.window = window
+        self.header, self._data = _open(self.path, _PACK_MAGIC, "anomaly pack", "months")
+        self.vars3d = [entry["name"] for entry in self.header["variables"] if entry["is3d"]]
+        self.vars2d = [entry["name"] for entry in self.header["variables"] if not entry["is3d"]]
+        self._fields = _fields(self._data, self.header["variables"])
+
+    @classmethod
+    def from_config(
+        cls,
+        cfg: SimpleNamespace,
+        window: GridWindow | None = None,
+        grid: tuple[np.ndarray, np.ndarray] | None = None,
+    ) -> AnomalyPack:
+        """Open the pack ``cfg.anomaly_pack`` for the variables of a configuration.
+
+        If *grid*, the ERA5 latitudes and longitudes processed (those of
+        *window*), is given, the CC-signal files must be on it.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the pack does not exist.
+        ValueError
+            If it lacks a variable of the configuration, a CC-signal file
+            it was compiled from has changed since or is not on *grid*.
+        """
+        path = Path(cfg.anomaly_pack)
+        if not path.exists():
+            raise FileNotFoundError(
+                f"Anomaly pack not found: {path}; compile it with scripts/compile_anomaly_pack.py"
+            )
+        pack = cls(path, window)
+        try:
+            _check_sources(cfg, pack.header, "anomaly pack", path)
+            _check_grid(cfg, window, grid)
+        except ValueError:
+            pack.close()
+            raise
+        return pack
+
+    @property
+    def handle(self) -> tuple[str, GridWindow | None]:
+        """Picklable handle for :meth:`attach` in other processes."""
+        return str(self.path), self.window
+
+    @classmethod
+    def attach(cls, handle: tuple[str, GridWindow | None], track: bool = True) -> AnomalyPack:
+        """Map the pack of *handle* (see :attr:`handle`) in another process."""
+        return cls(*handle)
+
+    def month(self, var: str, month: int) -> np.ndarray:
+        """Return the anomaly of *var* for *month* (0-based, January = 0).
+
+        The returned array is a read-only view of the pack (a copy only for
+        windows crossing the longitude seam).
+        """
+        field = self._fields[var][month]
+        return field if self.window is None else self.window.read(field, ...)
+
+    def close(self) -> None:
+        """Unmap the pack."""
+        self._fields.clear()
+        self._data = None
+
+    def __enter__(self) -> AnomalyPack:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _cube_slots(freq_hours: int) -> tuple[dict[bool, np.ndarray], np.ndarray]:
+    """Distinct interpolation weights of the time-of-year slots of both calendars.
+
+    Returns the slot of every output time of a common and of a leap year, and
+    the weight records of the slots.  The weights only depend on the calendar
+    (see :func:`pgw4era.utils.calc_midmonth`), and times after the leap day
+    mostly share their slots with the common year.
+    """
+    records = {}
+    for leap, year in _CUBE_YEARS.items():
+        times = np.arange(
+            np.datetime64(f"{year}-01-01", "s"),
+            np.datetime64(f"{year + 1}-01-01", "s"),
+            np.timedelta64(freq_hours, "h"),
+        )
+        records[leap] = calc_interp_weights(times)
+    both = np.concatenate([records[False], records[True]])
+    # The records that select the same fields: "nearest" only matters when 0
+    key = np.empty(
+        len(both),
+        dtype=[("i1", "i8"), ("i2", "i8"), ("weight", "f8"), ("single3d", "?"), ("exact", "?")],
+    )
+    for name in ("i1", "i2", "weight", "exact"):
+        key[name] = both[name]
+    key["single3d"] = both["nearest"] == 0
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    ncommon = len(records[False])
+    return {False: inverse[:ncommon], True: inverse[ncommon:]}, both[first]
+
+
+def compile_anomaly_cube(
+    cfg: SimpleNamespace,
+    path: str | Path,
+    window: GridWindow | None = None,
+    freq_hours: int = 3,
+    grid: tuple[np.ndarray, np.ndarray] | None = None,
+) -> Path:
+    """Compile the interpolated anomalies of every time of year into an anomaly cube.
+
+    For every output time of a common and of a leap year (every
+    *freq_hours*), the anomalies of all variables are interpolated between
+    their two months exactly as the writers do (see
+    :meth:`pgw4era.blend.Blender.blend` and ``cfg.precision``), with missing
+    values set to zero, and stored as float32.  Times sharing their weights
+    share their fields.  The anomalies are read with :func:`open_anomalies`
+    over *window*, which must be the window the writers will process, and
+    must be on *grid*, the ERA5 latitudes and longitudes of the window.  The
+    cube is written under a temporary name and renamed once complete.
+
+    Returns
+    -------
+    pathlib.Path
+        The path of the cube.
+
+    Raises
+    ------
+    ValueError
+        If a CC-signal file is not on *grid*.
+    """
+    path = Path(path)
+    slots, records = _cube_slots(freq_hours)
+    part = path.with_name(f"{path.name}.part")
+    blender = Blender(compute_dtype(getattr(cfg, "precision", "float32")))
+    with _open_month_source(cfg, window, grid) as anoms:
+        shapes = {var: (anoms.month(var, 0).shape, True) for var in cfg.variables_3d}
+        shapes.update({var: (anoms.month(var, 0).shape, False) for var in cfg.variables_2d})
+        variables, record_nbytes = _layout(shapes)
+        sources = {var: anomaly_path(cfg, var, var in cfg.variables_3d) for var in shapes}
+        header = {
+            "dtype": "<f4",
+            "freq_hours": freq_hours,
+            "precision": getattr(cfg, "precision", "float32"),
+            "window": _window_spec(window),
+            "slots": len(records),
+            "record_nbytes": record_nbytes,
+            "variables": variables,
+            "calendars": {str(int(leap)): slot.tolist() for leap, slot in slots.items()},
+            "sources": {var: _source_stamp(source) for var, source in sources.items()},
+        }
+        try:
+            data = _create(part, _CUBE_MAGIC, header, len(records))
+            fields = _fields(data, variables)
+            # Adding -0.0 leaves any float unchanged, so the cube holds the anomaly alone
+            zeros = {var: np.full(shape, -0.0) for var, (shape, _) in shapes.items()}
+            for slot, w in enumerate(records):
+                i1, i2 = int(w["i1"]), int(w["i2"])
+                for var, (_, is3d) in shapes.items():
+                    single = w["nearest"] == 0 if is3d else w["exact"]
+                    blender.blend(
+                        fields[var][slot],
+                        zeros[var],
+                        anoms.month(var, i1),
+                        None if single else anoms.month(var, i2),
+                        w["weight"],
+                    )
+            data.flush()
+            del fields, data
+        except Exception:
+            part.unlink(missing_ok=True)
+            raise
+    os.replace(part, path)
+    return path
+
+
+class AnomalyCube:
+    """Memory-mapped anomaly cube written by :func:`compile_anomaly_cube`.
+
+    Serves the anomaly of every variable at every output time, already
+    interpolated between months, as a read-only view of the cube: the
+    writers only add it to the ERA5 fields.  Every year of a run reuses the
+    fields of its calendar (common or leap).
+
+    Parameters
+    ----------
+    path:
+        Path of the cube.
+
+    Raises
+    ------
+    ValueError
+        If *path* is not an anomaly cube.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.header, self._data = _open(self.path, _CUBE_MAGIC, "anomaly cube", "slots")
+        self.freq_hours = self.header["freq_hours"]
+        self.vars3d = [entry["name"] for entry in self.header["variables"] if entry["is3d"]]
+        self.vars2d = [entry["name"] for entry in self.header["variables"] if not entry["is3d"]]
+        self._slots = {
+            leap: np.asarray(self.header["calendars"][str(int(leap))]) for leap in (False, True)
+        }
+        self._fields = _fields(self._data, self.header["variables"])
+
+    @classmethod
+    def from_config(
+        cls,
+        cfg: SimpleNamespace,
+        window: GridWindow | None = None,
+        grid: tuple[np.ndarray, np.ndarray] | None = None,
+    ) -> AnomalyCube:
+        """Open the cube ``cfg.anomaly_cube`` for a configuration and *window*.
+
+        If *grid*, the ERA5 latitudes and longitudes processed (those of
+        *window*), is given, the CC-signal files must be on it.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the cube does not exist.
+        ValueError
+            If it was compiled for another window or precision, lacks a
+            variable of the configuration, or a CC-signal file it was
+            compiled from has changed since or is not on *grid*.
+        """
+        path = Path(cfg.anomaly_cube)
+        if not path.exists():
+            raise FileNotFoundError(
+                f"Anomaly cube not found: {path}; compile it with scripts/compile_anomaly_cube.py"
+            )
+        cube = cls(path)
+        precision = getattr(cfg, "precision", "float32")
+        try:
+            if cube.header["window"] != _window_spec(window):
+                raise ValueError(f"Anomaly cube {path} was compiled for another domain window")
+            if cube.header["precision"] != precision:
+                raise ValueError(
+                    f"Anomaly cube {path} was compiled for precision "
+                    f"{cube.header['precision']!r}, not {precision!r}"
+                )
+            _check_sources(cfg, cube.header, "anomaly cube", path)
+            _check_grid(cfg, window, grid)
+        except ValueError:
+            cube.close()
+            raise
+        return cube
+
+    @property
+    def handle(self) -> str:
+        """Picklable handle for :meth:`attach` in other processes."""
+        return str(self.path)
+
+    @classmethod
+    def attach(cls, handle: str, track: bool = True) -> AnomalyCube:
+        """Map the cube of *handle* (see :attr:`handle`) in another process."""
+        return cls(handle)
+
+    def slot(self, time: dt.datetime) -> int:
+        """Index of the fields of *time* in the cube.
+
+        Raises
+        ------
+        ValueError
+            If *time* is not a multiple of the cube frequency after midnight.
+        """
+        seconds = (time - dt.datetime(time.year, 1, 1)).total_seconds()
+        step, rest = divmod(int(seconds), 3600 * self.freq_hours)
+        if rest or seconds != int(seconds):
+            raise ValueError(f"{time} is not on the {self.freq_hours}-hourly grid of the cube")
+        return int(self._slots[calendar.isleap(time.year)][step])
+
+    def field(self, var: str, time: dt.datetime) -> np.ndarray:
+        """Return the interpolated anomaly of *var* at *time* (a read-only view)."""
+        return self._fields[var][self.slot(time)]
+
+    def close(self) -> None:
+        """Unmap the cube."""
+        self._fields.clear()
+        self._data = None
+
+    def __enter__(self) -> AnomalyCube:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+#: Values of ``anomaly_mode``: interpolate the monthly anomalies at every
+#: timestep, or read them from an anomaly cube compiled once.
+ANOMALY_MODES = ("exact", "doy")
+
+
+def _open_month_source(
+    cfg: SimpleNamespace,
+    window: GridWindow | None = None,
+    grid: tuple[np.ndarray, np.ndarray] | None = None,
+) -> AnomalyPack | AnomalyStore:
+    """Monthly anomalies of a configuration: its anomaly pack if ``anomaly_pack`` is set."""
+    if getattr(cfg, "anomaly_pack", None):
+        return AnomalyPack.from_config(cfg, window, grid)
+    return AnomalyStore.from_config(cfg, window, grid)
+
+
+def open_anomalies(
+    cfg: SimpleNamespace,
+    window: GridWindow | None = None,
+    grid: tuple[np.ndarray, np.ndarray] | None = None,
+) -> AnomalyCube | AnomalyPack | AnomalyStore:
+    """Anomaly source of a configuration for the writers.
+
+    The anomaly cube ``anomaly_cube`` in the day-of-year mode
+    (``anomaly_mode = "doy"``); otherwise the anomaly pack if
+    ``anomaly_pack`` is set, or the CC-signal files.  *grid* is the
+    ``(lat, lon)`` processed by the writers, the ERA5 coordinates of
+    *window*; the CC-signal files must be on it.
+
+    Raises
+    ------
+    ValueError
+        If ``anomaly_mode`` is unknown or a CC-signal file is not on *grid*.
+    """
+    mode = getattr(cfg, "anomaly_mode", "exact")
+    if mode not in ANOMALY_MODES:
+        raise ValueError(f"Unknown anomaly_mode {mode!r}; expected one of {ANOMALY_MODES}")
+    if mode == "doy":
+        return AnomalyCube.from_config(cfg, window, grid)
+    return _open_month_source(cfg, window, grid)
@@ -0,0 +1,175 @@
+"""pgw4era.blend — fused ERA5 + anomaly blending kernel.
+
+For every field the writers compute::
+
+    out = float32(clip(era / divisor + nan_to_num(a1 + (a2 - a1) * weight)))
+
+Written with plain NumPy expressions this allocates half a dozen full-size
+float64 temporaries per variable (the difference, the scaled product, the
+interpolated anomaly, its ``nan_to_num`` copy, the sum and the clipped
+field) before the result is copied once more into the float32 output array.
+:class:`Blender` evaluates the same expression with in-place ufuncs in
+reusable scratch buffers and casts the result straight into a slot of the
+preallocated float32 output, so a timestep needs one float32 output buffer
+plus at most two float64 scratch buffers the size of one variable.
+
+By default every step is evaluated in the dtype NumPy gives the plain
+expression (e.g. a float32 difference of the anomalies, float64
+interpolation and sum for packed ERA5 data) before one final rounding to
+float32, so the output is bit-identical.  A Blender built with a working
+dtype (the ``float32`` precision policy, see
+:func:`pgw4era.utils.compute_dtype`) evaluates every step in that dtype
+instead, directly in the output array when it has that dtype.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+class Blender:
+    """Blend ERA5 fields with interpolated anomalies into float32 buffers.
+
+    Scratch buffers are allocated on first use for each field shape and
+    reused by every following call, so one instance should be kept per
+    thread for a whole run.
+
+    Parameters
+    ----------
+    dtype:
+        Working dtype of the arithmetic.  ``None`` follows NumPy's type
+        promotion of the plain expression.
+    """
+
+    def __init__(self, dtype: np.dtype | str | None = None) -> None:
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self._scratch: dict[tuple[tuple[int, ...], int], np.ndarray] = {}
+
+    def _buffer(self, shape: tuple[int, ...], slot: int) -> np.ndarray:
+        buf = self._scratch.get((shape, slot))
+        if buf is None:
+            buf = self._scratch[(shape, slot)] = np.empty(shape, dtype=self.dtype or "float64")
+        return buf
+
+    @staticmethod
+    def _weight(weight: float | np.ndarray, ndim: int) -> float | np.ndarray:
+        """Broadcast per-timestep weights over the field axes; unwrap 0-d arrays."""
+        weight = np.asarray(weight)
+        if weight.ndim:
+            return weight.reshape(weight.shape + (1,) * (ndim - weight.ndim))
+        return weight[()]
+
+    def blend(
+        self,
+        out: np.ndarray,
+        era: np.ndarray,
+        anom_1: np.ndarray,
+        anom_2: np.ndarray | None = None,
+        weight: float | np.ndarray = 0.0,
+        divisor: float | None = None,
+        clip: tuple[float, float] | None = None,
+    ) -> np.ndarray:
+        """Write ``era / divisor + nan_to_num(anomaly)`` into *out*.
+
+        Parameters
+        ----------
+        out:
+            Output array, typically one slot of the float32 ``fields3d`` /
+            ``fields2d`` buffer, with the shape of *era*.
+        era:
+            ERA5 field.  May have a leading batch (time) axis; masked
+            arrays are blended from their data.
+        anom_1, anom_2:
+            Anomaly of the two months to interpolate.  If *anom_2* is
+            ``None`` *anom_1* is used alone.  NaN anomalies count as zero.
+        weight:
+            Interpolation weight of *anom_2*: a scalar, or one value per
+            timestep of a batched *era*.
+        divisor:
+            If given, *era* is divided by it first (e.g. g for geopotential).
+        clip:
+            Optional ``(min, max)`` bounds applied to the result.
+
+        Returns
+        -------
+        numpy.ndarray
+            *out*.
+        """
+        if self.dtype is not None:
+            return self._blend_fixed(out, era, anom_1, anom_2, weight, divisor, clip)
+
+        # Empty probe of the same array type: masked arrays promote differently
+        probe = era.ravel()[:0]
+        era = np.ma.getdata(era)
+        shape = era.shape
+        anom = self._buffer(shape, 0)
+
+        # Each step runs in the dtype NumPy would give the plain expression
+        # (probed on empty arrays), so intermediate rounding is unchanged.
+        if anom_2 is None:
+            anom_dtype = anom_1.dtype
+            np.copyto(anom, anom_1)
+        else:
+            weight = self._weight(weight, len(shape))
+            diff_dtype = np.result_type(anom_1, anom_2)
+            prod_dtype = (np.empty(0, diff_dtype) * weight).dtype
+            anom_dtype = np.result_type(anom_1.dtype, prod_dtype)
+            np.subtract(anom_2, anom_1, out=anom, dtype=diff_dtype)
+            np.multiply(anom, weight, out=anom, dtype=prod_dtype)
+            np.add(anom, anom_1, out=anom, dtype=anom_dtype)
+        np.nan_to_num(anom, copy=False)
+
+        if divisor is None:
+            sum_dtype = (probe + np.empty(0, anom_dtype)).dtype
+            np.add(anom, era, out=anom, dtype=sum_dtype)
+        else:
+            scaled_dtype = (probe / divisor).dtype
+            sum_dtype = ((probe / divisor) + np.empty(0, anom_dtype)).dtype
+            scaled = self._buffer(shape, 1)
+            np.divide(era, divisor, out=scaled, dtype=scaled_dtype)
+            np.add(anom, scaled, out=anom, dtype=sum_dtype)
+
+        if clip is not None:
+            np.clip(anom, clip[0], clip[1], out=anom)
+
+        np.copyto(out, anom, casting="same_kind")
+        return out
+
+    def _blend_fixed(
+        self,
+        out: np.ndarray,
+        era: np.ndarray,
+        anom_1: np.ndarray,
+        anom_2: np.ndarray | None,
+        weight: float | np.ndarray,
+        divisor: float | None,
+        clip: tuple[float, float] | None,
+    ) -> np.ndarray:
+        """:meth:`blend` with every step evaluated in :attr:`dtype`."""
+        dtype = self.dtype
+        era = np.ma.getdata(era)
+        shape = era.shape
+        anom = out if out.dtype == dtype else self._buffer(shape, 0)
+
+        if anom_2 is None:
+            np.copyto(anom, anom_1, casting="same_kind")
+        else:
+            weight = np.asarray(self._weight(weight, len(shape)), dtype=dtype)
+            np.subtract(anom_2, anom_1, out=anom, dtype=dtype)
+            np.multiply(anom, weight, out=anom, dtype=dtype)
+            np.add(anom, anom_1, out=anom, dtype=dtype)
+        np.nan_to_num(anom, copy=False)
+
+        if divisor is None:
+            np.add(anom, era, out=anom, dtype=dtype)
+        else:
+            scaled = self._buffer(shape, 1)
+            np.divide(era, dtype.type(divisor), out=scaled, dtype=dtype)
+            np.add(anom, scaled, out=anom, dtype=dtype)
+
+        if clip is not None:
+            np.clip(anom, clip[0], clip[1], out=anom)
+
+        if anom is not out:
+            np.copyto(out, anom, casting="same_kind")
+        return out
@@ -0,0 +1,258 @@
+"""pgw4era.climatology — streaming monthly climatologies of CMIP6 series.
+
+The annual cycle of a model over a period used to be computed by opening all
+the historical and scenario files of a variable with ``xr.open_mfdataset``,
+concatenating them and averaging with ``groupby("time.month")``, which can
+pull a multi-century 3-D series through memory.  :class:`MonthlyClimatology`
+walks the files instead, skipping those outside the period by the date range
+in their names, and adds every monthly field within the period to a running
+sum for its calendar month.  Only one month of data and the twelve monthly
+sums are held in memory, whatever the length of the period.
+
+:func:`accumulate` feeds the climatologies of several periods (e.g. the
+present and future periods of the CC signal) from a single scan of the files,
+and :func:`write_delta` writes their difference without reading them back.
+
+The mean has the semantics of ``mean("time", skipna=False)``: a point that is
+missing (or outside :data:`VALID_RANGES`) in any month of the period is
+missing in the climatology of that calendar month.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import os
+import re
+from collections.abc import Callable, Sequence
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+
+# Physically plausible values of the CMIP6 fields; anything else is missing
+VALID_RANGES: dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "hus": lambda x: (x >= 0) & (x <= 100),
+    "hur": lambda x: (x >= 0) & (x <= 100),
+    "ta": lambda x: (x >= 0) & (x < 400),
+    "ua": lambda x: (x > -500) & (x < 500),
+    "va": lambda x: (x > -500) & (x < 500),
+    "zg": lambda x: (x > -1000) & (x < 60000),
+}
+
+# Date range at the end of CMIP6 file names, e.g. ta_Amon_..._gn_201501-210012.nc
+_FILE_DATES = re.compile(r"_(\d{4})\d*-(\d{4})\d*\.nc$")
+
+# Coordinate attributes worth keeping; bounds are not carried over
+_COORD_ATTRS = ("standard_name", "long_name", "units", "axis", "positive")
+
+
+def file_years(path: str | Path) -> tuple[int, int] | None:
+    """First and last year in a CMIP6 file name, or ``None`` if it has none."""
+    match = _FILE_DATES.search(Path(path).name)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+class MonthlyClimatology:
+    """Running monthly means of a variable over the years *syear*..*eyear*.
+
+    Parameters
+    ----------
+    varname:
+        Name of the variable, whose first dimension must be time.
+    syear, eyear:
+        First and last year of the period (inclusive).
+    valid:
+        Function returning a mask of the valid values of a field; other values
+        are treated as missing.  Defaults to ``VALID_RANGES.get(varname)``.
+    """
+
+    def __init__(
+        self,
+        varname: str,
+        syear: int,
+        eyear: int,
+        valid: Callable[[np.ndarray], np.ndarray] | None = None,
+    ) -> None:
+        self.varname = varname
+        self.syear = syear
+        self.eyear = eyear
+        self.valid = valid if valid is not None else VALID_RANGES.get(varname)
+        self.count = np.zeros(12, dtype="int64")
+        self.months: set[tuple[int, int]] = set()
+        self._sum: np.ndarray | None = None
+        self._dtype = np.dtype("float32")
+        self._dims: tuple[str, ...] = ()
+        self._coords: dict[str, tuple[np.ndarray, dict]] = {}
+        self._scalars: dict[str, tuple[np.ndarray, dict]] = {}
+        self._attrs: dict = {}
+
+    def _init(self, ds: nc.Dataset, var: nc.Variable) -> None:
+        """Take the grid and metadata from the first file within the period."""
+        self._sum = np.zeros((12, *var.shape[1:]), dtype="float64")
+        if var.dtype.kind == "f":
+            self._dtype = var.dtype
+        self._dims = var.dimensions[1:]
+        self._attrs = {
+            key: var.getncattr(key)
+            for key in var.ncattrs()
+            if key in ("standard_name", "long_name", "units")
+        }
+        for dim in self._dims:
+            if dim in ds.variables:
+                coord = ds.variables[dim]
+                attrs = {
+                    key: coord.getncattr(key) for key in coord.ncattrs() if key in _COORD_ATTRS
+                }
+                self._coords[dim] = (np.asarray(coord[:]), attrs)
+        # Scalar coordinates such as the 2 m height of tas
+        for name in getattr(var, "coordinates", "").split():
+            if name in ds.variables and ds.variables[name].ndim == 0:
+                coord = ds.variables[name]
+                attrs = {
+                    key: coord.getncattr(key) for key in coord.ncattrs() if key in _COORD_ATTRS
+                }
+                self._scalars[name] = (np.asarray(coord[...]), attrs)
+
+    def add_file(self, path: str | Path, mask_zero: bool = False) -> int:
+        """Add the months of *path* within the period; see :func:`accumulate`."""
+        return accumulate(path, [self], mask_zero)
+
+    def _check_grid(self, path: str | Path, ds: nc.Dataset, var: nc.Variable) -> None:
+        if self._sum is None:
+            self._init(ds, var)
+        elif var.shape[1:] != self._sum.shape[1:]:
+            raise ValueError(
+                f"{path}: {self.varname} has shape {var.shape[1:]}, expected {self._sum.shape[1:]}"
+            )
+
+    def _add(self, year: int, month: int, field: np.ndarray) -> None:
+        # NaN propagates through the sum, as with skipna=False
+        self._sum[month - 1] += field
+        self.count[month - 1] += 1
+        self.months.add((year, month))
+
+    def missing_months(self) -> list[tuple[int, int]]:
+        """(year, month) pairs of the period that no added file provided."""
+        return [
+            (year, month)
+            for year in range(self.syear, self.eyear + 1)
+            for month in range(1, 13)
+            if (year, month) not in self.months
+        ]
+
+    def _mean(self) -> np.ndarray:
+        if self._sum is None:
+            raise ValueError(f"No {self.varname} data within {self.syear}-{self.eyear}")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._sum / self.count.reshape(-1, *[1] * (self._sum.ndim - 1))
+
+    def mean(self) -> np.ndarray:
+        """``(12, ...)`` monthly means; NaN where any month was missing."""
+        return self._mean().astype(self._dtype)
+
+    def to_netcdf(self, path: str | Path) -> None:
+        """Write the climatology with a ``month`` dimension (1..12).
+
+        The file is written under a temporary name and renamed once complete.
+        """
+        self._write(path, self.mean(), "month", np.arange(1, 13), {})
+
+    def _write(
+        self, path: str | Path, data: np.ndarray, time_dim: str, times: np.ndarray, attrs: dict
+    ) -> None:
+        path = Path(path)
+        part = path.with_name(f"{path.name}.part")
+        with nc.Dataset(part, "w") as ds:
+            ds.createDimension(time_dim, None if time_dim == "time" else 12)
+            time = ds.createVariable(time_dim, times.dtype, (time_dim,))
+            time.setncatts(attrs)
+            time[:] = times
+            for dim, size in zip(self._dims, data.shape[1:]):
+                ds.createDimension(dim, size)
+            for name, (values, coord_attrs) in {**self._coords, **self._scalars}.items():
+                dims = (name,) if name in self._coords else ()
+                coord = ds.createVariable(name, values.dtype, dims)
+                coord.setncatts(coord_attrs)
+                coord[...] = values
+            var = ds.createVariable(
+                self.varname,
+                data.dtype,
+                (time_dim, *self._dims),
+                fill_value=np.array(1e20, dtype=data.dtype),
+            )
+            var.setncatts(self._attrs)
+            if self._scalars:
+                var.coordinates = " ".join(self._scalars)
+            var[:] = np.ma.masked_invalid(data)
+        os.replace(part, path)
+
+
+def accumulate(
+    path: str | Path, climatologies: Sequence[MonthlyClimatology], mask_zero: bool = False
+) -> int:
+    """Add the months of *path* to every climatology whose period contains them.
+
+    Every month is read and masked once, however many periods it belongs
+    to; files whose name shows they lie outside all periods are not opened.
+    The climatologies must be of the same variable.  With *mask_zero*,
+    values equal to zero are treated as missing.  Returns the number of
+    months read.
+
+    Raises
+    ------
+    ValueError
+        If the grid of *path* differs from that of the files added before.
+    """
+    years = file_years(path)
+    if years is not None and not any(
+        years[0] <= clim.eyear and years[1] >= clim.syear for clim in climatologies
+    ):
+        return 0
+    varname, valid = climatologies[0].varname, climatologies[0].valid
+
+    added = 0
+    with nc.Dataset(path) as ds:
+        var = ds.variables[varname]
+        time = ds.variables[var.dimensions[0]]
+        dates = nc.num2date(
+            time[:],
+            time.units,
+            getattr(time, "calendar", "standard"),
+            only_use_cftime_datetimes=True,
+        )
+        for index, date in enumerate(np.atleast_1d(dates)):
+            targets = [clim for clim in climatologies if clim.syear <= date.year <= clim.eyear]
+            if not targets:
+                continue
+            for clim in targets:
+                clim._check_grid(path, ds, var)
+            field = np.ma.filled(var[index].astype("float64"), np.nan)
+            with np.errstate(invalid="ignore"):
+                if valid is not None:
+                    field[~valid(field)] = np.nan
+                if mask_zero:
+                    field[field == 0.0] = np.nan
+            for clim in targets:
+                clim._add(date.year, date.month, field)
+            added += 1
+    return added
+
+
+def write_delta(future: MonthlyClimatology, present: MonthlyClimatology, path: str | Path) -> None:
+    """Write the climate-change signal *future* - *present* of every month.
+
+    The months are on a ``time`` axis dated on the first day of each month
+    of the first year of *present*, as the downstream steps expect.
+    """
+    year = present.syear
+    units = f"days since {year}-01-01"
+    dates = [dt.datetime(year, month, 1) for month in range(1, 13)]
+    times = np.asarray(nc.date2num(dates, units, "proleptic_gregorian"), dtype="int64")
+    delta = future._mean() - present._mean()
+    present._write(
+        path,
+        delta.astype(present._dtype),
+        "time",
+        times,
+        {"units": units, "calendar": "proleptic_gregorian"},
+    )
@@ -0,0 +1,325 @@
+"""pgw4era.compare — field-by-field comparison of intermediate-file directories.
+
+Verifying a multi-year run against a reference means comparing thousands of
+``ERA5:*`` file pairs of a few hundred slabs each.  :func:`compare_dirs`
+distributes the file pairs over a process pool, and for every slab pair:
+
+1. compares the raw slab bytes (through zero-copy views of the memory-mapped
+   files, see :class:`pgw4era.intermediate.IntermediateFile`) and stops there
+   if they are identical, which is the common case of a regression check;
+2. otherwise computes the maximum absolute difference, the mean absolute
+   reference value and the ``allclose(ref, new, atol, rtol)`` test in a
+   single pass over cache-sized blocks, in float64.
+
+A slab pair is identical if its bytes are equal, if the maximum absolute
+difference is within *atol*, or if every value is within
+``atol + rtol * abs(new)`` of the reference (NumPy's ``allclose``).  The
+result is a :class:`ComparisonReport` that can be written as JSON; with
+``fail_fast`` the comparison stops at the first difference.
+"""
+
+from __future__ import annotations
+
+import math
+import multiprocessing as mp
+import traceback
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from pgw4era.intermediate import IntermediateFile
+
+# Elements of a slab processed per block by the tolerance pass
+_BLOCK = 1 << 15
+
+
+@dataclass
+class FieldDiff:
+    """A slab that differs beyond the tolerances."""
+
+    field: str
+    xlvl: float
+    max_abs: float
+    max_rel: float
+
+
+@dataclass
+class FileResult:
+    """Comparison of one pair of intermediate files.
+
+    Attributes
+    ----------
+    name:
+        File name, e.g. ``ERA5:2009-06-01_00``.
+    identical, different:
+        Number of slabs compared that are identical / differ.
+    missing_fields, extra_fields:
+        ``(field, xlvl)`` of slabs only in the reference / new file.
+    diffs:
+        The differing slabs.
+    error:
+        Error message if a file could not be read.
+    """
+
+    name: str
+    identical: int = 0
+    different: int = 0
+    missing_fields: list[tuple[str, float]] = field(default_factory=list)
+    extra_fields: list[tuple[str, float]] = field(default_factory=list)
+    diffs: list[FieldDiff] = field(default_factory=list)
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        """Whether the files match: no differences, missing slabs or errors."""
+        return not (self.different or self.missing_fields or self.error)
+
+
+@dataclass
+class ComparisonReport:
+    """Result of :func:`compare_dirs`."""
+
+    ref: str
+    new: str
+    atol: float
+    rtol: float
+    missing_files: list[str]
+    extra_files: list[str]
+    files: list[FileResult]
+    stopped_early: bool = False
+
+    @property
+    def identical(self) -> int:
+        """Number of identical slabs."""
+        return sum(result.identical for result in self.files)
+
+    @property
+    def different(self) -> int:
+        """Number of differing slabs."""
+        return sum(result.different for result in self.files)
+
+    @property
+    def ok(self) -> bool:
+        """Whether every reference file has an identical counterpart."""
+        return not self.missing_files and all(result.ok for result in self.files)
+
+    def to_dict(self) -> dict:
+        """JSON-serialisable summary; only files that do not match are listed.
+
+        Non-finite differences (NaN, inf) are written as strings.
+        """
+
+        def clean(value):
+            if isinstance(value, float) and not math.isfinite(value):
+                return str(value)
+            if isinstance(value, dict):
+                return {key: clean(item) for key, item in value.items()}
+            if isinstance(value, list | tuple):
+                return [clean(item) for item in value]
+            return value
+
+        return clean(
+            {
+                "ref": self.ref,
+                "new": self.new,
+                "atol": self.atol,
+                "rtol": self.rtol,
+                "ok": self.ok,
+                "stopped_early": self.stopped_early,
+                "files_compared": len(self.files),
+                "files_with_differences": sum(not result.ok for result in self.files),
+                "fields_compared": self.identical + self.different,
+                "fields_identical": self.identical,
+                "fields_different": self.different,
+                "missing_files": self.missing_files,
+                "extra_files": self.extra_files,
+                "files": [asdict(result) for result in self.files if not result.ok],
+            }
+        )
+
+
+def slab_stats(
+    ref: np.ndarray, new: np.ndarray, atol: float = 0.0, rtol: float = 0.0
+) -> tuple[bool, float, float]:
+    """Compare two slabs in one blocked float64 pass.
+
+    Returns
+    -------
+    tuple
+        ``(close, max_abs, mean_abs_ref)``: whether the slabs are identical
+        within the tolerances, the maximum absolute difference (NaN if any
+        value is NaN) and the mean absolute value of *ref*.
+    """
+    ref = ref.reshape(-1)
+    new = new.reshape(-1)
+    size = ref.size
+    if not size:
+        return True, 0.0, 0.0
+    nblock = min(size, _BLOCK)
+    a = np.empty(nblock)
+    b = np.empty(nblock)
+    diff = np.empty(nblock)
+
+    max_abs = 0.0
+    sum_abs = 0.0
+    allclose = True
+    # inf - inf and NaNs are handled explicitly below
+    with np.errstate(invalid="ignore"):
+        for start in range(0, size, _BLOCK):
+            stop = min(start + _BLOCK, size)
+            n = stop - start
+            a_blk, b_blk, d_blk = a[:n], b[:n], diff[:n]
+            np.copyto(a_blk, ref[start:stop])
+            np.copyto(b_blk, new[start:stop])
+            np.subtract(a_blk, b_blk, out=d_blk)
+            np.abs(d_blk, out=d_blk)
+            blk_max = float(d_blk.max())
+            # NaN propagates like np.max over the whole slab would
+            if math.isnan(blk_max) or blk_max > max_abs:
+                max_abs = blk_max
+            if allclose:
+                # b_blk becomes the tolerance atol + rtol * |new|
+                np.abs(b_blk, out=b_blk)
+                b_blk *= rtol
+                b_blk += atol
+                if not (d_blk <= b_blk).all():
+                    if math.isfinite(blk_max):
+                        allclose = False
+                    else:
+                        # Infinities and NaNs: NumPy's own definition
+                        allclose = bool(np.isclose(a_blk, new[start:stop], rtol, atol).all())
+            np.abs(a_blk, out=a_blk)
+            sum_abs += float(a_blk.sum())
+
+    return max_abs <= atol or allclose, max_abs, sum_abs / size
+
+
+def compare_files(
+    ref_path: str | Path,
+    new_path: str | Path,
+    atol: float = 0.0,
+    rtol: float = 0.0,
+    fail_fast: bool = False,
+) -> FileResult:
+    """Compare two intermediate files slab by slab.
+
+    With *fail_fast* the comparison stops at the first differing slab.
+    Files that cannot be read are reported in :attr:`FileResult.error`.
+    """
+    result = FileResult(Path(ref_path).name)
+    try:
+        with IntermediateFile(ref_path) as ref_file, IntermediateFile(new_path) as new_file:
+            ref_keys = ref_file.keys()
+            new_keys = set(new_file.keys())
+            result.missing_fields = [key for key in ref_keys if key not in new_keys]
+            result.extra_fields = sorted(new_keys - set(ref_keys))
+            for key in sorted(new_keys.intersection(ref_keys)):
+                ref_slab = ref_file[key]
+                new_slab = new_file[key]
+                if ref_slab.shape != new_slab.shape:
+                    result.diffs.append(FieldDiff(key[0], key[1], math.inf, math.inf))
+                elif ref_slab.dtype == new_slab.dtype and np.array_equal(
+                    ref_slab.view(np.uint32), new_slab.view(np.uint32)
+                ):
+                    result.identical += 1
+                    continue
+                else:
+                    close, max_abs, mean_abs = slab_stats(ref_slab, new_slab, atol, rtol)
+                    if close:
+                        result.identical += 1
+                        continue
+                    max_rel = max_abs / mean_abs if mean_abs > 0 else 0.0
+                    result.diffs.append(FieldDiff(key[0], key[1], max_abs, max_rel))
+                result.different += 1
+                if fail_fast:
+                    break
+    except (OSError, ValueError) as exc:
+        result.error = f"{type(exc).__name__}: {exc}"
+    return result
+
+
+def _compare_pair(*args) -> FileResult:
+    try:
+        return compare_files(*args)
+    except Exception as exc:
+        # Tracebacks do not survive pickling; keep the worker-side one
+        raise RuntimeError(f"{type(exc).__name__}: {exc}\n{traceback.format_exc()}") from None
+
+
+def find_era5_files(directory: str | Path) -> dict[str, Path]:
+    """Return a mapping of file name → path of the ``ERA5:*`` files in *directory*."""
+    return {path.name: path for path in sorted(Path(directory).glob("ERA5:*"))}
+
+
+def compare_dirs(
+    ref_dir: str | Path,
+    new_dir: str | Path,
+    atol: float = 0.0,
+    rtol: float = 0.0,
+    workers: int = 1,
+    fail_fast: bool = False,
+    progress: Callable[[FileResult], None] | None = None,
+) -> ComparisonReport:
+    """Compare the ``ERA5:*`` files present in both directories.
+
+    Parameters
+    ----------
+    ref_dir, new_dir:
+        Reference and new output directories.
+    atol, rtol:
+        Absolute and relative tolerances (0 for an exact match).
+    workers:
+        Number of worker processes the file pairs are distributed over.
+    fail_fast:
+        Stop at the first difference (a differing slab, a missing slab or
+        an unreadable file).  Reference files missing from *new_dir* are
+        reported whatever this setting.
+    progress:
+        Called with the result of every file pair, in file-name order.
+
+    Returns
+    -------
+    ComparisonReport
+    """
+    ref_files = find_era5_files(ref_dir)
+    new_files = find_era5_files(new_dir)
+    common = sorted(ref_files.keys() & new_files.keys())
+    report = ComparisonReport(
+        ref=str(ref_dir),
+        new=str(new_dir),
+        atol=atol,
+        rtol=rtol,
+        missing_files=sorted(ref_files.keys() - new_files.keys()),
+        extra_files=sorted(new_files.keys() - ref_files.keys()),
+        files=[],
+    )
+    pairs = [(ref_files[name], new_files[name], atol, rtol, fail_fast) for name in common]
+
+    def record(result: FileResult) -> bool:
+        report.files.append(result)
+        if progress is not None:
+            progress(result)
+        if fail_fast and not result.ok:
+            report.stopped_early = True
+            return False
+        return True
+
+    if workers <= 1:
+        for pair in pairs:
+            if not record(compare_files(*pair)):
+                break
+        return report
+
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+    try:
+        futures = [pool.submit(_compare_pair, *pair) for pair in pairs]
+        for future in futures:
+            if not record(future.result()):
+                break
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return report
@@ -83,6 +83,28 @@ def load_config(path: str | Path, profile: str) -> SimpleNamespace:
     # Derived helpers
     cfg.setdefault("models", None)
     cfg.setdefault("figs_path", None)
+    cfg.setdefault("ERA5grib_dir", ".")
+    cfg.setdefault("anomaly_cache_mb", None)
+    cfg.setdefault("anomaly_pack", None)
+    cfg.setdefault("anomaly_mode", "exact")
+    cfg.setdefault("anomaly_cube", None)
+    cfg.setdefault("writer_backend", "auto")
+    cfg.setdefault("era5_window_mb", None)
+    cfg.setdefault("domain", None)
+    cfg.setdefault("pipeline_depth", 2)
+    cfg.setdefault("precision", "float32")
+    cfg.setdefault("manifest", True)
+    cfg.setdefault("manifest_checksums", False)
+    cfg.setdefault("regrid_method", "bilinear")
+    cfg.setdefault("regrid_grid", "era5_grid")
+    cfg.setdefault("regrid_cache_dir", None)
+    cfg.setdefault("ensemble_statistics", ["mean"])
+    cfg.setdefault("ensemble_weights", None)
+    cfg.setdefault("ensemble_max_missing", 1.0)
+    cfg.setdefault("cc_signal_statistic", "mean")
+    cfg.setdefault("pinterp_method", "linear")
+    cfg.setdefault("pinterp_below", "linear")
+    cfg.setdefault("pinterp_above", "linear")
     cfg["variables_all"] = cfg["variables_2d"] + cfg["variables_3d"]
     periods = cfg["periods"]
     cfg["syearp"] = periods[0][0]
@@ -8,8 +8,10 @@ CRYOWRF extends WRF with advanced snow/ice physics.  This module writes the
 same fields as the WRF variant plus additional snow-related 2-D fields
 (``SNOW``, ``SNOWH``) expected by CRYOWRF's land-surface initialisation.
 
-The Fortran I/O extension ``outputInter_CRYOWRF`` (``outputInter_CRYOWRF.f90``
-compiled with f2py) must be importable from the same directory::
+Files are written by the Fortran I/O extension ``outputInter_CRYOWRF``
+(``outputInter_CRYOWRF.f90`` compiled with f2py) when it has been compiled in
+the same directory, and otherwise by the pure-NumPy writer in
+:mod:`pgw4era.intermediate` (see ``writer_backend``).  To compile it::
 
     cd pgw4era/cryowrf
     f2py -c outputInter_CRYOWRF.f90 -m outputInter_CRYOWRF
@@ -20,32 +22,49 @@ Authors: Daniel Argüeso, CRYOWRF integration
 from __future__ import annotations
 
 import datetime as dt
-import sys
+from collections.abc import Iterator
 from pathlib import Path
 from types import SimpleNamespace
 
 import netCDF4 as nc
 import numpy as np
 
+from pgw4era.anomalies import (
+    AnomalyCube,
+    AnomalyPack,
+    AnomalyStore,
+    SharedAnomalyStore,
+    open_anomalies,
+)
+from pgw4era.blend import Blender
 from pgw4era.constants import const
-from pgw4era.utils import calc_midmonth, calc_relhum, checkfile
+from pgw4era.domain import GridWindow, domain_window
+from pgw4era.era5 import ERA5File
+from pgw4era.intermediate import FIELDS2D_CRYOWRF, select_writer
+from pgw4era.manifest import Manifest
+from pgw4era.parallel import run_parallel
+from pgw4era.pipeline import run_pipeline
+from pgw4era.utils import (
+    calc_days,
+    calc_interp_weights,
+    calc_relhum,
+    checkfile,
+    compute_dtype,
+)
 
 # ---------------------------------------------------------------------------
-# Load the compiled Fortran extension from the same directory as this file
+# Intermediate-file writer: compiled Fortran extension or pure NumPy
 # ---------------------------------------------------------------------------
 _CRYO_DIR = Path(__file__).parent
-if str(_CRYO_DIR) not in sys.path:
-    sys.path.insert(0, str(_CRYO_DIR))
-
-try:
-    import outputInter_CRYOWRF as f90  # type: ignore[import]
-except ImportError as exc:
-    raise ImportError(
-        "Could not import 'outputInter_CRYOWRF'. "
-        "Compile it with:\n"
-        f"  cd {_CRYO_DIR}\n"
-        "  f2py -c outputInter_CRYOWRF.f90 -m outputInter_CRYOWRF"
-    ) from exc
+
+
+def load_writer(backend: str = "auto"):
+    """Return the object whose ``writeint`` writes the CRYOWRF intermediate files.
+
+    See :func:`pgw4era.intermediate.select_writer` for the *backend* values.
+    """
+    return select_writer(backend, "outputInter_CRYOWRF", str(_CRYO_DIR), tuple(FIELDS2D_CRYOWRF))
+
 
 # ---------------------------------------------------------------------------
 # Variable mappings
@@ -103,59 +122,84 @@ PLVS: list[float] = [
     100.00,
 ]
 
+# Variables of the fields3d / fields2d slabs, in the order they are written
+FIELDS3D_VARS: list[str] = ["hur", "ta", "ua", "va", "zg"]
+FIELDS2D_VARS: list[str] = ["uas", "vas", "hurs", "ps", "psl", "tas", "ts"]
+
 # CRYOWRF uses 9 2-D fields (7 standard + SNOW + SNOWH)
 _N2D = 9
 _RHO_WATER = 1000.0  # kg/m³, used to convert snow depth to physical depth
 
 
-def run(cfg: SimpleNamespace, overwrite_file: bool = False, create_figs: bool = False) -> None:
-    """Process ERA5 + CMIP6 anomaly data and write CRYOWRF intermediate files.
+def read_day(
+    date: dt.date,
+    cfg: SimpleNamespace,
+    anoms: AnomalyStore | SharedAnomalyStore | AnomalyPack | AnomalyCube,
+    overwrite_file: bool = False,
+    window: GridWindow | None = None,
+    manifest: Manifest | None = None,
+) -> Iterator[SimpleNamespace]:
+    """Yield the inputs of every timestep of one ERA5 day that has to be written.
+
+    All file access of the writer happens here: the ERA5 fields and the
+    anomaly months needed by each timestep are read and handed over as arrays,
+    so :func:`blend_timestep` and :func:`write_timestep` can run in other
+    threads (see :func:`pgw4era.pipeline.run_pipeline`).
 
     Parameters
     ----------
+    date:
+        Day to process; ``era5_daily_pl_YYYYMMDD.nc`` and
+        ``era5_daily_sfc_YYYYMMDD.nc`` are read from ``cfg.ERA5netcdf_dir``.
     cfg:
         Configuration namespace returned by :func:`pgw4era.config.load_config`.
-        CRYOWRF-specific keys: ``one_timestep_files`` (bool), ``noahmp`` (bool).
+    anoms:
+        Source of the monthly CC-signal fields.
     overwrite_file:
         If ``True``, overwrite existing output files.
-    create_figs:
-        If ``True``, save diagnostic PNG figures (currently unused).
+    window:
+        Window of the ERA5 grid to read (see :mod:`pgw4era.domain`).
+        ``None`` processes the whole grid.
+    manifest:
+        Run manifest (see :mod:`pgw4era.manifest`).  If given, existing
+        output files are rewritten unless it records them as completely
+        written from the current inputs.
+
+    Yields
+    ------
+    SimpleNamespace
+        ``filedate``; ``output`` (file name) and ``inputs`` (input digest,
+        ``None`` without manifest); ``era3d`` (variable → ERA5 field) and ``era2d`` (ERA5
+        code → field); ``anom`` (variable → pair of anomaly months, the
+        second ``None`` when the first is used alone) and the interpolation
+        ``weight``.
     """
-    syear = cfg.syear
-    eyear = cfg.eyear
-    smonth = cfg.smonth
-    emonth = cfg.emonth
-    experiments = cfg.experiments
-    year_ranges = cfg.periods
-    syearp, eyearp = year_ranges[0]
-    syearf, eyearf = year_ranges[1]
+    year, month, day = date.year, date.month, date.day
 
     vars3d = cfg.variables_3d
     vars2d = cfg.variables_2d
-    nfields3d = len(vars3d)
+    codes2d = []
+    for var in vars2d:
+        codes2d += (
+            [VARS2D_CODES["dew"], VARS2D_CODES["tas"]] if var == "hurs" else [VARS2D_CODES[var]]
+        )
 
-    CMIP6anom_dir = cfg.CMIP6anom_dir
     ERA5_dir = cfg.ERA5netcdf_dir
+    file_pl = f"{ERA5_dir}/era5_daily_pl_{year}{month:02d}{day:02d}.nc"
+    file_sfc = f"{ERA5_dir}/era5_daily_sfc_{year}{month:02d}{day:02d}.nc"
 
-    # Reference grid from ERA5 surface file
-    file_ref = nc.Dataset(f"{cfg.ERA5netcdf_dir}/{cfg.ERA5_sfc_ref_file}")
-    lat = file_ref.variables["latitude"][:]
-    lon = file_ref.variables["longitude"][:]
-    file_ref.close()
-
-    nlon = len(lon)
-    nlat = len(lat)
-
-    year, month, day = syear, smonth, 1
-
-    while year < eyear or (year == eyear and month < emonth):
-        midmonth = calc_midmonth(year)
-
-        print(f"processing year {year} month {month:02d} day {day:02d}")
+    print(f"processing year {year} month {month:02d} day {day:02d}")
 
-        ferapl = nc.Dataset(f"{ERA5_dir}/era5_daily_pl_{year}{month:02d}{day:02d}.nc", "r")
-        ferasfc = nc.Dataset(f"{ERA5_dir}/era5_daily_sfc_{year}{month:02d}{day:02d}.nc", "r")
+    # Every output of the day is computed from the same inputs
+    inputs = manifest.digest([file_pl, file_sfc]) if manifest is not None else None
 
+    # Working dtype of the precision policy (None: default masked reads)
+    dtype = compute_dtype(cfg.precision)
+    ferapl = ERA5File(file_pl, cfg.era5_window_mb, window, dtype)
+    ferasfc = ERA5File(file_sfc, cfg.era5_window_mb, window, dtype)
+    # Snow fields, if the surface file has them
+    codes2d += [code for code in (VARS2D_CODES["sd"], VARS2D_CODES["rsn"]) if code in ferasfc]
+    try:
         date_init = dt.datetime(year, month, day, 0)
         date_end = dt.datetime(year, month, day, 21)
 
@@ -164,154 +208,327 @@ def run(cfg: SimpleNamespace, overwrite_file: bool = False, create_figs: bool =
         date1 = nc.date2index(date_init, time_filepl, calendar="standard", select="exact")
         date2 = nc.date2index(date_end, time_filepl, calendar="standard", select="exact")
 
-        vout: dict[str, np.ndarray] = {}
+        times = nc.num2date(
+            time_filepl[date1 : date2 + 1],
+            units=time_filepl.units,
+            calendar="standard",
+            only_use_cftime_datetimes=False,
+            only_use_python_datetimes=True,
+        )
+        # Anomaly interpolation weights for all timesteps of the day at once
+        weights = calc_interp_weights(times)
+
         print("Looping over timesteps in original ERA5 file")
 
         for nt in range(date1, date2 + 1):
-            proc_date = nc.num2date(time_filepl[nt], units=time_filepl.units, calendar="standard")
+            proc_date = times[nt - date1]
             print("processing 3Dvar time: ", proc_date)
             filedate = proc_date.strftime("%Y-%m-%d_%H-%M-%S")
 
             file_out = "ERA5:" + filedate.split("_")[0] + "_" + filedate.split("_")[1].split("-")[0]
-            filewrite = checkfile(file_out, overwrite_file)
-            if filewrite:
-                tdelta = np.asarray(
-                    [(midmonth[i] - proc_date).total_seconds() for i in range(len(midmonth))]
-                )
-                tdelta_min = np.argmin(np.abs(tdelta))
-                if tdelta[tdelta_min] < 0:
-                    i1 = (tdelta_min - 1) % 12
-                    i2 = (tdelta_min) % 12
-                    tdelta_before = np.abs(tdelta[tdelta_min])
-                    tdelta_mid_month = (
-                        midmonth[tdelta_min + 1] - midmonth[tdelta_min]
-                    ).total_seconds()
-                else:
-                    i1 = (tdelta_min - 2) % 12
-                    i2 = (tdelta_min - 1) % 12
-                    tdelta_before = np.abs(tdelta[tdelta_min - 1])
-                    tdelta_mid_month = (
-                        midmonth[tdelta_min] - midmonth[tdelta_min - 1]
-                    ).total_seconds()
-
-                # --- 3-D variables ---
+            if not checkfile(file_out, overwrite_file, manifest, inputs):
+                continue
+
+            w = weights[nt - date1]
+            i1, i2 = int(w["i1"]), int(w["i2"])
+
+            anom = {}
+            if isinstance(anoms, AnomalyCube):
+                # Day-of-year mode: the anomaly of the timestep is precomputed
+                for var in vars3d + vars2d:
+                    anom[var] = (anoms.field(var, proc_date), None)
+            else:
                 for var in vars3d:
-                    print(f"Processing variable {var}")
-                    fanom = nc.Dataset(
-                        f"{CMIP6anom_dir}/{var}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-                        f"_{experiments[0]}-{experiments[1]}_CC_signal_pinterp.nc"
-                    )
-
-                    if np.all(np.diff(ferapl.variables["level"][:]) > 0):
-                        var_era = ferapl.variables[VARS3D_CODES[var]][nt, ::-1, :, :]
-                    else:
-                        var_era = ferapl.variables[VARS3D_CODES[var]][nt, :, :, :]
-
-                    if var == "zg":
-                        var_era = var_era / 9.81
-
-                    if np.argmin(np.abs(tdelta)) == 0:
-                        var_anom = fanom.variables[var][i1, ::-1, :, :]
-                    else:
-                        var_anom_1 = fanom.variables[var][i1, ::-1, :, :]
-                        var_anom_2 = fanom.variables[var][i2, ::-1, :, :]
-                        var_anom = (
-                            var_anom_1
-                            + (var_anom_2 - var_anom_1) * tdelta_before / tdelta_mid_month
-                        )
-
-                    temp = var_era + np.nan_to_num(var_anom)
-                    if var == "hur":
-                        temp = np.clip(temp, 0, 100)
-                    vout[var] = temp
-                    fanom.close()
-
-                # --- 2-D variables ---
+                    single = w["nearest"] == 0
+                    anom[var] = (anoms.month(var, i1), None if single else anoms.month(var, i2))
                 for var in vars2d:
-                    print(f"Processing variable {var}")
-                    if var == "hurs":
-                        dew_era = ferasfc.variables[VARS2D_CODES["dew"]][nt, :, :] - const.tkelvin
-                        tas_era = ferasfc.variables[VARS2D_CODES["tas"]][nt, :, :] - const.tkelvin
-                        var_era = calc_relhum(dew_era, tas_era)
-                    else:
-                        var_era = ferasfc.variables[VARS2D_CODES[var]][nt, :, :]
-
-                    fanom = nc.Dataset(
-                        f"{CMIP6anom_dir}/{var}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-                        f"_{experiments[0]}-{experiments[1]}_CC_signal.nc"
-                    )
-
-                    if np.min(np.abs(tdelta)) == 0:
-                        var_anom = fanom.variables[var][i1, :, :]
-                    else:
-                        var_anom_1 = fanom.variables[var][i1, :, :]
-                        var_anom_2 = fanom.variables[var][i2, :, :]
-                        var_anom = (
-                            var_anom_1
-                            + (var_anom_2 - var_anom_1) * tdelta_before / tdelta_mid_month
-                        )
-
-                    vout[var] = var_era + np.nan_to_num(var_anom)
-                    fanom.close()
-
-                # --- CRYOWRF snow fields ---
-                # Snow water equivalent (kg/m²)
-                if "sd" in ferasfc.variables:
-                    snow_we = ferasfc.variables["sd"][nt, :, :]  # m of water equiv.
-                    snow_we = snow_we * _RHO_WATER  # convert to kg/m²
-                else:
-                    snow_we = np.zeros((nlat, nlon), dtype="float32")
-
-                # Physical snow depth (m): sd [m water] * rho_water / rho_snow
-                # ERA5 provides snow density (rsn, kg/m³); fall back to 300 kg/m³
-                if "rsn" in ferasfc.variables:
-                    rho_snow = ferasfc.variables["rsn"][nt, :, :]
-                    rho_snow = np.where(rho_snow > 0, rho_snow, 300.0)
-                else:
-                    rho_snow = np.full((nlat, nlon), 300.0, dtype="float32")
-
-                snow_depth = snow_we / rho_snow  # physical depth in m
-
-                # --- Write CRYOWRF intermediate format ---
-                fields3d = np.ndarray(shape=(nfields3d, len(PLVS), nlat, nlon), dtype="float32")
-                fields2d = np.ndarray(shape=(_N2D, nlat, nlon), dtype="float32")
-
-                startlat = float(lat[0])
-                startlon = float(lon[0])
-                deltalon = 0.30
-                deltalat = -0.30
-
-                fields3d[0] = np.float32(vout["hur"])
-                fields3d[1] = np.float32(vout["ta"])
-                fields3d[2] = np.float32(vout["ua"])
-                fields3d[3] = np.float32(vout["va"])
-                fields3d[4] = np.float32(vout["zg"])
-
-                fields2d[0] = np.float32(vout["uas"])
-                fields2d[1] = np.float32(vout["vas"])
-                fields2d[2] = np.float32(vout["hurs"])
-                fields2d[3] = np.float32(vout["ps"])
-                fields2d[4] = np.float32(vout["psl"])
-                fields2d[5] = np.float32(vout["tas"])
-                fields2d[6] = np.float32(vout["ts"])
-                fields2d[7] = np.float32(snow_we)
-                fields2d[8] = np.float32(snow_depth)
-
-                f90.writeint(
-                    PLVS,
-                    fields3d,
-                    fields2d,
-                    filedate,
-                    nlat,
-                    nlon,
-                    startlat,
-                    startlon,
-                    deltalon,
-                    deltalat,
-                )
-
+                    single = w["exact"]
+                    anom[var] = (anoms.month(var, i1), None if single else anoms.month(var, i2))
+
+            yield SimpleNamespace(
+                filedate=filedate,
+                output=file_out,
+                inputs=inputs,
+                era3d={var: ferapl.field(VARS3D_CODES[var], nt) for var in vars3d},
+                era2d={code: ferasfc.field(code, nt) for code in codes2d},
+                anom=anom,
+                weight=w["weight"],
+            )
+    finally:
         ferapl.close()
         ferasfc.close()
 
-        end_date = dt.datetime(year, month, day) + dt.timedelta(days=1)
-        year, month, day = end_date.year, end_date.month, end_date.day
+
+def blend_timestep(
+    step: SimpleNamespace,
+    cfg: SimpleNamespace,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    blender: Blender | None = None,
+    out: tuple[np.ndarray, np.ndarray] | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Add the interpolated anomalies to the ERA5 fields of one timestep.
+
+    Parameters
+    ----------
+    step:
+        Timestep inputs yielded by :func:`read_day`.
+    cfg:
+        Configuration namespace returned by :func:`pgw4era.config.load_config`.
+    lat, lon:
+        Coordinates of the processed grid.
+    blender:
+        Blending kernel whose scratch buffers are reused across calls.
+    out:
+        Preallocated float32 ``(fields3d, fields2d)`` buffers to fill.  If
+        ``None``, new buffers are allocated (needed when the previous
+        timestep may still be being written, as in the pipeline mode).
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        ``(fields3d, fields2d)`` in the order written to the intermediate
+        files.
+    """
+    nlon = len(lon)
+    nlat = len(lat)
+
+    if blender is None:
+        blender = Blender(compute_dtype(cfg.precision))
+    if out is None:
+        fields3d = np.empty((len(FIELDS3D_VARS), len(PLVS), nlat, nlon), dtype="float32")
+        fields2d = np.empty((_N2D, nlat, nlon), dtype="float32")
+    else:
+        fields3d, fields2d = out
+
+    weight = step.weight
+
+    for nf, var in enumerate(FIELDS3D_VARS):
+        print(f"Processing variable {var}")
+        var_anom_1, var_anom_2 = step.anom[var]
+        blender.blend(
+            fields3d[nf],
+            step.era3d[var],
+            var_anom_1,
+            var_anom_2,
+            weight,
+            divisor=9.81 if var == "zg" else None,
+            clip=(0, 100) if var == "hur" else None,
+        )
+
+    for nf, var in enumerate(FIELDS2D_VARS):
+        print(f"Processing variable {var}")
+        if var == "hurs":
+            dew_era = step.era2d[VARS2D_CODES["dew"]] - const.tkelvin
+            tas_era = step.era2d[VARS2D_CODES["tas"]] - const.tkelvin
+            var_era = calc_relhum(dew_era, tas_era)
+        else:
+            var_era = step.era2d[VARS2D_CODES[var]]
+
+        var_anom_1, var_anom_2 = step.anom[var]
+        blender.blend(fields2d[nf], var_era, var_anom_1, var_anom_2, weight)
+
+    # --- CRYOWRF snow fields ---
+    # Snow water equivalent (kg/m²)
+    if VARS2D_CODES["sd"] in step.era2d:
+        snow_we = step.era2d[VARS2D_CODES["sd"]]  # m of water equiv.
+        snow_we = snow_we * _RHO_WATER  # convert to kg/m²
+    else:
+        snow_we = np.zeros((nlat, nlon), dtype="float32")
+
+    # Physical snow depth (m): sd [m water] * rho_water / rho_snow
+    # ERA5 provides snow density (rsn, kg/m³); fall back to 300 kg/m³
+    if VARS2D_CODES["rsn"] in step.era2d:
+        rho_snow = step.era2d[VARS2D_CODES["rsn"]]
+        rho_snow = np.where(rho_snow > 0, rho_snow, 300.0)
+    else:
+        rho_snow = np.full((nlat, nlon), 300.0, dtype="float32")
+
+    snow_depth = snow_we / rho_snow  # physical depth in m
+
+    fields2d[7] = snow_we
+    fields2d[8] = snow_depth
+
+    return fields3d, fields2d
+
+
+def write_timestep(
+    writer,
+    filedate: str,
+    fields3d: np.ndarray,
+    fields2d: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+) -> None:
+    """Write the CRYOWRF intermediate file of one timestep with *writer*."""
+    startlat = float(lat[0])
+    startlon = float(lon[0])
+    deltalon = 0.30
+    deltalat = -0.30
+
+    writer.writeint(
+        PLVS,
+        fields3d,
+        fields2d,
+        filedate,
+        len(lat),
+        len(lon),
+        startlat,
+        startlon,
+        deltalon,
+        deltalat,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Main processing function
+# ---------------------------------------------------------------------------
+
+
+def process_day(
+    date: dt.date,
+    cfg: SimpleNamespace,
+    anoms: AnomalyStore | SharedAnomalyStore | AnomalyPack | AnomalyCube,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    overwrite_file: bool = False,
+    window: GridWindow | None = None,
+    manifest: Manifest | None = None,
+) -> int:
+    """Write the CRYOWRF intermediate files for every timestep of one ERA5 day.
+
+    Parameters
+    ----------
+    date:
+        Day to process; ``era5_daily_pl_YYYYMMDD.nc`` and
+        ``era5_daily_sfc_YYYYMMDD.nc`` are read from ``cfg.ERA5netcdf_dir``.
+    cfg:
+        Configuration namespace returned by :func:`pgw4era.config.load_config`.
+    anoms:
+        Source of the monthly CC-signal fields.
+    lat, lon:
+        Coordinates of the processed grid (the domain window, if any).
+    overwrite_file:
+        If ``True``, overwrite existing output files.
+    window:
+        Window of the ERA5 grid to read (see :mod:`pgw4era.domain`).
+        ``None`` processes the whole grid.
+    manifest:
+        Run manifest in which every written file is recorded
+        (see :mod:`pgw4era.manifest`).
+
+    Returns
+    -------
+    int
+        Number of intermediate files written.
+    """
+    writer = load_writer(cfg.writer_backend)
+    blender = Blender(compute_dtype(cfg.precision))
+    out = None
+    nwritten = 0
+    for step in read_day(date, cfg, anoms, overwrite_file, window, manifest):
+        # Output buffers are allocated once and refilled for every timestep
+        out = fields3d, fields2d = blend_timestep(step, cfg, lat, lon, blender, out)
+        write_timestep(writer, step.filedate, fields3d, fields2d, lat, lon)
+        if manifest is not None:
+            manifest.record(step.output, step.inputs)
+        nwritten += 1
+    return nwritten
+
+
+def run(
+    cfg: SimpleNamespace,
+    overwrite_file: bool = False,
+    create_figs: bool = False,
+    workers: int = 1,
+    pipeline: bool = False,
+) -> None:
+    """Process ERA5 + CMIP6 anomaly data and write CRYOWRF intermediate files.
+
+    Parameters
+    ----------
+    cfg:
+        Configuration namespace returned by :func:`pgw4era.config.load_config`.
+        CRYOWRF-specific keys: ``one_timestep_files`` (bool), ``noahmp`` (bool).
+    overwrite_file:
+        If ``True``, overwrite existing output files.
+    create_figs:
+        If ``True``, save diagnostic PNG figures (currently unused).
+    workers:
+        Number of worker processes.  Days are independent, so with
+        ``workers > 1`` they are distributed over a process pool that shares
+        the anomaly annual cycle through shared memory
+        (see :func:`pgw4era.parallel.run_parallel`).
+    pipeline:
+        If ``True``, overlap reading, blending and writing in a single
+        process with a reader and a writer thread
+        (see :func:`pgw4era.pipeline.run_pipeline`).  Cannot be combined
+        with ``workers > 1``.
+    """
+    if pipeline and workers > 1:
+        raise ValueError("The pipeline mode runs in a single process; use it with workers=1")
+
+    # Reference grid from ERA5 surface file
+    file_ref = nc.Dataset(f"{cfg.ERA5netcdf_dir}/{cfg.ERA5_sfc_ref_file}")
+    lat = file_ref.variables["latitude"][:]
+    lon = file_ref.variables["longitude"][:]
+    file_ref.close()
+
+    # Only the window covering the configured domain is processed, if any
+    window = domain_window(cfg, lat, lon)
+    if window is not None:
+        lat, lon = window.coords(lat, lon)
+        print(f"Processing the {len(lat)} x {len(lon)} domain window of the ERA5 grid")
+
+    days = calc_days(cfg.syear, cfg.smonth, cfg.eyear, cfg.emonth)
+
+    # Record of the written files, to resume interrupted or outdated runs
+    manifest = Manifest.from_config(cfg)
+
+    if workers > 1:
+        run_parallel(
+            process_day,
+            days,
+            cfg,
+            workers,
+            lat,
+            lon,
+            overwrite_file,
+            window,
+            manifest,
+            window=window,
+            grid=(lat, lon),
+        )
+        return
+
+    # Anomaly files (or the anomaly pack or cube) are opened once for all timesteps
+    anoms = open_anomalies(cfg, window, (lat, lon))
+    if pipeline:
+        writer = load_writer(cfg.writer_backend)
+        blender = Blender(compute_dtype(cfg.precision))
+
+        def write(result: tuple) -> None:
+            output, inputs, *fields = result
+            write_timestep(writer, *fields, lat, lon)
+            if manifest is not None:
+                manifest.record(output, inputs)
+
+        nwritten = run_pipeline(
+            days,
+            lambda date: read_day(date, cfg, anoms, overwrite_file, window, manifest),
+            lambda step: (
+                step.output,
+                step.inputs,
+                step.filedate,
+                *blend_timestep(step, cfg, lat, lon, blender),
+            ),
+            write,
+            depth=cfg.pipeline_depth,
+        )
+        print(f"Pipeline finished: {nwritten} file(s) written")
+    else:
+        for date in days:
+            process_day(date, cfg, anoms, lat, lon, overwrite_file, window, manifest)
+    anoms.close()
+    if manifest is not None:
+        manifest.close()
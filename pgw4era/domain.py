@@ -0,0 +1,328 @@
+"""pgw4era.domain — restrict processing to the WRF parent-domain bounding box.
+
+By default the writers process the whole global ERA5 grid.  When the
+configuration profile has a ``domain`` section, only the window of the ERA5
+grid covering the domain (plus a halo) is read from the ERA5 and CC-signal
+files, blended and written to the intermediate files::
+
+    [wrf.domain]
+    lat_min = 30.0
+    lat_max = 50.0
+    lon_min = -15.0
+    lon_max = 40.0
+    halo = 3.0            # degrees added on every side (default 0)
+
+or, to take the bounds from the WPS parent domain, its ``geo_em`` file or
+the ``&geogrid`` section of the WPS namelist (before running geogrid)::
+
+    [wrf.domain]
+    geo_em = "/path/to/geo_em.d01.nc"     # or namelist = "/path/to/namelist.wps"
+    halo = 3.0
+
+Windows crossing the longitude seam of the ERA5 grid (e.g. a domain from
+-15° to 40° on a 0-360° grid) are read as two pieces and joined, and their
+longitudes are made continuous so the intermediate files start at the
+western edge of the domain.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+
+import netCDF4 as nc
+import numpy as np
+
+_BOUNDS_KEYS = ("lat_min", "lat_max", "lon_min", "lon_max")
+_SOURCE_KEYS = ("geo_em", "namelist")
+
+# Earth radius (m) of the WPS map projections
+_EARTH_RADIUS = 6370000.0
+
+
+@dataclass(frozen=True)
+class GridWindow:
+    """Rectangular window of a regular latitude-longitude grid.
+
+    Attributes
+    ----------
+    lat:
+        Slice of the latitude axis.
+    lon:
+        Slices of the longitude axis, in output order: one, or two when the
+        window crosses the last column of the grid.
+    """
+
+    lat: slice
+    lon: tuple[slice, ...]
+
+    @classmethod
+    def from_bounds(
+        cls,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        lat_min: float,
+        lat_max: float,
+        lon_min: float,
+        lon_max: float,
+        halo: float = 0.0,
+    ) -> GridWindow:
+        """Window of the grid ``(lat, lon)`` covering the given bounds plus *halo*.
+
+        *lon_min* may be larger than *lon_max* for boxes crossing the
+        antimeridian (e.g. ``lon_min=170, lon_max=-170``).
+
+        Raises
+        ------
+        ValueError
+            If no grid point lies within the bounds.
+        """
+        lat = np.asarray(lat)
+        lon = np.asarray(lon)
+
+        rows = np.nonzero((lat >= lat_min - halo) & (lat <= lat_max + halo))[0]
+        if rows.size == 0:
+            raise ValueError(f"No ERA5 latitude within [{lat_min}, {lat_max}] ± {halo}")
+
+        span = (lon_max - lon_min) % 360.0 if lon_max - lon_min < 360.0 else 360.0
+        span += 2 * halo
+        nlon = len(lon)
+        if span >= 360.0 - abs(float(lon[1] - lon[0])) / 2:
+            cols = [slice(0, nlon)]
+        else:
+            offset = (lon - (lon_min - halo)) % 360.0
+            inside = np.nonzero(offset <= span)[0]
+            if inside.size == 0:
+                raise ValueError(f"No ERA5 longitude within [{lon_min}, {lon_max}] ± {halo}")
+            gaps = np.nonzero(np.diff(inside) > 1)[0]
+            if gaps.size == 0:
+                cols = [slice(int(inside[0]), int(inside[-1]) + 1)]
+            else:
+                # Inside columns are {0..a} ∪ {b..nlon-1}; the west edge is b
+                a, b = int(inside[gaps[0]]), int(inside[gaps[0] + 1])
+                cols = [slice(b, nlon), slice(0, a + 1)]
+
+        return cls(slice(int(rows[0]), int(rows[-1]) + 1), tuple(cols))
+
+    @property
+    def wraps(self) -> bool:
+        """Whether the window crosses the longitude seam of the grid."""
+        return len(self.lon) > 1
+
+    def shape(self, nlat: int, nlon: int) -> tuple[int, int]:
+        """Shape of the window of a ``(nlat, nlon)`` grid."""
+        return len(range(nlat)[self.lat]), sum(len(range(nlon)[piece]) for piece in self.lon)
+
+    def coords(self, lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Latitudes and longitudes of the window, with continuous longitudes."""
+        lon_pieces = [np.asarray(lon[piece], dtype=float) for piece in self.lon]
+        if not self.wraps:
+            return np.asarray(lat[self.lat]), lon_pieces[0]
+        lon_window = np.concatenate([lon_pieces[0], lon_pieces[1] + 360.0])
+        if lon_window[0] >= 180.0:
+            lon_window -= 360.0
+        return np.asarray(lat[self.lat]), lon_window
+
+    def read(self, var, *index) -> np.ndarray:
+        """Return ``var[*index, lat, lon]`` restricted to the window.
+
+        *var* is a netCDF variable or an array whose last two axes are
+        latitude and longitude; *index* selects the leading axes.
+        """
+        pieces = [var[(*index, self.lat, piece)] for piece in self.lon]
+        if len(pieces) == 1:
+            return pieces[0]
+        if any(isinstance(piece, np.ma.MaskedArray) for piece in pieces):
+            return np.ma.concatenate(pieces, axis=-1)
+        return np.concatenate(pieces, axis=-1)
+
+
+def domain_bounds(domain: dict) -> tuple[float, float, float, float]:
+    """Return ``(lat_min, lat_max, lon_min, lon_max)`` of a ``domain`` config section.
+
+    Raises
+    ------
+    ValueError
+        If the section does not give exactly one of ``geo_em``, ``namelist``
+        and the four bounds, or has unknown keys.
+    """
+    unknown = set(domain) - {*_BOUNDS_KEYS, *_SOURCE_KEYS, "halo"}
+    if unknown:
+        raise ValueError(f"Unknown key(s) in domain section: {', '.join(sorted(unknown))}")
+    has_bounds = [key for key in _BOUNDS_KEYS if key in domain]
+    sources = [key for key in _SOURCE_KEYS if key in domain]
+    if sources:
+        if has_bounds or len(sources) > 1:
+            raise ValueError(
+                "domain section: give one of geo_em, namelist or lat/lon bounds, not both"
+            )
+        if "namelist" in domain:
+            return namelist_bounds(domain["namelist"])
+        return geo_em_bounds(domain["geo_em"])
+    if len(has_bounds) != len(_BOUNDS_KEYS):
+        missing = [key for key in _BOUNDS_KEYS if key not in domain]
+        raise ValueError(f"domain section is missing key(s): {', '.join(missing)}")
+    return tuple(float(domain[key]) for key in _BOUNDS_KEYS)
+
+
+def geo_em_bounds(path: str) -> tuple[float, float, float, float]:
+    """Return the lat/lon bounding box of a WPS ``geo_em`` file.
+
+    The cell-corner coordinates (``XLAT_C``/``XLONG_C``) are used when
+    present, otherwise the mass-point ones.  Longitudes are unwrapped around
+    the domain centre, so domains crossing the antimeridian give
+    ``lon_min > lon_max``.
+    """
+    with nc.Dataset(path) as ds:
+        suffix = "C" if "XLAT_C" in ds.variables else "M"
+        xlat = np.asarray(ds.variables[f"XLAT_{suffix}"][0])
+        xlon = np.asarray(ds.variables[f"XLONG_{suffix}"][0])
+
+    return _lonlat_bounds(xlat, xlon)
+
+
+def _lonlat_bounds(xlat: np.ndarray, xlon: np.ndarray) -> tuple[float, float, float, float]:
+    """Bounding box of points, with longitudes unwrapped around the middle point."""
+    center = float(xlon[xlon.shape[0] // 2, xlon.shape[1] // 2])
+    rel = (xlon - center + 180.0) % 360.0 - 180.0
+    lon_min = (center + rel.min() + 180.0) % 360.0 - 180.0
+    lon_max = (center + rel.max() + 180.0) % 360.0 - 180.0
+    return float(xlat.min()), float(xlat.max()), float(lon_min), float(lon_max)
+
+
+# Tokens of a Fortran namelist: quoted strings, group starts and ends,
+# "key =" and plain values
+_NAMELIST_TOKEN = re.compile(r"""'[^']*'|"[^"]*"|&\w+|/|\w+\s*=|[^\s,=]+""")
+
+
+def _namelist_value(item: str) -> str | int | float | bool:
+    if item[0] in "'\"":
+        return item[1:-1]
+    if item.lower() in (".true.", ".false.", "t", "f"):
+        return item.lower() in (".true.", "t")
+    try:
+        return int(item)
+    except ValueError:
+        pass
+    try:
+        return float(item.lower().replace("d", "e"))
+    except ValueError:
+        return item
+
+
+def read_namelist(path: str | Path) -> dict[str, dict[str, list]]:
+    """Parse a Fortran namelist file such as ``namelist.wps``.
+
+    Returns the values of every group by key (both lower-cased), each a list
+    of its comma-separated values (strings, numbers or booleans).
+    """
+    text = "\n".join(line.split("!", 1)[0] for line in Path(path).read_text().splitlines())
+    groups: dict[str, dict[str, list]] = {}
+    group: dict[str, list] | None = None
+    values: list | None = None
+    for item in _NAMELIST_TOKEN.findall(text):
+        if item.startswith("&"):
+            group = groups.setdefault(item[1:].lower(), {})
+        elif item == "/":
+            group = values = None
+        elif group is None:
+            continue
+        elif item.endswith("="):
+            values = group[item[:-1].strip().lower()] = []
+        elif values is not None:
+            values.append(_namelist_value(item))
+    return groups
+
+
+def namelist_bounds(path: str | Path) -> tuple[float, float, float, float]:
+    """Return the lat/lon bounding box of the parent domain of a WPS namelist.
+
+    The corner points of domain 1 of ``&geogrid`` are computed from its map
+    projection on the sphere used by WPS (``lambert``, ``polar``,
+    ``mercator`` or unrotated ``lat-lon``), so the bounds are those of the
+    corner coordinates of the ``geo_em.d01.nc`` file geogrid writes.
+    Longitudes are unwrapped as by :func:`geo_em_bounds`.
+
+    Raises
+    ------
+    ValueError
+        If the namelist has no ``&geogrid`` section or lacks a key, or the
+        projection is not supported.
+    """
+    geogrid = read_namelist(path).get("geogrid")
+    if geogrid is None:
+        raise ValueError(f"{path}: no &geogrid section")
+
+    def first(key: str, default: float | None = None) -> float | str:
+        if key in geogrid:
+            return geogrid[key][0]
+        if default is None:
+            raise ValueError(f"{path}: &geogrid is missing {key}")
+        return default
+
+    proj = str(first("map_proj", "lambert")).lower()
+    if proj not in ("lambert", "polar", "mercator", "lat-lon"):
+        raise ValueError(f"{path}: unsupported map_proj {proj!r}")
+    e_we, e_sn = int(first("e_we")), int(first("e_sn"))
+    dx, dy = float(first("dx")), float(first("dy"))
+    ref_lat, ref_lon = float(first("ref_lat")), float(first("ref_lon"))
+    # Corner points relative to the reference point, in grid lengths; the
+    # reference point is the domain centre unless ref_x/ref_y give its mass
+    # point (1-based, half a grid length from the corners)
+    ref_x = float(first("ref_x", e_we / 2)) - 0.5
+    ref_y = float(first("ref_y", e_sn / 2)) - 0.5
+    xi, yj = np.meshgrid(np.arange(e_we) - ref_x, np.arange(e_sn) - ref_y)
+
+    if proj == "lat-lon":
+        if float(first("pole_lat", 90.0)) != 90.0:
+            raise ValueError(f"{path}: rotated lat-lon domains are not supported; use geo_em")
+        return _lonlat_bounds(ref_lat + yj * dy, ref_lon + xi * dx)
+
+    lam0 = np.deg2rad(float(first("stand_lon", ref_lon)))
+    phi1 = np.deg2rad(float(first("truelat1", 0.0 if proj == "mercator" else None)))
+    phir, lamr = np.deg2rad(ref_lat), np.deg2rad(ref_lon)
+    if proj == "lambert":
+        phi2 = np.deg2rad(float(first("truelat2", np.rad2deg(phi1))))
+        if abs(phi1 - phi2) > 1e-10:
+            n = np.log(np.cos(phi1) / np.cos(phi2)) / np.log(
+                np.tan(np.pi / 4 + phi2 / 2) / np.tan(np.pi / 4 + phi1 / 2)
+            )
+        else:
+            n = np.sin(phi1)
+        scale = _EARTH_RADIUS * np.cos(phi1) * np.tan(np.pi / 4 + phi1 / 2) ** n / n
+        rho_ref = scale / np.tan(np.pi / 4 + phir / 2) ** n
+        # x, and the distance to the cone apex along the central meridian
+        x = rho_ref * np.sin(n * (lamr - lam0)) + xi * dx
+        apex = rho_ref * np.cos(n * (lamr - lam0)) - yj * dy
+        rho = np.sign(n) * np.hypot(x, apex)
+        phi = 2 * np.arctan((scale / rho) ** (1 / n)) - np.pi / 2
+        lam = lam0 + np.arctan2(np.sign(n) * x, np.sign(n) * apex) / n
+    elif proj == "polar":
+        hem = 1.0 if phi1 >= 0 else -1.0
+        scale = _EARTH_RADIUS * (1 + np.sin(abs(phi1)))
+        rho_ref = scale * np.tan(np.pi / 4 - hem * phir / 2)
+        x = rho_ref * np.sin(lamr - lam0) + xi * dx
+        y = -hem * rho_ref * np.cos(lamr - lam0) + yj * dy
+        phi = hem * (np.pi / 2 - 2 * np.arctan(np.hypot(x, y) / scale))
+        lam = lam0 + np.arctan2(x, -hem * y)
+    else:  # mercator
+        scale = _EARTH_RADIUS * np.cos(phi1)
+        y = scale * np.log(np.tan(np.pi / 4 + phir / 2)) + yj * dy
+        phi = 2 * np.arctan(np.exp(y / scale)) - np.pi / 2
+        lam = lamr + xi * dx / scale
+    return _lonlat_bounds(np.rad2deg(phi), np.rad2deg(lam))
+
+
+def domain_window(cfg: SimpleNamespace, lat: np.ndarray, lon: np.ndarray) -> GridWindow | None:
+    """Window of the ERA5 grid covering the configured domain, or ``None``.
+
+    ``None`` (process the whole grid) is returned when the profile has no
+    ``domain`` section.
+    """
+    domain = getattr(cfg, "domain", None)
+    if not domain:
+        return None
+    bounds = domain_bounds(domain)
+    return GridWindow.from_bounds(lat, lon, *bounds, halo=float(domain.get("halo", 0.0)))
@@ -0,0 +1,586 @@
+"""pgw4era.download — concurrent, resumable ERA5 retrievals from the CDS.
+
+The ERA5 inputs of the writers are one GRIB file per day for the pressure
+levels (``era5_daily_pl_YYYYMMDD.grb``) and one for the surface
+(``era5_daily_sfc_YYYYMMDD.grb``).  :func:`era5_retrievals` builds the CDS
+requests of every day of the configured period (``syear``/``smonth`` to
+``eyear``/``emonth``, as processed by the writers) and :func:`download` runs
+them:
+
+- with *max_fields*, the days of every month are batched into as few
+  requests as the CDS size limits allow instead of one request per day, and
+  every download is split back into the daily files by
+  :func:`split_grib_by_day` (a plain scan of the GRIB message headers);
+- at most *workers* requests are queued at the CDS at the same time, each
+  from its own client;
+- every retrieval is written under a temporary name and only renamed once it
+  holds complete GRIB messages, so an interrupted transfer never leaves a
+  truncated file under the final name;
+- a failed retrieval is retried with exponential backoff and never stops the
+  others;
+- the outcome of every retrieval is kept in a JSON state file next to the
+  downloads, so an interrupted or partly failed run started again only
+  requests the files still missing.  Complete files downloaded before the
+  state file existed are recognised and not requested again.
+
+The client is any object with the ``retrieve(dataset, request, target)``
+method of ``cdsapi.Client``; pass *client_factory* to use another one (a
+local mirror, or a fake server in the tests).
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import itertools
+import json
+import math
+import os
+import threading
+import time
+import traceback
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import BinaryIO, Protocol
+
+import numpy as np
+
+from pgw4era.domain import domain_bounds
+from pgw4era.regrid import GridDescription, read_grid_description
+from pgw4era.utils import calc_days
+
+#: File name of the download state, in the download directory.
+STATE_NAME = "era5_download_state.json"
+
+PL_DATASET = "reanalysis-era5-pressure-levels"
+SFC_DATASET = "reanalysis-era5-single-levels"
+
+PL_VARIABLES = [
+    "geopotential",
+    "temperature",
+    "u_component_of_wind",
+    "relative_humidity",
+    "v_component_of_wind",
+]
+PRESSURE_LEVELS = [
+    "1", "2", "3", "5", "7", "10", "20", "30", "50", "70", "100", "125", "150", "175", "200",
+    "225", "250", "300", "350", "400", "450", "500", "550", "600", "650", "700", "750", "775",
+    "800", "825", "850", "875", "900", "925", "950", "975", "1000",
+]  # fmt: skip
+SFC_VARIABLES = [
+    "10m_u_component_of_wind",
+    "10m_v_component_of_wind",
+    "2m_dewpoint_temperature",
+    "2m_temperature",
+    "land_sea_mask",
+    "mean_sea_level_pressure",
+    "sea_ice_cover",
+    "sea_surface_temperature",
+    "skin_temperature",
+    "snow_depth",
+    "soil_temperature_level_1",
+    "soil_temperature_level_2",
+    "soil_temperature_level_3",
+    "soil_temperature_level_4",
+    "surface_pressure",
+    "volumetric_soil_water_layer_1",
+    "volumetric_soil_water_layer_2",
+    "volumetric_soil_water_layer_3",
+    "volumetric_soil_water_layer_4",
+]
+#: Maximum number of fields of an ERA5 request accepted by the CDS.
+MAX_FIELDS = 60_000
+
+ERA5_TIMES = ["00:00", "06:00", "12:00", "18:00"]
+ERA5_GRID = [0.3, 0.3]
+
+# Dataset and request fields of the two kinds of daily files
+_KINDS = {
+    "pl": (
+        PL_DATASET,
+        {"variable": PL_VARIABLES, "pressure_level": PRESSURE_LEVELS},
+    ),
+    "sfc": (SFC_DATASET, {"variable": SFC_VARIABLES}),
+}
+
+
+class Client(Protocol):
+    """The part of ``cdsapi.Client`` used to download."""
+
+    def retrieve(self, name: str, request: dict, target: str) -> object: ...
+
+
+@dataclass
+class Retrieval:
+    """One CDS request, saved to the file *name* of the download directory.
+
+    A request for several days has the ``strftime`` pattern *split* of the
+    daily files it is split into (see :func:`split_grib_by_day`) and their
+    *days*.
+    """
+
+    name: str
+    dataset: str
+    request: dict
+    split: str | None = None
+    days: list[dt.date] = field(default_factory=list)
+
+    @property
+    def files(self) -> list[str]:
+        """Names of the files the retrieval provides."""
+        if self.split is None:
+            return [self.name]
+        return [day.strftime(self.split) for day in self.days]
+
+
+@dataclass
+class RetrievalResult:
+    """Outcome of a :class:`Retrieval` after all its attempts."""
+
+    name: str
+    ok: bool
+    attempts: int
+    seconds: float
+    skipped: bool = False
+    error: str | None = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _fields_per_day(kind: str) -> int:
+    """Number of GRIB fields of one day of *kind*."""
+    _, fields = _KINDS[kind]
+    return len(ERA5_TIMES) * math.prod(len(values) for values in fields.values())
+
+
+def era5_area(cfg: SimpleNamespace) -> list[float] | None:
+    """CDS ``area`` (north, west, south, east) covering the domain of *cfg*, or ``None``.
+
+    The bounds of the ``domain`` section plus its halo (see
+    :func:`pgw4era.domain.domain_bounds`) are widened to the nearest points
+    of the global ERA5 grid, so the regional grid is a window of the global
+    one.  Longitudes increase from west to east, beyond 180° for domains
+    crossing the antimeridian.  ``None`` (the global grid) is returned when
+    the profile has no ``domain`` section.
+    """
+    domain = getattr(cfg, "domain", None)
+    if not domain:
+        return None
+    lat_min, lat_max, lon_min, lon_max = domain_bounds(domain)
+    halo = float(domain.get("halo", 0.0))
+    dlon, dlat = ERA5_GRID
+
+    def snap(value: float, step: float, up: bool) -> float:
+        # Tolerate rounding errors of bounds given on the grid
+        index = math.ceil(value / step - 1e-6) if up else math.floor(value / step + 1e-6)
+        return round(index * step, 6)
+
+    north = min(snap(lat_max + halo, dlat, True), 90.0)
+    south = max(snap(lat_min - halo, dlat, False), -90.0)
+    span = (lon_max - lon_min) % 360.0 if lon_max - lon_min < 360.0 else 360.0
+    west = snap(lon_min - halo, dlon, False)
+    east = snap(lon_min + span + halo, dlon, True)
+    if east - west >= 360.0 - dlon / 2:
+        west, east = 0.0, round(360.0 - dlon, 6)
+    return [north, west, south, east]
+
+
+def area_grid(area: list[float] | None) -> GridDescription:
+    """Grid of the ERA5 files downloaded for *area* (``None``: the global grid)."""
+    dlon, dlat = ERA5_GRID
+    north, west, south, east = area or [90.0, 0.0, -90.0, 360.0 - dlon]
+    return GridDescription(
+        gridtype="lonlat",
+        xsize=round((east - west) / dlon) + 1,
+        ysize=round((north - south) / dlat) + 1,
+        xfirst=west,
+        xinc=dlon,
+        yfirst=north,
+        yinc=-dlat,
+    )
+
+
+def check_regrid_grid(cfg: SimpleNamespace, area: list[float] | None) -> None:
+    """Refuse a ``regrid_grid`` other than the grid of the ERA5 files of *area*.
+
+    The writers add the CC signal, regridded to ``regrid_grid``, to the ERA5
+    fields point by point, so both must be on the same grid.  A missing
+    ``regrid_grid`` file is accepted for the global grid only.
+
+    Raises
+    ------
+    ValueError
+        If ``regrid_grid`` describes another grid, or is missing for a
+        regional *area*.
+    """
+    expected = area_grid(area)
+    what = "the global ERA5 grid" if area is None else "the ERA5 grid of the downloaded area"
+    if not Path(cfg.regrid_grid).exists():
+        if area is None:
+            return
+        raise ValueError(f"regrid_grid {cfg.regrid_grid} does not exist, it must describe {what}")
+    grid = read_grid_description(cfg.regrid_grid)
+    if (
+        grid.lat.shape != expected.lat.shape
+        or grid.lon.shape != expected.lon.shape
+        or not np.allclose(grid.lat, expected.lat, atol=1e-6)
+        or not np.allclose((grid.lon - expected.lon + 180.0) % 360.0 - 180.0, 0.0, atol=1e-6)
+    ):
+        raise ValueError(f"regrid_grid {cfg.regrid_grid} is not {what}")
+
+
+def era5_retrievals(
+    cfg: SimpleNamespace,
+    kinds: Sequence[str] = ("pl", "sfc"),
+    max_fields: int | None = None,
+    area: list[float] | None = None,
+) -> list[Retrieval]:
+    """ERA5 retrievals of the period of *cfg*.
+
+    With *max_fields*, the days of every month are grouped into as few
+    requests as the limit on the number of fields of a request allows (a
+    whole month of pressure levels is 23 000 fields).  Requests never span
+    two months, as the CDS stores ERA5 by month.  Every multi-day download
+    is split into the daily files afterwards.
+
+    Parameters
+    ----------
+    cfg:
+        Configuration; ``syear``, ``smonth``, ``eyear`` and ``emonth`` select
+        the days (see :func:`pgw4era.utils.calc_days`).
+    kinds:
+        ``"pl"`` (pressure levels) and/or ``"sfc"`` (surface).
+    max_fields:
+        Maximum number of fields (variables x levels x times x days) of a
+        request; ``None`` for one request per day.
+    area:
+        Region to download (see :func:`era5_area`); ``None`` for the global
+        grid.
+
+    Raises
+    ------
+    ValueError
+        If a kind is unknown.
+    """
+    for kind in kinds:
+        if kind not in _KINDS:
+            raise ValueError(f"Unknown ERA5 file kind {kind!r}; expected one of {tuple(_KINDS)}")
+    days = calc_days(cfg.syear, cfg.smonth, cfg.eyear, cfg.emonth)
+    retrievals = []
+    for kind in kinds:
+        dataset, fields = _KINDS[kind]
+        daily = f"era5_daily_{kind}_%Y%m%d.grb"
+        per_batch = 1 if max_fields is None else max(max_fields // _fields_per_day(kind), 1)
+        for _, month in itertools.groupby(days, key=lambda day: (day.year, day.month)):
+            month = list(month)
+            for start in range(0, len(month), per_batch):
+                batch = month[start : start + per_batch]
+                request = {
+                    "product_type": "reanalysis",
+                    "format": "grib",
+                    **fields,
+                    "year": f"{batch[0].year}",
+                    "month": f"{batch[0].month:02d}",
+                    "day": [f"{day.day:02d}" for day in batch],
+                    "time": ERA5_TIMES,
+                    "grid": ERA5_GRID,
+                }
+                if area is not None:
+                    request["area"] = area
+                if len(batch) == 1:
+                    request["day"] = request["day"][0]
+                    retrievals.append(Retrieval(batch[0].strftime(daily), dataset, request))
+                else:
+                    name = f"era5_{kind}_{batch[0]:%Y%m%d}-{batch[-1]:%Y%m%d}.grb"
+                    retrievals.append(Retrieval(name, dataset, request, daily, batch))
+    return retrievals
+
+
+def _grib_messages(fh: BinaryIO, size: int) -> Iterator[tuple[int, int, int]]:
+    """Offset, length and edition of every GRIB message of *fh*.
+
+    Raises ValueError at the first message that is not complete.
+    """
+    offset = 0
+    while offset < size:
+        fh.seek(offset)
+        header = fh.read(16)
+        if len(header) < 8 or header[:4] != b"GRIB":
+            raise ValueError(f"No GRIB message at byte {offset}")
+        edition = header[7]
+        if edition == 1:
+            length = int.from_bytes(header[4:7], "big")
+        elif edition == 2 and len(header) == 16:
+            length = int.from_bytes(header[8:16], "big")
+        else:
+            raise ValueError(f"Unsupported GRIB edition {edition} at byte {offset}")
+        if length < 16 or offset + length > size:
+            raise ValueError(f"Truncated GRIB message at byte {offset}")
+        fh.seek(offset + length - 4)
+        if fh.read(4) != b"7777":
+            raise ValueError(f"GRIB message at byte {offset} does not end with 7777")
+        yield offset, length, edition
+        offset += length
+
+
+def grib_complete(path: str | Path) -> bool:
+    """Whether *path* is a non-empty sequence of complete GRIB messages.
+
+    Every message (edition 1 or 2) must start with ``GRIB``, have the length
+    given in its header and end with ``7777``; trailing bytes of a truncated
+    message make the file incomplete.
+    """
+    size = os.path.getsize(path)
+    try:
+        with open(path, "rb") as fh:
+            for _ in _grib_messages(fh, size):
+                pass
+    except ValueError:
+        return False
+    return size > 0
+
+
+def grib_reference_date(message: bytes) -> dt.date:
+    """Date of the reference time of a GRIB *message* (edition 1 or 2)."""
+    if message[7] == 1:
+        # Section 1 after the 8 bytes of section 0: year of century, month,
+        # day at octets 13-15 and the century at octet 25
+        pds = message[8:]
+        return dt.date((pds[24] - 1) * 100 + pds[12], pds[13], pds[14])
+    # Section 1 after the 16 bytes of section 0: year at octets 13-14
+    ids = message[16:]
+    return dt.date(int.from_bytes(ids[12:14], "big"), ids[14], ids[15])
+
+
+def split_grib_by_day(path: str | Path, pattern: str, target_dir: str | Path) -> dict[str, int]:
+    """Split the GRIB file *path* into one file per day of reference time.
+
+    The messages of every day are written, in their order in *path*, to
+    ``target_dir / day.strftime(pattern)``; for the analysed ERA5 fields the
+    reference time is the valid time.  Each file is written under a
+    temporary name and renamed once complete, replacing an existing one.
+    Returns the size of every file written, by name.
+
+    Raises
+    ------
+    ValueError
+        If *path* holds an incomplete GRIB message.
+    """
+    target_dir = Path(target_dir)
+    size = os.path.getsize(path)
+    parts: dict[str, BinaryIO] = {}
+    try:
+        with open(path, "rb") as fh:
+            for offset, length, _ in _grib_messages(fh, size):
+                fh.seek(offset)
+                message = fh.read(length)
+                name = grib_reference_date(message).strftime(pattern)
+                if name not in parts:
+                    parts[name] = open(target_dir / f"{name}.part", "wb")
+                parts[name].write(message)
+    except BaseException:
+        for name, out in parts.items():
+            out.close()
+            (target_dir / f"{name}.part").unlink(missing_ok=True)
+        raise
+    sizes = {}
+    for name, out in parts.items():
+        sizes[name] = out.tell()
+        out.close()
+        os.replace(target_dir / f"{name}.part", target_dir / name)
+    return sizes
+
+
+class DownloadState:
+    """Outcome of every retrieval of a download directory, kept as JSON.
+
+    Entries are keyed by retrieval name and hold the status (``"done"`` or
+    ``"failed"``), the dataset and request, the number of attempts, and the
+    sizes of the files provided (see :attr:`Retrieval.files`) or the last
+    error.  The file is rewritten
+    atomically after every change; instances can be shared by threads.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.entries: dict[str, dict] = {}
+        if self.path.exists():
+            self.entries = json.loads(self.path.read_text())["retrievals"]
+
+    def is_done(self, retrieval: Retrieval, target_dir: Path) -> bool:
+        """Whether *retrieval* completed and its files are still as downloaded.
+
+        Complete files without an entry (downloaded before the state file
+        existed, or by daily requests) are recorded as done.  Entries of
+        another request are stale.
+        """
+        with self._lock:
+            entry = self.entries.get(retrieval.name)
+        paths = [target_dir / name for name in retrieval.files]
+        if entry is not None and entry["status"] == "done":
+            same = entry["dataset"] == retrieval.dataset and entry["request"] == retrieval.request
+            files = entry.get("files", {retrieval.name: entry.get("size")})
+            return same and all(
+                path.exists() and path.stat().st_size == files.get(path.name) for path in paths
+            )
+        if entry is None and all(path.exists() and grib_complete(path) for path in paths):
+            files = {path.name: path.stat().st_size for path in paths}
+            self.record(retrieval, "done", attempts=0, files=files)
+            return True
+        return False
+
+    def record(self, retrieval: Retrieval, status: str, **fields) -> None:
+        """Set the entry of *retrieval* and save the state."""
+        with self._lock:
+            self.entries[retrieval.name] = {
+                "status": status,
+                "dataset": retrieval.dataset,
+                "request": retrieval.request,
+                **fields,
+            }
+            part = self.path.with_name(f"{self.path.name}.part")
+            part.write_text(json.dumps({"retrievals": self.entries}, indent=1) + "\n")
+            os.replace(part, self.path)
+
+
+def _cds_client() -> Client:
+    import cdsapi
+
+    return cdsapi.Client()
+
+
+def download(
+    retrievals: Sequence[Retrieval],
+    target_dir: str | Path,
+    client_factory: Callable[[], Client] | None = None,
+    workers: int = 4,
+    retries: int = 3,
+    backoff: float = 60.0,
+    max_backoff: float = 3600.0,
+    state: str | Path | None = None,
+    keep_batches: bool = False,
+    sleep: Callable[[float], None] = time.sleep,
+) -> list[RetrievalResult]:
+    """Run *retrievals* into *target_dir* and return their results in order.
+
+    Parameters
+    ----------
+    retrievals:
+        Requests to download; those recorded as done in the state file (and
+        complete files not yet recorded) are skipped.
+    target_dir:
+        Directory of the downloaded files; created if needed.
+    client_factory:
+        Callable returning a client; called once per worker thread.  Default:
+        ``cdsapi.Client``.
+    workers:
+        Maximum number of requests in flight.
+    retries:
+        Number of times a failed request is made again.
+    backoff, max_backoff:
+        Seconds to wait before the first retry, doubled at every further
+        retry up to *max_backoff*.
+    state:
+        Path of the state file; default ``<target_dir>/era5_download_state.json``.
+    keep_batches:
+        Keep the downloads of multi-day retrievals after splitting them into
+        the daily files.
+    sleep:
+        Function waiting between attempts.
+    """
+    target_dir = Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    progress = DownloadState(state or target_dir / STATE_NAME)
+    factory = client_factory or _cds_client
+    local = threading.local()
+    lock = threading.Lock()
+    ntotal = len(retrievals)
+    ndone = 0
+
+    def report(message: str) -> None:
+        nonlocal ndone
+        with lock:
+            ndone += 1
+            print(f"[{ndone}/{ntotal}] {message}")
+
+    def run(retrieval: Retrieval) -> RetrievalResult:
+        target = target_dir / retrieval.name
+        part = target.with_name(f"{target.name}.part")
+        if progress.is_done(retrieval, target_dir):
+            report(f"{retrieval.name} already downloaded")
+            return RetrievalResult(retrieval.name, True, 0, 0.0, skipped=True)
+        if not hasattr(local, "client"):
+            local.client = factory()
+        attempts = 0
+        errors: list[str] = []
+        start = time.perf_counter()
+        while attempts <= retries:
+            if attempts:
+                delay = min(backoff * 2 ** (attempts - 1), max_backoff)
+                print(f"{retrieval.name} FAILED (attempt {attempts}), retrying in {delay:g} s")
+                sleep(delay)
+            attempts += 1
+            try:
+                local.client.retrieve(retrieval.dataset, retrieval.request, str(part))
+                if not part.exists() or not grib_complete(part):
+                    raise OSError(f"incomplete GRIB file received for {retrieval.name}")
+                if retrieval.split is None:
+                    files = {retrieval.name: part.stat().st_size}
+                    os.replace(part, target)
+                else:
+                    files = split_grib_by_day(part, retrieval.split, target_dir)
+                    missing = sorted(set(retrieval.files) - set(files))
+                    if missing:
+                        raise OSError(f"{retrieval.name} holds no data for {', '.join(missing)}")
+                    files = {name: files[name] for name in retrieval.files}
+                    if keep_batches:
+                        os.replace(part, target)
+                    else:
+                        part.unlink()
+            except Exception as exc:
+                errors.append(f"{type(exc).__name__}: {exc}")
+                part.unlink(missing_ok=True)
+                continue
+            seconds = time.perf_counter() - start
+            size = sum(files.values())
+            progress.record(retrieval, "done", attempts=attempts, files=files)
+            report(f"{retrieval.name} done ({size / 1024**2:.1f} MiB, {seconds:.1f} s)")
+            return RetrievalResult(retrieval.name, True, attempts, round(seconds, 3))
+
+        seconds = time.perf_counter() - start
+        progress.record(retrieval, "failed", attempts=attempts, error=errors[-1])
+        report(f"{retrieval.name} FAILED: {errors[-1]}")
+        return RetrievalResult(retrieval.name, False, attempts, round(seconds, 3), error=errors[-1])
+
+    def guarded(retrieval: Retrieval) -> RetrievalResult:
+        try:
+            return run(retrieval)
+        except Exception as exc:
+            # A failing client factory or state file; keep the other downloads going
+            error = f"{type(exc).__name__}: {exc}\n{traceback.format_exc()}"
+            report(f"{retrieval.name} FAILED: {error.splitlines()[0]}")
+            return RetrievalResult(retrieval.name, False, 0, 0.0, error=error)
+
+    print(f"Downloading {ntotal} file(s) with {workers} concurrent request(s) to {target_dir}")
+    results: dict[str, RetrievalResult] = {}
+    with ThreadPoolExecutor(max(workers, 1)) as executor:
+        futures = {executor.submit(guarded, retrieval): retrieval for retrieval in retrievals}
+        for future in as_completed(futures):
+            results[futures[future].name] = future.result()
+    ordered = [results[retrieval.name] for retrieval in retrievals]
+
+    failed = [result for result in ordered if not result.ok]
+    skipped = sum(result.skipped for result in ordered)
+    print(
+        f"Finished: {ntotal - len(failed)} of {ntotal} file(s) available "
+        f"({skipped} already downloaded)"
+    )
+    if failed:
+        print(f"{len(failed)} file(s) failed; run again to resume:")
+        for result in failed:
+            print(f"  {result.name}: {result.error.splitlines()[0]}")
+    return ordered
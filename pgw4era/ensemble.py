@@ -0,0 +1,433 @@
+"""pgw4era.ensemble — streaming multi-model mean of the regridded CC signals.
+
+The ensemble mean used to be computed by rewriting every per-model delta with
+corrected pressure levels, stacking all of them along a ``model`` dimension
+(30 models x 12 months x 19 levels x 601 x 1200 for a 3-D variable), writing
+the stack and only then averaging.  :class:`EnsembleMean` instead reads the
+models one month at a time and keeps a running sum and count of the valid
+values, so memory and disk use do not grow with the size of the ensemble.
+
+Besides the (optionally weighted) mean, :class:`EnsembleQuantiles` computes
+the median and any quantiles of the ensemble.  Those need all models at every
+point, so the grid is processed in blocks of rows read from every model file,
+bounded by a memory budget instead of stacking the whole ensemble.
+
+All statistics skip missing values, and a point is missing in a statistic
+when the fraction of models missing it exceeds ``max_missing``.  Model
+weights (e.g. for performance or independence) apply to every statistic.
+Quantiles are interpolated between the models' values placed at the
+midpoints of their cumulative weights; with equal weights this is numpy's
+``method="hazen"``.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+
+#: The 19 pressure levels (Pa) of the CMIP6 ``plev19`` axis.  Some models
+#: store them with rounding differences, so they are replaced by these values.
+CMIP6_PLEVS = np.array(
+    [
+        100000,
+        92500,
+        85000,
+        70000,
+        60000,
+        50000,
+        40000,
+        30000,
+        25000,
+        20000,
+        15000,
+        10000,
+        7000,
+        5000,
+        3000,
+        2000,
+        1000,
+        500,
+        100,
+    ],
+    dtype="float64",
+)
+
+# Statistics that can be requested by name: "mean", "median" or "q<percent>"
+_QUANTILE = re.compile(r"q(\d+(?:\.\d+)?)$")
+
+# Coordinate attributes copied to the outputs; bounds are not carried over
+_COORD_ATTRS = ("standard_name", "long_name", "units", "axis", "positive", "calendar")
+
+
+def parse_statistic(name: str) -> float | None:
+    """Quantile (0..1) of statistic *name*, or ``None`` for ``"mean"``.
+
+    Raises
+    ------
+    ValueError
+        If *name* is not ``"mean"``, ``"median"`` or ``"q<percent>"`` (e.g.
+        ``"q90"``, ``"q2.5"``).
+    """
+    if name == "mean":
+        return None
+    if name == "median":
+        return 0.5
+    match = _QUANTILE.match(name)
+    if match is None or not 0.0 <= float(match.group(1)) <= 100.0:
+        raise ValueError(
+            f"Unknown ensemble statistic {name!r}; expected 'mean', 'median' or 'q<percent>'"
+        )
+    return float(match.group(1)) / 100.0
+
+
+def statistic_suffix(name: str) -> str:
+    """File-name suffix of the CC-signal files of statistic *name* (none for the mean)."""
+    return "" if name == "mean" else f"_{name}"
+
+
+def weighted_quantile(
+    values: np.ndarray, weights: np.ndarray, quantiles: Sequence[float]
+) -> np.ndarray:
+    """Weighted quantiles of *values* along axis 0, skipping NaN.
+
+    Every value is placed at the midpoint of its cumulative weight and the
+    quantiles are interpolated linearly between those positions (clamped to
+    the smallest and largest value).  Returns an array of shape
+    ``(len(quantiles), *values.shape[1:])``; NaN where all values are NaN.
+    """
+    values = np.asarray(values, dtype="float64")
+    weights = np.reshape(np.asarray(weights, dtype="float64"), (-1,) + (1,) * (values.ndim - 1))
+    order = np.argsort(values, axis=0)
+    values = np.take_along_axis(values, order, axis=0)
+    weight = np.take_along_axis(np.broadcast_to(weights, values.shape), order, axis=0)
+    weight = np.where(np.isnan(values), 0.0, weight)
+    cumulative = np.cumsum(weight, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        position = (cumulative - 0.5 * weight) / cumulative[-1]
+    # Missing and zero-weight values take no part
+    position[weight == 0.0] = np.nan
+
+    out = np.empty((len(quantiles), *values.shape[1:]))
+    for n, q in enumerate(quantiles):
+        below = np.where(position <= q, position, -np.inf)
+        above = np.where(position >= q, position, np.inf)
+        lo, hi = below.argmax(axis=0)[None], above.argmin(axis=0)[None]
+        pos_lo = np.take_along_axis(below, lo, axis=0)[0]
+        pos_hi = np.take_along_axis(above, hi, axis=0)[0]
+        val_lo = np.take_along_axis(values, lo, axis=0)[0]
+        val_hi = np.take_along_axis(values, hi, axis=0)[0]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac = np.where(pos_hi > pos_lo, (q - pos_lo) / (pos_hi - pos_lo), 0.0)
+        result = val_lo + frac * (val_hi - val_lo)
+        result = np.where(np.isfinite(pos_lo), result, val_hi)
+        out[n] = np.where(np.isfinite(pos_lo) | np.isfinite(pos_hi), result, np.nan)
+    return out
+
+
+class _Ensemble:
+    """Grid, metadata and model weights shared by the ensemble statistics.
+
+    Parameters
+    ----------
+    varname:
+        Variable to average; its first dimension must be time.
+    plev:
+        Pressure levels written for the ``plev`` axis instead of those of the
+        model files (see :data:`CMIP6_PLEVS`); ``None`` keeps the levels of
+        the first file.
+    max_missing:
+        Largest fraction of models that may miss a point for its statistics
+        to be kept; with the default ``1.0`` any point with a valid model is
+        kept.
+    weights:
+        Weight of every model, by name; ``None`` weighs all models equally.
+    """
+
+    def __init__(
+        self,
+        varname: str,
+        plev: np.ndarray | None = None,
+        max_missing: float = 1.0,
+        weights: Mapping[str, float] | None = None,
+    ) -> None:
+        self.varname = varname
+        self.plev = plev
+        self.max_missing = max_missing
+        self.weights = weights
+        self.models: list[str] = []
+        self._shape: tuple[int, ...] | None = None
+        self._dtype = np.dtype("float32")
+        self._dims: tuple[str, ...] = ()
+        self._coords: dict[str, tuple[np.ndarray, dict]] = {}
+        self._attrs: dict = {}
+
+    def _check(self, path: str | Path, ds: nc.Dataset, var: nc.Variable) -> None:
+        """Take the grid and metadata from the first model; check the others against it."""
+        if self._shape is not None:
+            if var.shape != self._shape:
+                raise ValueError(
+                    f"{path}: {self.varname} has shape {var.shape}, expected {self._shape}"
+                )
+            return
+        self._shape = var.shape
+        if var.dtype.kind == "f":
+            self._dtype = var.dtype
+        self._dims = var.dimensions
+        self._attrs = {
+            key: var.getncattr(key)
+            for key in var.ncattrs()
+            if key in ("standard_name", "long_name", "units")
+        }
+        for dim in self._dims:
+            if dim not in ds.variables:
+                continue
+            coord = ds.variables[dim]
+            attrs = {key: coord.getncattr(key) for key in coord.ncattrs() if key in _COORD_ATTRS}
+            values = np.asarray(coord[:])
+            if dim == "plev" and self.plev is not None:
+                if len(self.plev) != len(values):
+                    raise ValueError(
+                        f"{path}: {len(values)} pressure levels, expected {len(self.plev)}"
+                    )
+                values = np.asarray(self.plev, dtype=values.dtype)
+            self._coords[dim] = (values, attrs)
+
+    def _weight(self, model: str) -> float:
+        if self.weights is None:
+            return 1.0
+        if model not in self.weights:
+            raise ValueError(f"No ensemble weight for model {model!r}")
+        return float(self.weights[model])
+
+    def _too_sparse(self, count: np.ndarray) -> np.ndarray:
+        """Points with too few valid models for their statistics to be kept."""
+        return (count == 0) | (1.0 - count / len(self.models) > self.max_missing)
+
+    def _create(self, path: Path, leading: tuple[str, ...] = ()) -> nc.Dataset:
+        """Create an output file with the grid of the first model."""
+        ds = nc.Dataset(path, "w")
+        for dim in leading:
+            ds.createDimension(dim, None)
+        for dim, size in zip(self._dims, self._shape):
+            ds.createDimension(dim, None if dim == "time" and not leading else size)
+        for name, (values, attrs) in self._coords.items():
+            coord = ds.createVariable(name, values.dtype, (name,))
+            coord.setncatts(attrs)
+            coord[:] = values
+        var = ds.createVariable(
+            self.varname,
+            self._dtype,
+            (*leading, *self._dims),
+            fill_value=np.array(1e20, dtype=self._dtype),
+        )
+        var.setncatts(self._attrs)
+        if not leading:
+            ds.setncattr("models", " ".join(self.models))
+            if self.weights is not None:
+                ds.setncattr("weights", [self._weight(model) for model in self.models])
+        return ds
+
+
+class EnsembleMean(_Ensemble):
+    """Running (weighted) ensemble mean of one variable of per-model CC-signal files.
+
+    Models are read one month at a time into running sums, so memory use
+    does not depend on the number of models.  Takes the parameters of
+    :class:`_Ensemble` plus:
+
+    Parameters
+    ----------
+    allmodels:
+        Path of an optional file stacking every model along a ``model``
+        dimension, written as the models are added.
+    """
+
+    def __init__(
+        self,
+        varname: str,
+        plev: np.ndarray | None = None,
+        max_missing: float = 1.0,
+        allmodels: str | Path | None = None,
+        weights: Mapping[str, float] | None = None,
+    ) -> None:
+        super().__init__(varname, plev, max_missing, weights)
+        self._allmodels_path = None if allmodels is None else Path(allmodels)
+        self._allmodels: nc.Dataset | None = None
+        self._sum: np.ndarray | None = None
+        self._count: np.ndarray | None = None
+        self._wsum: np.ndarray | None = None
+
+    def add(self, path: str | Path, model: str | None = None) -> None:
+        """Add the model of file *path*, one month at a time.
+
+        Raises
+        ------
+        ValueError
+            If the grid of *path* differs from that of the first model, or
+            the model has no weight.
+        """
+        model = model or Path(path).stem
+        weight = self._weight(model)
+        with nc.Dataset(path) as ds:
+            var = ds.variables[self.varname]
+            self._check(path, ds, var)
+            if self._sum is None:
+                self._sum = np.zeros(self._shape, dtype="float64")
+                self._count = np.zeros(self._shape, dtype="uint16")
+                if self.weights is not None:
+                    self._wsum = np.zeros(self._shape, dtype="float64")
+            if self._allmodels_path is not None and self._allmodels is None:
+                part = self._allmodels_path.with_name(f"{self._allmodels_path.name}.part")
+                self._allmodels = self._create(part, ("model",))
+                self._allmodels.createVariable("model", str, ("model",))
+
+            index = len(self.models)
+            for month in range(var.shape[0]):
+                field = np.ma.filled(var[month].astype("float64"), np.nan)
+                valid = ~np.isnan(field)
+                if self._wsum is None:
+                    np.add(self._sum[month], field, out=self._sum[month], where=valid)
+                else:
+                    np.add(self._sum[month], weight * field, out=self._sum[month], where=valid)
+                    np.add(self._wsum[month], weight, out=self._wsum[month], where=valid)
+                self._count[month] += valid
+                if self._allmodels is not None:
+                    self._allmodels[self.varname][index, month] = np.ma.masked_invalid(field)
+        self.models.append(model)
+        if self._allmodels is not None:
+            self._allmodels["model"][index] = model
+
+    def mean(self) -> np.ndarray:
+        """Ensemble mean of the models added so far; NaN where too many are missing."""
+        if self._sum is None:
+            raise ValueError(f"No model added to the ensemble mean of {self.varname}")
+        norm = self._count if self._wsum is None else self._wsum
+        mean = np.empty(self._shape, dtype=self._dtype)
+        # Month by month, to keep the temporaries small
+        for month in range(self._shape[0]):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = self._sum[month] / norm[month]
+            values[self._too_sparse(self._count[month])] = np.nan
+            mean[month] = values
+        return mean
+
+    def to_netcdf(self, path: str | Path) -> None:
+        """Write the ensemble mean, and complete the all-models file if any.
+
+        Both files are written under a temporary name and renamed once
+        complete.
+        """
+        path = Path(path)
+        part = path.with_name(f"{path.name}.part")
+        mean = self.mean()
+        with self._create(part) as ds:
+            ds[self.varname][:] = np.ma.masked_invalid(mean)
+        os.replace(part, path)
+        if self._allmodels is not None:
+            self._allmodels.close()
+            self._allmodels = None
+            part = self._allmodels_path.with_name(f"{self._allmodels_path.name}.part")
+            os.replace(part, self._allmodels_path)
+
+    def close(self) -> None:
+        """Close (and discard) an incomplete all-models file."""
+        if self._allmodels is not None:
+            self._allmodels.close()
+            self._allmodels = None
+            self._allmodels_path.with_name(f"{self._allmodels_path.name}.part").unlink()
+
+    def __enter__(self) -> EnsembleMean:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class EnsembleQuantiles(_Ensemble):
+    """Ensemble quantiles (e.g. the median) of one variable of per-model CC-signal files.
+
+    The models are registered with :meth:`add` and read by :meth:`to_netcdf`
+    in blocks of rows of about *chunk_mb* MiB of working memory, from all
+    model files at once.  Takes the parameters of :class:`_Ensemble` plus:
+
+    Parameters
+    ----------
+    quantiles:
+        Quantiles (0..1) to compute.
+    chunk_mb:
+        Working-memory budget of a block.
+    """
+
+    def __init__(
+        self,
+        varname: str,
+        quantiles: Sequence[float],
+        plev: np.ndarray | None = None,
+        max_missing: float = 1.0,
+        weights: Mapping[str, float] | None = None,
+        chunk_mb: float = 512.0,
+    ) -> None:
+        super().__init__(varname, plev, max_missing, weights)
+        self.quantiles = list(quantiles)
+        self.chunk_mb = chunk_mb
+        self._paths: list[str | Path] = []
+
+    def add(self, path: str | Path, model: str | None = None) -> None:
+        """Register the model of file *path*; only its header is read now.
+
+        Raises
+        ------
+        ValueError
+            If the grid of *path* differs from that of the first model, or
+            the model has no weight.
+        """
+        model = model or Path(path).stem
+        self._weight(model)
+        with nc.Dataset(path) as ds:
+            self._check(path, ds, ds.variables[self.varname])
+        self._paths.append(path)
+        self.models.append(model)
+
+    def _blocks(self):
+        """Indices of the blocks of rows, over all leading axes."""
+        *lead, nlat, nlon = self._shape
+        # About ten float64 arrays of one block per model are alive at once
+        rows = int(self.chunk_mb * 1024**2 // (10 * 8 * len(self._paths) * nlon))
+        rows = min(max(rows, 1), nlat)
+        for index in np.ndindex(*lead):
+            for row in range(0, nlat, rows):
+                yield (*index, slice(row, min(row + rows, nlat)))
+
+    def to_netcdf(self, paths: Sequence[str | Path]) -> None:
+        """Write every quantile to its file in *paths* (written atomically)."""
+        if not self._paths:
+            raise ValueError(f"No model added to the ensemble quantiles of {self.varname}")
+        if len(paths) != len(self.quantiles):
+            raise ValueError(f"{len(self.quantiles)} output paths needed, got {len(paths)}")
+        weights = np.array([self._weight(model) for model in self.models])
+        paths = [Path(path) for path in paths]
+        parts = [path.with_name(f"{path.name}.part") for path in paths]
+        inputs = [nc.Dataset(path) for path in self._paths]
+        outputs = [self._create(part) for part in parts]
+        try:
+            for block in self._blocks():
+                stack = np.stack(
+                    [
+                        np.ma.filled(ds.variables[self.varname][block].astype("float64"), np.nan)
+                        for ds in inputs
+                    ]
+                )
+                sparse = self._too_sparse(np.count_nonzero(~np.isnan(stack), axis=0))
+                for out, values in zip(outputs, weighted_quantile(stack, weights, self.quantiles)):
+                    values[sparse] = np.nan
+                    out.variables[self.varname][block] = np.ma.masked_invalid(values)
+        finally:
+            for ds in inputs + outputs:
+                ds.close()
+        for part, path in zip(parts, paths):
+            os.replace(part, path)
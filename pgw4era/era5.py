@@ -0,0 +1,155 @@
+"""pgw4era.era5 — windowed reads of the ERA5 daily netCDF files.
+
+The writers need every variable of a daily ``era5_daily_pl_*.nc`` /
+``era5_daily_sfc_*.nc`` file at every one of its timesteps.  Reading them one
+timestep at a time, with the level axis reversed by a ``::-1`` slice, makes
+netCDF4 issue a strided read and a copy per variable and timestep.
+:class:`ERA5File` instead reads each variable in a few large, chunk-aligned
+time windows (by default the whole day in one request) and serves every
+timestep as a view of that window.
+
+With a working *dtype* (the ``float32`` precision policy, see
+:func:`pgw4era.utils.compute_dtype`) netCDF4's auto-masking and -scaling are
+turned off and the packed values are unpacked by :func:`unpack` directly into
+that dtype, avoiding the masked float64 arrays of the default reads.
+"""
+
+from __future__ import annotations
+
+import netCDF4 as nc
+import numpy as np
+
+from pgw4era.domain import GridWindow
+
+
+def unpack(var: nc.Variable, raw: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """Unpack *raw* values read from *var* with auto-masking and -scaling off.
+
+    The values are converted to *dtype* and scaled in place with the
+    variable's ``scale_factor`` / ``add_offset``.  Values equal to its
+    ``_FillValue`` or ``missing_value`` (netCDF's default fill value if it
+    has no ``_FillValue``, as netCDF4 does) are set to NaN instead of being
+    masked.
+    """
+    dtype = np.dtype(dtype)
+    data = raw.astype(dtype)
+    if hasattr(var, "scale_factor"):
+        data *= dtype.type(var.scale_factor)
+    if hasattr(var, "add_offset"):
+        data += dtype.type(var.add_offset)
+
+    attrs = var.ncattrs()
+    fill_values = [var.getncattr(name) for name in ("_FillValue", "missing_value") if name in attrs]
+    if "_FillValue" not in attrs and raw.dtype.itemsize > 1:
+        fill_values.append(nc.default_fillvals[raw.dtype.str[1:]])
+    for value in np.ravel(fill_values):
+        np.putmask(data, raw == value, np.nan)
+    return data
+
+
+class ERA5File:
+    """ERA5 netCDF file whose variables are read in whole time windows.
+
+    The level order of the file is inspected once when it is opened: if the
+    ``level`` coordinate is ascending (hPa, i.e. top of the atmosphere first),
+    4-D fields are served with the level axis reversed so that they start at
+    the surface, as written to the intermediate files.
+
+    Parameters
+    ----------
+    path:
+        Path of the netCDF file.
+    window_mb:
+        Approximate maximum size in MiB of a single read.  Windows span a
+        whole number of the variable's time chunks (at least one).  ``None``
+        reads each variable's whole time axis at once, which for a daily file
+        is one request per variable per day.
+    window:
+        Latitude-longitude window to read (see :mod:`pgw4era.domain`).
+        ``None`` reads the whole grid.
+    dtype:
+        Working dtype of the fields (see :func:`unpack`).  ``None`` keeps
+        netCDF4's default masked reads.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        window_mb: float | None = None,
+        window: GridWindow | None = None,
+        dtype: np.dtype | str | None = None,
+    ) -> None:
+        self.dataset = nc.Dataset(path, "r")
+        self.window_mb = window_mb
+        self.window = window
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        if self.dtype is not None:
+            self.dataset.set_auto_maskandscale(False)
+        levels = self.dataset.variables.get("level")
+        self.levels_reversed = levels is not None and bool(np.all(np.diff(levels[:]) > 0))
+        self._windows: dict[str, tuple[int, np.ndarray]] = {}
+        self.nreads = 0
+
+    @property
+    def variables(self) -> dict[str, nc.Variable]:
+        """The variables of the underlying :class:`netCDF4.Dataset`."""
+        return self.dataset.variables
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.dataset.variables
+
+    def _window_steps(self, var: nc.Variable) -> int:
+        ntimes = var.shape[0]
+        if self.window_mb is None:
+            return max(ntimes, 1)
+        chunking = var.chunking()
+        tchunk = 1 if chunking == "contiguous" else chunking[0]
+        if self.dtype is not None:
+            itemsize = self.dtype.itemsize
+        elif hasattr(var, "scale_factor"):
+            # Packed variables are unpacked to float64
+            itemsize = 8
+        else:
+            itemsize = var.dtype.itemsize
+        shape = var.shape[1:]
+        if self.window is not None:
+            shape = (*shape[:-2], *self.window.shape(*shape[-2:]))
+        step_nbytes = int(np.prod(shape)) * itemsize
+        nsteps = int(self.window_mb * 1024**2) // max(step_nbytes, 1)
+        return max(tchunk, nsteps // tchunk * tchunk)
+
+    def field(self, code: str, nt: int) -> np.ndarray:
+        """Return variable *code* at time index *nt*.
+
+        The result is a view of the cached window (level-reversed for 4-D
+        fields of files with ascending levels) and must not be modified in
+        place.
+        """
+        window = self._windows.get(code)
+        if window is None or not 0 <= nt - window[0] < len(window[1]):
+            var = self.dataset.variables[code]
+            nsteps = self._window_steps(var)
+            start = nt // nsteps * nsteps
+            if self.window is None:
+                data = var[start : start + nsteps]
+            else:
+                data = self.window.read(var, slice(start, start + nsteps), Ellipsis)
+            if self.dtype is not None:
+                data = unpack(var, data, self.dtype)
+            window = self._windows[code] = (start, data)
+            self.nreads += 1
+        start, data = window
+        if data.ndim == 4 and self.levels_reversed:
+            return data[nt - start, ::-1]
+        return data[nt - start]
+
+    def close(self) -> None:
+        """Close the file and drop the cached windows."""
+        self._windows.clear()
+        self.dataset.close()
+
+    def __enter__(self) -> ERA5File:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,561 @@
+"""pgw4era.intermediate — WPS intermediate-format files written with NumPy.
+
+Pure-Python replacement for the f2py ``outputInter`` / ``outputInter_CRYOWRF``
+extensions.  Files are byte-identical to those written by the Fortran
+``writeint`` subroutine: version-5 WPS intermediate format, big-endian
+Fortran unformatted sequential records with 4-byte record markers.
+
+Each 2-D field is written as five records::
+
+    1. version                          (int32)
+    2. hdate, xfcst, map_source, field,
+       units, desc, xlvl, nx, ny, iproj (156 bytes)
+    3. startloc, startlat, startlon,
+       deltalat, deltalon, earth_radius (28 bytes)
+    4. is_wind_grid_rel                 (logical, int32)
+    5. slab                             (nx * ny float32, longitude fastest)
+
+The Fortran writer transposes every ``(nlat, nlon)`` slab into a
+``(nlon, nlat)`` column-major array before writing it, which is exactly the
+row-major memory order of the NumPy slab, so no transpose is needed here.
+
+:class:`IntermediateFile` reads such files back: it memory-maps the file,
+indexes the byte offset of every slab by ``(field, level)`` from the headers
+alone and returns slabs as zero-copy views of the mapping.
+"""
+
+from __future__ import annotations
+
+import functools
+import importlib
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+# (field, units, description) of every slab, in the order of the fields arrays
+FIELDS3D: list[tuple[str, str, str]] = [
+    ("RH", "percent", "Relative Humidity"),
+    ("TT", "K", "Temperature"),
+    ("UU", "m s-1", "U"),
+    ("VV", "m s-1", "V"),
+    ("GHT", "m", "Height"),
+]
+FIELDS2D_WRF: list[tuple[str, str, str]] = [
+    ("UU", "m s-1", "U"),
+    ("VV", "m s-1", "V"),
+    ("RH", "percent", "Relative Humidity"),
+    ("PSFC", "Pa", "Surface Pressure"),
+    ("PMSL", "Pa", "Sea-level pressure"),
+    ("TT", "K", "Temperature"),
+    ("SKINTEMP", "K", "Sea-Surface Temperature"),
+]
+FIELDS2D_CRYOWRF: list[tuple[str, str, str]] = FIELDS2D_WRF + [
+    ("SNOW", "kg m-2", "Water equivalent snow depth"),
+    ("SNOWH", "m", "Physical snow depth"),
+]
+
+_VERSION = 5
+_IPROJ = 0  # cylindrical equidistant
+_STARTLOC = "SWCORNER"
+_EARTH_RADIUS = 6367.470215  # km
+_XLVL_SFC = 200100.0
+_XLVL_PMSL = 201300.0
+_RECORDS_PER_FIELD = 5
+
+# Maximum number of buffers handed to a single writev call (POSIX IOV_MAX)
+_IOV_MAX = 1024
+
+
+def _record(payload: bytes) -> bytes:
+    marker = struct.pack(">i", len(payload))
+    return marker + payload + marker
+
+
+def _text(value: str, length: int) -> bytes:
+    """Blank-pad (or truncate) *value* like a Fortran CHARACTER(len=length)."""
+    return value.encode("ascii")[:length].ljust(length, b" ")
+
+
+def _write_buffers(fh, buffers: list) -> None:
+    """Write *buffers* to *fh* in as few system calls as possible."""
+    if not hasattr(os, "writev"):
+        fh.writelines(buffers)
+        return
+    fh.flush()
+    fd = fh.fileno()
+    views = [memoryview(buf).cast("B") for buf in buffers]
+    for start in range(0, len(views), _IOV_MAX):
+        chunk = views[start : start + _IOV_MAX]
+        while chunk:
+            nbytes = os.writev(fd, chunk)
+            # Drop what was written; a short write may end inside a buffer
+            while chunk and nbytes >= len(chunk[0]):
+                nbytes -= len(chunk[0])
+                chunk.pop(0)
+            if chunk and nbytes:
+                chunk[0] = chunk[0][nbytes:]
+
+
+def write_intermediate(
+    path: str | Path,
+    plvs: Sequence[float],
+    fields3d: np.ndarray,
+    fields2d: np.ndarray,
+    hdate: str,
+    startlat: float,
+    startlon: float,
+    deltalon: float,
+    deltalat: float,
+    names3d: Sequence[tuple[str, str, str]] = FIELDS3D,
+    names2d: Sequence[tuple[str, str, str]] = FIELDS2D_WRF,
+    map_source: str = "ERA5",
+) -> None:
+    """Write one WPS intermediate file.
+
+    Parameters
+    ----------
+    path:
+        Output file path.
+    plvs:
+        Pressure levels (Pa) of the second axis of *fields3d*.
+    fields3d:
+        Array of shape ``(nfields3d, nlev, nlat, nlon)``.
+    fields2d:
+        Array of shape ``(nfields2d, nlat, nlon)``.
+    hdate:
+        Valid date, e.g. ``"2009-06-01_00-00-00"``.
+    startlat, startlon:
+        Latitude/longitude of the first grid point.
+    deltalon, deltalat:
+        Grid spacing in degrees.
+    names3d, names2d:
+        ``(field, units, description)`` of each entry of *fields3d* /
+        *fields2d*.
+    map_source:
+        Source model / originating centre written in every header.
+
+    Notes
+    -----
+    Both field arrays are converted to big-endian float32 once (a no-op if
+    they already are) and written slab by slab straight from that buffer,
+    to ``<path>.part``, which is renamed to *path* once complete.
+    """
+    fields3d = np.ascontiguousarray(fields3d, dtype=">f4")
+    fields2d = np.ascontiguousarray(fields2d, dtype=">f4")
+    nlat, nlon = fields2d.shape[-2:]
+
+    version = _record(struct.pack(">i", _VERSION))
+    grid = _record(
+        _text(_STARTLOC, 8)
+        + struct.pack(">fffff", startlat, startlon, deltalat, deltalon, _EARTH_RADIUS)
+    )
+    wind = _record(struct.pack(">i", 0))
+    slab_marker = struct.pack(">i", nlon * nlat * 4)
+    prefix = _text(hdate, 24) + struct.pack(">f", 0.0) + _text(map_source, 32)
+    suffix = struct.pack(">iii", nlon, nlat, _IPROJ)
+
+    def slab_buffers(spec: tuple[str, str, str], xlvl: float, slab: np.ndarray) -> list:
+        field, units, desc = spec
+        header = _record(
+            prefix
+            + _text(field, 9)
+            + _text(units, 25)
+            + _text(desc, 46)
+            + struct.pack(">f", xlvl)
+            + suffix
+        )
+        return [version + header + grid + wind + slab_marker, slab, slab_marker]
+
+    buffers: list = []
+    for nf in range(fields3d.shape[0]):
+        for nl, xlvl in enumerate(plvs):
+            buffers += slab_buffers(names3d[nf], xlvl, fields3d[nf, nl])
+    for nf in range(fields2d.shape[0]):
+        xlvl = _XLVL_PMSL if names2d[nf][0] == "PMSL" else _XLVL_SFC
+        buffers += slab_buffers(names2d[nf], xlvl, fields2d[nf])
+
+    # Written under a temporary name and renamed, so an interrupted write
+    # never leaves a truncated file under the final name
+    part = f"{path}.part"
+    with open(part, "wb") as fh:
+        _write_buffers(fh, buffers)
+    os.replace(part, path)
+
+
+class IntermediateWriter:
+    """Drop-in replacement for the f2py ``writeint`` extensions.
+
+    :meth:`writeint` has the signature of the Fortran subroutine and writes
+    ``./<prefix>:YYYY-MM-DD_HH`` in the current directory.  Native-endian
+    fields are byte-swapped into big-endian buffers that are allocated on the
+    first call and reused for every following timestep of the same shape.
+
+    Parameters
+    ----------
+    names3d, names2d:
+        ``(field, units, description)`` of the 3-D and 2-D fields.
+    prefix:
+        Output file prefix, also used as ``map_source``.
+    """
+
+    def __init__(
+        self,
+        names3d: Sequence[tuple[str, str, str]] = FIELDS3D,
+        names2d: Sequence[tuple[str, str, str]] = FIELDS2D_WRF,
+        prefix: str = "ERA5",
+    ) -> None:
+        self.names3d = list(names3d)
+        self.names2d = list(names2d)
+        self.prefix = prefix
+        self._buffers: dict[str, np.ndarray] = {}
+
+    def _stage(self, key: str, fields: np.ndarray) -> np.ndarray:
+        if fields.dtype == np.dtype(">f4") and fields.flags.c_contiguous:
+            return fields
+        buf = self._buffers.get(key)
+        if buf is None or buf.shape != fields.shape:
+            buf = self._buffers[key] = np.empty(fields.shape, dtype=">f4")
+        np.copyto(buf, fields, casting="unsafe")
+        return buf
+
+    def writeint(
+        self,
+        plvs: Sequence[float],
+        fields3d: np.ndarray,
+        fields2d: np.ndarray,
+        hdate: str,
+        nlats: int,
+        nlons: int,
+        startlat: float,
+        startlon: float,
+        deltalon: float,
+        deltalat: float,
+    ) -> None:
+        """Write the intermediate file of one timestep (see :func:`write_intermediate`)."""
+        if fields2d.shape[-2:] != (nlats, nlons):
+            raise ValueError(
+                f"fields have shape {fields2d.shape[-2:]}, expected ({nlats}, {nlons})"
+            )
+        path = f"./{self.prefix}:{hdate[:13]}"
+        print(path)
+        write_intermediate(
+            path,
+            plvs,
+            self._stage("3d", np.asarray(fields3d)),
+            self._stage("2d", np.asarray(fields2d)),
+            hdate,
+            startlat,
+            startlon,
+            deltalon,
+            deltalat,
+            self.names3d,
+            self.names2d,
+            self.prefix,
+        )
+
+
+@functools.cache
+def select_writer(
+    backend: str,
+    fortran_module: str,
+    fortran_dir: str,
+    names2d: tuple[tuple[str, str, str], ...],
+):
+    """Return the object whose ``writeint`` writes the intermediate files.
+
+    Parameters
+    ----------
+    backend:
+        ``"numpy"`` for :class:`IntermediateWriter`, ``"fortran"`` for the
+        compiled f2py extension, or ``"auto"`` to use the extension if it can
+        be imported and the NumPy writer otherwise.
+    fortran_module:
+        Name of the f2py extension, e.g. ``"outputInter"``.
+    fortran_dir:
+        Directory containing the compiled extension.
+    names2d:
+        ``(field, units, description)`` of the 2-D fields written by the
+        NumPy writer.
+
+    Raises
+    ------
+    ImportError
+        If ``backend="fortran"`` and the extension cannot be imported.
+    ValueError
+        If *backend* is not recognised.
+    """
+    if backend not in ("auto", "numpy", "fortran"):
+        raise ValueError(f"Unknown writer backend '{backend}'. Use auto, numpy or fortran.")
+
+    if backend in ("auto", "fortran"):
+        if fortran_dir not in sys.path:
+            sys.path.insert(0, fortran_dir)
+        try:
+            return importlib.import_module(fortran_module)
+        except ImportError as exc:
+            if backend == "fortran":
+                raise ImportError(
+                    f"Could not import '{fortran_module}'. "
+                    "Compile it with:\n"
+                    f"  cd {fortran_dir}\n"
+                    f"  f2py -c {fortran_module}.f90 -m {fortran_module}"
+                ) from exc
+
+    return IntermediateWriter(FIELDS3D, names2d)
+
+
+# ---------------------------------------------------------------------------
+# Reader
+# ---------------------------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class IntermediateField:
+    """Header of one 2-D slab of an intermediate file and where its data is.
+
+    Attributes
+    ----------
+    hdate, xfcst, map_source, field_name, units, desc, xlvl, nlons, nlats, iproj:
+        The header record (text blank-stripped).
+    offset:
+        Byte offset of the slab data in the file.
+    """
+
+    hdate: str
+    xfcst: float
+    map_source: str
+    field_name: str
+    units: str
+    desc: str
+    xlvl: float
+    nlons: int
+    nlats: int
+    iproj: int
+    offset: int
+
+    @property
+    def key(self) -> tuple[str, float]:
+        """Identifier of the slab within a file: ``(field_name, xlvl)``."""
+        return (self.field_name, self.xlvl)
+
+
+class IntermediateFile:
+    """Memory-mapped, indexed WPS intermediate (version 5) file.
+
+    Opening a file only reads the record markers and header records, which
+    are decoded all at once when every slab has the same record layout (as
+    in files written by WPS or :func:`write_intermediate`).  Slab data is not
+    read until a slab is accessed, and is then returned as a read-only
+    ``(nlats, nlons)`` float32 view of the mapping in the byte order of the
+    file (big-endian as written by WPS; little-endian files are detected
+    too).  Iterating over many files to compare a single field therefore
+    only touches the pages of that field.
+
+    Views keep the mapping alive: :meth:`close` releases it immediately if
+    no view is left, and otherwise when the last view is garbage collected.
+
+    Parameters
+    ----------
+    path:
+        Path of the file.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a complete version-5 intermediate file.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.byteorder = ">"
+        if size >= 4 and struct.unpack_from("<i", self._mmap, 0)[0] == 4:
+            self.byteorder = "<"
+        self._fields: list[IntermediateField] | None = None
+        try:
+            self._headers, self._offsets = self._scan_regular() or self._scan_records()
+        except Exception:
+            self.close()
+            raise
+        names = np.char.strip(self._headers["field"].astype("U")).tolist()
+        self._index: dict[tuple[str, float], int] = {}
+        for n, key in enumerate(zip(names, self._headers["xlvl"].tolist())):
+            self._index.setdefault(key, n)
+
+    def _header_dtype(self) -> np.dtype:
+        order = self.byteorder
+        return np.dtype(
+            [
+                ("hdate", "S24"),
+                ("xfcst", f"{order}f4"),
+                ("map_source", "S32"),
+                ("field", "S9"),
+                ("units", "S25"),
+                ("desc", "S46"),
+                ("xlvl", f"{order}f4"),
+                ("nlons", f"{order}i4"),
+                ("nlats", f"{order}i4"),
+                ("iproj", f"{order}i4"),
+            ]
+        )
+
+    def _record_sizes(self, pos: int) -> list[int]:
+        """Payload sizes of the records of the slab starting at byte *pos*."""
+        buf = self._mmap
+        sizes = []
+        for _ in range(_RECORDS_PER_FIELD):
+            if pos + 4 > len(buf):
+                raise ValueError(f"{self.path}: truncated record at byte {pos}")
+            (nbytes,) = struct.unpack_from(f"{self.byteorder}i", buf, pos)
+            end = pos + 4 + nbytes
+            if nbytes < 0 or end + 4 > len(buf) or buf[end : end + 4] != buf[pos : pos + 4]:
+                raise ValueError(f"{self.path}: corrupt record at byte {pos}")
+            sizes.append(nbytes)
+            pos = end + 4
+        return sizes
+
+    def _scan_regular(self) -> tuple[np.ndarray, np.ndarray] | None:
+        """Decode all headers at once if every slab has the records of the first one."""
+        buf = self._mmap
+        header_dtype = self._header_dtype()
+        if not len(buf):
+            return np.empty(0, header_dtype), np.empty(0, dtype="int64")
+        sizes = self._record_sizes(0)
+        if sizes[0] != 4 or sizes[1] != header_dtype.itemsize:
+            return None
+        starts = np.cumsum([0] + [nbytes + 8 for nbytes in sizes])
+        stride = int(starts[-1])
+        if len(buf) % stride:
+            return None
+
+        marker = f"{self.byteorder}i4"
+        names, formats, offsets = ["version", "header"], [marker, header_dtype], [4, starts[1] + 4]
+        for k, nbytes in enumerate(sizes):
+            names += [f"lead{k}", f"trail{k}"]
+            formats += [marker, marker]
+            offsets += [starts[k], starts[k] + 4 + nbytes]
+        layout = np.dtype(
+            {"names": names, "formats": formats, "offsets": offsets, "itemsize": stride}
+        )
+        records = np.frombuffer(buf, dtype=layout)
+        for k, nbytes in enumerate(sizes):
+            if np.any(records[f"lead{k}"] != nbytes) or np.any(records[f"trail{k}"] != nbytes):
+                return None
+        if np.any(records["version"] != _VERSION):
+            return None
+        headers = records["header"].copy()
+        if np.any(headers["nlons"].astype("int64") * headers["nlats"] * 4 != sizes[4]):
+            return None
+        offsets = np.arange(len(records), dtype="int64") * stride + int(starts[4]) + 4
+        return headers, offsets
+
+    def _scan_records(self) -> tuple[np.ndarray, np.ndarray]:
+        """Walk the file record by record (slabs of different grids or layouts)."""
+        buf = self._mmap
+        header_dtype = self._header_dtype()
+        headers, offsets = [], []
+        pos = 0
+        while pos < len(buf):
+            sizes = self._record_sizes(pos)
+            starts = pos + np.cumsum([0] + [nbytes + 8 for nbytes in sizes])
+            (version,) = struct.unpack_from(f"{self.byteorder}i", buf, pos + 4)
+            if sizes[0] != 4 or version != _VERSION:
+                raise ValueError(f"{self.path}: not a version-{_VERSION} intermediate file")
+            if sizes[1] != header_dtype.itemsize:
+                raise ValueError(f"{self.path}: header of {sizes[1]} bytes at byte {starts[1]}")
+            header = np.frombuffer(buf, header_dtype, count=1, offset=int(starts[1]) + 4).copy()
+            if int(header["nlons"][0]) * int(header["nlats"][0]) * 4 != sizes[4]:
+                raise ValueError(f"{self.path}: slab size does not match its grid at byte {pos}")
+            headers.append(header)
+            offsets.append(int(starts[4]) + 4)
+            pos = int(starts[-1])
+        return np.concatenate(headers), np.asarray(offsets, dtype="int64")
+
+    def _entry(self, n: int) -> IntermediateField:
+        header = self._headers[n]
+        return IntermediateField(
+            hdate=header["hdate"].decode("ascii").strip(),
+            xfcst=float(header["xfcst"]),
+            map_source=header["map_source"].decode("ascii").strip(),
+            field_name=header["field"].decode("ascii").strip(),
+            units=header["units"].decode("ascii").strip(),
+            desc=header["desc"].decode("ascii").strip(),
+            xlvl=float(header["xlvl"]),
+            nlons=int(header["nlons"]),
+            nlats=int(header["nlats"]),
+            iproj=int(header["iproj"]),
+            offset=int(self._offsets[n]),
+        )
+
+    @property
+    def fields(self) -> list[IntermediateField]:
+        """Headers of all slabs, in file order."""
+        if self._fields is None:
+            self._fields = [self._entry(n) for n in range(len(self))]
+        return self._fields
+
+    def keys(self) -> list[tuple[str, float]]:
+        """``(field_name, xlvl)`` of every slab, in file order."""
+        return list(self._index)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, key: tuple[str, float]) -> bool:
+        return key in self._index
+
+    def __iter__(self) -> Iterator[IntermediateField]:
+        """Lazily yield the header of every slab, in file order."""
+        if self._fields is not None:
+            return iter(self._fields)
+        return (self._entry(n) for n in range(len(self)))
+
+    def field(self, field_name: str, xlvl: float) -> IntermediateField:
+        """Header of the slab of *field_name* at level *xlvl* (``KeyError`` if absent)."""
+        return self._entry(self._index[(field_name, float(xlvl))])
+
+    def _view(self, offset: int, nlats: int, nlons: int) -> np.ndarray:
+        """Zero-copy ``(nlats, nlons)`` view of the slab data at byte *offset*."""
+        return np.frombuffer(
+            self._mmap, dtype=f"{self.byteorder}f4", count=nlats * nlons, offset=offset
+        ).reshape(nlats, nlons)
+
+    def slab(self, entry: IntermediateField) -> np.ndarray:
+        """Zero-copy ``(nlats, nlons)`` view of the data of *entry*."""
+        return self._view(entry.offset, entry.nlats, entry.nlons)
+
+    def __getitem__(self, key: tuple[str, float]) -> np.ndarray:
+        """Zero-copy view of the slab of ``(field_name, xlvl)``."""
+        n = self._index[(key[0], float(key[1]))]
+        # Only the grid of the header is needed, not a whole IntermediateField
+        header = self._headers[n]
+        return self._view(int(self._offsets[n]), int(header["nlats"]), int(header["nlons"]))
+
+    def items(self) -> Iterator[tuple[IntermediateField, np.ndarray]]:
+        """Lazily yield ``(header, slab view)`` for every slab, in file order."""
+        for entry in self:
+            yield entry, self.slab(entry)
+
+    def close(self) -> None:
+        """Release the mapping (deferred while slab views are alive)."""
+        if isinstance(self._mmap, mmap.mmap):
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Exported views still use it; it is unmapped when they are freed
+                pass
+        self._mmap = b""
+
+    def __enter__(self) -> IntermediateFile:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
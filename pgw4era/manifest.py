@@ -0,0 +1,250 @@
+"""pgw4era.manifest — record of the inputs every output file was written from.
+
+Without a manifest the writers skip a timestep whenever its ``ERA5:*`` file
+exists, so a file left half-written by a killed job counts as done and a
+changed anomaly file goes unnoticed unless everything is redone with
+``--overwrite``.  :class:`Manifest` keeps, in an SQLite database next to the
+outputs, one row per output file with:
+
+- the digest of everything the file was computed from: the configuration
+  values that affect the output, the two ERA5 daily files of its day, the
+  ERA5 reference file and the CC-signal files;
+- the size and modification time of the file once completely written.
+
+A timestep is up to date only if its row exists, its input digest matches
+the current inputs and the file on disk still has the recorded size and
+modification time; everything else is rewritten.  Rows are committed after
+the file has been written, in a single transaction each, so a run
+interrupted at any point leaves a consistent manifest and restarts where it
+stopped.  SQLite handles the locking between the worker processes of
+``--workers``.
+
+Inputs are identified by their size and modification time, or with
+``manifest_checksums = true`` by a BLAKE2 checksum of their content (cached
+in the manifest by size and modification time, so every file is only hashed
+once).  Outputs written before the manifest existed have no row and are
+rewritten once.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+from types import SimpleNamespace
+
+from pgw4era.anomalies import anomaly_path
+from pgw4era.domain import domain_bounds
+
+#: File name of the manifest, in the output directory.
+MANIFEST_NAME = "pgw4era_manifest.sqlite"
+
+# Configuration keys that change the content of the output files.  Input
+# locations need not be part of the digest (the inputs themselves are
+# fingerprinted), and neither do the time range, execution settings or the
+# settings of the upstream steps that wrote the CC-signal files.
+_OUTPUT_KEYS = (
+    "variables_2d",
+    "variables_3d",
+    "experiments",
+    "periods",
+    "cc_signal_statistic",
+    "anomaly_mode",
+    "precision",
+    "domain",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    name TEXT PRIMARY KEY,
+    inputs TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checksums (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    checksum TEXT NOT NULL
+);
+"""
+
+
+def config_digest(cfg: SimpleNamespace) -> str:
+    """Digest of the configuration values that affect the output files.
+
+    Only the keys listed in ``_OUTPUT_KEYS`` are digested; the ``domain``
+    section through the bounds and halo it resolves to, so that moving its
+    ``geo_em`` or namelist file does not make the outputs stale.
+    """
+    values = {key: getattr(cfg, key) for key in _OUTPUT_KEYS if hasattr(cfg, key)}
+    if values.get("domain"):
+        domain = values["domain"]
+        values["domain"] = [*domain_bounds(domain), float(domain.get("halo", 0.0))]
+    text = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def file_checksum(path: str | Path, chunk_mb: int = 4) -> str:
+    """BLAKE2 checksum of the content of *path*."""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(chunk_mb * 1024**2):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Input digests of the output files of a run, stored in SQLite.
+
+    Instances can be shared by threads and passed to worker processes: each
+    process opens its own connection on first use.
+
+    Parameters
+    ----------
+    path:
+        Path of the SQLite database; created if needed.
+    inputs:
+        Input files shared by every output (anomaly files, reference grid).
+    cfg:
+        Configuration whose output-affecting values are part of every digest.
+    checksums:
+        Identify input files by content checksum instead of size and
+        modification time.
+    timeout:
+        Seconds to wait for a lock held by another process.
+    """
+
+    def __init__(
+        self,
+        path: str | Path = MANIFEST_NAME,
+        inputs: Iterable[str | Path] = (),
+        cfg: SimpleNamespace | None = None,
+        checksums: bool = False,
+        timeout: float = 60.0,
+    ) -> None:
+        self.path = Path(path).resolve()
+        self.checksums = checksums
+        self.timeout = timeout
+        self._conn: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._lock = threading.RLock()
+        base = hashlib.sha256()
+        if cfg is not None:
+            base.update(config_digest(cfg).encode())
+        for path_in in inputs:
+            base.update(self.signature(path_in).encode())
+        self.base = base.hexdigest()
+        # Nothing is held open until the manifest is used (e.g. in workers)
+        self.close()
+
+    @classmethod
+    def from_config(cls, cfg: SimpleNamespace, directory: str | Path = ".") -> Manifest | None:
+        """Manifest of a configuration profile in *directory*; ``None`` if disabled.
+
+        The manifest is enabled unless the profile sets ``manifest = false``.
+        """
+        if not getattr(cfg, "manifest", True):
+            return None
+        inputs = [f"{cfg.ERA5netcdf_dir}/{cfg.ERA5_sfc_ref_file}"]
+        inputs += [anomaly_path(cfg, var, True) for var in cfg.variables_3d]
+        inputs += [anomaly_path(cfg, var, False) for var in cfg.variables_2d]
+        return cls(
+            Path(directory) / MANIFEST_NAME,
+            inputs,
+            cfg,
+            getattr(cfg, "manifest_checksums", False),
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # Called with the lock held
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            self._pid = os.getpid()
+            with self._conn:
+                self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def __getstate__(self) -> dict:
+        # Connections and locks cannot be pickled; workers create their own
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return {**state, "_conn": None, "_pid": None}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def signature(self, path: str | Path) -> str:
+        """Identify the content of an input file (see the module docstring)."""
+        stat = os.stat(path)
+        if not self.checksums:
+            return f"{stat.st_size}:{stat.st_mtime_ns}"
+        key = str(Path(path).resolve())
+        with self._lock:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT checksum FROM checksums WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    (key, stat.st_size, stat.st_mtime_ns),
+                )
+                .fetchone()
+            )
+        if row is not None:
+            return row[0]
+        checksum = file_checksum(path)
+        with self._lock, self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?)",
+                (key, stat.st_size, stat.st_mtime_ns, checksum),
+            )
+        return checksum
+
+    def digest(self, paths: Iterable[str | Path]) -> str:
+        """Input digest of an output computed from *paths* and the shared inputs."""
+        digest = hashlib.sha256(self.base.encode())
+        for path in paths:
+            digest.update(self.signature(path).encode())
+        return digest.hexdigest()
+
+    def is_current(self, name: str | Path, inputs: str) -> bool:
+        """Whether output *name* was completely written from inputs with digest *inputs*."""
+        with self._lock:
+            row = (
+                self._connection()
+                .execute("SELECT inputs, size, mtime_ns FROM outputs WHERE name = ?", (str(name),))
+                .fetchone()
+            )
+        if row is None or row[0] != inputs:
+            return False
+        try:
+            stat = os.stat(name)
+        except FileNotFoundError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (row[1], row[2])
+
+    def record(self, name: str | Path, inputs: str) -> None:
+        """Record that output *name* has been completely written from *inputs*."""
+        stat = os.stat(name)
+        with self._lock, self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)",
+                (str(name), inputs, stat.st_size, stat.st_mtime_ns),
+            )
+
+    def close(self) -> None:
+        """Close the connection of this process."""
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> Manifest:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
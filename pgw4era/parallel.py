@@ -0,0 +1,152 @@
+"""pgw4era.parallel — process-pool driver for the intermediate-file writers.
+
+Every ERA5 day is independent: it has its own ``era5_daily_pl_*.nc`` /
+``era5_daily_sfc_*.nc`` inputs and its own ``ERA5:*`` outputs.
+:func:`run_parallel` distributes the days of a run over a pool of worker
+processes.  The anomaly annual cycle is loaded once by the parent into shared
+memory (:class:`pgw4era.anomalies.SharedAnomalyStore`) and attached by every
+worker, so memory use does not grow with the number of workers.  With an
+anomaly pack or cube (:class:`pgw4era.anomalies.AnomalyPack`,
+:class:`pgw4era.anomalies.AnomalyCube`) the workers map the file instead,
+sharing its pages through the page cache.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import multiprocessing as mp
+import os
+import traceback
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+
+from pgw4era.anomalies import (
+    AnomalyCube,
+    AnomalyPack,
+    AnomalyStore,
+    SharedAnomalyStore,
+    open_anomalies,
+)
+from pgw4era.domain import GridWindow
+
+# Per-worker anomaly store, attached once in the pool initializer
+_ANOMS: SharedAnomalyStore | AnomalyPack | AnomalyCube | None = None
+
+
+def _init_worker(
+    store: type[SharedAnomalyStore | AnomalyPack | AnomalyCube], handle, track: bool, quiet: bool
+) -> None:
+    global _ANOMS
+    _ANOMS = store.attach(handle, track=track)
+    if quiet:
+        # Per-timestep chatter from the workers (including Fortran prints) would
+        # interleave; the parent reports progress instead.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.close(devnull)
+
+
+def _run_day(process_day: Callable[..., int], date: dt.date, cfg: SimpleNamespace, *args) -> int:
+    try:
+        return process_day(date, cfg, _ANOMS, *args)
+    except Exception as exc:
+        # Tracebacks do not survive pickling; keep the worker-side one
+        raise RuntimeError(f"{type(exc).__name__}: {exc}\n{traceback.format_exc()}") from None
+
+
+def run_parallel(
+    process_day: Callable[..., int],
+    days: list[dt.date],
+    cfg: SimpleNamespace,
+    workers: int,
+    *args,
+    quiet: bool = True,
+    window: GridWindow | None = None,
+    grid: tuple[np.ndarray, np.ndarray] | None = None,
+) -> None:
+    """Run ``process_day(date, cfg, anoms, *args)`` for every day on a process pool.
+
+    Progress is reported in day order as results complete, and days that
+    fail do not stop the others.  Once all days have been processed a summary
+    is printed and, if any day failed, :class:`RuntimeError` is raised.
+
+    Parameters
+    ----------
+    process_day:
+        Module-level function processing one day and returning the number of
+        files written, e.g. :func:`pgw4era.wrf.write_intermediate.process_day`.
+    days:
+        Days to process.
+    cfg:
+        Configuration namespace returned by :func:`pgw4era.config.load_config`.
+    workers:
+        Number of worker processes.
+    *args:
+        Extra positional arguments passed to *process_day* after the anomaly
+        store.
+    quiet:
+        If ``True``, discard the workers' standard output.
+    window:
+        Window of the anomaly grid to load (see :mod:`pgw4era.domain`).
+    grid:
+        ERA5 latitudes and longitudes of *window*, which the CC-signal files
+        must be on (see :func:`pgw4era.anomalies.open_anomalies`).
+
+    Raises
+    ------
+    ValueError
+        If a CC-signal file is not on *grid*.
+    RuntimeError
+        If one or more days failed.
+    """
+    # Fork shares the parent's resource tracker, so attached blocks need no
+    # special handling; other start methods must not track them.
+    if "fork" in mp.get_all_start_methods():
+        ctx = mp.get_context("fork")
+    else:
+        ctx = mp.get_context()
+    track = ctx.get_start_method() == "fork"
+
+    if getattr(cfg, "anomaly_mode", "exact") == "doy" or getattr(cfg, "anomaly_pack", None):
+        # Packs and cubes are mapped by every worker instead
+        shared = open_anomalies(cfg, window, grid)
+    else:
+        with AnomalyStore.from_config(cfg, window, grid) as store:
+            shared = SharedAnomalyStore.from_store(store)
+
+    ndays = len(days)
+    nwritten = 0
+    failures: list[tuple[dt.date, str]] = []
+    print(f"Processing {ndays} day(s) with {workers} worker(s)")
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(type(shared), shared.handle, track, quiet),
+        ) as pool:
+            futures = [pool.submit(_run_day, process_day, date, cfg, *args) for date in days]
+            for n, (date, future) in enumerate(zip(days, futures), start=1):
+                try:
+                    nfiles = future.result()
+                except Exception as exc:
+                    failures.append((date, str(exc)))
+                    print(f"[{n}/{ndays}] {date:%Y-%m-%d} FAILED: {str(exc).splitlines()[0]}")
+                else:
+                    nwritten += nfiles
+                    print(f"[{n}/{ndays}] {date:%Y-%m-%d} done ({nfiles} file(s) written)")
+    finally:
+        shared.close()
+
+    print(f"Finished: {ndays - len(failures)} of {ndays} day(s) succeeded, {nwritten} file(s)")
+    if failures:
+        print(f"{len(failures)} day(s) failed:")
+        for date, error in failures:
+            print(f"  {date:%Y-%m-%d}: {error}")
+        raise RuntimeError(
+            f"{len(failures)} of {ndays} day(s) failed: "
+            + ", ".join(f"{date:%Y-%m-%d}" for date, _ in failures)
+        )
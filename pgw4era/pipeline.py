@@ -0,0 +1,140 @@
+"""pgw4era.pipeline — threaded read / blend / write pipeline for the writers.
+
+In the serial writers every timestep is read, blended and written before the
+next one is started, so the disk is idle while NumPy blends and the CPU is
+idle while netCDF4 reads and the intermediate file is written.
+:func:`run_pipeline` overlaps the three stages in a single process:
+
+* a reader thread iterates over the days, reading the ERA5 fields and the
+  anomaly months of each timestep (it performs all netCDF/HDF5 access, which
+  is not thread-safe, so no other thread touches the files);
+* the calling thread blends each timestep;
+* a writer thread writes the intermediate files.
+
+The stages are connected by queues holding at most ``depth`` timesteps each,
+which bounds the memory used by the pipeline.  netCDF4 reads, NumPy
+arithmetic on large arrays and file writes release the GIL, so the stages
+run concurrently.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
+
+# Marks the end of a stage's output
+_DONE = object()
+
+# Seconds between checks of the stop flag while waiting on a queue
+_POLL = 0.1
+
+
+def run_pipeline(
+    items: Iterable[Any],
+    read: Callable[[Any], Iterator[Any]],
+    compute: Callable[[Any], Any],
+    write: Callable[[Any], None],
+    depth: int = 2,
+) -> int:
+    """Run ``write(compute(step))`` for every step of ``read(item)`` for every item.
+
+    Parameters
+    ----------
+    items:
+        Work items, e.g. the days to process, consumed in order by the
+        reader thread.
+    read:
+        Returns an iterator over the steps of one item, e.g. the timesteps
+        of a day.  Closed early if the pipeline is stopped by an error.
+    compute:
+        Turns a step into a result; runs in the calling thread.
+    write:
+        Consumes a result; runs in the writer thread, in step order.
+    depth:
+        Maximum number of steps waiting between two consecutive stages.
+
+    Returns
+    -------
+    int
+        Number of results written.
+
+    Raises
+    ------
+    Exception
+        The first exception raised by any stage, after all stages have
+        stopped.
+    """
+    if depth < 1:
+        raise ValueError(f"Pipeline depth must be at least 1, got {depth}")
+
+    steps: queue.Queue = queue.Queue(maxsize=depth)
+    results: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    errors: list[BaseException] = []
+    nwritten = 0
+
+    def fail(exc: BaseException) -> None:
+        errors.append(exc)
+        stop.set()
+
+    def put(q: queue.Queue, item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q: queue.Queue) -> Any:
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def reader() -> None:
+        try:
+            for item in items:
+                with contextlib.closing(read(item)) as item_steps:
+                    for step in item_steps:
+                        if not put(steps, step):
+                            return
+        except BaseException as exc:
+            fail(exc)
+        finally:
+            put(steps, _DONE)
+
+    def writer() -> None:
+        nonlocal nwritten
+        try:
+            while (result := get(results)) is not _DONE:
+                write(result)
+                nwritten += 1
+        except BaseException as exc:
+            fail(exc)
+
+    threads = [
+        threading.Thread(target=reader, name="pgw4era-reader", daemon=True),
+        threading.Thread(target=writer, name="pgw4era-writer", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while (step := get(steps)) is not _DONE:
+            if not put(results, compute(step)):
+                break
+    except BaseException as exc:
+        fail(exc)
+    finally:
+        put(results, _DONE)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return nwritten
@@ -0,0 +1,551 @@
+"""pgw4era.regrid — regridding of CMIP6 fields to the ERA5 grid.
+
+The CC-signal stage regrids the delta file of every model and variable to the
+ERA5 grid described by ``era5_grid`` (a CDO grid description, as written by
+``cdo griddes``).  Calling ``cdo -remapbil`` for each of them recomputes the
+same interpolation weights from a model grid to the 1200 x 601 ERA5 grid
+every time.  Here the weights of a source grid are computed once as a sparse
+matrix, cached in memory and on disk, and applied to all months and levels
+of a variable in one sparse matrix product.
+
+Both grids must be rectilinear (regular or Gaussian latitude-longitude, as
+the atmospheric CMIP6 fields are).  Two methods are available:
+
+``"bilinear"``
+    Bilinear interpolation in longitude-latitude, like ``cdo remapbil``.
+    A target point is missing (NaN) if any of its four source points is.
+    Longitude wraps around for global source grids; target latitudes beyond
+    the outermost source latitudes (the polar caps) take the values of the
+    outermost rows.  Target points outside a regional source grid are
+    missing.
+``"conservative"``
+    First-order conservative remapping on the sphere, like ``cdo remapcon``:
+    every target cell is the area-weighted mean of the valid source cells
+    overlapping it.
+
+On rectilinear grids both weight matrices are Kronecker products of a
+latitude and a longitude matrix, so computing them takes a fraction of a
+second even for the ERA5 grid.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import shlex
+from dataclasses import dataclass
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+from scipy import sparse
+
+METHODS = ("bilinear", "conservative")
+
+# Bumped whenever the weights computed for the same grids change
+_WEIGHTS_VERSION = 1
+
+# Names of the coordinate variables of the source files
+_LAT_NAMES = ("lat", "latitude")
+_LON_NAMES = ("lon", "longitude")
+
+# Weights computed in this process, by cache key
+_WEIGHTS: dict[str, Regridder] = {}
+
+
+@dataclass(frozen=True)
+class GridDescription:
+    """Rectilinear target grid read from a CDO grid description file.
+
+    The coordinates are given either by ``xfirst``/``xinc`` and
+    ``yfirst``/``yinc`` or by explicit ``xvals``/``yvals``.
+    """
+
+    gridtype: str
+    xsize: int
+    ysize: int
+    xfirst: float | None = None
+    xinc: float | None = None
+    yfirst: float | None = None
+    yinc: float | None = None
+    xvals: tuple[float, ...] | None = None
+    yvals: tuple[float, ...] | None = None
+    xname: str = "lon"
+    yname: str = "lat"
+    xunits: str = "degrees_east"
+    yunits: str = "degrees_north"
+    xlongname: str = "longitude"
+    ylongname: str = "latitude"
+
+    @property
+    def lon(self) -> np.ndarray:
+        """Longitudes of the grid columns."""
+        if self.xvals is not None:
+            return np.asarray(self.xvals, dtype="float64")
+        return self.xfirst + self.xinc * np.arange(self.xsize, dtype="float64")
+
+    @property
+    def lat(self) -> np.ndarray:
+        """Latitudes of the grid rows."""
+        if self.yvals is not None:
+            return np.asarray(self.yvals, dtype="float64")
+        return self.yfirst + self.yinc * np.arange(self.ysize, dtype="float64")
+
+
+def read_grid_description(path: str | Path) -> GridDescription:
+    """Parse a CDO grid description file (e.g. the output of ``cdo griddes``).
+
+    Raises
+    ------
+    ValueError
+        If the grid is not a ``lonlat`` or ``gaussian`` grid, or its
+        coordinates are not fully described.
+    """
+    entries: dict[str, list[str]] = {}
+    key = None
+    for line in Path(path).read_text().splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if "=" in line:
+            key, value = (part.strip() for part in line.split("=", 1))
+            entries[key] = shlex.split(value)
+        elif key is not None:
+            # Continuation line of a list of values (xvals, yvals, ...)
+            entries[key] += line.split()
+
+    gridtype = entries.get("gridtype", [""])[0]
+    if gridtype not in ("lonlat", "gaussian"):
+        raise ValueError(f"{path}: unsupported gridtype {gridtype!r}; expected lonlat or gaussian")
+    try:
+        xsize, ysize = int(entries["xsize"][0]), int(entries["ysize"][0])
+    except KeyError as exc:
+        raise ValueError(f"{path}: missing {exc.args[0]}") from None
+
+    def number(name: str) -> float | None:
+        return float(entries[name][0]) if name in entries else None
+
+    def values(name: str, size: int) -> tuple[float, ...] | None:
+        if name not in entries:
+            return None
+        vals = tuple(float(v) for v in entries[name])
+        if len(vals) != size:
+            raise ValueError(f"{path}: {name} has {len(vals)} values, expected {size}")
+        return vals
+
+    def text(name: str, default: str) -> str:
+        return " ".join(entries[name]) if name in entries else default
+
+    grid = GridDescription(
+        gridtype=gridtype,
+        xsize=xsize,
+        ysize=ysize,
+        xfirst=number("xfirst"),
+        xinc=number("xinc"),
+        yfirst=number("yfirst"),
+        yinc=number("yinc"),
+        xvals=values("xvals", xsize),
+        yvals=values("yvals", ysize),
+        xname=text("xname", "lon"),
+        yname=text("yname", "lat"),
+        xunits=text("xunits", "degrees_east"),
+        yunits=text("yunits", "degrees_north"),
+        xlongname=text("xlongname", "longitude"),
+        ylongname=text("ylongname", "latitude"),
+    )
+    for axis in "xy":
+        explicit = getattr(grid, f"{axis}vals") is not None
+        regular = getattr(grid, f"{axis}first") is not None and getattr(grid, f"{axis}inc")
+        if not (explicit or regular):
+            raise ValueError(f"{path}: {axis} coordinates need {axis}vals or {axis}first/{axis}inc")
+    return grid
+
+
+def write_grid_description(grid: GridDescription, path: str | Path) -> None:
+    """Write *grid* as a CDO grid description file, as ``cdo griddes`` does."""
+    lines = [
+        "#",
+        "# gridID 1",
+        "#",
+        f"gridtype  = {grid.gridtype}",
+        f"gridsize  = {grid.xsize * grid.ysize}",
+        f"xsize     = {grid.xsize}",
+        f"ysize     = {grid.ysize}",
+        f"xname     = {grid.xname}",
+        f'xlongname = "{grid.xlongname}"',
+        f'xunits    = "{grid.xunits}"',
+        f"yname     = {grid.yname}",
+        f'ylongname = "{grid.ylongname}"',
+        f'yunits    = "{grid.yunits}"',
+    ]
+
+    def number(value: float) -> str:
+        return np.format_float_positional(value, trim="-")
+
+    for axis in "xy":
+        vals = getattr(grid, f"{axis}vals")
+        if vals is not None:
+            lines.append(f"{axis}vals     = " + " ".join(number(v) for v in vals))
+        else:
+            lines.append(f"{axis}first    = {number(getattr(grid, f'{axis}first'))}")
+            lines.append(f"{axis}inc      = {number(getattr(grid, f'{axis}inc'))}")
+    Path(path).write_text("\n".join(lines) + "\n")
+
+
+# ---------------------------------------------------------------------------
+# One-dimensional weights
+# ---------------------------------------------------------------------------
+
+
+def _is_cyclic(lon: np.ndarray) -> bool:
+    """Whether the longitudes cover the whole circle at a regular-ish spacing."""
+    if len(lon) < 2:
+        return False
+    step = 360.0 / len(lon)
+    span = np.ptp(np.mod(lon - lon[0], 360.0))
+    return abs(span + step - 360.0) < 0.5 * step
+
+
+def _linear_weights(
+    src: np.ndarray, dst: np.ndarray, period: float | None, clamp: bool
+) -> tuple[sparse.csr_matrix, np.ndarray]:
+    """Linear interpolation matrix from *src* to *dst* coordinates.
+
+    With a *period* (longitudes), *dst* is compared with *src* modulo the
+    period, and a source axis covering the whole period wraps around.
+    Returns the ``(len(dst), len(src))`` matrix and a mask of the *dst*
+    points inside the source range (all of them if *clamp*, which holds the
+    values of the outermost source points constant beyond them).
+    """
+    if len(src) < 2:
+        raise ValueError("at least two source coordinates are needed to interpolate")
+    order = np.argsort(src, kind="stable")
+    coords = src[order]
+    if period is not None:
+        dst = coords[0] + np.mod(dst - coords[0], period)
+        if _is_cyclic(src):
+            coords = np.append(coords, coords[0] + period)
+            order = np.append(order, order[0])
+
+    upper = np.clip(np.searchsorted(coords, dst, side="right"), 1, len(coords) - 1)
+    lower = upper - 1
+    weight = (dst - coords[lower]) / (coords[upper] - coords[lower])
+    inside = (weight >= 0.0) & (weight <= 1.0)
+    if clamp:
+        weight = np.clip(weight, 0.0, 1.0)
+        inside[:] = True
+
+    rows = np.arange(len(dst))
+    matrix = sparse.csr_matrix(
+        (
+            np.concatenate([1.0 - weight[inside], weight[inside]]),
+            (
+                np.concatenate([rows[inside], rows[inside]]),
+                np.concatenate([order[lower[inside]], order[upper[inside]]]),
+            ),
+        ),
+        shape=(len(dst), len(src)),
+    )
+    # Points on a source coordinate only depend on that point
+    matrix.eliminate_zeros()
+    return matrix, inside
+
+
+def _edges(centres: np.ndarray, lower: float | None, upper: float | None) -> np.ndarray:
+    """Cell edges half-way between *centres*, optionally clipped to [lower, upper]."""
+    if len(centres) < 2:
+        raise ValueError("at least two coordinates are needed to define grid cells")
+    mid = 0.5 * (centres[1:] + centres[:-1])
+    edges = np.concatenate(
+        [[centres[0] - (mid[0] - centres[0])], mid, [centres[-1] + (centres[-1] - mid[-1])]]
+    )
+    if lower is not None:
+        edges = np.clip(edges, lower, upper)
+    return edges
+
+
+def _overlaps(src_edges: np.ndarray, dst_edges: np.ndarray, period: float | None) -> np.ndarray:
+    """Overlap length of every (dst, src) pair of intervals, with optional periodicity."""
+    src_lo = np.minimum(src_edges[:-1], src_edges[1:])
+    src_hi = np.maximum(src_edges[:-1], src_edges[1:])
+    dst_lo = np.minimum(dst_edges[:-1], dst_edges[1:])
+    dst_hi = np.maximum(dst_edges[:-1], dst_edges[1:])
+    shifts = (0.0,) if period is None else (-period, 0.0, period)
+    overlap = np.zeros((len(dst_lo), len(src_lo)))
+    for shift in shifts:
+        lo = np.maximum(dst_lo[:, None], src_lo[None, :] + shift)
+        hi = np.minimum(dst_hi[:, None], src_hi[None, :] + shift)
+        overlap += np.clip(hi - lo, 0.0, None)
+    return overlap
+
+
+def _conservative_weights(
+    src: np.ndarray, dst: np.ndarray, period: float | None
+) -> sparse.csr_matrix:
+    """Fraction of every *dst* cell covered by every *src* cell along one axis.
+
+    Longitudes (with a *period*) are measured in degrees, latitudes in
+    sin(latitude), proportional to the area of a latitude band.
+    """
+    if period is not None:
+        src_edges = _edges(src, None, None)
+        dst_edges = _edges(dst, None, None)
+    else:
+        src_edges = np.sin(np.deg2rad(_edges(src, -90.0, 90.0)))
+        dst_edges = np.sin(np.deg2rad(_edges(dst, -90.0, 90.0)))
+    overlap = _overlaps(src_edges, dst_edges, period)
+    width = np.abs(np.diff(dst_edges))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(width[:, None] > 0, overlap / width[:, None], 0.0)
+    return sparse.csr_matrix(fraction)
+
+
+# ---------------------------------------------------------------------------
+# Regridder
+# ---------------------------------------------------------------------------
+
+
+class Regridder:
+    """Sparse regridding weights from one rectilinear grid to another.
+
+    Parameters
+    ----------
+    weights:
+        ``(ny_dst * nx_dst, ny_src * nx_src)`` sparse weight matrix over the
+        flattened (C-order) latitude-longitude grids.
+    valid:
+        Target points that have source points; the others are missing.
+    src_shape, dst_shape:
+        ``(nlat, nlon)`` of the source and target grids.
+    method:
+        One of :data:`METHODS`.
+    """
+
+    def __init__(
+        self,
+        weights: sparse.csr_matrix,
+        valid: np.ndarray,
+        src_shape: tuple[int, int],
+        dst_shape: tuple[int, int],
+        method: str,
+    ) -> None:
+        if method not in METHODS:
+            raise ValueError(f"Unknown regridding method {method!r}; expected one of {METHODS}")
+        self.weights = sparse.csr_matrix(weights)
+        self.valid = np.asarray(valid, dtype=bool)
+        self.src_shape = tuple(src_shape)
+        self.dst_shape = tuple(dst_shape)
+        self.method = method
+
+    @classmethod
+    def from_coords(
+        cls,
+        src_lat: np.ndarray,
+        src_lon: np.ndarray,
+        dst_lat: np.ndarray,
+        dst_lon: np.ndarray,
+        method: str = "bilinear",
+    ) -> Regridder:
+        """Compute the weights from the 1-D coordinates of both grids."""
+        src_lat, src_lon, dst_lat, dst_lon = (
+            np.asarray(coord, dtype="float64") for coord in (src_lat, src_lon, dst_lat, dst_lon)
+        )
+        if method == "bilinear":
+            # Polar caps beyond the outermost rows of a global grid are held constant
+            clamp = _is_cyclic(src_lon)
+            wlat, vlat = _linear_weights(src_lat, dst_lat, period=None, clamp=clamp)
+            wlon, vlon = _linear_weights(src_lon, dst_lon, period=360.0, clamp=False)
+            valid = np.outer(vlat, vlon).ravel()
+        elif method == "conservative":
+            wlat = _conservative_weights(src_lat, dst_lat, period=None)
+            wlon = _conservative_weights(src_lon, dst_lon, period=360.0)
+            valid = np.outer(wlat.getnnz(axis=1) > 0, wlon.getnnz(axis=1) > 0).ravel()
+        else:
+            raise ValueError(f"Unknown regridding method {method!r}; expected one of {METHODS}")
+        weights = sparse.kron(wlat, wlon, format="csr")
+        return cls(
+            weights, valid, (len(src_lat), len(src_lon)), (len(dst_lat), len(dst_lon)), method
+        )
+
+    def save(self, path: str | Path) -> None:
+        """Save the weights to an ``.npz`` file (written atomically)."""
+        path = Path(path)
+        part = path.with_name(f"{path.name}.{os.getpid()}.part")
+        with open(part, "wb") as fh:
+            np.savez(
+                fh,
+                data=self.weights.data,
+                indices=self.weights.indices,
+                indptr=self.weights.indptr,
+                valid=self.valid,
+                src_shape=self.src_shape,
+                dst_shape=self.dst_shape,
+                method=self.method,
+            )
+        os.replace(part, path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> Regridder:
+        """Load weights saved with :meth:`save`."""
+        with np.load(path) as npz:
+            src_shape = tuple(int(n) for n in npz["src_shape"])
+            dst_shape = tuple(int(n) for n in npz["dst_shape"])
+            weights = sparse.csr_matrix(
+                (npz["data"], npz["indices"], npz["indptr"]),
+                shape=(dst_shape[0] * dst_shape[1], src_shape[0] * src_shape[1]),
+            )
+            return cls(weights, npz["valid"], src_shape, dst_shape, str(npz["method"]))
+
+    def __call__(self, data: np.ndarray, chunk_mb: float = 256.0) -> np.ndarray:
+        """Regrid *data*, whose last two axes are the source latitude and longitude.
+
+        All leading axes (months, levels, ...) are regridded together in one
+        sparse product per chunk of about *chunk_mb* MiB of float64 output.
+        Missing values (masked or NaN) are NaN in the result, which has the
+        floating dtype of *data* (float32 for packed 16-bit data).
+        """
+        data = np.ma.filled(np.ma.asarray(data, dtype=np.result_type(data, np.float32)), np.nan)
+        if data.shape[-2:] != self.src_shape:
+            raise ValueError(f"data has grid shape {data.shape[-2:]}, expected {self.src_shape}")
+        lead = data.shape[:-2]
+        flat = data.reshape(-1, self.src_shape[0] * self.src_shape[1])
+        out = np.empty((flat.shape[0], self.weights.shape[0]), dtype=data.dtype)
+
+        step = max(1, int(chunk_mb * 1024**2 // (8 * self.weights.shape[0])))
+        for start in range(0, flat.shape[0], step):
+            block = flat[start : start + step].astype("float64").T
+            if self.method == "conservative":
+                # Normalised by the valid fraction of each target cell (fracarea)
+                missing = np.isnan(block)
+                block[missing] = 0.0
+                total = self.weights @ block
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    result = total / (self.weights @ (~missing).astype("float64"))
+            else:
+                result = self.weights @ block
+            result[~self.valid] = np.nan
+            out[start : start + step] = result.T
+        return out.reshape(*lead, *self.dst_shape)
+
+
+def _cache_key(src_lat, src_lon, dst_lat, dst_lon, method: str) -> str:
+    digest = hashlib.sha256(f"{method}:{_WEIGHTS_VERSION}".encode())
+    for coord in (src_lat, src_lon, dst_lat, dst_lon):
+        coord = np.ascontiguousarray(coord, dtype="float64")
+        digest.update(str(coord.shape).encode())
+        digest.update(coord.tobytes())
+    return digest.hexdigest()
+
+
+def get_regridder(
+    src_lat: np.ndarray,
+    src_lon: np.ndarray,
+    target: GridDescription,
+    method: str = "bilinear",
+    cache_dir: str | Path | None = None,
+) -> Regridder:
+    """Return the regridder from a source grid to *target*, computing it at most once.
+
+    Weights are kept in memory for the rest of the process and, if
+    *cache_dir* is given, saved there as ``<method>_<hash>.npz`` and loaded
+    by later runs.
+    """
+    key = _cache_key(src_lat, src_lon, target.lat, target.lon, method)
+    regridder = _WEIGHTS.get(key)
+    if regridder is not None:
+        return regridder
+
+    path = Path(cache_dir) / f"{method}_{key[:24]}.npz" if cache_dir is not None else None
+    if path is not None and path.exists():
+        regridder = Regridder.load(path)
+    else:
+        regridder = Regridder.from_coords(src_lat, src_lon, target.lat, target.lon, method)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            regridder.save(path)
+    _WEIGHTS[key] = regridder
+    return regridder
+
+
+def _coord_name(ds: nc.Dataset, names: tuple[str, ...]) -> str:
+    for name in names:
+        if name in ds.variables and ds.variables[name].ndim == 1:
+            return name
+    raise ValueError(f"{ds.filepath()}: no 1-D coordinate variable among {names}")
+
+
+def regrid_netcdf(
+    src_path: str | Path,
+    dst_path: str | Path,
+    target: GridDescription,
+    method: str = "bilinear",
+    cache_dir: str | Path | None = None,
+) -> None:
+    """Regrid every latitude-longitude variable of a netCDF file to *target*.
+
+    Variables whose last two dimensions are the latitude and longitude of
+    the file are regridded; variables with other dimensions are copied, and
+    cell bounds of the source grid are dropped.  The output is written under
+    a temporary name and renamed once complete.
+    """
+    dst_path = Path(dst_path)
+    part = dst_path.with_name(f"{dst_path.name}.part")
+    with nc.Dataset(src_path) as src:
+        lat_name = _coord_name(src, _LAT_NAMES)
+        lon_name = _coord_name(src, _LON_NAMES)
+        lat_dim = src.variables[lat_name].dimensions[0]
+        lon_dim = src.variables[lon_name].dimensions[0]
+        regridder = get_regridder(
+            src.variables[lat_name][:], src.variables[lon_name][:], target, method, cache_dir
+        )
+        renamed = {lat_dim: target.yname, lon_dim: target.xname}
+
+        with nc.Dataset(part, "w", format=src.data_model) as dst:
+            dst.setncatts({key: src.getncattr(key) for key in src.ncattrs()})
+            for name, dim in src.dimensions.items():
+                if name == lat_dim:
+                    dst.createDimension(target.yname, target.ysize)
+                elif name == lon_dim:
+                    dst.createDimension(target.xname, target.xsize)
+                else:
+                    dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+            for name, coord, units, long_name, standard_name in (
+                (target.yname, target.lat, target.yunits, target.ylongname, "latitude"),
+                (target.xname, target.lon, target.xunits, target.xlongname, "longitude"),
+            ):
+                var = dst.createVariable(name, "f8", (name,))
+                var.setncatts(
+                    {"standard_name": standard_name, "long_name": long_name, "units": units}
+                )
+                var.axis = "Y" if name == target.yname else "X"
+                var[:] = coord
+
+            for name, var in src.variables.items():
+                if name in (lat_name, lon_name):
+                    continue
+                dims = var.dimensions
+                gridded = dims[-2:] == (lat_dim, lon_dim)
+                if not gridded and (lat_dim in dims or lon_dim in dims):
+                    # Bounds and other variables on one axis of the source grid
+                    continue
+                attrs = {key: var.getncattr(key) for key in var.ncattrs() if key != "_FillValue"}
+                if gridded:
+                    # Regridded values are written unpacked
+                    attrs.pop("scale_factor", None)
+                    attrs.pop("add_offset", None)
+                    data = regridder(var[:])
+                    fill = getattr(var, "_FillValue", np.float32(1e20))
+                    if np.isnan(fill):
+                        fill = np.float32(1e20)
+                    out = dst.createVariable(
+                        name, data.dtype, tuple(renamed.get(d, d) for d in dims), fill_value=fill
+                    )
+                    out.setncatts(attrs)
+                    out[:] = np.ma.masked_invalid(data)
+                else:
+                    fill = getattr(var, "_FillValue", None)
+                    out = dst.createVariable(name, var.dtype, dims, fill_value=fill)
+                    out.setncatts(attrs)
+                    out[...] = var[...]
+    os.replace(part, dst_path)
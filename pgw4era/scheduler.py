@@ -0,0 +1,194 @@
+"""pgw4era.scheduler — process-pool scheduler for independent preprocessing tasks.
+
+The CMIP6 stage computes the annual cycles, climate-change signal and regridded
+delta of every (model, variable) pair independently.  :func:`run_tasks` runs
+such tasks on a pool of worker processes:
+
+- every :class:`Task` carries a memory hint, and tasks are only started while
+  the hints of the running tasks fit in the memory budget (a task larger than
+  the whole budget runs alone).  The largest tasks are started first so the
+  small 2-D tasks fill the gaps at the end of the run;
+- a failing task is retried up to *retries* times and never stops the others;
+- once all tasks have finished a summary is printed and, optionally, written
+  as JSON, and the results are returned so the caller decides the exit status.
+
+With ``workers=1`` tasks run one after the other in the calling process.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+import traceback
+from collections.abc import Callable, Sequence
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+
+@dataclass
+class Task:
+    """A unit of work: ``func(*args)``, needing about *memory_mb* MiB."""
+
+    name: str
+    func: Callable[..., object]
+    args: tuple = ()
+    memory_mb: float = 0.0
+
+
+@dataclass
+class TaskResult:
+    """Outcome of a :class:`Task` after all its attempts."""
+
+    name: str
+    ok: bool
+    attempts: int
+    seconds: float
+    memory_mb: float
+    error: str | None = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class _State:
+    task: Task
+    attempts: int = 0
+    seconds: float = 0.0
+    errors: list[str] = field(default_factory=list)
+
+
+class _InlineExecutor(Executor):
+    """Executor running every submitted call immediately in this process."""
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+
+def _call(func: Callable[..., object], args: tuple) -> float:
+    start = time.perf_counter()
+    try:
+        func(*args)
+    except Exception as exc:
+        # Tracebacks do not survive pickling; keep the worker-side one
+        raise RuntimeError(f"{type(exc).__name__}: {exc}\n{traceback.format_exc()}") from None
+    return time.perf_counter() - start
+
+
+def run_tasks(
+    tasks: Sequence[Task],
+    workers: int = 1,
+    memory_mb: float | None = None,
+    retries: int = 1,
+    summary: str | Path | None = None,
+) -> list[TaskResult]:
+    """Run *tasks* on a process pool and return their results in task order.
+
+    Parameters
+    ----------
+    tasks:
+        Tasks to run; their functions must be picklable (module-level).
+    workers:
+        Maximum number of tasks running at the same time.
+    memory_mb:
+        Memory budget (MiB) for the hints of the running tasks; ``None`` for
+        no limit besides *workers*.
+    retries:
+        Number of times a failed task is run again.
+    summary:
+        Path of a JSON file to write the results to.
+    """
+    states = [_State(task) for task in tasks]
+    # Largest first; the order of the tasks is kept among equal hints
+    pending = sorted(states, key=lambda state: -state.task.memory_mb)
+    running: dict[Future, _State] = {}
+    ntasks = len(states)
+    ndone = 0
+    budget = float("inf") if memory_mb is None else memory_mb
+
+    def new_executor() -> Executor:
+        return ProcessPoolExecutor(workers) if workers > 1 else _InlineExecutor()
+
+    def finish(future: Future, state: _State) -> bool:
+        """Account for a finished attempt; return whether the pool broke."""
+        nonlocal ndone
+        try:
+            state.seconds += future.result()
+        except Exception as exc:
+            state.errors.append(str(exc) or type(exc).__name__)
+            message = state.errors[-1].splitlines()[0]
+            if state.attempts <= retries:
+                print(f"{state.task.name} FAILED (attempt {state.attempts}), retrying: {message}")
+                pending.append(state)
+            else:
+                ndone += 1
+                print(f"[{ndone}/{ntasks}] {state.task.name} FAILED: {message}")
+            return isinstance(exc, BrokenProcessPool)
+        ndone += 1
+        print(f"[{ndone}/{ntasks}] {state.task.name} done ({state.seconds:.1f} s)")
+        return False
+
+    print(f"Running {ntasks} task(s) with {workers} worker(s)")
+    executor = new_executor()
+    try:
+        while pending or running:
+            in_use = sum(state.task.memory_mb for state in running.values())
+            for state in list(pending):
+                if len(running) >= workers:
+                    break
+                if running and in_use + state.task.memory_mb > budget:
+                    continue
+                pending.remove(state)
+                state.attempts += 1
+                running[executor.submit(_call, state.task.func, state.task.args)] = state
+                in_use += state.task.memory_mb
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                broken |= finish(future, running.pop(future))
+            if broken:
+                # A worker died (e.g. killed out of memory) and took the whole
+                # pool with it: every other running task has failed as well
+                for future in wait(running)[0]:
+                    finish(future, running.pop(future))
+                executor.shutdown()
+                executor = new_executor()
+    finally:
+        executor.shutdown()
+
+    results = [
+        TaskResult(
+            name=state.task.name,
+            ok=len(state.errors) < state.attempts,
+            attempts=state.attempts,
+            seconds=round(state.seconds, 3),
+            memory_mb=state.task.memory_mb,
+            error=None if len(state.errors) < state.attempts else state.errors[-1],
+        )
+        for state in states
+    ]
+    failed = [result for result in results if not result.ok]
+    print(f"Finished: {ntasks - len(failed)} of {ntasks} task(s) succeeded")
+    if failed:
+        print(f"{len(failed)} task(s) failed:")
+        for result in failed:
+            print(f"  {result.name}: {result.error.splitlines()[0]}")
+    if summary is not None:
+        report = {
+            "workers": workers,
+            "memory_mb": memory_mb,
+            "retries": retries,
+            "succeeded": ntasks - len(failed),
+            "failed": len(failed),
+            "tasks": [result.to_dict() for result in results],
+        }
+        Path(summary).write_text(json.dumps(report, indent=2) + "\n")
+    return results
@@ -3,14 +3,25 @@
 from __future__ import annotations
 
 import datetime as dt
+import functools
 import os
+from collections.abc import Sequence
+from typing import TYPE_CHECKING
 
 import numpy as np
 
 from pgw4era.constants import const
 
+if TYPE_CHECKING:
+    from pgw4era.manifest import Manifest
 
-def checkfile(file_out: str, overwrite: bool | str) -> bool:
+
+def checkfile(
+    file_out: str,
+    overwrite: bool | str,
+    manifest: Manifest | None = None,
+    inputs: str | None = None,
+) -> bool:
     """Check if an output file exists and whether it should be written.
 
     Parameters
@@ -19,6 +30,12 @@ def checkfile(file_out: str, overwrite: bool | str) -> bool:
         Path to the output file.
     overwrite:
         If ``True`` (or the string ``"True"``), overwrite existing files.
+    manifest:
+        Run manifest (see :mod:`pgw4era.manifest`).  If given, existing files
+        are only kept if the manifest records them as completely written from
+        the same inputs.
+    inputs:
+        Input digest of the file (see :meth:`pgw4era.manifest.Manifest.digest`).
 
     Returns
     -------
@@ -34,12 +51,15 @@ def checkfile(file_out: str, overwrite: bool | str) -> bool:
     print("  --> OUTPUT FILE:")
     print("         ", file_out)
     if fileexist:
-        if not overwrite:
-            print("          +++ FILE ALREADY EXISTS +++")
-            filewrite = False
-        else:
+        if overwrite:
             print("           +++ FILE EXISTS AND WILL BE OVERWRITTEN +++")
             filewrite = True
+        elif manifest is not None and not manifest.is_current(file_out, inputs):
+            print("           +++ FILE IS INCOMPLETE OR OUT OF DATE AND WILL BE REWRITTEN +++")
+            filewrite = True
+        else:
+            print("          +++ FILE ALREADY EXISTS +++")
+            filewrite = False
     else:
         print("         +++ FILE DOES NOT EXISTS YET +++")
         filewrite = True
@@ -84,6 +104,125 @@ def calc_midmonth(year: int) -> list[dt.datetime]:
     return midm_date
 
 
+#: Record layout returned by :func:`calc_interp_weights`.
+INTERP_WEIGHTS_DTYPE = np.dtype(
+    [("i1", "i8"), ("i2", "i8"), ("weight", "f8"), ("nearest", "i8"), ("exact", "?")]
+)
+
+
+@functools.cache
+def _midmonth_seconds(year: int) -> np.ndarray:
+    """Return :func:`calc_midmonth` of *year* as int64 seconds since the epoch."""
+    midmonth = np.asarray(calc_midmonth(year), dtype="datetime64[s]")
+    return midmonth.astype("int64")
+
+
+def calc_interp_weights(times: Sequence[dt.datetime] | np.ndarray) -> np.ndarray:
+    """Return the monthly-anomaly interpolation weights for every time in *times*.
+
+    For each time the two bracketing mid-months are found in
+    :func:`calc_midmonth` of its year and the anomaly is interpolated as
+    ``anom[i1] + (anom[i2] - anom[i1]) * weight``.  The search is done for all
+    times at once and reproduces exactly the per-timestep branch logic of the
+    writers, including the wrap of mid-December/mid-January onto months 11/0.
+
+    Parameters
+    ----------
+    times:
+        Sequence of :class:`datetime.datetime` or a ``datetime64`` array.
+
+    Returns
+    -------
+    numpy.ndarray
+        Structured array with dtype :data:`INTERP_WEIGHTS_DTYPE` and one
+        record per time:
+
+        - ``i1``, ``i2``: 0-based months bracketing the time.
+        - ``weight``: fraction of the way from mid-month ``i1`` to ``i2``.
+        - ``nearest``: index of the closest of the 14 mid-months.  ``0``
+          (closest to mid-December of the previous year) means 3-D fields use
+          month ``i1`` alone.
+        - ``exact``: the time falls exactly on a mid-month, in which case 2-D
+          fields use month ``i1`` alone.
+    """
+    times = np.asarray(times, dtype="datetime64[s]").reshape(-1)
+    seconds = times.astype("int64")
+    years = times.astype("datetime64[Y]").astype("int64") + 1970
+
+    midmonth = np.empty((seconds.size, 14), dtype="int64")
+    for year in np.unique(years):
+        midmonth[years == year] = _midmonth_seconds(int(year))
+
+    rows = np.arange(seconds.size)
+    tdelta = (midmonth - seconds[:, None]).astype("float64")
+    nearest = np.argmin(np.abs(tdelta), axis=1)
+    before = tdelta[rows, nearest] < 0
+
+    # Python-style negative indexing (nearest - 1 == -1 picks the last mid-month)
+    prev = (nearest - 1) % 14
+    succ = (nearest + 1) % 14
+
+    weights = np.empty(seconds.size, dtype=INTERP_WEIGHTS_DTYPE)
+    weights["i1"] = np.where(before, nearest - 1, nearest - 2) % 12
+    weights["i2"] = np.where(before, nearest, nearest - 1) % 12
+    tdelta_before = np.abs(np.where(before, tdelta[rows, nearest], tdelta[rows, prev]))
+    tdelta_mid_month = np.where(
+        before,
+        midmonth[rows, succ] - midmonth[rows, nearest],
+        midmonth[rows, nearest] - midmonth[rows, prev],
+    ).astype("float64")
+    weights["weight"] = tdelta_before / tdelta_mid_month
+    weights["nearest"] = nearest
+    weights["exact"] = np.min(np.abs(tdelta), axis=1) == 0
+    return weights
+
+
+def calc_days(syear: int, smonth: int, eyear: int, emonth: int) -> list[dt.date]:
+    """Return the ERA5 days processed by the writers for a configured period.
+
+    Days run from the first day of *smonth* in *syear* up to, but not
+    including, the first day of *emonth* in *eyear*.
+    """
+    start = dt.date(syear, smonth, 1)
+    end = dt.date(eyear, emonth, 1)
+    return [start + dt.timedelta(days=i) for i in range((end - start).days)]
+
+
+def calc_output_times(
+    syear: int, smonth: int, eyear: int, emonth: int, freq_hours: int = 3
+) -> np.ndarray:
+    """Return the output times processed by the writers for a configured period.
+
+    The writers process every day from ``syear-smonth-01`` up to, but not
+    including, the first day of ``emonth`` in ``eyear``.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``datetime64[s]`` array spaced by *freq_hours*.
+    """
+    start = np.datetime64(f"{syear:04d}-{smonth:02d}-01", "s")
+    end = np.datetime64(f"{eyear:04d}-{emonth:02d}-01", "s")
+    return np.arange(start, end, np.timedelta64(freq_hours, "h"))
+
+
+def calc_interp_schedule(
+    syear: int, smonth: int, eyear: int, emonth: int, freq_hours: int = 3
+) -> tuple[np.ndarray, np.ndarray]:
+    """Return output times and their interpolation weights for a whole run.
+
+    Convenience wrapper combining :func:`calc_output_times` and
+    :func:`calc_interp_weights`.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        ``(times, weights)`` with one weight record per output time.
+    """
+    times = calc_output_times(syear, smonth, eyear, emonth, freq_hours)
+    return times, calc_interp_weights(times)
+
+
 def calc_relhum(dewpt: np.ndarray, t: np.ndarray) -> np.ndarray:
     """Calculate relative humidity from dew-point and air temperature.
 
@@ -106,3 +245,30 @@ def calc_relhum(dewpt: np.ndarray, t: np.ndarray) -> np.ndarray:
         / np.exp((const.es_Abolton * t) / (const.es_Bbolton + t))
     )
     return relhum
+
+
+#: Values accepted for the ``precision`` configuration key.
+PRECISIONS = ("float32", "float64")
+
+
+def compute_dtype(precision: str) -> np.dtype | None:
+    """Return the working dtype of the writers for a ``precision`` policy.
+
+    - ``"float32"``: ERA5 and anomaly fields are read without netCDF4
+      auto-masking, unpacked directly to float32 (missing values become NaN)
+      and blended in float32, the dtype of the intermediate files.
+    - ``"float64"``: ``None``, i.e. netCDF4's default masked reads and
+      NumPy's type promotion (packed ERA5 fields are blended in float64 and
+      rounded to float32 once), which reproduces earlier releases bit for
+      bit.
+
+    Raises
+    ------
+    ValueError
+        If *precision* is not one of :data:`PRECISIONS`.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Unknown precision {precision!r}; expected one of {', '.join(PRECISIONS)}"
+        )
+    return np.dtype("float32") if precision == "float32" else None
@@ -0,0 +1,208 @@
+"""pgw4era.vinterp — vertical interpolation of the CC signal to the ERA5 levels.
+
+The ensemble CC signals of the 3-D variables are on the 19 CMIP6 ``plev19``
+levels and must be interpolated to the 37 ERA5 pressure levels written to the
+intermediate files.  ``Dataset.interp`` did this with a scipy interpolator
+per call, rebuilding the same bracketing of the levels for every file.
+
+Both level sets are the same for every month and column, so
+:class:`VerticalInterpolator` computes once, for every target level, the
+source levels bracketing it and the weight of the upper one.  Interpolating
+is then one gather of the bracketing levels and one fused multiply-add over
+all the months and columns passed at once.
+
+Interpolation is linear in pressure (``method="linear"``, as before) or in
+the logarithm of pressure (``method="log"``).  Target levels beyond the
+source levels are extrapolated separately below the lowest source level
+(higher pressure, ``below``) and above the highest one (``above``):
+
+``"linear"``
+    Linear extrapolation from the two outermost source levels (the former
+    behaviour).
+``"constant"``
+    The value of the outermost source level.
+``"nan"``
+    Missing.
+
+A missing value on a bracketing level makes the interpolated value missing;
+target levels that coincide with a source level take its value exactly.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+
+_METHODS = ("linear", "log")
+_EXTRAPOLATIONS = ("linear", "constant", "nan")
+
+
+class VerticalInterpolator:
+    """Interpolation weights from the pressure levels *source* to *target*.
+
+    Parameters
+    ----------
+    source, target:
+        Pressure levels (any consistent unit, in any order); the output
+        levels are in the order of *target*.
+    method:
+        ``"linear"`` or ``"log"`` (linear in the logarithm of pressure).
+    below, above:
+        Extrapolation to target levels with a higher pressure than the lowest
+        source level, and with a lower pressure than the highest one:
+        ``"linear"``, ``"constant"`` or ``"nan"``.
+
+    Raises
+    ------
+    ValueError
+        If an option is unknown, there are fewer than two source levels, or
+        a level is not positive with ``method="log"``.
+    """
+
+    def __init__(
+        self,
+        source: np.ndarray,
+        target: np.ndarray,
+        method: str = "linear",
+        below: str = "linear",
+        above: str = "linear",
+    ) -> None:
+        if method not in _METHODS:
+            raise ValueError(f"Unknown interpolation method {method!r}; expected one of {_METHODS}")
+        for option in (below, above):
+            if option not in _EXTRAPOLATIONS:
+                raise ValueError(
+                    f"Unknown extrapolation {option!r}; expected one of {_EXTRAPOLATIONS}"
+                )
+        source = np.asarray(source, dtype="float64")
+        target = np.asarray(target, dtype="float64")
+        if source.size < 2:
+            raise ValueError("At least two source levels are needed")
+        if method == "log" and (np.any(source <= 0) or np.any(target <= 0)):
+            raise ValueError("Pressure levels must be positive for log-pressure interpolation")
+        self.source = source
+        self.target = target
+        self.method = method
+
+        transform = np.log if method == "log" else np.asarray
+        order = np.argsort(source)
+        xs, xt = transform(source[order]), transform(target)
+        # Bracketing pair (k, k + 1) of the sorted levels, the outermost pair beyond them
+        k = np.clip(np.searchsorted(xs, xt) - 1, 0, len(xs) - 2)
+        weight = (xt - xs[k]) / (xs[k + 1] - xs[k])
+        lo, hi = order[k], order[k + 1]
+
+        # Sorted ascending in pressure, so beyond the largest pressure is "below"
+        for beyond, option, edge in (
+            (xt > xs[-1], below, 1.0),
+            (xt < xs[0], above, 0.0),
+        ):
+            if option == "constant":
+                weight[beyond] = edge
+        # Exact levels read only that level, so a missing neighbour does not matter
+        exact = np.isclose(weight, 0.0, rtol=0.0, atol=1e-12)
+        hi[exact] = lo[exact]
+        exact = np.isclose(weight, 1.0, rtol=0.0, atol=1e-12)
+        lo[exact] = hi[exact]
+        weight[exact] = 0.0
+
+        self.lower = lo
+        self.upper = hi
+        self.weight = weight
+        self.missing = np.zeros(len(xt), dtype=bool)
+        if below == "nan":
+            self.missing |= xt > xs[-1]
+        if above == "nan":
+            self.missing |= xt < xs[0]
+
+    def __call__(self, data: np.ndarray, axis: int = -3) -> np.ndarray:
+        """Interpolate *data* along its level axis *axis* (default: ``(..., lev, y, x)``).
+
+        Masked values are treated as missing (NaN).  The result is a float
+        array of the dtype of *data* (float32 for integer data).
+        """
+        data = np.ma.filled(data, np.nan) if np.ma.isMaskedArray(data) else np.asarray(data)
+        if data.dtype.kind != "f":
+            data = data.astype("float32")
+        axis = axis % data.ndim
+        shape = [1] * data.ndim
+        shape[axis] = -1
+        nlev = len(self.weight)
+        # One gather for both bracketing levels
+        bracket = np.take(data, np.concatenate([self.lower, self.upper]), axis=axis)
+        lower = np.take(bracket, np.arange(nlev), axis=axis)
+        upper = np.take(bracket, np.arange(nlev, 2 * nlev), axis=axis)
+        weight = self.weight.astype(data.dtype).reshape(shape)
+        out = lower + weight * (upper - lower)
+        if self.missing.any():
+            out[(slice(None),) * axis + (self.missing,)] = np.nan
+        return out
+
+
+def interpolate_netcdf(
+    src_path: str | Path,
+    dst_path: str | Path,
+    varname: str,
+    target: np.ndarray,
+    method: str = "linear",
+    below: str = "linear",
+    above: str = "linear",
+    level_name: str = "plev",
+) -> None:
+    """Interpolate *varname* of a netCDF file to the pressure levels *target*.
+
+    The level coordinate *level_name* is replaced by *target* (keeping its
+    attributes), other variables on the source levels (such as bounds) are
+    dropped and the remaining ones are copied.  The variable is
+    interpolated one time step at a time; the output is written under a
+    temporary name and renamed once complete.  See
+    :class:`VerticalInterpolator` for the options.
+    """
+    dst_path = Path(dst_path)
+    part = dst_path.with_name(f"{dst_path.name}.part")
+    target = np.asarray(target)
+    with nc.Dataset(src_path) as src:
+        interpolator = VerticalInterpolator(
+            src.variables[level_name][:], target, method, below, above
+        )
+        with nc.Dataset(part, "w", format=src.data_model) as dst:
+            dst.setncatts({key: src.getncattr(key) for key in src.ncattrs()})
+            for name, dim in src.dimensions.items():
+                size = len(target) if name == level_name else len(dim)
+                dst.createDimension(name, None if dim.isunlimited() else size)
+
+            for name, var in src.variables.items():
+                dims = var.dimensions
+                attrs = {key: var.getncattr(key) for key in var.ncattrs() if key != "_FillValue"}
+                if name == level_name:
+                    out = dst.createVariable(name, var.dtype, dims)
+                    out.setncatts(attrs)
+                    out[:] = target
+                elif name == varname:
+                    attrs.pop("scale_factor", None)
+                    attrs.pop("add_offset", None)
+                    dtype = var.dtype if var.dtype.kind == "f" else np.dtype("float32")
+                    fill = getattr(var, "_FillValue", np.array(1e20, dtype=dtype))
+                    if np.isnan(fill):
+                        fill = np.array(1e20, dtype=dtype)
+                    out = dst.createVariable(name, dtype, dims, fill_value=fill)
+                    out.setncatts(attrs)
+                    axis = dims.index(level_name)
+                    if axis == 0:
+                        out[:] = np.ma.masked_invalid(interpolator(var[:], axis))
+                    else:
+                        for step in range(var.shape[0]):
+                            field = interpolator(var[step], axis - 1)
+                            out[step] = np.ma.masked_invalid(field)
+                elif level_name in dims:
+                    # Bounds of the source levels
+                    continue
+                else:
+                    fill = getattr(var, "_FillValue", None)
+                    out = dst.createVariable(name, var.dtype, dims, fill_value=fill)
+                    out.setncatts(attrs)
+                    out[...] = var[...]
+    os.replace(part, dst_path)
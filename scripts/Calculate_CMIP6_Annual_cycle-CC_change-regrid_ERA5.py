@@ -3,22 +3,32 @@
 
 Calculate CMIP6 annual cycle, climate-change signal, and regrid to ERA5 grid.
 
+The delta files are regridded with :mod:`pgw4era.regrid` to the grid described
+by ``regrid_grid`` (default ``era5_grid``); the weights of every model grid are
+computed once and cached in ``regrid_cache_dir``.
+
+Every (model, variable) pair is an independent task; with ``--workers`` they
+run on a process pool (:mod:`pgw4era.scheduler`).  A failing task is retried
+and does not stop the others; a summary of all tasks is written at the end and
+the script exits with status 1 if any of them failed.
+
 Usage
 -----
     python scripts/Calculate_CMIP6_Annual_cycle-CC_change-regrid_ERA5.py \
         --config pgw4era.toml --profile wrf
+    python scripts/Calculate_CMIP6_Annual_cycle-CC_change-regrid_ERA5.py \
+        --config pgw4era.toml --profile wrf --workers 8 --memory-mb 64000
 """
 
 from __future__ import annotations
 
 import argparse
+import math
 import os
-import subprocess
 from glob import glob
 from pathlib import Path
 
 import xarray as xr
-from tqdm.auto import tqdm
 
 
 class bcolors:
@@ -33,14 +43,6 @@ class bcolors:
     UNDERLINE = "\033[4m"
 
 
-def preprocess(ds):
-    drop_vars = [var for var in ds.variables if "bnds" in ds[var].dims]
-    ds = ds.drop_vars(drop_vars)
-    if "bnds" in ds.dims:
-        ds = ds.drop_dims("bnds")
-    return ds
-
-
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Calculate CMIP6 annual cycle, CC signal, and regrid to ERA5.",
@@ -48,93 +50,116 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument("--config", default="pgw4era.toml", help="Path to TOML config file.")
     parser.add_argument("--profile", default="wrf", help="Profile name in the TOML config.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes; (model, variable) tasks run in parallel.",
+    )
+    parser.add_argument(
+        "--memory-mb",
+        type=float,
+        default=None,
+        help="Memory budget (MiB) shared by the running tasks; default: no limit.",
+    )
+    parser.add_argument(
+        "--retries", type=int, default=1, help="Number of times a failed task is retried."
+    )
+    parser.add_argument(
+        "--summary",
+        default=None,
+        help="JSON summary of the tasks; default: <CMIP6anom_dir>/CC_signal_tasks.json.",
+    )
     return parser.parse_args()
 
 
-def calculate_annual_cycle(GCM, varname, experiments, syear, eyear, idir, odir):
-    filenames_p = sorted(glob(f"{idir}/{experiments[0]}/{varname}/{GCM}/{varname}*nc"))
-    finallp = xr.open_mfdataset(filenames_p, preprocess=preprocess)
-    if finallp.time.dtype == "O":
-        finallp["time"] = finallp["time"].astype("datetime64[ns]")
-    finallp_period = finallp.sel(time=slice(str(syear), str(eyear)))
+def annual_cycle_file(odir, GCM, varname, experiments, period):
+    syear, eyear = period
+    return f"{odir}/{GCM}/{varname}_{syear}-{eyear}_{'-'.join(experiments)}.nc"
 
-    filenames_f = sorted(glob(f"{idir}/{experiments[1]}/{varname}/{GCM}/{varname}*nc"))
-    finallf = xr.open_mfdataset(filenames_f, preprocess=preprocess)
-    finallf = finallf.where(finallf[varname] != 0.0)
-    if finallf.time.dtype == "O":
-        finallf["time"] = finallf["time"].astype("datetime64[ns]")
-    finallf_period = finallf.sel(time=slice(str(syear), str(eyear)))
 
-    finall = xr.concat([finallp_period, finallf_period], dim="time")
+def delta_file(odir, GCM, varname, experiments, period_p, period_f):
+    (syearp, eyearp), (syearf, eyearf) = period_p, period_f
+    return (
+        f"{odir}/{GCM}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
+        f"_{'-'.join(experiments)}_delta.nc"
+    )
 
-    Path(f"{odir}/{GCM}/").mkdir(exist_ok=True, parents=True)
 
-    ofname = f"{odir}/{GCM}/{varname}_{syear}-{eyear}_{'-'.join(experiments)}.nc"
-    print(f"{bcolors.OKCYAN}Saving file: {ofname}{bcolors.ENDC}")
+def calculate_annual_cycles(GCM, varname, experiments, year_ranges, idir, acycle_odir, deltas_odir):
+    """Annual cycles of all periods from one scan of the model files, and their deltas.
 
-    if not os.path.isfile(ofname):
-        import pandas as pd
+    The delta of every later period is taken with respect to the first one.
+    """
+    from pgw4era.climatology import MonthlyClimatology, accumulate, write_delta
 
-        fin_p = finall.sel(time=slice(str(syear), str(eyear)))
-        avail_dates = pd.to_datetime(fin_p.time.values)
-        year_months = {(d.year, d.month) for d in avail_dates}
-        all_months = {(y, m) for y in range(syear, eyear + 1) for m in range(1, 13)}
+    Path(f"{acycle_odir}/{GCM}/").mkdir(exist_ok=True, parents=True)
+    Path(f"{deltas_odir}/{GCM}/").mkdir(exist_ok=True, parents=True)
+    cycle_files = [
+        annual_cycle_file(acycle_odir, GCM, varname, experiments, period) for period in year_ranges
+    ]
+    delta_files = [
+        delta_file(deltas_odir, GCM, varname, experiments, year_ranges[0], period)
+        for period in year_ranges[1:]
+    ]
 
-        if year_months != all_months:
-            raise SystemExit(
-                f"{bcolors.ERROR}ERROR: Not all requested years/months available: "
-                f"{GCM} {varname}{bcolors.ENDC}"
+    if all(os.path.isfile(ofname) for ofname in cycle_files):
+        for syear, eyear in year_ranges:
+            print(
+                f"{bcolors.OKCYAN}{varname} {GCM} {syear}-{eyear} Already processed{bcolors.ENDC}"
+            )
+        for period in year_ranges[1:]:
+            calculate_CC_signal(
+                GCM, varname, experiments, year_ranges[0], period, acycle_odir, deltas_odir
+            )
+        return
+
+    # Streamed file by file; zeros in the scenario files are missing values
+    climatologies = [MonthlyClimatology(varname, syear, eyear) for syear, eyear in year_ranges]
+    for filename in sorted(glob(f"{idir}/{experiments[0]}/{varname}/{GCM}/{varname}*nc")):
+        accumulate(filename, climatologies)
+    for filename in sorted(glob(f"{idir}/{experiments[1]}/{varname}/{GCM}/{varname}*nc")):
+        accumulate(filename, climatologies, mask_zero=True)
+
+    for (syear, eyear), climatology in zip(year_ranges, climatologies):
+        if climatology.missing_months():
+            raise ValueError(
+                f"Not all requested years/months available: {GCM} {varname} {syear}-{eyear}"
             )
 
-        if varname == "hus":
-            fin_p = fin_p.where((fin_p.hus >= 0) & (fin_p.hus <= 100))
-        elif varname == "hur":
-            fin_p = fin_p.where((fin_p.hur >= 0) & (fin_p.hur <= 100))
-        elif varname == "ta":
-            fin_p = fin_p.where((fin_p.ta >= 0) & (fin_p.ta < 400))
-        elif varname == "ua":
-            fin_p = fin_p.where((fin_p.ua > -500) & (fin_p.ua < 500))
-        elif varname == "va":
-            fin_p = fin_p.where((fin_p.va > -500) & (fin_p.va < 500))
-        elif varname == "zg":
-            fin_p = fin_p.where((fin_p.zg > -1000) & (fin_p.zg < 60000))
-
-        fin_p_mm = fin_p.groupby("time.month").mean("time", skipna=False)
-        fin_p_mm.to_netcdf(ofname)
-        print(
-            f"{bcolors.OKGREEN}Created annual cycle: {GCM} {varname} {syear}-{eyear}{bcolors.ENDC}"
-        )
-    else:
-        print(f"{bcolors.OKCYAN}{varname} {GCM} {syear}-{eyear} Already processed{bcolors.ENDC}")
-
-    finall.close()
+    for (syear, eyear), climatology, ofname in zip(year_ranges, climatologies, cycle_files):
+        if not os.path.isfile(ofname):
+            print(f"{bcolors.OKCYAN}Saving file: {ofname}{bcolors.ENDC}")
+            climatology.to_netcdf(ofname)
+            print(
+                f"{bcolors.OKGREEN}Created annual cycle: {GCM} {varname} {syear}-{eyear}"
+                f"{bcolors.ENDC}"
+            )
+    for climatology, ofname in zip(climatologies[1:], delta_files):
+        if not os.path.isfile(ofname):
+            write_delta(climatology, climatologies[0], ofname)
+            print(f"{bcolors.OKGREEN}Created delta file: {GCM} {varname}{bcolors.ENDC}")
 
 
-def calculate_CC_signal(GCM, varname, experiments, year_ranges, idir, odir):
-    syearp, eyearp = year_ranges[0]
-    syearf, eyearf = year_ranges[1]
+def calculate_CC_signal(GCM, varname, experiments, period_p, period_f, idir, odir):
+    """Delta between two annual-cycle files written by an earlier run."""
+    syearp = period_p[0]
 
-    ofname = (
-        f"{odir}/{GCM}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-        f"_{'-'.join(experiments)}_delta.nc"
-    )
+    ofname = delta_file(odir, GCM, varname, experiments, period_p, period_f)
     Path(f"{odir}/{GCM}/").mkdir(exist_ok=True, parents=True)
 
     if not os.path.isfile(ofname):
         import pandas as pd
 
-        fin_p = xr.open_dataset(
-            f"{idir}/{GCM}/{varname}_{syearp}-{eyearp}_{'-'.join(experiments)}.nc"
-        )
-        fin_f = xr.open_dataset(
-            f"{idir}/{GCM}/{varname}_{syearf}-{eyearf}_{'-'.join(experiments)}.nc"
-        )
+        fin_p = xr.open_dataset(annual_cycle_file(idir, GCM, varname, experiments, period_p))
+        fin_f = xr.open_dataset(annual_cycle_file(idir, GCM, varname, experiments, period_f))
         fin_d = fin_f - fin_p
 
         datelist = pd.date_range(f"{syearp}-01-01", periods=12, freq="MS")
         foutclean = fin_d.rename({"month": "time"})
         foutclean = foutclean.assign_coords({"time": datelist})
-        foutclean.to_netcdf(ofname, unlimited_dims="time")
+        foutclean.to_netcdf(f"{ofname}.part", unlimited_dims="time")
+        os.replace(f"{ofname}.part", ofname)
 
         fin_p.close()
         fin_f.close()
@@ -143,10 +168,66 @@ def calculate_CC_signal(GCM, varname, experiments, year_ranges, idir, odir):
         print(f"{bcolors.OKCYAN}CC file {varname} {GCM} Already processed{bcolors.ENDC}")
 
 
+def estimate_memory_mb(GCM, varname, experiments, idir, target) -> float:
+    """Rough peak memory (MiB) of the task of one model and variable.
+
+    Dominated by the 12-month delta regridded to the target grid, held in
+    float64 together with its source.  0 if the first historical file cannot
+    be read: the task then fails on its own instead of the whole stage.
+    """
+    files = sorted(glob(f"{idir}/{experiments[0]}/{varname}/{GCM}/{varname}*nc"))
+    if not files:
+        return 0.0
+    try:
+        with xr.open_dataset(files[0], decode_times=False) as ds:
+            shape = ds[varname].shape[1:]
+    except (OSError, ValueError, KeyError) as exc:
+        print(
+            f"{bcolors.WARNING}Cannot estimate the memory of {GCM} {varname}: {exc}{bcolors.ENDC}"
+        )
+        return 0.0
+    nlev = math.prod(shape[:-2])
+    npoints = math.prod(shape[-2:]) + target.xsize * target.ysize
+    return 2 * 12 * nlev * npoints * 8 / 1024**2
+
+
+def process_model_variable(GCM, varname, cfg, target, regrid_cache) -> None:
+    """Annual cycles, CC signal and regridded delta of one model and variable."""
+    from pgw4era.regrid import regrid_netcdf
+
+    experiments = cfg.experiments
+    year_ranges = cfg.periods
+    odir = cfg.CMIP6anom_dir
+    acycle_odir = f"{odir}/annual_cycle"
+    deltas_odir = f"{odir}/deltas"
+    regrid_era5 = f"{odir}/regrid_ERA5"
+
+    calculate_annual_cycles(
+        GCM, varname, experiments, year_ranges, cfg.CMIP6_monthly_dir, acycle_odir, deltas_odir
+    )
+
+    syearp, eyearp = year_ranges[0]
+    for period in year_ranges[1:]:
+        syearf, eyearf = period
+        delta = delta_file(deltas_odir, GCM, varname, experiments, year_ranges[0], period)
+        regrid_file = (
+            f"{regrid_era5}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
+            f"_{'-'.join(experiments)}_{GCM}_delta.nc"
+        )
+        if not os.path.isfile(regrid_file):
+            try:
+                regrid_netcdf(delta, regrid_file, target, cfg.regrid_method, regrid_cache)
+            except Exception as exc:
+                raise RuntimeError(f"Could not regrid to ERA5: {GCM} {varname}: {exc}") from exc
+            print(f"{bcolors.OKGREEN}Regridded delta to ERA5: {GCM} {varname}{bcolors.ENDC}")
+
+
 def main() -> None:
     args = parse_args()
 
     from pgw4era.config import load_config
+    from pgw4era.regrid import read_grid_description
+    from pgw4era.scheduler import Task, run_tasks
 
     cfg = load_config(args.config, args.profile)
 
@@ -157,56 +238,36 @@ def main() -> None:
     else:
         models = cfg.models
 
-    variables = cfg.variables_all
-    experiments = cfg.experiments
     year_ranges = cfg.periods
-    idir = cfg.CMIP6_monthly_dir
     odir = cfg.CMIP6anom_dir
-
-    acycle_odir = f"{odir}/annual_cycle"
-    deltas_odir = f"{odir}/deltas"
-    regrid_era5 = f"{odir}/regrid_ERA5"
+    regrid_cache = cfg.regrid_cache_dir or f"{odir}/regrid_weights"
+    era5_grid = read_grid_description(cfg.regrid_grid)
 
     print(f"{bcolors.HEADER}Creating Annual cycles and delta files{bcolors.ENDC}")
-    Path(acycle_odir).mkdir(exist_ok=True, parents=True)
-    Path(deltas_odir).mkdir(exist_ok=True, parents=True)
-    Path(regrid_era5).mkdir(exist_ok=True, parents=True)
+    for subdir in ("annual_cycle", "deltas", "regrid_ERA5"):
+        Path(f"{odir}/{subdir}").mkdir(exist_ok=True, parents=True)
 
     print(f"{bcolors.OKGREEN}Processing periods: {year_ranges}{bcolors.ENDC}")
 
-    for GCM in tqdm(models):
-        for varname in variables:
-            for period in year_ranges:
-                syear, eyear = period
-                print(f"{bcolors.OKCYAN}Processing period: {syear} - {eyear}{bcolors.ENDC}")
-                calculate_annual_cycle(GCM, varname, experiments, syear, eyear, idir, acycle_odir)
-
-            calculate_CC_signal(GCM, varname, experiments, year_ranges, acycle_odir, deltas_odir)
-
-            syearp, eyearp = year_ranges[0]
-            syearf, eyearf = year_ranges[1]
-            delta_file = (
-                f"{deltas_odir}/{GCM}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-                f"_{'-'.join(experiments)}_delta.nc"
-            )
-            regrid_file = (
-                f"{regrid_era5}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-                f"_{'-'.join(experiments)}_{GCM}_delta.nc"
-            )
-            if not os.path.isfile(regrid_file):
-                try:
-                    subprocess.check_output(
-                        f"cdo -remapbil,era5_grid {delta_file} {regrid_file}",
-                        shell=True,
-                    )
-                    print(
-                        f"{bcolors.OKGREEN}Regridded delta to ERA5: {GCM} {varname}{bcolors.ENDC}"
-                    )
-                except Exception:
-                    raise SystemExit(
-                        f"{bcolors.ERROR}ERROR: Could not regrid to ERA5: {GCM} {varname}"
-                        f"{bcolors.ENDC}"
-                    )
+    tasks = [
+        Task(
+            f"{GCM} {varname}",
+            process_model_variable,
+            (GCM, varname, cfg, era5_grid, regrid_cache),
+            estimate_memory_mb(GCM, varname, cfg.experiments, cfg.CMIP6_monthly_dir, era5_grid),
+        )
+        for GCM in models
+        for varname in cfg.variables_all
+    ]
+    results = run_tasks(
+        tasks,
+        workers=args.workers,
+        memory_mb=args.memory_mb,
+        retries=args.retries,
+        summary=args.summary or f"{odir}/CC_signal_tasks.json",
+    )
+    if not all(result.ok for result in results):
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
@@ -1,22 +1,29 @@
 #!/usr/bin/env python
 """Create_CMIP6_AnnualCycleChange_ENSMEAN.py
 
-Compute the ensemble mean of CMIP6 annual-cycle climate-change signals.
+Compute ensemble statistics of CMIP6 annual-cycle climate-change signals.
+
+The regridded per-model deltas are averaged one model at a time with
+:class:`pgw4era.ensemble.EnsembleMean`, and the median and quantiles listed
+in ``ensemble_statistics`` are computed block by block with
+:class:`pgw4era.ensemble.EnsembleQuantiles`, optionally weighting the models
+by ``ensemble_weights``.  The pressure levels of the 3-D variables are set to
+the CMIP6 ``plev19`` values on the fly.  Every statistic is written to its own
+``*_CC_signal[_<statistic>].nc`` file in ``CMIP6anom_dir``, where the next
+steps read them.
 
 Usage
 -----
     python scripts/Create_CMIP6_AnnualCycleChange_ENSMEAN.py \
         --config pgw4era.toml --profile wrf
+    python scripts/Create_CMIP6_AnnualCycleChange_ENSMEAN.py \
+        --config pgw4era.toml --profile wrf --allmodels
 """
 
 from __future__ import annotations
 
 import argparse
-from glob import glob
-from pathlib import Path
-
-import numpy as np
-import xarray as xr
+import os
 
 
 class bcolors:
@@ -31,15 +38,6 @@ class bcolors:
     UNDERLINE = "\033[4m"
 
 
-def mean_with_missing_threshold(data_array, dim, threshold=0.2):
-    valid_counts = data_array.count(dim=dim)
-    total_counts = data_array.sizes[dim]
-    missing_fraction = 1 - (valid_counts / total_counts)
-    mask = missing_fraction > threshold
-    mean_values = data_array.mean(dim=dim, skipna=True)
-    return mean_values.where(~mask, np.nan)
-
-
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Create CMIP6 annual-cycle change ensemble mean.",
@@ -47,6 +45,24 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument("--config", default="pgw4era.toml", help="Path to TOML config file.")
     parser.add_argument("--profile", default="wrf", help="Profile name in the TOML config.")
+    parser.add_argument(
+        "--max-missing",
+        type=float,
+        default=None,
+        help="Largest fraction of models that may miss a point for its statistics to be "
+        "kept (default: ensemble_max_missing of the config).",
+    )
+    parser.add_argument(
+        "--chunk-mb",
+        type=float,
+        default=512.0,
+        help="Working memory (MiB) of a block of the quantile computation.",
+    )
+    parser.add_argument(
+        "--allmodels",
+        action="store_true",
+        help="Also write the *_CC_signal_allmodels.nc files stacking every model.",
+    )
     return parser.parse_args()
 
 
@@ -54,6 +70,13 @@ def main() -> None:
     args = parse_args()
 
     from pgw4era.config import load_config
+    from pgw4era.ensemble import (
+        CMIP6_PLEVS,
+        EnsembleMean,
+        EnsembleQuantiles,
+        parse_statistic,
+        statistic_suffix,
+    )
 
     cfg = load_config(args.config, args.profile)
 
@@ -69,84 +92,53 @@ def main() -> None:
     year_ranges = cfg.periods
     syearp, eyearp = year_ranges[0]
     syearf, eyearf = year_ranges[1]
+    statistics = cfg.ensemble_statistics
+    quantiles = {name: parse_statistic(name) for name in statistics}
+    weights = cfg.ensemble_weights
+    max_missing = cfg.ensemble_max_missing if args.max_missing is None else args.max_missing
 
     idir = f"{cfg.CMIP6anom_dir}/regrid_ERA5"
-    odir = f"{cfg.CMIP6anom_dir}/regrid_ERA5"
-    cpdir = f"{cfg.CMIP6anom_dir}/corrected_plevs"
-
-    plvs = np.asarray(
-        [
-            100000,
-            92500,
-            85000,
-            70000,
-            60000,
-            50000,
-            40000,
-            30000,
-            25000,
-            20000,
-            15000,
-            10000,
-            7000,
-            5000,
-            3000,
-            2000,
-            1000,
-            500,
-            100,
-        ]
-    )
-    correct_plevs = True
-
-    Path(odir).mkdir(exist_ok=True, parents=True)
-
-    for GCM in models:
-        if correct_plevs:
-            Path(cpdir).mkdir(exist_ok=True, parents=True)
-            for varname in variables:
-                filepath = (
-                    f"{idir}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-                    f"_{'-'.join(experiments)}_{GCM}_delta.nc"
-                )
-                filename = filepath.split("/")[-1]
-                print(filename)
-                fin = xr.open_dataset(filepath)
-                if varname in ["ta", "hur", "ua", "va", "zg"]:
-                    fin.coords["plev"] = plvs
-                    fin.to_netcdf(f"{cpdir}/{filename}")
-                else:
-                    if "height" in fin.coords:
-                        fin = fin.drop_vars("height")
-                    fin = fin[varname]
-                    fin.to_netcdf(f"{cpdir}/{filename}")
+    odir = cfg.CMIP6anom_dir
+    prefix = f"{syearp}-{eyearp}_{syearf}-{eyearf}_{'-'.join(experiments)}"
+    quantile_names = [name for name in statistics if quantiles[name] is not None]
 
     for varname in variables:
         print(varname)
-        filesin = []
+        filepaths = {}
         for GCM in models:
-            filesin.extend(
-                sorted(
-                    glob(
-                        f"{cpdir}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-                        f"_{'-'.join(experiments)}_{GCM}_delta.nc"
-                    )
-                )
+            filepath = f"{idir}/{varname}_{prefix}_{GCM}_delta.nc"
+            if not os.path.isfile(filepath):
+                print(f"{bcolors.WARNING}Missing {varname} delta of {GCM}{bcolors.ENDC}")
+                continue
+            filepaths[GCM] = filepath
+        plev = CMIP6_PLEVS if varname in cfg.variables_3d else None
+
+        allmodels = f"{odir}/{varname}_{prefix}_CC_signal_allmodels.nc" if args.allmodels else None
+        if "mean" in statistics or allmodels is not None:
+            with EnsembleMean(varname, plev, max_missing, allmodels, weights) as ensemble:
+                for GCM, filepath in filepaths.items():
+                    ensemble.add(filepath, GCM)
+                ensemble.to_netcdf(f"{odir}/{varname}_{prefix}_CC_signal.nc")
+        if quantile_names:
+            ensemble = EnsembleQuantiles(
+                varname,
+                [quantiles[name] for name in quantile_names],
+                plev,
+                max_missing,
+                weights,
+                args.chunk_mb,
             )
-
-        fin = xr.open_mfdataset(filesin, concat_dim="model", combine="nested")
-
-        if "areacella" in fin.variables:
-            fin = fin.drop_vars("areacella")
-
-        fin.to_netcdf(
-            f"{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-            f"_{'-'.join(experiments)}_CC_signal_allmodels.nc"
-        )
-
-        fin_ensmean = mean_with_missing_threshold(fin, dim="model", threshold=1).squeeze()
-        fin_ensmean.to_netcdf(
-            f"{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}_{'-'.join(experiments)}_CC_signal.nc"
+            for GCM, filepath in filepaths.items():
+                ensemble.add(filepath, GCM)
+            ensemble.to_netcdf(
+                [
+                    f"{odir}/{varname}_{prefix}_CC_signal{statistic_suffix(name)}.nc"
+                    for name in quantile_names
+                ]
+            )
+        print(
+            f"{bcolors.OKGREEN}Ensemble {', '.join(statistics)} of {varname} from "
+            f"{len(filepaths)} model(s){bcolors.ENDC}"
         )
 
 
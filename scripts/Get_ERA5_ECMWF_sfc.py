@@ -1,66 +1,124 @@
 #!/usr/bin/env python
 """Get_ERA5_ECMWF_sfc.py — Download ERA5 single-level (surface) data via CDS API.
 
-Edit the year/month/day ranges inside this script to match your target period.
+Every day from ``syear``/``smonth`` up to ``eyear``/``emonth`` (as processed
+by the writers) is downloaded, in requests of as many days of a month as the
+CDS allows (or one request per day with ``--daily``), to
+``era5_daily_sfc_YYYYMMDD.grb`` in ``ERA5grib_dir``, with several requests
+queued at the CDS at the same time (see :func:`pgw4era.download.download`).
+Interrupted runs resume where they stopped: files already downloaded are not
+requested again.
+
+With a ``domain`` section in the profile, only the area covering the domain
+and its halo is downloaded, and the CDO description of the regional grid is
+written next to the files (``era5_grid``).  Nothing is downloaded unless
+``regrid_grid`` describes the grid of the downloaded files, so that the CC
+signal is regridded to the same grid.
+
+Usage
+-----
+    python scripts/Get_ERA5_ECMWF_sfc.py --config pgw4era.toml --profile wrf
+    python scripts/Get_ERA5_ECMWF_sfc.py --config pgw4era.toml --profile wrf --workers 8
 """
 
-import calendar
+from __future__ import annotations
 
-import cdsapi
+import argparse
+from pathlib import Path
 
-c = cdsapi.Client()
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Download ERA5 single-level (surface) data via CDS API.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--config", default="pgw4era.toml", help="Path to TOML config file.")
+    parser.add_argument("--profile", default="wrf", help="Profile name in the TOML config.")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Maximum number of requests queued at the CDS."
+    )
+    parser.add_argument(
+        "--retries", type=int, default=3, help="Number of times a failed request is made again."
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=60.0,
+        help="Seconds before the first retry, doubled at every further retry.",
+    )
+    parser.add_argument(
+        "--max-fields",
+        type=int,
+        default=None,
+        help="Maximum number of fields of a request (default: the CDS limit).",
+    )
+    parser.add_argument(
+        "--daily", action="store_true", help="Make one request per day instead of batches."
+    )
+    parser.add_argument(
+        "--keep-batches",
+        action="store_true",
+        help="Keep the multi-day downloads after splitting them into daily files.",
+    )
+    parser.add_argument(
+        "--global",
+        dest="global_grid",
+        action="store_true",
+        help="Download the global grid even if the profile has a domain section.",
+    )
+    parser.add_argument(
+        "--state",
+        default=None,
+        help="JSON download state; default: <ERA5grib_dir>/era5_download_state.json.",
+    )
+    return parser.parse_args()
 
-def retrieve_era5():
-    """Iterate over days and download ERA5 surface data."""
-    yearStart = 2010
-    yearEnd = 2010
-    monthStart = 1
-    monthEnd = 12
 
-    for year in range(yearStart, yearEnd + 1):
-        for month in range(monthStart, monthEnd + 1):
-            for day in range(1, calendar.monthrange(year, month)[1] + 1):
-                target = f"era5_daily_sfc_{year:04d}{month:02d}{day:02d}.grb"
-                era5_request(year, month, day, target)
+def main() -> None:
+    args = parse_args()
 
+    from pgw4era.config import load_config
+    from pgw4era.download import (
+        MAX_FIELDS,
+        area_grid,
+        check_regrid_grid,
+        download,
+        era5_area,
+        era5_retrievals,
+    )
+    from pgw4era.regrid import write_grid_description
 
-def era5_request(year, month, day, target):
-    c.retrieve(
-        "reanalysis-era5-single-levels",
-        {
-            "product_type": "reanalysis",
-            "format": "grib",
-            "variable": [
-                "10m_u_component_of_wind",
-                "10m_v_component_of_wind",
-                "2m_dewpoint_temperature",
-                "2m_temperature",
-                "land_sea_mask",
-                "mean_sea_level_pressure",
-                "sea_ice_cover",
-                "sea_surface_temperature",
-                "skin_temperature",
-                "snow_depth",
-                "soil_temperature_level_1",
-                "soil_temperature_level_2",
-                "soil_temperature_level_3",
-                "soil_temperature_level_4",
-                "surface_pressure",
-                "volumetric_soil_water_layer_1",
-                "volumetric_soil_water_layer_2",
-                "volumetric_soil_water_layer_3",
-                "volumetric_soil_water_layer_4",
-            ],
-            "year": f"{year}",
-            "month": f"{month:02d}",
-            "day": f"{day:02d}",
-            "time": ["00:00", "06:00", "12:00", "18:00"],
-            "grid": [0.3, 0.3],
-        },
-        target,
+    cfg = load_config(args.config, args.profile)
+    max_fields = None if args.daily else args.max_fields or MAX_FIELDS
+    area = None if args.global_grid else era5_area(cfg)
+    if area is not None:
+        grid_file = Path(cfg.ERA5grib_dir) / "era5_grid"
+        Path(cfg.ERA5grib_dir).mkdir(parents=True, exist_ok=True)
+        write_grid_description(area_grid(area), grid_file)
+    # The CC signal is regridded to regrid_grid and added to these files point by point
+    try:
+        check_regrid_grid(cfg, area)
+    except ValueError as exc:
+        if area is None:
+            fix = "regrid_grid to the description of the global ERA5 grid (era5_grid)"
+        else:
+            fix = f'regrid_grid = "{grid_file}" in the profile'
+        print(f"ERROR: {exc}; set {fix} before downloading")
+        raise SystemExit(1) from None
+    if area is not None:
+        print(f"Downloading the area N/W/S/E = {'/'.join(f'{v:g}' for v in area)}")
+    results = download(
+        era5_retrievals(cfg, ["sfc"], max_fields, area),
+        cfg.ERA5grib_dir,
+        workers=args.workers,
+        retries=args.retries,
+        backoff=args.backoff,
+        state=args.state,
+        keep_batches=args.keep_batches,
     )
+    if not all(result.ok for result in results):
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
-    retrieve_era5()
+    main()
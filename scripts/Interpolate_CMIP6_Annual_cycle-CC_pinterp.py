@@ -3,6 +3,11 @@
 
 Interpolate CMIP6 annual-cycle CC signals to ERA5 pressure levels.
 
+Every ensemble statistic listed in ``ensemble_statistics`` is interpolated
+with :func:`pgw4era.vinterp.interpolate_netcdf`, linearly in pressure or
+log-pressure (``pinterp_method``), extrapolating beyond the CMIP6 levels as
+set by ``pinterp_below`` and ``pinterp_above``.
+
 Usage
 -----
     python scripts/Interpolate_CMIP6_Annual_cycle-CC_pinterp.py \
@@ -15,7 +20,7 @@ import argparse
 import os
 import time
 
-import xarray as xr
+import netCDF4 as nc
 
 
 def parse_args() -> argparse.Namespace:
@@ -41,6 +46,8 @@ def main() -> None:
     args = parse_args()
 
     from pgw4era.config import load_config
+    from pgw4era.ensemble import statistic_suffix
+    from pgw4era.vinterp import interpolate_netcdf
 
     cfg = load_config(args.config, args.profile)
 
@@ -52,8 +59,8 @@ def main() -> None:
     syearp, eyearp = year_ranges[0]
     syearf, eyearf = year_ranges[1]
 
-    era5_ref = xr.open_dataset(ERA5_pl_ref_file)
-    era5_plev = era5_ref.plev.values
+    with nc.Dataset(ERA5_pl_ref_file) as era5_ref:
+        era5_plev = era5_ref.variables["plev"][:]
 
     interp_dir = f"{CMIP6anom_dir}/interp_plevs"
     os.makedirs(interp_dir, exist_ok=True)
@@ -62,18 +69,23 @@ def main() -> None:
     for varname in variables:
         ctime_00 = checkpoint(0)
 
-        out_file = (
-            f"{interp_dir}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-            f"_{'-'.join(experiments)}_CC_signal_pinterp.nc"
-        )
-        if not os.path.exists(out_file):
-            fin = xr.open_dataset(
-                f"{CMIP6anom_dir}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
-                f"_{'-'.join(experiments)}_CC_signal.nc"
+        for statistic in cfg.ensemble_statistics:
+            suffix = statistic_suffix(statistic)
+            out_file = (
+                f"{interp_dir}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
+                f"_{'-'.join(experiments)}_CC_signal{suffix}_pinterp.nc"
             )
-            fin.reindex(plev=fin.plev[::-1])
-            fin_pinterp = fin.interp(plev=era5_plev, kwargs={"fill_value": "extrapolate"})
-            fin_pinterp.to_netcdf(out_file, unlimited_dims="time")
+            if not os.path.exists(out_file):
+                interpolate_netcdf(
+                    f"{CMIP6anom_dir}/{varname}_{syearp}-{eyearp}_{syearf}-{eyearf}"
+                    f"_{'-'.join(experiments)}_CC_signal{suffix}.nc",
+                    out_file,
+                    varname,
+                    era5_plev,
+                    cfg.pinterp_method,
+                    cfg.pinterp_below,
+                    cfg.pinterp_above,
+                )
 
         checkpoint(ctime_00, f"{varname} file interpolated")
 
@@ -21,81 +21,12 @@ Usage
 from __future__ import annotations
 
 import argparse
-import struct
 import sys
-from dataclasses import dataclass
 from pathlib import Path
 
 import numpy as np
 
-# ---------------------------------------------------------------------------
-# WRF intermediate binary reader  (shared with compare_wrf_output.py)
-# ---------------------------------------------------------------------------
-
-
-@dataclass
-class WRFField:
-    """One 2-D slab from a WRF intermediate file."""
-
-    hdate: str
-    field_name: str
-    units: str
-    desc: str
-    xlvl: float
-    nlons: int
-    nlats: int
-    slab: np.ndarray  # shape (nlons, nlats), big-endian float32
-
-    @property
-    def key(self) -> tuple[str, float]:
-        return (self.field_name, float(self.xlvl))
-
-
-def _read_fortran_record(f) -> bytes | None:
-    hdr = f.read(4)
-    if len(hdr) < 4:
-        return None
-    (size,) = struct.unpack(">i", hdr)
-    data = f.read(size)
-    f.read(4)  # trailing length marker
-    return data
-
-
-def read_wrf_intermediate(path: Path) -> list[WRFField]:
-    """Read all field slabs from a WRF intermediate (big-endian Fortran) file."""
-    fields: list[WRFField] = []
-    with open(path, "rb") as f:
-        while True:
-            rec = _read_fortran_record(f)
-            if rec is None:
-                break
-
-            rec = _read_fortran_record(f)
-            (hdate, _xfcst, _map_source, field_name, units, desc, xlvl, nlons, nlats, _iproj) = (
-                struct.unpack(">24sf32s9s25s46sfiii", rec)
-            )
-
-            _read_fortran_record(f)  # grid descriptor
-            _read_fortran_record(f)  # wind rotation flag
-
-            rec = _read_fortran_record(f)
-            slab = np.frombuffer(rec, dtype=">f4").reshape(nlons, nlats).copy()
-
-            fields.append(
-                WRFField(
-                    hdate=hdate.decode("ascii").strip(),
-                    field_name=field_name.decode("ascii").strip(),
-                    units=units.decode("ascii").strip(),
-                    desc=desc.decode("ascii").strip(),
-                    xlvl=float(xlvl),
-                    nlons=int(nlons),
-                    nlats=int(nlats),
-                    slab=slab,
-                )
-            )
-
-    return fields
-
+from pgw4era.intermediate import IntermediateField, IntermediateFile
 
 # ---------------------------------------------------------------------------
 # CRYOWRF-only field names
@@ -113,18 +44,23 @@ def compare_file_pair(
     cryo_path: Path,
     atol: float,
     rtol: float,
-) -> tuple[int, int, list[WRFField]]:
+) -> tuple[int, int, list[tuple[IntermediateField, np.ndarray]]]:
     """Compare a WRF file against a CRYOWRF file.
 
-    Returns (n_identical, n_different, cryowrf_only_fields).
+    Returns (n_identical, n_different, cryowrf_only_fields), the latter as
+    (header, slab) pairs.
     """
-    wrf_fields = {f.key: f for f in read_wrf_intermediate(wrf_path)}
-    cryo_fields = {f.key: f for f in read_wrf_intermediate(cryo_path)}
+    with IntermediateFile(wrf_path) as wrf_file, IntermediateFile(cryo_path) as cryo_file:
+        return _compare_files(wrf_file, cryo_file, atol, rtol)
+
 
-    cryo_only = [f for f in read_wrf_intermediate(cryo_path) if f.field_name in CRYOWRF_ONLY]
+def _compare_files(
+    wrf_file: IntermediateFile, cryo_file: IntermediateFile, atol: float, rtol: float
+) -> tuple[int, int, list[tuple[IntermediateField, np.ndarray]]]:
+    cryo_only = [(f, slab) for f, slab in cryo_file.items() if f.field_name in CRYOWRF_ONLY]
 
-    wrf_keys = set(wrf_fields)
-    cryo_keys = {k for k in cryo_fields if cryo_fields[k].field_name not in CRYOWRF_ONLY}
+    wrf_keys = set(wrf_file.keys())
+    cryo_keys = {k for k in cryo_file.keys() if k[0] not in CRYOWRF_ONLY}
 
     missing_from_cryo = wrf_keys - cryo_keys
     if missing_from_cryo:
@@ -134,8 +70,8 @@ def compare_file_pair(
     n_different = 0
 
     for key in sorted(wrf_keys & cryo_keys):
-        wrf_slab = wrf_fields[key].slab.astype(np.float64)
-        cryo_slab = cryo_fields[key].slab.astype(np.float64)
+        wrf_slab = wrf_file[key].astype(np.float64)
+        cryo_slab = cryo_file[key].astype(np.float64)
 
         max_abs = float(np.max(np.abs(wrf_slab - cryo_slab)))
         wrf_mean = float(np.mean(np.abs(wrf_slab)))
@@ -151,10 +87,10 @@ def compare_file_pair(
     return n_identical, n_different, cryo_only
 
 
-def print_snow_stats(fields: list[WRFField]) -> None:
+def print_snow_stats(fields: list[tuple[IntermediateField, np.ndarray]]) -> None:
     """Print basic statistics for SNOW and SNOWH fields."""
-    for f in fields:
-        slab = f.slab.astype(np.float64)
+    for f, slab in fields:
+        slab = slab.astype(np.float64)
         nonzero = slab[slab > 0]
         print(
             f"  {f.field_name:<8} ({f.units})"
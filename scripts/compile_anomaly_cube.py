@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""compile_anomaly_cube.py
+
+Compile the interpolated CMIP6 anomalies of every time of year into an anomaly cube.
+
+The monthly anomalies (the CC-signal files, or the anomaly pack if
+``anomaly_pack`` is set) are interpolated to every output time of a common
+and of a leap year, over the domain window of the profile and with its
+``precision``, exactly as the writers do (see
+:func:`pgw4era.anomalies.compile_anomaly_cube`).  Set ``anomaly_mode = "doy"``
+and ``anomaly_cube`` in the profile to have the writers read the cube.
+
+Usage
+-----
+    python scripts/compile_anomaly_cube.py --config pgw4era.toml --profile wrf
+    python scripts/compile_anomaly_cube.py --config pgw4era.toml --profile wrf \
+        --output /data/CMIP6/anomaly_cube.bin
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compile the interpolated CMIP6 anomalies into an anomaly cube.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--config", default="pgw4era.toml", help="Path to TOML config file.")
+    parser.add_argument("--profile", default="wrf", help="Profile name in the TOML config.")
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Path of the cube (default: anomaly_cube of the profile, or "
+        "<CMIP6anom_dir>/anomaly_cube.bin).",
+    )
+    parser.add_argument("--freq-hours", type=int, default=3, help="Hours between the output times.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    import netCDF4 as nc
+
+    from pgw4era.anomalies import compile_anomaly_cube
+    from pgw4era.config import load_config
+    from pgw4era.domain import domain_window
+
+    cfg = load_config(args.config, args.profile)
+    output = args.output or cfg.anomaly_cube or f"{cfg.CMIP6anom_dir}/anomaly_cube.bin"
+
+    # The window the writers process, from the ERA5 reference grid
+    with nc.Dataset(f"{cfg.ERA5netcdf_dir}/{cfg.ERA5_sfc_ref_file}") as file_ref:
+        lat, lon = file_ref["latitude"][:], file_ref["longitude"][:]
+    window = domain_window(cfg, lat, lon)
+    if window is not None:
+        lat, lon = window.coords(lat, lon)
+
+    ctime = time.time()
+    path = compile_anomaly_cube(cfg, output, window, args.freq_hours, (lat, lon))
+    print(f"Anomaly cube written to {path} in {time.time() - ctime:0.2f} seconds")
+    if cfg.anomaly_mode != "doy" or str(path) != str(cfg.anomaly_cube):
+        print(f'Set anomaly_mode = "doy" and anomaly_cube = "{path}" in the profile to use it')
+
+
+if __name__ == "__main__":
+    main()
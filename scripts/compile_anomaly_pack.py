@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""compile_anomaly_pack.py
+
+Compile the CMIP6 CC-signal files into an anomaly pack for the writers.
+
+The ``*_CC_signal_pinterp.nc`` (3-D) and ``*_CC_signal.nc`` (2-D) files of
+the configured variables are written into one float32 file in ERA5 level
+order, with missing values set to zero (see
+:func:`pgw4era.anomalies.compile_anomaly_pack`).  Set ``anomaly_pack`` in the
+profile to the pack to have the writers memory-map it.
+
+Usage
+-----
+    python scripts/compile_anomaly_pack.py --config pgw4era.toml --profile wrf
+    python scripts/compile_anomaly_pack.py --config pgw4era.toml --profile wrf \
+        --output /data/CMIP6/anomaly_pack.bin
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compile the CMIP6 CC-signal files into an anomaly pack.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--config", default="pgw4era.toml", help="Path to TOML config file.")
+    parser.add_argument("--profile", default="wrf", help="Profile name in the TOML config.")
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Path of the pack (default: anomaly_pack of the profile, or "
+        "<CMIP6anom_dir>/anomaly_pack.bin).",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    from pgw4era.anomalies import compile_anomaly_pack
+    from pgw4era.config import load_config
+
+    cfg = load_config(args.config, args.profile)
+    output = args.output or cfg.anomaly_pack or f"{cfg.CMIP6anom_dir}/anomaly_pack.bin"
+
+    ctime = time.time()
+    path = compile_anomaly_pack(cfg, output)
+    print(f"Anomaly pack written to {path} in {time.time() - ctime:0.2f} seconds")
+    if cfg.anomaly_pack is None or str(path) != str(cfg.anomaly_pack):
+        print(f'Set anomaly_pack = "{path}" in the profile to use it')
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ Usage
     python scripts/run_pgw.py --config pgw4era.toml --profile wrf
     python scripts/run_pgw.py --config pgw4era.toml --profile cryowrf
     python scripts/run_pgw.py --config pgw4era.toml --profile cryowrf --overwrite
+    python scripts/run_pgw.py --config pgw4era.toml --profile wrf --workers 32
 """
 
 from __future__ import annotations
@@ -38,6 +39,17 @@ def parse_args() -> argparse.Namespace:
         default=False,
         help="Overwrite existing output files.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes; ERA5 days are distributed over a process pool.",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Overlap reading, blending and writing with reader/writer threads (single process).",
+    )
     return parser.parse_args()
 
 
@@ -51,7 +63,7 @@ def main() -> None:
     if args.profile == "wrf":
         from pgw4era.wrf.write_intermediate import run
 
-        run(cfg, overwrite_file=args.overwrite)
+        run(cfg, overwrite_file=args.overwrite, workers=args.workers, pipeline=args.pipeline)
 
     elif args.profile == "cryowrf":
         one_timestep = getattr(cfg, "one_timestep_files", False)
@@ -59,7 +71,7 @@ def main() -> None:
             from pgw4era.cryowrf.write_intermediate_onetimestep import run
         else:
             from pgw4era.cryowrf.write_intermediate import run
-        run(cfg, overwrite_file=args.overwrite)
+        run(cfg, overwrite_file=args.overwrite, workers=args.workers, pipeline=args.pipeline)
 
 
 if __name__ == "__main__":
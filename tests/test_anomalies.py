@@ -0,0 +1,368 @@
+"""Tests for pgw4era.anomalies."""
+
+import datetime as dt
+from pathlib import Path
+from types import SimpleNamespace
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from pgw4era.anomalies import (
+    AnomalyCube,
+    AnomalyPack,
+    AnomalyStore,
+    SharedAnomalyStore,
+    anomaly_path,
+    compile_anomaly_cube,
+    compile_anomaly_pack,
+    open_anomalies,
+)
+from pgw4era.blend import Blender
+from pgw4era.domain import GridWindow
+from pgw4era.utils import calc_interp_weights, compute_dtype
+
+NLEV, NLAT, NLON = 4, 3, 5
+# Global grid of the CC-signal files
+LAT = np.array([90.0, 0.0, -90.0])
+LON = np.arange(NLON) * 72.0
+
+
+def _write_anomaly(path: Path, var: str, is3d: bool) -> np.ndarray:
+    """Write a synthetic 12-month CC-signal file and return its data."""
+    shape = (12, NLEV, NLAT, NLON) if is3d else (12, NLAT, NLON)
+    data = np.arange(np.prod(shape), dtype="float32").reshape(shape)
+    with nc.Dataset(path, "w") as ds:
+        ds.createDimension("time", 12)
+        dims = ["time"]
+        if is3d:
+            ds.createDimension("plev", NLEV)
+            dims.append("plev")
+        ds.createDimension("lat", NLAT)
+        ds.createDimension("lon", NLON)
+        dims += ["lat", "lon"]
+        ds.createVariable("lat", "f8", ["lat"])[:] = LAT
+        ds.createVariable("lon", "f8", ["lon"])[:] = LON
+        ds.createVariable(var, "f4", dims)[:] = data
+    return data
+
+
+@pytest.fixture()
+def cfg(tmp_path: Path) -> SimpleNamespace:
+    cfg = SimpleNamespace(
+        CMIP6anom_dir=str(tmp_path),
+        periods=[[2004, 2023], [2031, 2050]],
+        experiments=["historical", "ssp585"],
+        variables_3d=["ta", "hur"],
+        variables_2d=["tas"],
+        anomaly_cache_mb=None,
+    )
+    cfg.data = {}
+    for var in cfg.variables_3d:
+        cfg.data[var] = _write_anomaly(Path(anomaly_path(cfg, var, True)), var, True)
+    for var in cfg.variables_2d:
+        cfg.data[var] = _write_anomaly(Path(anomaly_path(cfg, var, False)), var, False)
+    return cfg
+
+
+class TestAnomalyPath:
+    def test_3d_uses_pinterp_file(self, cfg):
+        path = anomaly_path(cfg, "ta", True)
+        assert path.endswith("ta_2004-2023_2031-2050_historical-ssp585_CC_signal_pinterp.nc")
+
+    def test_2d_uses_signal_file(self, cfg):
+        path = anomaly_path(cfg, "tas", False)
+        assert path.endswith("tas_2004-2023_2031-2050_historical-ssp585_CC_signal.nc")
+
+    def test_statistic_selects_files(self, cfg):
+        cfg.cc_signal_statistic = "q90"
+        assert anomaly_path(cfg, "ta", True).endswith("_CC_signal_q90_pinterp.nc")
+        assert anomaly_path(cfg, "tas", False).endswith("_CC_signal_q90.nc")
+
+
+class TestAnomalyStore:
+    def test_3d_levels_reversed(self, cfg):
+        with AnomalyStore.from_config(cfg) as store:
+            np.testing.assert_array_equal(store.month("ta", 3), cfg.data["ta"][3, ::-1])
+
+    def test_2d_values(self, cfg):
+        with AnomalyStore.from_config(cfg) as store:
+            np.testing.assert_array_equal(store.month("tas", 11), cfg.data["tas"][11])
+
+    def test_window(self, cfg):
+        window = GridWindow(slice(1, 3), (slice(3, 5), slice(0, 1)))
+        with AnomalyStore.from_config(cfg, window) as store:
+            expected = cfg.data["ta"][5, ::-1, 1:3][..., [3, 4, 0]]
+            np.testing.assert_array_equal(store.month("ta", 5), expected)
+            expected = cfg.data["tas"][5, 1:3][..., [3, 4, 0]]
+            np.testing.assert_array_equal(store.month("tas", 5), expected)
+
+    def test_month_read_once(self, cfg):
+        """Repeated requests for a cached month must not touch the files again."""
+        with AnomalyStore.from_config(cfg) as store:
+            for _ in range(5):
+                for var in ("ta", "hur", "tas"):
+                    store.month(var, 0)
+                    store.month(var, 1)
+            assert store.nreads == 2
+
+    def test_unbounded_keeps_whole_cycle(self, cfg):
+        with AnomalyStore.from_config(cfg) as store:
+            for month in range(12):
+                store.month("ta", month)
+            assert store.max_months == 12
+            assert len(store.cached_months) == 12
+
+    def test_budget_evicts_least_recently_used(self, cfg):
+        cfg.anomaly_cache_mb = 0
+        with AnomalyStore.from_config(cfg) as store:
+            assert store.max_months == 2
+            store.month("ta", 0)
+            store.month("ta", 1)
+            store.month("ta", 0)
+            store.month("ta", 2)
+            assert store.cached_months == [0, 2]
+            np.testing.assert_array_equal(store.month("tas", 1), cfg.data["tas"][1])
+            assert store.nreads == 4
+
+    @pytest.mark.parametrize("precision", ["float32", "float64"])
+    def test_masked_values_returned_as_nan(self, cfg, precision):
+        cfg.precision = precision
+        path = anomaly_path(cfg, "tas", False)
+        with nc.Dataset(path, "a") as ds:
+            ds.variables["tas"][2, 1, 1] = np.ma.masked
+        with AnomalyStore.from_config(cfg) as store:
+            field = store.month("tas", 2)
+            assert not np.ma.isMaskedArray(field)
+            assert field.dtype == np.float32
+            assert np.isnan(field[1, 1])
+            assert np.isnan(field).sum() == 1
+
+    def test_missing_file_raises(self, cfg):
+        cfg.variables_2d = ["psl"]
+        with pytest.raises(FileNotFoundError):
+            AnomalyStore.from_config(cfg)
+
+
+class TestSharedAnomalyStore:
+    def test_matches_file_store(self, cfg):
+        with AnomalyStore.from_config(cfg) as store:
+            with SharedAnomalyStore.from_store(store) as shared:
+                for month in range(12):
+                    for var in ("ta", "hur", "tas"):
+                        np.testing.assert_array_equal(
+                            shared.month(var, month), store.month(var, month)
+                        )
+
+    def test_attach_sees_owner_data(self, cfg):
+        with AnomalyStore.from_config(cfg) as store:
+            shared = SharedAnomalyStore.from_store(store)
+        try:
+            attached = SharedAnomalyStore.attach(shared.handle)
+            np.testing.assert_array_equal(attached.month("ta", 5), cfg.data["ta"][5, ::-1])
+            attached.close()
+        finally:
+            shared.close()
+
+    def test_months_read_only(self, cfg):
+        with AnomalyStore.from_config(cfg) as store:
+            with SharedAnomalyStore.from_store(store) as shared:
+                with pytest.raises(ValueError):
+                    shared.month("tas", 0)[0, 0] = 1.0
+
+
+@pytest.fixture()
+def pack(cfg, tmp_path):
+    cfg.anomaly_pack = str(compile_anomaly_pack(cfg, tmp_path / "anomaly_pack.bin"))
+    return cfg
+
+
+class TestAnomalyPack:
+    def test_matches_file_store(self, pack):
+        with AnomalyStore.from_config(pack) as store, AnomalyPack.from_config(pack) as packed:
+            assert packed.vars3d == ["ta", "hur"] and packed.vars2d == ["tas"]
+            for month in range(12):
+                for var in ("ta", "hur", "tas"):
+                    field = packed.month(var, month)
+                    assert field.dtype == np.float32 and field.flags.c_contiguous
+                    np.testing.assert_array_equal(field, store.month(var, month))
+
+    def test_months_are_read_only_views(self, pack):
+        with AnomalyPack.from_config(pack) as packed:
+            field = packed.month("ta", 4)
+            assert np.shares_memory(field, packed._fields["ta"])
+            assert not field.flags.writeable
+            with pytest.raises(ValueError):
+                field[0, 0, 0] = 1.0
+
+    def test_window(self, pack):
+        window = GridWindow(slice(1, 3), (slice(3, 5), slice(0, 1)))
+        with AnomalyPack.from_config(pack, window) as packed:
+            expected = pack.data["ta"][5, ::-1, 1:3][..., [3, 4, 0]]
+            np.testing.assert_array_equal(packed.month("ta", 5), expected)
+
+    def test_missing_values_zero(self, cfg, tmp_path):
+        with nc.Dataset(anomaly_path(cfg, "tas", False), "a") as ds:
+            ds.variables["tas"][2, 1, 1] = np.ma.masked
+        cfg.anomaly_pack = str(compile_anomaly_pack(cfg, tmp_path / "anomaly_pack.bin"))
+        with AnomalyPack.from_config(cfg) as packed:
+            assert packed.month("tas", 2)[1, 1] == 0.0
+            assert np.count_nonzero(packed.month("tas", 2)) == NLAT * NLON - 1
+
+    def test_attach(self, pack):
+        with AnomalyPack.from_config(pack) as packed:
+            with AnomalyPack.attach(packed.handle) as attached:
+                np.testing.assert_array_equal(attached.month("hur", 7), packed.month("hur", 7))
+
+    def test_open_anomalies(self, cfg, pack):
+        with open_anomalies(pack) as anoms:
+            assert isinstance(anoms, AnomalyPack)
+        pack.anomaly_pack = None
+        with open_anomalies(pack) as anoms:
+            assert isinstance(anoms, AnomalyStore)
+
+    def test_stale_or_incomplete_pack_rejected(self, pack):
+        pack.variables_2d = ["tas", "psl"]
+        with pytest.raises(ValueError, match="lacks psl; recompile"):
+            AnomalyPack.from_config(pack)
+        pack.variables_2d = ["tas"]
+        with nc.Dataset(anomaly_path(pack, "tas", False), "a") as ds:
+            ds.variables["tas"][0, 0, 0] = -1.0
+        with pytest.raises(ValueError, match="older than the CC signal of tas"):
+            AnomalyPack.from_config(pack)
+
+    def test_missing_pack_or_bad_file(self, cfg, tmp_path):
+        cfg.anomaly_pack = str(tmp_path / "missing.bin")
+        with pytest.raises(FileNotFoundError, match="compile_anomaly_pack.py"):
+            AnomalyPack.from_config(cfg)
+        (tmp_path / "other.bin").write_bytes(b"not a pack")
+        with pytest.raises(ValueError, match="not an anomaly pack"):
+            AnomalyPack(tmp_path / "other.bin")
+
+
+def _exact_anomaly(store, var, time, precision):
+    """The anomaly of *var* at *time* as blended by the writers in the exact mode."""
+    w = calc_interp_weights([time])[0]
+    single = w["nearest"] == 0 if var in store.vars3d else w["exact"]
+    a1 = store.month(var, int(w["i1"]))
+    a2 = None if single else store.month(var, int(w["i2"]))
+    out = np.empty(a1.shape, dtype="float32")
+    return Blender(compute_dtype(precision)).blend(out, np.zeros(a1.shape), a1, a2, w["weight"])
+
+
+TIMES = [
+    dt.datetime(1999, 1, 1, 0),
+    dt.datetime(2009, 1, 15, 12),
+    dt.datetime(2009, 2, 14, 3),
+    dt.datetime(2012, 2, 29, 21),
+    dt.datetime(2012, 3, 10, 6),
+    dt.datetime(2013, 3, 10, 6),
+    dt.datetime(2100, 7, 16, 0),
+    dt.datetime(2000, 12, 31, 21),
+]
+
+
+@pytest.fixture()
+def cube(cfg, tmp_path):
+    cfg.anomaly_mode = "doy"
+    cfg.anomaly_cube = str(compile_anomaly_cube(cfg, tmp_path / "anomaly_cube.bin"))
+    return cfg
+
+
+class TestAnomalyCube:
+    def test_matches_exact_mode(self, cube):
+        with AnomalyStore.from_config(cube) as store, AnomalyCube.from_config(cube) as anoms:
+            for time in TIMES:
+                for var in ("ta", "hur", "tas"):
+                    field = anoms.field(var, time)
+                    assert field.dtype == np.float32 and not field.flags.writeable
+                    expected = _exact_anomaly(store, var, time, "float32")
+                    np.testing.assert_array_equal(field, expected)
+
+    def test_float64_bound(self, cube, tmp_path):
+        cube.precision = "float64"
+        compile_anomaly_cube(cube, cube.anomaly_cube)
+        with AnomalyStore.from_config(cube) as store, AnomalyCube.from_config(cube) as anoms:
+            for time in TIMES:
+                w = calc_interp_weights([time])[0]
+                if w["exact"] or w["nearest"] == 0:
+                    continue
+                a1, a2 = store.month("ta", int(w["i1"])), store.month("ta", int(w["i2"]))
+                exact = a1 + (a2 - a1) * w["weight"]
+                diff = np.abs(anoms.field("ta", time) - exact)
+                assert np.all(diff <= 2.0**-24 * np.abs(exact))
+
+    def test_calendars_share_slots(self, cube):
+        with AnomalyCube.from_config(cube) as anoms:
+            # Leap and common years only differ between mid-January and mid-March
+            assert anoms.slot(dt.datetime(2012, 7, 1)) == anoms.slot(dt.datetime(2013, 7, 1))
+            assert anoms.slot(dt.datetime(2012, 2, 1)) != anoms.slot(dt.datetime(2013, 2, 1))
+            assert anoms.slot(dt.datetime(1990, 5, 5, 9)) == anoms.slot(dt.datetime(2050, 5, 5, 9))
+            assert anoms.header["slots"] < 2 * 365 * 8
+
+    def test_off_grid_time(self, cube):
+        with AnomalyCube.from_config(cube) as anoms:
+            with pytest.raises(ValueError, match="3-hourly grid"):
+                anoms.slot(dt.datetime(2009, 1, 1, 4))
+
+    def test_window(self, cfg, tmp_path):
+        window = GridWindow(slice(1, 3), (slice(3, 5), slice(0, 1)))
+        cfg.anomaly_cube = str(compile_anomaly_cube(cfg, tmp_path / "cube.bin", window))
+        with AnomalyStore.from_config(cfg, window) as store:
+            with AnomalyCube.from_config(cfg, window) as anoms:
+                expected = _exact_anomaly(store, "ta", TIMES[1], "float32")
+                np.testing.assert_array_equal(anoms.field("ta", TIMES[1]), expected)
+        with pytest.raises(ValueError, match="another domain window"):
+            AnomalyCube.from_config(cfg)
+
+    def test_precision_mismatch(self, cube):
+        cube.precision = "float64"
+        with pytest.raises(ValueError, match="compiled for precision 'float32'"):
+            AnomalyCube.from_config(cube)
+
+    def test_open_anomalies(self, cube):
+        with open_anomalies(cube) as anoms:
+            assert isinstance(anoms, AnomalyCube)
+        cube.anomaly_mode = "monthly"
+        with pytest.raises(ValueError, match="Unknown anomaly_mode"):
+            open_anomalies(cube)
+
+
+class TestGrid:
+    """The CC signal must be on the ERA5 grid the writers process."""
+
+    WINDOW = GridWindow(slice(1, 3), (slice(3, 5), slice(0, 1)))
+
+    def test_global_grid_and_window(self, cfg, tmp_path):
+        with open_anomalies(cfg, None, (LAT, LON)):
+            pass
+        grid = self.WINDOW.coords(LAT, LON)
+        with AnomalyStore.from_config(cfg, self.WINDOW, grid) as store:
+            assert store.month("tas", 0).shape == (2, 3)
+        cfg.anomaly_pack = str(compile_anomaly_pack(cfg, tmp_path / "anomaly_pack.bin"))
+        with open_anomalies(cfg, self.WINDOW, grid) as anoms:
+            assert isinstance(anoms, AnomalyPack)
+
+    def test_regional_era5_grid_rejected(self, cfg, tmp_path):
+        """Regional ERA5 files with a global CC signal would read the wrong points."""
+        # ERA5 downloaded for the area of the window, and the window of that grid
+        era5_lat, era5_lon = self.WINDOW.coords(LAT, LON)
+        window = GridWindow(slice(0, 2), (slice(0, 3),))
+        grid = window.coords(era5_lat, era5_lon)
+        with pytest.raises(ValueError, match="does not match the ERA5 grid.*other coordinates"):
+            AnomalyStore.from_config(cfg, window, grid)
+        with pytest.raises(ValueError, match=r"3 x 5 points, not 2 x 3"):
+            open_anomalies(cfg, None, grid)
+
+        cube = tmp_path / "anomaly_cube.bin"
+        with pytest.raises(ValueError, match="does not match the ERA5 grid"):
+            compile_anomaly_cube(cfg, cube, window, grid=grid)
+        assert not cube.exists() and not cube.with_name(f"{cube.name}.part").exists()
+
+        cfg.anomaly_pack = str(compile_anomaly_pack(cfg, tmp_path / "anomaly_pack.bin"))
+        with pytest.raises(ValueError, match="does not match the ERA5 grid"):
+            AnomalyPack.from_config(cfg, window, grid)
+        cfg.anomaly_mode = "doy"
+        cfg.anomaly_cube = str(compile_anomaly_cube(cfg, cube, window))
+        with pytest.raises(ValueError, match="does not match the ERA5 grid"):
+            open_anomalies(cfg, window, grid)
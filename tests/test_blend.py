@@ -0,0 +1,85 @@
+"""Tests for pgw4era.blend."""
+
+import numpy as np
+import pytest
+
+from pgw4era.blend import Blender
+
+
+def _reference(era, anom_1, anom_2, weight, divisor, clip) -> np.ndarray:
+    """The plain NumPy expression the writers used before the fused kernel."""
+    if divisor is not None:
+        era = era / divisor
+    anom = anom_1 if anom_2 is None else anom_1 + (anom_2 - anom_1) * weight
+    temp = era + np.nan_to_num(anom)
+    if clip is not None:
+        temp = np.clip(temp, *clip)
+    return np.asarray(np.float32(temp))
+
+
+@pytest.mark.parametrize("masked", [True, False])
+@pytest.mark.parametrize("era_dtype", ["float32", "float64"])
+@pytest.mark.parametrize("single", [True, False])
+@pytest.mark.parametrize(("divisor", "clip"), [(None, None), (9.81, None), (None, (0, 100))])
+def test_bit_identical_to_plain_expression(masked, era_dtype, single, divisor, clip):
+    rng = np.random.default_rng(0)
+    shape = (4, 6, 7)
+    era = (rng.normal(size=shape) * 50 + 50).astype(era_dtype)
+    if masked:
+        era = np.ma.masked_array(era)
+    anom_1 = rng.normal(size=shape).astype("float32") * 10
+    anom_2 = None if single else rng.normal(size=shape).astype("float32") * 10
+    anom_1[0, 0, :3] = np.nan
+    weight = np.float64(0.37)
+
+    out = np.empty(shape, dtype="float32")
+    Blender().blend(out, era, anom_1, anom_2, weight, divisor, clip)
+
+    expected = _reference(era, anom_1, anom_2, weight, divisor, clip)
+    np.testing.assert_array_equal(out.view("u4"), expected.view("u4"))
+
+
+def test_batch_of_timesteps():
+    rng = np.random.default_rng(1)
+    era = rng.normal(size=(3, 5, 6)) * 100
+    anom_1 = rng.normal(size=(5, 6)).astype("float32")
+    anom_2 = rng.normal(size=(5, 6)).astype("float32")
+    weights = np.array([0.1, 0.5, 0.9])
+
+    out = np.empty(era.shape, dtype="float32")
+    Blender().blend(out, era, anom_1, anom_2, weights)
+
+    for nt, weight in enumerate(weights):
+        expected = _reference(era[nt], anom_1, anom_2, np.float64(weight), None, None)
+        np.testing.assert_array_equal(out[nt], expected)
+
+
+def test_scratch_reused_and_output_slot_filled():
+    rng = np.random.default_rng(2)
+    blender = Blender()
+    fields = np.zeros((2, 5, 6), dtype="float32")
+    for nf in range(2):
+        era = rng.normal(size=(5, 6))
+        anom = rng.normal(size=(5, 6)).astype("float32")
+        slot = fields[nf]
+        assert blender.blend(slot, era, anom) is slot
+        np.testing.assert_array_equal(fields[nf], np.float32(era + anom))
+    assert len(blender._scratch) == 1
+
+
+def test_float32_working_dtype():
+    rng = np.random.default_rng(3)
+    era = rng.normal(size=(4, 5, 6)).astype("float32") * 1000 + 50000
+    anom_1 = rng.normal(size=(4, 5, 6)).astype("float32")
+    anom_2 = rng.normal(size=(4, 5, 6)).astype("float32")
+    anom_2[1, 2, 3] = np.nan
+    weight = np.float64(0.25)
+
+    blender = Blender("float32")
+    out = np.empty(era.shape, dtype="float32")
+    blender.blend(out, era, anom_1, anom_2, weight, divisor=9.81)
+
+    expected = _reference(era, anom_1, anom_2, weight, 9.81, None)
+    np.testing.assert_allclose(out, expected, rtol=1e-6)
+    # Only the divided field needs scratch: the float32 output is the work buffer
+    assert [buf.dtype for buf in blender._scratch.values()] == [np.float32]
@@ -0,0 +1,139 @@
+"""Tests for pgw4era.climatology."""
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from pgw4era.climatology import MonthlyClimatology, accumulate, file_years, write_delta
+
+
+def _series(path, start, end, varname="ta", seed=0, nlev=2):
+    """Write a monthly CMIP6-like file from *start* to *end* (YYYY-MM)."""
+    time = pd.date_range(f"{start}-01", f"{end}-01", freq="MS") + pd.Timedelta(days=14)
+    rng = np.random.default_rng(seed)
+    data = (250.0 + 10.0 * rng.random((len(time), nlev, 3, 4))).astype("float32")
+    ds = xr.Dataset(
+        {varname: (("time", "plev", "lat", "lon"), data, {"units": "K"})},
+        coords={
+            "time": time,
+            "plev": [85000.0, 50000.0][:nlev],
+            "lat": [-30.0, 0.0, 30.0],
+            "lon": [0.0, 90.0, 180.0, 270.0],
+        },
+    )
+    ds.to_netcdf(path)
+    return path
+
+
+@pytest.fixture()
+def files(tmp_path):
+    hist = _series(
+        tmp_path / "ta_Amon_M_historical_r1i1p1f1_gn_200001-201412.nc", "2000-01", "2014-12"
+    )
+    scen = _series(
+        tmp_path / "ta_Amon_M_ssp585_r1i1p1f1_gn_201501-202012.nc", "2015-01", "2020-12", seed=1
+    )
+    return hist, scen
+
+
+def _reference(hist, scen, syear, eyear):
+    """The former xarray implementation (without the valid-range masks)."""
+    fin_h = xr.open_dataset(hist).sel(time=slice(str(syear), str(eyear)))
+    fin_s = xr.open_dataset(scen)
+    fin_s = fin_s.where(fin_s.ta != 0.0).sel(time=slice(str(syear), str(eyear)))
+    fin = xr.concat([fin_h, fin_s], dim="time")
+    return fin.groupby("time.month").mean("time", skipna=False).ta.values
+
+
+def test_file_years():
+    assert file_years("ta_Amon_M_ssp585_r1i1p1f1_gn_201501-210012.nc") == (2015, 2100)
+    assert file_years("ta_M_delta.nc") is None
+
+
+def test_matches_groupby_mean(files):
+    hist, scen = files
+    climatology = MonthlyClimatology("ta", 2010, 2019)
+    assert climatology.add_file(hist) == 60
+    assert climatology.add_file(scen, mask_zero=True) == 60
+    assert climatology.missing_months() == []
+    np.testing.assert_allclose(climatology.mean(), _reference(hist, scen, 2010, 2019), rtol=1e-6)
+
+
+def test_missing_values_propagate(files, tmp_path):
+    hist, scen = files
+    with xr.open_dataset(scen) as ds:
+        ds = ds.load()
+    ds.ta[2, 0, 1, 1] = 0.0  # 2015-03, masked in scenario files
+    ds.ta[4, 1, 0, 0] = 500.0  # 2015-05, outside the valid range of ta
+    ds.to_netcdf(tmp_path / "edited_201501-202012.nc")
+
+    climatology = MonthlyClimatology("ta", 2010, 2019)
+    climatology.add_file(hist)
+    climatology.add_file(tmp_path / "edited_201501-202012.nc", mask_zero=True)
+    mean = climatology.mean()
+    assert np.isnan(mean[2, 0, 1, 1]) and np.isnan(mean[4, 1, 0, 0])
+    assert np.isfinite(mean).sum() == mean.size - 2
+
+
+def test_files_outside_period_not_opened(files, tmp_path):
+    hist, _ = files
+    (tmp_path / "ta_corrupt_190001-194912.nc").write_bytes(b"not netCDF")
+    climatology = MonthlyClimatology("ta", 2010, 2014)
+    assert climatology.add_file(tmp_path / "ta_corrupt_190001-194912.nc") == 0
+    climatology.add_file(hist)
+    assert climatology.missing_months() == []
+
+
+def test_missing_months_and_grid_mismatch(files, tmp_path):
+    hist, _ = files
+    climatology = MonthlyClimatology("ta", 2010, 2015)
+    climatology.add_file(hist)
+    assert climatology.missing_months() == [(2015, month) for month in range(1, 13)]
+    other = _series(tmp_path / "ta_other_201501-201512.nc", "2015-01", "2015-12", nlev=1)
+    with pytest.raises(ValueError, match="has shape"):
+        climatology.add_file(other)
+
+
+def test_to_netcdf(files, tmp_path):
+    hist, scen = files
+    climatology = MonthlyClimatology("ta", 2012, 2016)
+    climatology.add_file(hist)
+    climatology.add_file(scen, mask_zero=True)
+    climatology.to_netcdf(tmp_path / "ta_clim.nc")
+
+    assert not list(tmp_path.glob("*.part"))
+    with xr.open_dataset(tmp_path / "ta_clim.nc") as ds:
+        assert ds.ta.dims == ("month", "plev", "lat", "lon")
+        assert ds.ta.dtype == np.float32 and ds.ta.attrs["units"] == "K"
+        np.testing.assert_array_equal(ds.month, np.arange(1, 13))
+        np.testing.assert_array_equal(ds.plev, [85000.0, 50000.0])
+        np.testing.assert_allclose(ds.ta.values, _reference(hist, scen, 2012, 2016), rtol=1e-6)
+
+
+def test_accumulate_periods_in_one_scan(files):
+    hist, scen = files
+    periods = [(2001, 2010), (2008, 2017), (2016, 2020)]
+    climatologies = [MonthlyClimatology("ta", *period) for period in periods]
+    # Every month of 2001-2020 is read once, also those in two periods
+    assert accumulate(hist, climatologies) == 14 * 12
+    assert accumulate(scen, climatologies, mask_zero=True) == 6 * 12
+    for period, climatology in zip(periods, climatologies):
+        assert climatology.missing_months() == []
+        np.testing.assert_allclose(climatology.mean(), _reference(hist, scen, *period), rtol=1e-6)
+
+
+def test_write_delta(files, tmp_path):
+    hist, scen = files
+    present, future = MonthlyClimatology("ta", 2005, 2009), MonthlyClimatology("ta", 2016, 2020)
+    for path, mask_zero in ((hist, False), (scen, True)):
+        accumulate(path, [present, future], mask_zero)
+    write_delta(future, present, tmp_path / "ta_delta.nc")
+
+    with xr.open_dataset(tmp_path / "ta_delta.nc") as ds:
+        assert ds.ta.dims == ("time", "plev", "lat", "lon")
+        np.testing.assert_array_equal(
+            ds.time, pd.date_range("2005-01-01", periods=12, freq="MS").values
+        )
+        expected = _reference(hist, scen, 2016, 2020) - _reference(hist, scen, 2005, 2009)
+        np.testing.assert_allclose(ds.ta.values, expected, atol=1e-4)
@@ -0,0 +1,171 @@
+"""Tests for pgw4era.compare."""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from pgw4era.compare import compare_dirs, compare_files, slab_stats
+from pgw4era.intermediate import FIELDS2D_WRF, FIELDS3D, write_intermediate
+
+PLVS = [100000.0, 85000.0, 50000.0]
+NLAT, NLON = 4, 6
+
+
+def _fields(seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    fields3d = rng.normal(size=(len(FIELDS3D), len(PLVS), NLAT, NLON)).astype("float32")
+    fields2d = rng.normal(size=(len(FIELDS2D_WRF), NLAT, NLON)).astype("float32")
+    return fields3d, fields2d
+
+
+def _write(path: Path, fields3d: np.ndarray, fields2d: np.ndarray, plvs=PLVS) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_intermediate(path, plvs, fields3d, fields2d, "2009-06-01_00", 45.0, -10.0, 0.3, -0.3)
+
+
+def _dirs(tmp_path: Path, nfiles: int = 3) -> tuple[Path, Path]:
+    ref, new = tmp_path / "ref", tmp_path / "new"
+    for hour in range(nfiles):
+        fields = _fields(hour)
+        _write(ref / f"ERA5:2009-06-01_{hour:02d}", *fields)
+        _write(new / f"ERA5:2009-06-01_{hour:02d}", *fields)
+    return ref, new
+
+
+@pytest.mark.parametrize(("atol", "rtol"), [(0.0, 0.0), (0.05, 0.0), (0.0, 0.01), (0.01, 0.01)])
+def test_slab_stats_matches_numpy(atol, rtol, monkeypatch: pytest.MonkeyPatch):
+    # Small blocks so the slabs span several of them
+    monkeypatch.setattr("pgw4era.compare._BLOCK", 7)
+    rng = np.random.default_rng(0)
+    ref = rng.normal(size=(5, 9)).astype("float32")
+    new = ref + rng.normal(scale=0.01, size=ref.shape).astype("float32")
+
+    close, max_abs, mean_abs = slab_stats(ref, new, atol, rtol)
+
+    ref64, new64 = ref.astype("float64"), new.astype("float64")
+    max_expected = np.max(np.abs(ref64 - new64))
+    assert max_abs == max_expected
+    assert mean_abs == pytest.approx(np.mean(np.abs(ref64)))
+    assert close == (max_expected <= atol or np.allclose(ref64, new64, rtol, atol))
+
+
+def test_slab_stats_non_finite(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr("pgw4era.compare._BLOCK", 2)
+    ref = np.array([1.0, np.inf, 2.0], dtype="float32")
+    assert slab_stats(ref, ref.copy())[0]
+    new = np.array([1.0, np.nan, 5.0], dtype="float32")
+    close, max_abs, _ = slab_stats(ref, new, 1.0, 1.0)
+    assert not close
+    assert np.isnan(max_abs)
+
+
+class TestCompareFiles:
+    def test_identical(self, tmp_path: Path):
+        ref, new = _dirs(tmp_path, 1)
+        result = compare_files(ref / "ERA5:2009-06-01_00", new / "ERA5:2009-06-01_00")
+        assert result.ok
+        assert result.identical == len(FIELDS3D) * len(PLVS) + len(FIELDS2D_WRF)
+        assert result.different == 0
+
+    def test_tolerance(self, tmp_path: Path):
+        fields3d, fields2d = _fields()
+        _write(tmp_path / "ref", fields3d, fields2d)
+        fields3d[1, 2, 0, 0] += 0.5
+        _write(tmp_path / "new", fields3d, fields2d)
+
+        result = compare_files(tmp_path / "ref", tmp_path / "new")
+        assert result.different == 1
+        (diff,) = result.diffs
+        assert (diff.field, diff.xlvl) == (FIELDS3D[1][0], PLVS[2])
+        assert diff.max_abs == pytest.approx(0.5, rel=1e-6)
+        assert diff.max_rel > 0
+
+        assert compare_files(tmp_path / "ref", tmp_path / "new", atol=0.6).ok
+
+    def test_missing_and_extra_fields(self, tmp_path: Path):
+        fields3d, fields2d = _fields()
+        _write(tmp_path / "ref", fields3d, fields2d)
+        _write(tmp_path / "new", fields3d[:, :2], fields2d, PLVS[:1] + [70000.0])
+
+        result = compare_files(tmp_path / "ref", tmp_path / "new")
+        assert not result.ok
+        assert sorted(result.missing_fields) == sorted(
+            (name, PLVS[n]) for name, *_ in FIELDS3D for n in (1, 2)
+        )
+        assert sorted(result.extra_fields) == sorted((name, 70000.0) for name, *_ in FIELDS3D)
+        assert result.different == 0
+
+    def test_fail_fast(self, tmp_path: Path):
+        fields3d, fields2d = _fields()
+        _write(tmp_path / "ref", fields3d, fields2d)
+        _write(tmp_path / "new", fields3d + 1, fields2d + 1)
+
+        assert compare_files(tmp_path / "ref", tmp_path / "new").different > 1
+        result = compare_files(tmp_path / "ref", tmp_path / "new", fail_fast=True)
+        assert result.different == 1
+
+    def test_unreadable_file(self, tmp_path: Path):
+        ref, new = _dirs(tmp_path, 1)
+        path = new / "ERA5:2009-06-01_00"
+        path.write_bytes(path.read_bytes()[:-10])
+        result = compare_files(ref / path.name, path)
+        assert not result.ok
+        assert result.error.startswith("ValueError")
+
+
+class TestCompareDirs:
+    def test_identical(self, tmp_path: Path):
+        ref, new = _dirs(tmp_path)
+        seen = []
+        report = compare_dirs(ref, new, progress=lambda result: seen.append(result.name))
+        assert report.ok
+        assert report.different == 0
+        assert seen == [f"ERA5:2009-06-01_{hour:02d}" for hour in range(3)]
+
+    def test_missing_files(self, tmp_path: Path):
+        ref, new = _dirs(tmp_path)
+        (new / "ERA5:2009-06-01_01").rename(new / "ERA5:2009-06-01_05")
+        report = compare_dirs(ref, new)
+        assert not report.ok
+        assert report.missing_files == ["ERA5:2009-06-01_01"]
+        assert report.extra_files == ["ERA5:2009-06-01_05"]
+        assert len(report.files) == 2
+
+    def test_fail_fast(self, tmp_path: Path):
+        ref, new = _dirs(tmp_path)
+        for hour in (1, 2):
+            fields3d, fields2d = _fields(hour)
+            _write(new / f"ERA5:2009-06-01_{hour:02d}", fields3d * 2, fields2d)
+
+        report = compare_dirs(ref, new, fail_fast=True)
+        assert report.stopped_early
+        assert [result.name for result in report.files] == [
+            "ERA5:2009-06-01_00",
+            "ERA5:2009-06-01_01",
+        ]
+        assert report.different == 1
+
+    def test_workers(self, tmp_path: Path):
+        ref, new = _dirs(tmp_path)
+        fields3d, fields2d = _fields(1)
+        _write(new / "ERA5:2009-06-01_01", fields3d, fields2d * 2)
+
+        serial = compare_dirs(ref, new)
+        parallel = compare_dirs(ref, new, workers=2)
+        assert parallel == serial
+        assert parallel.different == len(FIELDS2D_WRF)
+
+    def test_json_report(self, tmp_path: Path):
+        ref, new = _dirs(tmp_path)
+        fields3d, fields2d = _fields(2)
+        fields2d[0, 0, 0] = np.nan
+        _write(new / "ERA5:2009-06-01_02", fields3d, fields2d)
+
+        summary = json.loads(json.dumps(compare_dirs(ref, new).to_dict()))
+        assert not summary["ok"]
+        assert summary["fields_different"] == 1
+        (entry,) = summary["files"]
+        assert entry["name"] == "ERA5:2009-06-01_02"
+        assert entry["diffs"][0]["max_abs"] == "nan"
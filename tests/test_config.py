@@ -81,6 +81,44 @@ class TestLoadWrfProfile:
         cfg = load_config(toml_file, "wrf")
         assert cfg.models is None
 
+    def test_precision_defaults_to_float32(self, toml_file):
+        cfg = load_config(toml_file, "wrf")
+        assert cfg.precision == "float32"
+
+    def test_manifest_enabled_by_default(self, toml_file):
+        cfg = load_config(toml_file, "wrf")
+        assert cfg.manifest is True
+        assert cfg.manifest_checksums is False
+
+    def test_regrid_defaults(self, toml_file):
+        cfg = load_config(toml_file, "wrf")
+        assert cfg.regrid_method == "bilinear"
+        assert cfg.regrid_grid == "era5_grid"
+        assert cfg.regrid_cache_dir is None
+
+    def test_ensemble_defaults(self, toml_file):
+        cfg = load_config(toml_file, "wrf")
+        assert cfg.ensemble_statistics == ["mean"]
+        assert cfg.ensemble_weights is None
+        assert cfg.ensemble_max_missing == 1.0
+        assert cfg.cc_signal_statistic == "mean"
+
+    def test_anomaly_pack_disabled_by_default(self, toml_file):
+        cfg = load_config(toml_file, "wrf")
+        assert cfg.anomaly_pack is None
+        assert cfg.anomaly_mode == "exact"
+        assert cfg.anomaly_cube is None
+
+    def test_era5_grib_dir_defaults_to_cwd(self, toml_file):
+        cfg = load_config(toml_file, "wrf")
+        assert cfg.ERA5grib_dir == "."
+
+    def test_pinterp_defaults(self, toml_file):
+        cfg = load_config(toml_file, "wrf")
+        assert cfg.pinterp_method == "linear"
+        assert cfg.pinterp_below == "linear"
+        assert cfg.pinterp_above == "linear"
+
 
 class TestLoadCryowrfProfile:
     def test_cryowrf_specific_keys(self, toml_file):
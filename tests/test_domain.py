@@ -0,0 +1,206 @@
+"""Tests for pgw4era.domain."""
+
+from pathlib import Path
+from types import SimpleNamespace
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from pgw4era.domain import (
+    GridWindow,
+    domain_bounds,
+    domain_window,
+    geo_em_bounds,
+    namelist_bounds,
+    read_namelist,
+)
+
+# ERA5-like global grid: latitudes north to south, longitudes 0-360
+LAT = np.arange(90.0, -90.1, -3.0)
+LON = np.arange(0.0, 360.0, 3.0)
+
+
+class TestGridWindow:
+    def test_inside_grid(self):
+        window = GridWindow.from_bounds(LAT, LON, 30.0, 50.0, 10.0, 40.0, halo=3.0)
+        lat, lon = window.coords(LAT, LON)
+        np.testing.assert_array_equal(lat, np.arange(51.0, 26.9, -3.0))
+        np.testing.assert_array_equal(lon, np.arange(9.0, 43.1, 3.0))
+        assert not window.wraps
+        assert window.shape(len(LAT), len(LON)) == (len(lat), len(lon))
+
+    def test_across_longitude_seam(self):
+        window = GridWindow.from_bounds(LAT, LON, 30.0, 50.0, -15.0, 40.0)
+        assert window.wraps
+        _, lon = window.coords(LAT, LON)
+        np.testing.assert_array_equal(lon, np.arange(-15.0, 39.1, 3.0))
+
+    def test_across_antimeridian(self):
+        lon180 = np.arange(-180.0, 180.0, 3.0)
+        window = GridWindow.from_bounds(LAT, lon180, -10.0, 10.0, 170.0, -170.0)
+        _, lon = window.coords(LAT, lon180)
+        np.testing.assert_array_equal(lon, np.arange(171.0, 189.1, 3.0))
+
+    def test_full_longitude_span(self):
+        window = GridWindow.from_bounds(LAT, LON, -10.0, 10.0, -180.0, 180.0)
+        assert window.lon == (slice(0, len(LON)),)
+
+    def test_no_points(self):
+        with pytest.raises(ValueError, match="latitude"):
+            GridWindow.from_bounds(LAT, LON, 91.0, 95.0, 0.0, 10.0)
+
+    def test_read_netcdf_and_array(self, tmp_path: Path):
+        data = np.arange(2 * len(LAT) * len(LON), dtype="f4").reshape(2, len(LAT), len(LON))
+        with nc.Dataset(tmp_path / "f.nc", "w") as ds:
+            ds.createDimension("time", 2)
+            ds.createDimension("latitude", len(LAT))
+            ds.createDimension("longitude", len(LON))
+            ds.createVariable("v", "f4", ("time", "latitude", "longitude"))[:] = data
+
+        window = GridWindow.from_bounds(LAT, LON, 30.0, 50.0, -15.0, 40.0)
+        cols = np.r_[np.arange(115, 120), np.arange(0, 14)]
+        expected = data[:, 14:21][..., cols]
+        np.testing.assert_array_equal(window.read(data, slice(None)), expected)
+        with nc.Dataset(tmp_path / "f.nc") as ds:
+            read = window.read(ds.variables["v"], slice(0, 2), Ellipsis)
+        np.testing.assert_array_equal(read, expected)
+
+
+class TestDomainConfig:
+    def test_no_domain(self):
+        assert domain_window(SimpleNamespace(domain=None), LAT, LON) is None
+
+    def test_bounds(self):
+        cfg = SimpleNamespace(
+            domain={"lat_min": 0.0, "lat_max": 10.0, "lon_min": 0.0, "lon_max": 9.0, "halo": 3}
+        )
+        window = domain_window(cfg, LAT, LON)
+        assert window.shape(len(LAT), len(LON)) == (6, 6)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError, match="missing"):
+            domain_bounds({"lat_min": 0.0})
+        with pytest.raises(ValueError, match="not both"):
+            domain_bounds({"geo_em": "x.nc", "lat_min": 0.0})
+        with pytest.raises(ValueError, match="not both"):
+            domain_bounds({"geo_em": "x.nc", "namelist": "namelist.wps"})
+        with pytest.raises(ValueError, match="Unknown"):
+            domain_bounds({"geo_em": "x.nc", "margin": 1.0})
+
+    def test_geo_em(self, tmp_path: Path):
+        xlat, xlon = np.meshgrid(np.linspace(35.0, 45.0, 5), np.linspace(170.0, 200.0, 4))
+        xlon = (xlon + 180.0) % 360.0 - 180.0
+        with nc.Dataset(tmp_path / "geo_em.d01.nc", "w") as ds:
+            ds.createDimension("Time", 1)
+            ds.createDimension("south_north", 4)
+            ds.createDimension("west_east", 5)
+            dims = ("Time", "south_north", "west_east")
+            ds.createVariable("XLAT_M", "f4", dims)[:] = xlat[None]
+            ds.createVariable("XLONG_M", "f4", dims)[:] = xlon[None]
+
+        lat_min, lat_max, lon_min, lon_max = geo_em_bounds(str(tmp_path / "geo_em.d01.nc"))
+        assert (lat_min, lat_max) == (35.0, 45.0)
+        assert lon_min == pytest.approx(170.0)
+        assert lon_max == pytest.approx(-160.0)
+
+
+REPO_NAMELIST = Path(__file__).parents[1] / "namelist_soilera5_cmip6_pgw.wps"
+
+GEOGRID = """\
+&share
+ max_dom = 2,
+/
+&geogrid
+ e_we = {e_we}, 91,
+ e_sn = {e_sn}, 61,
+ dx = {dx}, dy = {dy},   ! comment, with = signs
+ map_proj = '{proj}',
+ ref_lat = {ref_lat}, ref_lon = {ref_lon},
+ {extra}
+/
+"""
+
+
+def _namelist(tmp_path, e_we=101, e_sn=51, dx=20000.0, dy=20000.0, extra="", **kwargs):
+    path = tmp_path / "namelist.wps"
+    path.write_text(GEOGRID.format(e_we=e_we, e_sn=e_sn, dx=dx, dy=dy, extra=extra, **kwargs))
+    return path
+
+
+class TestNamelist:
+    def test_read_namelist(self):
+        groups = read_namelist(REPO_NAMELIST)
+        assert groups["share"]["start_date"] == ["2005-12-01_00:00:00"]
+        assert groups["geogrid"]["e_we"] == [1250] and groups["geogrid"]["ref_lat"] == [41.8]
+        assert groups["geogrid"]["map_proj"] == ["lambert"]
+        assert groups["metgrid"]["fg_name"] == ["ERA5"]
+
+    def test_lambert_repo_domain(self):
+        lat_min, lat_max, lon_min, lon_max = namelist_bounds(REPO_NAMELIST)
+        # 2500 x 1500 km centred at 41.8N 4.2E, on its central meridian
+        assert lon_min + lon_max == pytest.approx(2 * 4.2)
+        assert 33.0 < lat_min < 35.0 and 48.0 < lat_max < 49.5
+        assert 16.0 < lon_max - 4.2 < 18.0
+        assert domain_bounds({"namelist": str(REPO_NAMELIST)}) == (
+            lat_min,
+            lat_max,
+            lon_min,
+            lon_max,
+        )
+
+    def test_lambert_tangent_cone(self, tmp_path):
+        # A single standard parallel through the reference point, where the
+        # scale is true: one grid length north and south is 1 km of meridian
+        extra = "truelat1 = 45.0, stand_lon = 10.0,"
+        path = _namelist(
+            tmp_path, e_we=3, e_sn=3, dx=1000.0, dy=1000.0, proj="lambert", ref_lat=45.0,
+            ref_lon=10.0, extra=extra,
+        )  # fmt: skip
+        lat_min, lat_max, lon_min, lon_max = namelist_bounds(path)
+        arc = np.rad2deg(1000.0 / 6370000.0)
+        assert lat_max - 45.0 == pytest.approx(arc, rel=1e-3)
+        assert 45.0 - lat_min == pytest.approx(arc, rel=1e-3)
+        assert lon_max - 10.0 == pytest.approx(arc / np.cos(np.deg2rad(45.0)), rel=1e-3)
+
+    def test_polar(self, tmp_path):
+        extra = "truelat1 = 90.0, stand_lon = 0.0,"
+        path = _namelist(
+            tmp_path, e_we=11, e_sn=11, proj="polar", ref_lat=90.0, ref_lon=0.0, extra=extra
+        )
+        lat_min, lat_max, _, _ = namelist_bounds(path)
+        corner = np.hypot(5 * 20000.0, 5 * 20000.0)
+        expected = 90.0 - 2 * np.rad2deg(np.arctan(corner / (2 * 6370000.0)))
+        assert lat_min == pytest.approx(expected)
+        # The central corner point is the pole
+        assert lat_max == 90.0
+
+    def test_mercator_and_latlon(self, tmp_path):
+        extra = "truelat1 = 0.0,"
+        path = _namelist(tmp_path, proj="mercator", ref_lat=0.0, ref_lon=-170.0, extra=extra)
+        lat_min, lat_max, lon_min, lon_max = namelist_bounds(path)
+        half = np.rad2deg(25 * 20000.0 / 6370000.0)
+        assert lat_max == pytest.approx(-lat_min)
+        assert lat_max == pytest.approx(
+            np.rad2deg(2 * np.arctan(np.exp(np.deg2rad(half))) - np.pi / 2)
+        )
+        assert lon_min == pytest.approx(-170.0 - 2 * half) and lon_max == pytest.approx(
+            -170.0 + 2 * half
+        )
+
+        path = _namelist(tmp_path, dx=0.5, dy=0.25, proj="lat-lon", ref_lat=40.0, ref_lon=178.0)
+        assert namelist_bounds(path) == pytest.approx((33.75, 46.25, 153.0, -157.0))
+
+    def test_unsupported(self, tmp_path):
+        extra = "pole_lat = 40.0,"
+        path = _namelist(
+            tmp_path, dx=0.5, dy=0.5, proj="lat-lon", ref_lat=0.0, ref_lon=0.0, extra=extra
+        )
+        with pytest.raises(ValueError, match="rotated"):
+            namelist_bounds(path)
+        path = _namelist(tmp_path, proj="gnomonic", ref_lat=0.0, ref_lon=0.0)
+        with pytest.raises(ValueError, match="unsupported map_proj"):
+            namelist_bounds(path)
+        path.write_text("&share\n max_dom = 1,\n/\n")
+        with pytest.raises(ValueError, match="no &geogrid"):
+            namelist_bounds(path)
@@ -0,0 +1,344 @@
+"""Tests for pgw4era.download."""
+
+import datetime as dt
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pgw4era.domain import GridWindow
+from pgw4era.download import (
+    PL_DATASET,
+    SFC_DATASET,
+    STATE_NAME,
+    DownloadState,
+    area_grid,
+    check_regrid_grid,
+    download,
+    era5_area,
+    era5_retrievals,
+    grib_complete,
+    grib_reference_date,
+    split_grib_by_day,
+)
+from pgw4era.regrid import write_grid_description
+
+
+def _grib(payload: bytes, edition: int = 2, date: dt.date = dt.date(2009, 12, 1)) -> bytes:
+    """A GRIB message with the reference date *date* framing *payload*."""
+    if edition == 2:
+        section1 = bytearray(21)
+        section1[:5] = (21).to_bytes(4, "big") + b"\1"
+        section1[12:16] = date.year.to_bytes(2, "big") + bytes([date.month, date.day])
+        body = bytes(section1) + payload
+        length = len(body) + 20
+        header = b"GRIB\0\0\0\2" + length.to_bytes(8, "big")
+    else:
+        pds = bytearray(28)
+        pds[:3] = (28).to_bytes(3, "big")
+        year = (date.year - 1) % 100 + 1
+        pds[12:15] = bytes([year, date.month, date.day])
+        pds[24] = (date.year - year) // 100 + 1
+        body = bytes(pds) + payload
+        length = len(body) + 12
+        header = b"GRIB" + length.to_bytes(3, "big") + b"\1"
+    return header + body + b"7777"
+
+
+class FakeCDS:
+    """Local stand-in for the CDS: one client per thread, shared bookkeeping."""
+
+    def __init__(self, failures=None, truncate=(), delay=0.0):
+        self.failures = dict(failures or {})
+        self.truncate = set(truncate)
+        self.delay = delay
+        self.requests = []
+        self.clients = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.clients += 1
+        return self
+
+    def retrieve(self, name, request, target):
+        days = request["day"] if isinstance(request["day"], list) else [request["day"]]
+        dates = [dt.date(int(request["year"]), int(request["month"]), int(day)) for day in days]
+        key = f"{'pl' if name == PL_DATASET else 'sfc'}_{dates[0]:%Y%m%d}"
+        if len(dates) > 1:
+            key += f"-{dates[-1]:%Y%m%d}"
+        with self.lock:
+            self.requests.append(key)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            data = b"".join(
+                _grib(f"{time}".encode(), edition, date)
+                for time in range(2)
+                for date in dates
+                for edition in (1, 2)
+            )
+            if self.failures.get(key, 0) > 0:
+                self.failures[key] -= 1
+                with open(target, "wb") as fh:
+                    fh.write(data[:10])
+                raise ConnectionError("request queue timed out")
+            with open(target, "wb") as fh:
+                fh.write(data[:-3] if key in self.truncate else data)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture()
+def cfg():
+    return SimpleNamespace(syear=2009, smonth=12, eyear=2010, emonth=1)
+
+
+def _no_sleep(seconds):
+    pass
+
+
+def test_retrievals_cover_the_writer_days(cfg):
+    retrievals = era5_retrievals(cfg)
+    assert len(retrievals) == 62
+    first, last = retrievals[0], retrievals[-1]
+    assert first.name == "era5_daily_pl_20091201.grb" and first.dataset == PL_DATASET
+    assert last.name == "era5_daily_sfc_20091231.grb" and last.dataset == SFC_DATASET
+    assert first.request["day"] == "01" and first.request["month"] == "12"
+    assert len(first.request["pressure_level"]) == 37
+    assert "pressure_level" not in last.request
+    with pytest.raises(ValueError, match="Unknown ERA5 file kind"):
+        era5_retrievals(cfg, ["ml"])
+
+
+def test_grib_complete(tmp_path):
+    path = tmp_path / "file.grb"
+    data = _grib(b"abc") + _grib(b"defg", edition=1)
+    path.write_bytes(data)
+    assert grib_complete(path)
+    for broken in (b"", data[:-1], data + b"GRIB", b"HTML error page" + data):
+        path.write_bytes(broken)
+        assert not grib_complete(path)
+
+
+def test_concurrent_download(cfg, tmp_path, capsys):
+    server = FakeCDS(delay=0.05)
+    retrievals = era5_retrievals(cfg, ["sfc"])[:8]
+    results = download(retrievals, tmp_path / "grb", server, workers=4, sleep=_no_sleep)
+    assert [result.name for result in results] == [retrieval.name for retrieval in retrievals]
+    assert all(result.ok and result.attempts == 1 for result in results)
+    assert 1 < server.max_in_flight <= 4 and server.clients <= 4
+    for retrieval in retrievals:
+        assert grib_complete(tmp_path / "grb" / retrieval.name)
+    assert not list((tmp_path / "grb").glob("*.part"))
+    state = json.loads((tmp_path / "grb" / STATE_NAME).read_text())["retrievals"]
+    assert state["era5_daily_sfc_20091203.grb"]["status"] == "done"
+    assert "Finished: 8 of 8 file(s) available" in capsys.readouterr().out
+
+
+def test_retries_with_backoff(cfg, tmp_path):
+    server = FakeCDS(failures={"pl_20091201": 2, "pl_20091202": 5}, truncate={"pl_20091203"})
+    delays = []
+    retrievals = era5_retrievals(cfg, ["pl"])[:4]
+    results = download(
+        retrievals, tmp_path, server, workers=1, retries=2, backoff=10.0, sleep=delays.append
+    )
+    flaky, broken, truncated, fine = results
+    assert flaky.ok and flaky.attempts == 3
+    assert not broken.ok and broken.attempts == 3
+    assert broken.error == "ConnectionError: request queue timed out"
+    assert not truncated.ok and "incomplete GRIB" in truncated.error
+    assert fine.ok
+    assert delays[:2] == [10.0, 20.0]
+    # Failed attempts never leave a file under the final name
+    assert not (tmp_path / broken.name).exists() and not (tmp_path / truncated.name).exists()
+    assert not list(tmp_path.glob("*.part"))
+    state = DownloadState(tmp_path / STATE_NAME)
+    assert state.entries[broken.name]["status"] == "failed"
+
+
+def test_resume(cfg, tmp_path):
+    retrievals = era5_retrievals(cfg, ["pl"])[:5]
+    server = FakeCDS(failures={"pl_20091202": 10})
+    download(retrievals, tmp_path, server, retries=0, sleep=_no_sleep)
+    assert sorted(server.requests) == [f"pl_2009120{d}" for d in range(1, 6)]
+
+    # A file downloaded by other means, and one changed since its download
+    (tmp_path / "era5_daily_pl_20091206.grb").write_bytes(_grib(b"old"))
+    (tmp_path / "era5_daily_pl_20091203.grb").write_bytes(b"truncated")
+    retrievals = era5_retrievals(cfg, ["pl"])[:6]
+    server = FakeCDS()
+    results = download(retrievals, tmp_path, server, sleep=_no_sleep)
+    assert all(result.ok for result in results)
+    assert sorted(server.requests) == ["pl_20091202", "pl_20091203"]
+    assert [result.skipped for result in results] == [True, False, False, True, True, True]
+
+    # A changed request is made again
+    retrievals[0].request["grid"] = [0.25, 0.25]
+    server = FakeCDS()
+    download(retrievals, tmp_path, server, sleep=_no_sleep)
+    assert server.requests == ["pl_20091201"]
+
+
+def test_client_failure_does_not_stop_others(cfg, tmp_path):
+    def factory():
+        raise RuntimeError("no CDS API key")
+
+    results = download(era5_retrievals(cfg, ["pl"])[:2], tmp_path, factory, workers=2)
+    assert not any(result.ok for result in results)
+    assert results[0].error.startswith("RuntimeError: no CDS API key")
+
+
+def test_batches_within_months(cfg):
+    retrievals = era5_retrievals(cfg, ["pl", "sfc"], max_fields=740 * 10)
+    pl = [retrieval for retrieval in retrievals if retrieval.dataset == PL_DATASET]
+    assert [retrieval.name for retrieval in pl] == [
+        "era5_pl_20091201-20091210.grb",
+        "era5_pl_20091211-20091220.grb",
+        "era5_pl_20091221-20091230.grb",
+        "era5_daily_pl_20091231.grb",
+    ]
+    assert pl[0].request["day"] == [f"{day:02d}" for day in range(1, 11)]
+    assert pl[0].files[0] == "era5_daily_pl_20091201.grb" and len(pl[0].files) == 10
+    assert pl[-1].request["day"] == "31" and pl[-1].files == [pl[-1].name]
+    # The surface fields of the whole month fit in one request
+    sfc = [retrieval for retrieval in retrievals if retrieval.dataset == SFC_DATASET]
+    assert [retrieval.name for retrieval in sfc] == ["era5_sfc_20091201-20091231.grb"]
+
+    # Requests never span two months
+    cfg.emonth = 3
+    names = [retrieval.name for retrieval in era5_retrievals(cfg, ["sfc"], max_fields=10**6)]
+    assert names == [
+        "era5_sfc_20091201-20091231.grb",
+        "era5_sfc_20100101-20100131.grb",
+        "era5_sfc_20100201-20100228.grb",
+    ]
+
+
+@pytest.mark.parametrize("date", [dt.date(2000, 2, 29), dt.date(1999, 12, 31), dt.date(2023, 7, 4)])
+@pytest.mark.parametrize("edition", [1, 2])
+def test_grib_reference_date(date, edition):
+    assert grib_reference_date(_grib(b"data", edition, date)) == date
+
+
+def test_split_grib_by_day(tmp_path):
+    days = [dt.date(2010, 1, 30), dt.date(2010, 1, 31)]
+    messages = [_grib(f"{n}".encode(), 1 + n % 2, days[n // 2 % 2]) for n in range(8)]
+    (tmp_path / "batch.grb").write_bytes(b"".join(messages))
+    sizes = split_grib_by_day(tmp_path / "batch.grb", "day_%Y%m%d.grb", tmp_path)
+    assert sizes == {
+        "day_20100130.grb": sum(len(m) for m in messages[0:2] + messages[4:6]),
+        "day_20100131.grb": sum(len(m) for m in messages[2:4] + messages[6:8]),
+    }
+    # Messages keep their order
+    first = messages[0] + messages[1] + messages[4] + messages[5]
+    assert (tmp_path / "day_20100130.grb").read_bytes() == first
+
+    (tmp_path / "batch.grb").write_bytes(b"".join(messages)[:-1])
+    with pytest.raises(ValueError, match="does not end with 7777|Truncated"):
+        split_grib_by_day(tmp_path / "batch.grb", "new_%Y%m%d.grb", tmp_path)
+    assert not list(tmp_path.glob("new_*")) and not list(tmp_path.glob("*.part"))
+
+
+def test_batched_download(cfg, tmp_path):
+    server = FakeCDS()
+    retrievals = era5_retrievals(cfg, ["pl", "sfc"], max_fields=740 * 16)
+    results = download(retrievals, tmp_path, server, sleep=_no_sleep)
+    assert all(result.ok for result in results)
+    assert sorted(server.requests) == [
+        "pl_20091201-20091216",
+        "pl_20091217-20091231",
+        "sfc_20091201-20091231",
+    ]
+    daily = sorted(path.name for path in tmp_path.glob("*.grb"))
+    assert daily == sorted(retrieval.name for retrieval in era5_retrievals(cfg))
+    for name in ("era5_daily_pl_20091217.grb", "era5_daily_sfc_20091231.grb"):
+        with open(tmp_path / name, "rb") as fh:
+            data = fh.read()
+        assert grib_complete(tmp_path / name) and len(data) == 2 * sum(
+            len(_grib(b"0", edition)) for edition in (1, 2)
+        )
+        assert grib_reference_date(data) == dt.date(2009, 12, int(name[-6:-4]))
+
+    # Resumed with the former daily requests, or the batches: nothing to download
+    server = FakeCDS()
+    download(era5_retrievals(cfg), tmp_path, server, sleep=_no_sleep)
+    download(retrievals, tmp_path, server, sleep=_no_sleep)
+    assert server.requests == []
+
+    # A missing day makes the batch be downloaded again
+    (tmp_path / "era5_daily_pl_20091220.grb").unlink()
+    download(retrievals, tmp_path, server, sleep=_no_sleep)
+    assert server.requests == ["pl_20091217-20091231"]
+    assert (tmp_path / "era5_daily_pl_20091220.grb").exists()
+
+
+def test_batch_missing_days(cfg, tmp_path):
+    class Short(FakeCDS):
+        def retrieve(self, name, request, target):
+            request = {**request, "day": request["day"][:-1]}
+            super().retrieve(name, request, target)
+
+    retrievals = era5_retrievals(cfg, ["sfc"], max_fields=10**6)
+    (result,) = download(retrievals, tmp_path, Short(), retries=0, keep_batches=True)
+    assert not result.ok and "holds no data for era5_daily_sfc_20091231.grb" in result.error
+    assert not (tmp_path / retrievals[0].name).exists()
+
+
+class TestArea:
+    def test_global_without_domain(self, cfg):
+        cfg.domain = None
+        assert era5_area(cfg) is None
+        grid = area_grid(None)
+        assert (grid.xsize, grid.ysize) == (1200, 601)
+
+    def test_domain_snapped_to_era5_grid(self, cfg):
+        cfg.domain = {"lat_min": 30.0, "lat_max": 50.0, "lon_min": -15.0, "lon_max": 40.0}
+        assert era5_area(cfg) == [50.1, -15.0, 30.0, 40.2]
+        cfg.domain["halo"] = 3.0
+        area = era5_area(cfg)
+        assert area == [53.1, -18.0, 27.0, 43.2]
+        assert all(r.request["area"] == area for r in era5_retrievals(cfg, ["pl"], 10**6, area))
+
+        # The regional grid covers the domain window of the global grid, on the same points
+        grid, world = area_grid(area), area_grid(None)
+        bounds = (30.0, 50.0, -15.0, 40.0)
+        window = GridWindow.from_bounds(world.lat, world.lon, *bounds, halo=3.0)
+        regional = GridWindow.from_bounds(grid.lat, grid.lon, *bounds, halo=3.0)
+        for got, expected in zip(
+            regional.coords(grid.lat, grid.lon), window.coords(world.lat, world.lon)
+        ):
+            np.testing.assert_allclose(got, expected, atol=1e-9)
+        assert grid.lat[0] == 53.1 and grid.lat[-1] == pytest.approx(27.0)
+
+    def test_regrid_grid_must_match(self, cfg, tmp_path):
+        cfg.domain = {"lat_min": 30.0, "lat_max": 50.0, "lon_min": -15.0, "lon_max": 40.0}
+        area = era5_area(cfg)
+        cfg.regrid_grid = str(tmp_path / "era5_grid")
+        with pytest.raises(ValueError, match="does not exist"):
+            check_regrid_grid(cfg, area)
+        check_regrid_grid(cfg, None)
+
+        write_grid_description(area_grid(None), cfg.regrid_grid)
+        with pytest.raises(ValueError, match="is not the ERA5 grid of the downloaded area"):
+            check_regrid_grid(cfg, area)
+        check_regrid_grid(cfg, None)
+
+        write_grid_description(area_grid(area), cfg.regrid_grid)
+        check_regrid_grid(cfg, area)
+        with pytest.raises(ValueError, match="is not the global ERA5 grid"):
+            check_regrid_grid(cfg, None)
+
+    def test_antimeridian_and_poles(self, cfg):
+        cfg.domain = {"lat_min": 70.0, "lat_max": 89.0, "lon_min": 170.0, "lon_max": -170.0}
+        cfg.domain["halo"] = 2.0
+        assert era5_area(cfg) == [90.0, 168.0, 67.8, 192.0]
+        cfg.domain = {"lat_min": -10.0, "lat_max": 10.0, "lon_min": -180.0, "lon_max": 179.9}
+        assert era5_area(cfg)[1::2] == [0.0, 359.7]
@@ -0,0 +1,173 @@
+"""Tests for pgw4era.ensemble."""
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from pgw4era.ensemble import (
+    EnsembleMean,
+    EnsembleQuantiles,
+    parse_statistic,
+    statistic_suffix,
+    weighted_quantile,
+)
+
+
+def _delta(path, data, plev=(85000.0, 50000.0)):
+    """Write a regridded per-model delta file."""
+    ds = xr.Dataset(
+        {"ta": (("time", "plev", "lat", "lon"), data.astype("float32"), {"units": "K"})},
+        coords={
+            "time": pd.date_range("2004-01-01", periods=data.shape[0], freq="MS"),
+            "plev": list(plev),
+            "lat": [30.0, 0.0, -30.0],
+            "lon": [0.0, 120.0, 240.0, 300.0],
+        },
+    )
+    ds.to_netcdf(path, unlimited_dims="time")
+    return path
+
+
+def _reference(stack, threshold):
+    """The former mean_with_missing_threshold over a stacked ``model`` dimension."""
+    data = xr.DataArray(stack, dims=("model", "time", "plev", "lat", "lon"))
+    missing_fraction = 1 - data.count(dim="model") / data.sizes["model"]
+    return data.mean(dim="model", skipna=True).where(~(missing_fraction > threshold)).values
+
+
+@pytest.fixture()
+def stack(tmp_path):
+    data = np.random.default_rng(0).normal(2.0, 1.0, (4, 12, 2, 3, 4))
+    data[0, 0, 0, 0, 0] = np.nan
+    data[:2, 1, 1, 1, 1] = np.nan
+    data[:, 2, 0, 2, 3] = np.nan
+    paths = [_delta(tmp_path / f"ta_M{n}_delta.nc", data[n]) for n in range(4)]
+    return data, paths
+
+
+@pytest.mark.parametrize("threshold", [1.0, 0.3])
+def test_matches_stacked_mean(stack, threshold):
+    data, paths = stack
+    ensemble = EnsembleMean("ta", max_missing=threshold)
+    for path in paths:
+        ensemble.add(path)
+    mean = ensemble.mean()
+    assert mean.dtype == np.float32
+    np.testing.assert_allclose(mean, _reference(data, threshold), rtol=1e-6)
+    assert np.isnan(mean[2, 0, 2, 3])
+    assert np.isnan(mean[1, 1, 1, 1]) == (threshold < 0.5)
+
+
+def test_plev_fix_and_outputs(stack, tmp_path):
+    data, paths = stack
+    odd = _delta(tmp_path / "ta_M4_delta.nc", data[0], plev=(85000.001, 49999.99))
+    with EnsembleMean(
+        "ta", plev=np.array([85000.0, 50000.0]), allmodels=tmp_path / "all.nc"
+    ) as ensemble:
+        for n, path in enumerate([*paths, odd]):
+            ensemble.add(path, f"M{n}")
+        ensemble.to_netcdf(tmp_path / "mean.nc")
+
+    assert not list(tmp_path.glob("*.part"))
+    with xr.open_dataset(tmp_path / "mean.nc") as ds:
+        np.testing.assert_array_equal(ds.plev, [85000.0, 50000.0])
+        assert ds.ta.dims == ("time", "plev", "lat", "lon") and ds.ta.units == "K"
+        assert ds.models == "M0 M1 M2 M3 M4"
+        expected = _reference(np.concatenate([data, data[:1]]), 1.0)
+        np.testing.assert_allclose(ds.ta.values, expected, rtol=1e-6)
+    with xr.open_dataset(tmp_path / "all.nc") as ds:
+        assert ds.ta.dims == ("model", "time", "plev", "lat", "lon")
+        assert list(ds.model.values) == ["M0", "M1", "M2", "M3", "M4"]
+        np.testing.assert_allclose(ds.ta.values[:4], data.astype("float32"))
+
+
+def test_incompatible_models(stack, tmp_path):
+    data, paths = stack
+    ensemble = EnsembleMean("ta", plev=np.array([85000.0, 50000.0, 25000.0]))
+    with pytest.raises(ValueError, match="2 pressure levels, expected 3"):
+        ensemble.add(paths[0])
+
+    ensemble = EnsembleMean("ta")
+    ensemble.add(paths[0])
+    other = _delta(tmp_path / "ta_other.nc", data[0, :6])
+    with pytest.raises(ValueError, match="has shape"):
+        ensemble.add(other)
+
+
+def test_unfinished_allmodels_discarded(stack, tmp_path):
+    _, paths = stack
+    with EnsembleMean("ta", allmodels=tmp_path / "all.nc") as ensemble:
+        ensemble.add(paths[0])
+    assert not list(tmp_path.glob("all.nc*"))
+
+
+def test_weighted_quantile_matches_hazen():
+    values = np.random.default_rng(1).normal(size=(7, 5, 6))
+    values[:3, 0, 0] = np.nan
+    values[:, 1, 1] = np.nan
+    quantiles = [0.0, 0.1, 0.5, 0.9, 1.0]
+    result = weighted_quantile(values, np.ones(7), quantiles)
+    with np.errstate(invalid="ignore"), pytest.warns(RuntimeWarning):
+        expected = np.nanquantile(values, quantiles, axis=0, method="hazen")
+    np.testing.assert_allclose(result, expected, rtol=1e-12)
+    assert np.isnan(result[:, 1, 1]).all()
+
+
+def test_weighted_quantile_weights():
+    values = np.array([1.0, 2.0, 3.0])
+    # Positions at the midpoints of the cumulative weights: 1/8, 4/8 and 7/8
+    result = weighted_quantile(values, np.array([1.0, 2.0, 1.0]), [0.1, 0.2, 0.5, 0.8])
+    np.testing.assert_allclose(result, [1.0, 1.2, 2.0, 2.8])
+    # A zero weight drops the model
+    result = weighted_quantile(values, np.array([1.0, 0.0, 1.0]), [0.5])
+    np.testing.assert_allclose(result, [2.0])
+
+
+def test_weighted_mean(stack):
+    data, paths = stack
+    weights = {"M0": 1.0, "M1": 2.0, "M2": 0.5, "M3": 1.5}
+    ensemble = EnsembleMean("ta", weights=weights)
+    for n, path in enumerate(paths):
+        ensemble.add(path, f"M{n}")
+    w = np.array(list(weights.values())).reshape(-1, 1, 1, 1, 1)
+    with np.errstate(invalid="ignore"):
+        expected = np.nansum(data * w, axis=0) / np.sum(np.where(np.isnan(data), 0.0, w), axis=0)
+    np.testing.assert_allclose(ensemble.mean(), expected, rtol=1e-6)
+
+    with pytest.raises(ValueError, match="No ensemble weight for model 'M9'"):
+        ensemble.add(paths[0], "M9")
+
+
+@pytest.mark.parametrize("threshold", [1.0, 0.3])
+def test_quantile_files(stack, tmp_path, threshold):
+    data, paths = stack
+    # A tiny budget splits the grid into blocks of single rows
+    ensemble = EnsembleQuantiles(
+        "ta", [0.5, 0.9], plev=np.array([85000.0, 50000.0]), max_missing=threshold, chunk_mb=1e-6
+    )
+    for path in paths:
+        ensemble.add(path)
+    outputs = [tmp_path / "ta_CC_signal_median.nc", tmp_path / "ta_CC_signal_q90.nc"]
+    ensemble.to_netcdf(outputs)
+
+    assert not list(tmp_path.glob("*.part"))
+    sparse = np.isnan(_reference(data, threshold))
+    with np.errstate(invalid="ignore"), pytest.warns(RuntimeWarning):
+        expected = np.nanquantile(data, [0.5, 0.9], axis=0, method="hazen")
+    for path, values in zip(outputs, expected):
+        with xr.open_dataset(path) as ds:
+            assert ds.ta.dims == ("time", "plev", "lat", "lon") and ds.ta.units == "K"
+            assert ds.models == "ta_M0_delta ta_M1_delta ta_M2_delta ta_M3_delta"
+            np.testing.assert_allclose(ds.ta.values, np.where(sparse, np.nan, values), rtol=1e-6)
+
+
+def test_parse_statistic():
+    assert parse_statistic("mean") is None
+    assert parse_statistic("median") == 0.5
+    assert parse_statistic("q90") == 0.9
+    assert parse_statistic("q2.5") == 0.025
+    assert statistic_suffix("mean") == "" and statistic_suffix("q90") == "_q90"
+    for name in ("max", "q150", "p90"):
+        with pytest.raises(ValueError, match="Unknown ensemble statistic"):
+            parse_statistic(name)
@@ -0,0 +1,130 @@
+"""Tests for pgw4era.era5."""
+
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from pgw4era.domain import GridWindow
+from pgw4era.era5 import ERA5File, unpack
+
+NT, NLEV, NLAT, NLON = 8, 4, 3, 5
+
+
+def _write_era5(path: Path, ascending: bool, tchunk: int | None = None) -> None:
+    rng = np.random.default_rng(0)
+    with nc.Dataset(path, "w") as ds:
+        ds.createDimension("time", NT)
+        ds.createDimension("level", NLEV)
+        ds.createDimension("latitude", NLAT)
+        ds.createDimension("longitude", NLON)
+        levels = np.array([500.0, 700.0, 850.0, 1000.0])
+        ds.createVariable("level", "f4", ("level",))[:] = levels if ascending else levels[::-1]
+        chunks = None if tchunk is None else (tchunk, NLEV, NLAT, NLON)
+        t = ds.createVariable(
+            "t", "f4", ("time", "level", "latitude", "longitude"), chunksizes=chunks
+        )
+        t[:] = rng.normal(size=(NT, NLEV, NLAT, NLON))
+        ds.createVariable("sp", "f4", ("time", "latitude", "longitude"))[:] = rng.normal(
+            size=(NT, NLAT, NLON)
+        )
+
+
+@pytest.mark.parametrize("ascending", [True, False])
+def test_field_matches_direct_read(tmp_path: Path, ascending: bool):
+    path = tmp_path / "era5.nc"
+    _write_era5(path, ascending)
+
+    with nc.Dataset(path) as ds, ERA5File(str(path)) as era5:
+        assert era5.levels_reversed is ascending
+        for nt in range(NT):
+            expected = ds.variables["t"][nt, ::-1] if ascending else ds.variables["t"][nt]
+            np.testing.assert_array_equal(era5.field("t", nt), expected)
+            np.testing.assert_array_equal(era5.field("sp", nt), ds.variables["sp"][nt])
+        # One read per variable for the whole day
+        assert era5.nreads == 2
+
+
+def test_fields_are_views(tmp_path: Path):
+    path = tmp_path / "era5.nc"
+    _write_era5(path, ascending=True)
+
+    with ERA5File(str(path)) as era5:
+        first = np.ma.getdata(era5.field("t", 0))
+        again = np.ma.getdata(era5.field("t", 0))
+        assert np.shares_memory(first, again)
+        assert era5.nreads == 1
+        assert "t" in era5
+        assert "rsn" not in era5
+
+
+def test_windows_are_chunk_aligned(tmp_path: Path):
+    path = tmp_path / "era5.nc"
+    _write_era5(path, ascending=True, tchunk=2)
+    step_mb = NLEV * NLAT * NLON * 4 / 1024**2
+
+    # A budget of three timesteps is rounded down to one chunk of two
+    with nc.Dataset(path) as ds, ERA5File(str(path), window_mb=3 * step_mb) as era5:
+        for nt in range(NT):
+            np.testing.assert_array_equal(era5.field("t", nt), ds.variables["t"][nt, ::-1])
+        assert era5.nreads == NT // 2
+
+
+def test_window(tmp_path: Path):
+    path = tmp_path / "era5.nc"
+    _write_era5(path, ascending=True)
+    window = GridWindow(slice(0, 2), (slice(4, 5), slice(0, 2)))
+
+    with nc.Dataset(path) as ds, ERA5File(str(path), window=window) as era5:
+        for nt in range(NT):
+            expected = ds.variables["t"][nt, ::-1, 0:2][..., [4, 0, 1]]
+            np.testing.assert_array_equal(era5.field("t", nt), expected)
+            expected = ds.variables["sp"][nt, 0:2][..., [4, 0, 1]]
+            np.testing.assert_array_equal(era5.field("sp", nt), expected)
+        assert era5.nreads == 2
+
+
+def _write_packed(path: Path) -> np.ndarray:
+    """Write an ERA5-style int16 packed variable with one missing value."""
+    rng = np.random.default_rng(1)
+    values = rng.uniform(200.0, 320.0, size=(NT, NLAT, NLON))
+    with nc.Dataset(path, "w") as ds:
+        ds.createDimension("time", NT)
+        ds.createDimension("latitude", NLAT)
+        ds.createDimension("longitude", NLON)
+        var = ds.createVariable("t2m", "i2", ("time", "latitude", "longitude"))
+        var.scale_factor = 0.002
+        var.add_offset = 260.0
+        var[:] = values
+        var[3, 1, 2] = np.ma.masked
+    return values
+
+
+def test_float32_reads_unmasked(tmp_path: Path):
+    path = tmp_path / "era5.nc"
+    _write_packed(path)
+
+    with nc.Dataset(path) as ds, ERA5File(str(path), dtype="float32") as era5:
+        for nt in range(NT):
+            field = era5.field("t2m", nt)
+            expected = ds.variables["t2m"][nt]
+            assert type(field) is np.ndarray
+            assert field.dtype == np.float32
+            np.testing.assert_array_equal(np.isnan(field), np.ma.getmaskarray(expected))
+            np.testing.assert_allclose(field, expected.filled(np.nan), rtol=1e-7)
+
+
+def test_unpack_fill_values(tmp_path: Path):
+    path = tmp_path / "era5.nc"
+    with nc.Dataset(path, "w") as ds:
+        ds.createDimension("x", 4)
+        var = ds.createVariable("v", "i2", ("x",), fill_value=-1)
+        var.missing_value = np.int16(-2)
+        var.scale_factor = 0.5
+        var.set_auto_maskandscale(False)
+        var[:] = [-1, -2, -32767, 4]
+        raw = var[:]
+        data = unpack(var, raw, np.dtype("float32"))
+    # The default fill value is not special once _FillValue is set
+    np.testing.assert_array_equal(data, [np.nan, np.nan, -16383.5, 2.0])
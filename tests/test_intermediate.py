@@ -0,0 +1,256 @@
+"""Tests for pgw4era.intermediate."""
+
+import struct
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from pgw4era.intermediate import (
+    FIELDS2D_CRYOWRF,
+    FIELDS2D_WRF,
+    FIELDS3D,
+    IntermediateFile,
+    IntermediateWriter,
+    select_writer,
+    write_intermediate,
+)
+
+PLVS = [100000.0, 85000.0, 50000.0]
+NLAT, NLON = 4, 6
+
+
+def _read_records(path: Path) -> list[bytes]:
+    """Split a big-endian Fortran unformatted file into its records."""
+    records = []
+    data = path.read_bytes()
+    pos = 0
+    while pos < len(data):
+        (size,) = struct.unpack(">i", data[pos : pos + 4])
+        records.append(data[pos + 4 : pos + 4 + size])
+        assert data[pos + 4 + size : pos + 8 + size] == data[pos : pos + 4]
+        pos += 8 + size
+    return records
+
+
+def _fields(n2d: int = len(FIELDS2D_WRF)) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    fields3d = rng.normal(size=(len(FIELDS3D), len(PLVS), NLAT, NLON)).astype("float32")
+    fields2d = rng.normal(size=(n2d, NLAT, NLON)).astype("float32")
+    return fields3d, fields2d
+
+
+def _write(path: Path, nlat: int = NLAT, nlon: int = NLON) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(nlat)
+    fields3d = rng.normal(size=(len(FIELDS3D), len(PLVS), nlat, nlon)).astype("float32")
+    fields2d = rng.normal(size=(len(FIELDS2D_WRF), nlat, nlon)).astype("float32")
+    write_intermediate(
+        path, PLVS, fields3d, fields2d, "2009-06-01_00-00-00", 45.0, -10.0, 0.3, -0.3
+    )
+    return fields3d, fields2d
+
+
+def _to_little_endian(records: list[bytes]) -> bytes:
+    """Rewrite the records of a big-endian intermediate file in little-endian order."""
+    out = b""
+    for n, record in enumerate(records):
+        kind = n % 5
+        if kind == 1:
+            values = struct.unpack(">24sf32s9s25s46sfiii", record)
+            record = struct.pack("<24sf32s9s25s46sfiii", *values)
+        elif kind == 2:
+            record = struct.pack("<8sfffff", *struct.unpack(">8sfffff", record))
+        elif kind == 4:
+            record = np.frombuffer(record, dtype=">f4").astype("<f4").tobytes()
+        else:
+            record = struct.pack("<i", *struct.unpack(">i", record))
+        marker = struct.pack("<i", len(record))
+        out += marker + record + marker
+    return out
+
+
+class TestWriteIntermediate:
+    def test_record_layout(self, tmp_path: Path):
+        fields3d, fields2d = _fields()
+        path = tmp_path / "ERA5:2009-06-01_00"
+        write_intermediate(
+            path, PLVS, fields3d, fields2d, "2009-06-01_00-00-00", 45.0, -10.0, 0.3, -0.3
+        )
+
+        records = _read_records(path)
+        nslabs = len(FIELDS3D) * len(PLVS) + len(FIELDS2D_WRF)
+        assert len(records) == 5 * nslabs
+
+        version, header, grid, wind, slab = records[:5]
+        assert struct.unpack(">i", version) == (5,)
+        hdate, xfcst, source, field, units, desc, xlvl, nx, ny, iproj = struct.unpack(
+            ">24sf32s9s25s46sfiii", header
+        )
+        assert hdate == b"2009-06-01_00-00-00".ljust(24)
+        assert xfcst == 0.0
+        assert source.rstrip() == b"ERA5"
+        assert (field.rstrip(), units.rstrip(), desc.rstrip()) == (
+            b"RH",
+            b"percent",
+            b"Relative Humidity",
+        )
+        assert (xlvl, nx, ny, iproj) == (100000.0, NLON, NLAT, 0)
+        startloc, *values = struct.unpack(">8sfffff", grid)
+        assert startloc == b"SWCORNER"
+        np.testing.assert_allclose(values, [45.0, -10.0, -0.3, 0.3, 6367.470215])
+        assert struct.unpack(">i", wind) == (0,)
+        np.testing.assert_array_equal(
+            np.frombuffer(slab, dtype=">f4").reshape(NLAT, NLON), fields3d[0, 0]
+        )
+
+    def test_surface_levels(self, tmp_path: Path):
+        fields3d, fields2d = _fields()
+        path = tmp_path / "out"
+        write_intermediate(path, PLVS, fields3d, fields2d, "2009-06-01_00", 0.0, 0.0, 1.0, -1.0)
+
+        records = _read_records(path)
+        offset = 5 * len(FIELDS3D) * len(PLVS)
+        for nf, (name, _, _) in enumerate(FIELDS2D_WRF):
+            header = records[offset + 5 * nf + 1]
+            field = struct.unpack(">24sf32s9s", header[:69])[3]
+            (xlvl,) = struct.unpack(">f", header[-16:-12])
+            assert field.rstrip() == name.encode()
+            assert xlvl == (201300.0 if name == "PMSL" else 200100.0)
+            slab = np.frombuffer(records[offset + 5 * nf + 4], dtype=">f4")
+            np.testing.assert_array_equal(slab.reshape(NLAT, NLON), fields2d[nf])
+
+
+class TestIntermediateWriter:
+    def test_writeint_filename(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.chdir(tmp_path)
+        fields3d, fields2d = _fields(len(FIELDS2D_CRYOWRF))
+        writer = IntermediateWriter(FIELDS3D, FIELDS2D_CRYOWRF)
+        args = (NLAT, NLON, 45.0, -10.0, 0.3, -0.3)
+        writer.writeint(PLVS, fields3d, fields2d, "2009-06-01_03-00-00", *args)
+        writer.writeint(PLVS, fields3d, fields2d, "2009-06-01_06-00-00", *args)
+
+        assert sorted(p.name for p in tmp_path.iterdir()) == [
+            "ERA5:2009-06-01_03",
+            "ERA5:2009-06-01_06",
+        ]
+        reference = tmp_path / "reference"
+        write_intermediate(
+            reference,
+            PLVS,
+            fields3d,
+            fields2d,
+            "2009-06-01_06-00-00",
+            45.0,
+            -10.0,
+            0.3,
+            -0.3,
+            names2d=FIELDS2D_CRYOWRF,
+        )
+        assert (tmp_path / "ERA5:2009-06-01_06").read_bytes() == reference.read_bytes()
+
+    def test_shape_mismatch(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.chdir(tmp_path)
+        fields3d, fields2d = _fields()
+        with pytest.raises(ValueError, match="expected"):
+            IntermediateWriter().writeint(
+                PLVS, fields3d, fields2d, "2009-06-01_00", NLAT + 1, NLON, 0.0, 0.0, 1.0, -1.0
+            )
+
+
+class TestSelectWriter:
+    def test_numpy(self, tmp_path: Path):
+        writer = select_writer("numpy", "outputInter", str(tmp_path), tuple(FIELDS2D_WRF))
+        assert isinstance(writer, IntermediateWriter)
+
+    def test_auto_falls_back_to_numpy(self, tmp_path: Path):
+        writer = select_writer("auto", "no_such_module", str(tmp_path), tuple(FIELDS2D_WRF))
+        assert isinstance(writer, IntermediateWriter)
+
+    def test_fortran_missing(self, tmp_path: Path):
+        with pytest.raises(ImportError, match="f2py -c no_such_module.f90"):
+            select_writer("fortran", "no_such_module", str(tmp_path), tuple(FIELDS2D_WRF))
+
+    def test_unknown_backend(self, tmp_path: Path):
+        with pytest.raises(ValueError, match="Unknown writer backend"):
+            select_writer("cython", "outputInter", str(tmp_path), tuple(FIELDS2D_WRF))
+
+
+class TestIntermediateFile:
+    def test_index_and_views(self, tmp_path: Path):
+        path = tmp_path / "ERA5:2009-06-01_00"
+        fields3d, fields2d = _write(path)
+
+        with IntermediateFile(path) as ifile:
+            assert len(ifile) == len(FIELDS3D) * len(PLVS) + len(FIELDS2D_WRF)
+            assert ifile.keys()[0] == ("RH", 100000.0)
+            assert ("PMSL", 201300.0) in ifile
+            slab = ifile[("TT", 85000.0)]
+            assert slab.dtype == np.dtype(">f4")
+            assert not slab.flags.writeable and not slab.flags.owndata
+            np.testing.assert_array_equal(slab, fields3d[1, 1])
+            np.testing.assert_array_equal(ifile[("SKINTEMP", 200100)], fields2d[6])
+
+            header = ifile.field("GHT", 50000.0)
+            assert (header.units, header.desc) == ("m", "Height")
+            assert (header.hdate, header.map_source) == ("2009-06-01_00-00-00", "ERA5")
+            assert (header.nlats, header.nlons, header.iproj) == (NLAT, NLON, 0)
+            with pytest.raises(KeyError):
+                ifile.field("SNOW", 200100.0)
+        # Views outlive the file
+        np.testing.assert_array_equal(slab, fields3d[1, 1])
+
+    def test_lazy_iteration_in_file_order(self, tmp_path: Path):
+        path = tmp_path / "out"
+        fields3d, fields2d = _write(path)
+        expected = [slab for field in fields3d for slab in field] + list(fields2d)
+
+        with IntermediateFile(path) as ifile:
+            items = ifile.items()
+            header, slab = next(items)
+            assert header.key == ("RH", 100000.0)
+            rest = list(items)
+            assert len(rest) + 1 == len(expected)
+            for (_, slab), reference in zip([(header, slab)] + rest, expected):
+                np.testing.assert_array_equal(slab, reference)
+            assert [f.key for f in ifile] == ifile.keys()
+
+    def test_mixed_grids(self, tmp_path: Path):
+        """Files whose slabs have different grids are indexed record by record."""
+        _write(tmp_path / "a")
+        fields3d, _ = _write(tmp_path / "b", nlat=NLAT + 2)
+        path = tmp_path / "mixed"
+        path.write_bytes((tmp_path / "a").read_bytes() + (tmp_path / "b").read_bytes())
+
+        with IntermediateFile(path) as ifile:
+            assert len(ifile) == 2 * (len(FIELDS3D) * len(PLVS) + len(FIELDS2D_WRF))
+            entries = ifile.fields
+            second = entries[len(entries) // 2]
+            assert second.nlats == NLAT + 2
+            np.testing.assert_array_equal(ifile.slab(second), fields3d[0, 0])
+            # Keys already present in the first part are indexed to their first slab
+            assert ifile[("RH", 100000.0)].shape == (NLAT, NLON)
+
+    def test_little_endian(self, tmp_path: Path):
+        fields3d, _ = _write(tmp_path / "big")
+        path = tmp_path / "little"
+        path.write_bytes(_to_little_endian(_read_records(tmp_path / "big")))
+
+        with IntermediateFile(path) as ifile:
+            assert ifile.byteorder == "<"
+            assert ifile.field("TT", 50000.0).nlons == NLON
+            np.testing.assert_array_equal(ifile[("TT", 50000.0)], fields3d[1, 2])
+
+    def test_empty_file(self, tmp_path: Path):
+        path = tmp_path / "empty"
+        path.touch()
+        with IntermediateFile(path) as ifile:
+            assert len(ifile) == 0
+            assert ifile.keys() == []
+
+    @pytest.mark.parametrize("cut", [3, 100, -1])
+    def test_truncated_file(self, tmp_path: Path, cut: int):
+        _write(tmp_path / "out")
+        path = tmp_path / "truncated"
+        path.write_bytes((tmp_path / "out").read_bytes()[:cut])
+        with pytest.raises(ValueError, match="truncated|corrupt"):
+            IntermediateFile(path)
@@ -0,0 +1,181 @@
+"""Tests for pgw4era.manifest."""
+
+import os
+import pickle
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from pgw4era.manifest import MANIFEST_NAME, Manifest, config_digest
+from pgw4era.utils import checkfile
+
+
+def _touch(path: Path, content: bytes, mtime_ns: int) -> Path:
+    path.write_bytes(content)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+@pytest.fixture()
+def inputs(tmp_path: Path) -> dict[str, Path]:
+    return {
+        name: _touch(tmp_path / name, name.encode(), 10**18)
+        for name in ("anom.nc", "era5_daily_pl.nc", "era5_daily_sfc.nc")
+    }
+
+
+@pytest.fixture()
+def output(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    # Output names are relative to the working directory, as in the writers
+    monkeypatch.chdir(tmp_path)
+    return Path("ERA5:2009-06-01_00")
+
+
+def _manifest(tmp_path: Path, inputs: dict[str, Path], **kwargs) -> Manifest:
+    cfg = SimpleNamespace(precision="float32", syear=2009, **kwargs.pop("cfg", {}))
+    return Manifest(tmp_path / MANIFEST_NAME, [inputs["anom.nc"]], cfg, **kwargs)
+
+
+def _day(inputs: dict[str, Path]) -> list[Path]:
+    return [inputs["era5_daily_pl.nc"], inputs["era5_daily_sfc.nc"]]
+
+
+class TestConfigDigest:
+    def test_run_settings_ignored(self):
+        cfg = SimpleNamespace(precision="float32", syear=2009, writer_backend="auto")
+        other = SimpleNamespace(precision="float32", syear=1990, writer_backend="numpy")
+        assert config_digest(cfg) == config_digest(other)
+
+    def test_output_settings_change_digest(self):
+        cfg = SimpleNamespace(precision="float32", periods=[[2004, 2023], [2031, 2050]])
+        other = SimpleNamespace(precision="float64", periods=[[2004, 2023], [2031, 2050]])
+        assert config_digest(cfg) != config_digest(other)
+
+    def test_path_and_upstream_settings_ignored(self, tmp_path):
+        cfg = SimpleNamespace(
+            precision="float32",
+            domain={"lat_min": 30.0, "lat_max": 50.0, "lon_min": -15.0, "lon_max": 40.0},
+            regrid_grid="era5_grid",
+            regrid_method="bilinear",
+            regrid_cache_dir=None,
+            ensemble_statistics=["mean"],
+            ensemble_weights=None,
+            ensemble_max_missing=1.0,
+            pinterp_method="linear",
+            pinterp_below="linear",
+            pinterp_above="linear",
+            anomaly_pack=None,
+            anomaly_cube=None,
+        )
+        other = SimpleNamespace(
+            **{
+                **vars(cfg),
+                "regrid_grid": str(tmp_path / "era5_grid"),
+                "regrid_method": "conservative",
+                "regrid_cache_dir": str(tmp_path / "weights"),
+                "ensemble_statistics": ["mean", "median"],
+                "ensemble_weights": {"MPI-ESM1-2-HR": 2.0},
+                "ensemble_max_missing": 0.5,
+                "pinterp_method": "log",
+                "pinterp_below": "constant",
+                "pinterp_above": "nan",
+                "anomaly_pack": str(tmp_path / "anomaly_pack.bin"),
+                "anomaly_cube": str(tmp_path / "anomaly_cube.bin"),
+                "some_future_key": 1,
+            }
+        )
+        assert config_digest(cfg) == config_digest(other)
+
+    def test_domain_digested_through_its_bounds(self):
+        bounds = {"lat_min": 30.0, "lat_max": 50.0, "lon_min": -15.0, "lon_max": 40.0}
+        cfg = SimpleNamespace(precision="float32", domain=bounds)
+        other = SimpleNamespace(precision="float32", domain={**bounds, "halo": 0.0})
+        assert config_digest(cfg) == config_digest(other)
+        other.domain["halo"] = 3.0
+        assert config_digest(cfg) != config_digest(other)
+
+
+class TestManifest:
+    def test_record_and_check(self, tmp_path, inputs, output):
+        with _manifest(tmp_path, inputs) as manifest:
+            digest = manifest.digest(_day(inputs))
+            assert not manifest.is_current(output, digest)
+            output.write_bytes(b"complete")
+            manifest.record(output, digest)
+            assert manifest.is_current(output, digest)
+        # Persistent across runs
+        with _manifest(tmp_path, inputs) as manifest:
+            assert manifest.is_current(output, manifest.digest(_day(inputs)))
+
+    def test_incomplete_or_missing_output(self, tmp_path, inputs, output):
+        with _manifest(tmp_path, inputs) as manifest:
+            digest = manifest.digest(_day(inputs))
+            output.write_bytes(b"complete")
+            manifest.record(output, digest)
+            output.write_bytes(b"trunc")
+            assert not manifest.is_current(output, digest)
+            output.unlink()
+            assert not manifest.is_current(output, digest)
+
+    @pytest.mark.parametrize("changed", ["anom.nc", "era5_daily_sfc.nc", "config"])
+    def test_changed_inputs(self, tmp_path, inputs, output, changed):
+        with _manifest(tmp_path, inputs) as manifest:
+            output.write_bytes(b"complete")
+            manifest.record(output, manifest.digest(_day(inputs)))
+
+        cfg = {}
+        if changed == "config":
+            cfg["variables_3d"] = ["ta"]
+        else:
+            _touch(inputs[changed], b"new", 2 * 10**18)
+        with _manifest(tmp_path, inputs, cfg=cfg) as manifest:
+            assert not manifest.is_current(output, manifest.digest(_day(inputs)))
+
+    def test_checksums_ignore_mtime(self, tmp_path, inputs):
+        with _manifest(tmp_path, inputs, checksums=True) as manifest:
+            before = manifest.digest(_day(inputs))
+        _touch(inputs["anom.nc"], b"anom.nc", 2 * 10**18)
+        with _manifest(tmp_path, inputs, checksums=True) as manifest:
+            assert manifest.digest(_day(inputs)) == before
+        _touch(inputs["anom.nc"], b"changed", 3 * 10**18)
+        with _manifest(tmp_path, inputs, checksums=True) as manifest:
+            assert manifest.digest(_day(inputs)) != before
+
+    def test_pickle(self, tmp_path, inputs, output):
+        manifest = _manifest(tmp_path, inputs)
+        digest = manifest.digest(_day(inputs))
+        output.write_bytes(b"complete")
+        copy = pickle.loads(pickle.dumps(manifest))
+        copy.record(output, digest)
+        copy.close()
+        assert manifest.is_current(output, digest)
+        manifest.close()
+
+    def test_from_config(self, tmp_path, inputs):
+        cfg = SimpleNamespace(
+            manifest=False,
+            ERA5netcdf_dir=str(tmp_path),
+            ERA5_sfc_ref_file="era5_daily_sfc.nc",
+            variables_3d=[],
+            variables_2d=[],
+        )
+        assert Manifest.from_config(cfg, tmp_path) is None
+        cfg.manifest = True
+        manifest = Manifest.from_config(cfg, tmp_path)
+        assert manifest.path == (tmp_path / MANIFEST_NAME).resolve()
+
+
+class TestCheckfile:
+    def test_manifest_decides_for_existing_files(self, tmp_path, inputs, output):
+        with _manifest(tmp_path, inputs) as manifest:
+            digest = manifest.digest(_day(inputs))
+            assert checkfile(str(output), False, manifest, digest)
+            output.write_bytes(b"partial")
+            assert checkfile(str(output), False, manifest, digest)
+            manifest.record(output, digest)
+            assert not checkfile(str(output), False, manifest, digest)
+            assert checkfile(str(output), True, manifest, digest)
+            # Without manifest, existing files are kept
+            output.write_bytes(b"other")
+            assert not checkfile(str(output), False)
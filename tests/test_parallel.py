@@ -0,0 +1,64 @@
+"""Tests for pgw4era.parallel."""
+
+import datetime as dt
+
+import numpy as np
+import pytest
+
+from pgw4era.anomalies import AnomalyCube, compile_anomaly_cube, compile_anomaly_pack
+from pgw4era.parallel import run_parallel
+from tests.test_anomalies import cfg  # noqa: F401  (fixture)
+
+
+def _fake_day(date, _cfg, anoms, out_dir):
+    """Stand-in for a writer's process_day: dump one anomaly value per day."""
+    if date.day == 3:
+        raise OSError("missing ERA5 file")
+    value = anoms.month("tas", date.month - 1)[0, 0]
+    (out_dir / f"{date:%Y%m%d}").write_text(str(value))
+    return 1
+
+
+def _fake_cube_day(date, _cfg, anoms, out_dir):
+    """Stand-in for a writer's process_day in the day-of-year mode."""
+    value = anoms.field("tas", dt.datetime(date.year, date.month, date.day, 12))[0, 0]
+    (out_dir / f"{date:%Y%m%d}").write_text(str(value))
+    return 1
+
+
+class TestRunParallel:
+    def test_all_days_processed(self, cfg, tmp_path, capsys):  # noqa: F811
+        days = [dt.date(2009, 6, 1), dt.date(2009, 7, 2)]
+        run_parallel(_fake_day, days, cfg, 2, tmp_path)
+        for date in days:
+            value = float((tmp_path / f"{date:%Y%m%d}").read_text())
+            assert value == cfg.data["tas"][date.month - 1, 0, 0]
+        out = capsys.readouterr().out
+        assert out.index("[1/2] 2009-06-01") < out.index("[2/2] 2009-07-02")
+
+    def test_anomaly_pack(self, cfg, tmp_path, capsys):  # noqa: F811
+        cfg.anomaly_pack = str(compile_anomaly_pack(cfg, tmp_path / "anomaly_pack.bin"))
+        days = [dt.date(2009, 6, 1), dt.date(2009, 8, 2)]
+        run_parallel(_fake_day, days, cfg, 2, tmp_path)
+        for date in days:
+            value = float((tmp_path / f"{date:%Y%m%d}").read_text())
+            assert value == cfg.data["tas"][date.month - 1, 0, 0]
+
+    def test_anomaly_cube(self, cfg, tmp_path, capsys):  # noqa: F811
+        cfg.anomaly_mode = "doy"
+        cfg.anomaly_cube = str(compile_anomaly_cube(cfg, tmp_path / "anomaly_cube.bin"))
+        days = [dt.date(2009, 6, 1), dt.date(2012, 2, 29)]
+        run_parallel(_fake_cube_day, days, cfg, 2, tmp_path)
+        with AnomalyCube.from_config(cfg) as anoms:
+            for date in days:
+                value = float((tmp_path / f"{date:%Y%m%d}").read_text())
+                time = dt.datetime(date.year, date.month, date.day, 12)
+                assert np.float32(value) == anoms.field("tas", time)[0, 0]
+
+    def test_failures_summarised(self, cfg, tmp_path, capsys):  # noqa: F811
+        days = [dt.date(2009, 6, d) for d in range(1, 6)]
+        with pytest.raises(RuntimeError, match="1 of 5 day.*2009-06-03"):
+            run_parallel(_fake_day, days, cfg, 2, tmp_path)
+        assert len(list(tmp_path.glob("2009*"))) == 4
+        assert "missing ERA5 file" in capsys.readouterr().out
+        assert np.isfinite(float((tmp_path / "20090605").read_text()))
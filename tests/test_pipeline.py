@@ -0,0 +1,85 @@
+"""Tests for pgw4era.pipeline."""
+
+import threading
+
+import pytest
+
+from pgw4era.pipeline import run_pipeline
+
+
+def _steps(item: int):
+    for n in range(3):
+        yield (item, n)
+
+
+class TestRunPipeline:
+    def test_results_written_in_order(self):
+        written = []
+        nwritten = run_pipeline(range(4), _steps, lambda s: s[0] * 10 + s[1], written.append)
+        assert nwritten == 12
+        assert written == [item * 10 + n for item in range(4) for n in range(3)]
+
+    def test_stages_run_in_their_threads(self):
+        threads = {"read": set(), "compute": set(), "write": set()}
+
+        def read(item):
+            threads["read"].add(threading.current_thread().name)
+            yield item
+
+        def compute(step):
+            threads["compute"].add(threading.current_thread().name)
+            return step
+
+        def write(result):
+            threads["write"].add(threading.current_thread().name)
+
+        run_pipeline(range(5), read, compute, write, depth=1)
+        assert threads["read"] == {"pgw4era-reader"}
+        assert threads["compute"] == {threading.current_thread().name}
+        assert threads["write"] == {"pgw4era-writer"}
+
+    def test_bounded_queues(self):
+        """The reader never runs more than the queue depths ahead of the writer."""
+        produced = []
+        written = []
+        lead = []
+
+        def read(item):
+            produced.append(item)
+            lead.append(len(produced) - len(written))
+            yield item
+
+        run_pipeline(range(50), read, lambda s: s, written.append, depth=2)
+        assert written == list(range(50))
+        # depth steps in each queue, plus one in each of the three stages
+        assert max(lead) <= 2 * 2 + 3
+
+    @pytest.mark.parametrize("stage", ["read", "compute", "write"])
+    def test_error_stops_pipeline(self, stage: str):
+        closed = []
+
+        def read(item):
+            try:
+                if stage == "read" and item == 2:
+                    raise OSError("cannot read")
+                yield item
+            finally:
+                closed.append(item)
+
+        def compute(step):
+            if stage == "compute" and step == 2:
+                raise ValueError("cannot blend")
+            return step
+
+        def write(result):
+            if stage == "write" and result == 2:
+                raise OSError("cannot write")
+
+        with pytest.raises((OSError, ValueError), match="cannot"):
+            run_pipeline(range(100), read, compute, write, depth=1)
+        assert len(closed) < 100
+        assert threading.active_count() == 1
+
+    def test_invalid_depth(self):
+        with pytest.raises(ValueError, match="depth"):
+            run_pipeline([], _steps, lambda s: s, print, depth=0)
@@ -0,0 +1,203 @@
+"""Tests for pgw4era.regrid."""
+
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from pgw4era import regrid
+from pgw4era.regrid import (
+    GridDescription,
+    Regridder,
+    get_regridder,
+    read_grid_description,
+    regrid_netcdf,
+    write_grid_description,
+)
+
+GRIDDES = """\
+#
+# gridID 1
+#
+gridtype  = lonlat
+gridsize  = 12
+xsize     = 4
+ysize     = 3
+xname     = lon
+xlongname = "longitude"
+xunits    = "degrees_east"
+yname     = lat
+ylongname = "latitude"
+yunits    = "degrees_north"
+xfirst    = 0
+xinc      = 90
+yvals     = 45 0
+            -45
+"""
+
+
+def _grid(lat, lon) -> GridDescription:
+    return GridDescription("lonlat", len(lon), len(lat), xvals=tuple(lon), yvals=tuple(lat))
+
+
+class TestReadGridDescription:
+    def test_lonlat(self, tmp_path):
+        path = tmp_path / "grid"
+        path.write_text(GRIDDES)
+        grid = read_grid_description(path)
+        np.testing.assert_array_equal(grid.lon, [0, 90, 180, 270])
+        np.testing.assert_array_equal(grid.lat, [45, 0, -45])
+        assert grid.xlongname == "longitude"
+
+    def test_repo_era5_grid(self):
+        grid = read_grid_description(Path(__file__).parents[1] / "era5_grid")
+        assert grid.lon.shape == (1200,) and grid.lat.shape == (601,)
+        assert grid.lat[0] == 90.0 and grid.lat[-1] == pytest.approx(-90.0)
+
+    def test_unsupported_grid(self, tmp_path):
+        path = tmp_path / "grid"
+        path.write_text(GRIDDES.replace("lonlat", "curvilinear"))
+        with pytest.raises(ValueError, match="unsupported gridtype"):
+            read_grid_description(path)
+
+    def test_wrong_number_of_values(self, tmp_path):
+        path = tmp_path / "grid"
+        path.write_text(GRIDDES.replace("ysize     = 3", "ysize     = 4"))
+        with pytest.raises(ValueError, match="yvals has 3 values"):
+            read_grid_description(path)
+
+    def test_write_roundtrip(self, tmp_path):
+        (tmp_path / "grid").write_text(GRIDDES)
+        grid = read_grid_description(tmp_path / "grid")
+        write_grid_description(grid, tmp_path / "copy")
+        assert read_grid_description(tmp_path / "copy") == grid
+        # As written by cdo griddes
+        assert (tmp_path / "copy").read_text() == GRIDDES.replace(
+            "45 0\n            -45", "45 0 -45"
+        )
+
+
+class TestBilinear:
+    def test_exact_on_linear_field(self):
+        src_lat, src_lon = np.linspace(-60, 60, 7), np.linspace(10, 50, 9)
+        dst_lat, dst_lon = np.linspace(-50, 55, 11), np.linspace(12, 48, 13)
+        field = 2.0 * src_lat[:, None] - 0.5 * src_lon[None, :]
+        out = Regridder.from_coords(src_lat, src_lon, dst_lat, dst_lon)(field)
+        np.testing.assert_allclose(out, 2.0 * dst_lat[:, None] - 0.5 * dst_lon[None, :])
+
+    def test_cyclic_wraps_and_converts_longitudes(self):
+        # Source in -180..180, target in 0..360, across the dateline
+        src_lon = np.arange(-180.0, 180.0, 10.0)
+        src_lat = np.array([-10.0, 10.0])
+        field = np.broadcast_to(np.cos(np.deg2rad(src_lon)), (2, len(src_lon)))
+        dst_lon = np.array([0.0, 175.0, 185.0, 355.0])
+        out = Regridder.from_coords(src_lat, src_lon, [0.0], dst_lon)(field)
+        across = 0.5 * (np.cos(np.deg2rad(170.0)) - 1.0)
+        expected = [1.0, across, across, 0.5 * (np.cos(np.deg2rad(-10.0)) + 1.0)]
+        np.testing.assert_allclose(out[0], expected)
+
+    def test_polar_caps_and_regional_bounds(self):
+        src_lat, src_lon = np.array([-80.0, 0.0, 80.0]), np.arange(0.0, 360.0, 90.0)
+        field = np.repeat(src_lat[:, None], 4, axis=1)
+        out = Regridder.from_coords(src_lat, src_lon, [90.0, -90.0], [0.0])(field)
+        np.testing.assert_array_equal(out[:, 0], [80.0, -80.0])
+
+        regional = Regridder.from_coords(src_lat, [0.0, 90.0], [90.0, 40.0], [45.0, 135.0])
+        out = regional(field[:, :2])
+        assert np.isnan(out[0]).all() and np.isnan(out[1, 1])
+        assert out[1, 0] == pytest.approx(40.0)
+
+    def test_missing_values_propagate(self):
+        src = np.linspace(0, 30, 4)
+        field = np.ma.masked_array(np.ones((4, 4)), mask=False)
+        field[1, 1] = np.ma.masked
+        out = Regridder.from_coords(src, src, [5.0, 25.0, 10.0], [5.0, 25.0, 10.0])(field)
+        assert np.isnan(out[0, 0]) and np.isnan(out[2, 2])
+        assert out[1, 1] == 1.0 and out[0, 1] == 1.0
+
+    def test_leading_axes_and_chunks(self):
+        src = np.linspace(0, 30, 4)
+        data = np.random.default_rng(0).random((12, 3, 4, 4)).astype("float32")
+        regridder = Regridder.from_coords(src, src, [5.0, 15.0], [5.0, 15.0, 25.0])
+        whole = regridder(data)
+        assert whole.shape == (12, 3, 2, 3) and whole.dtype == np.float32
+        np.testing.assert_array_equal(regridder(data, chunk_mb=1e-4), whole)
+        np.testing.assert_allclose(whole[4, 1], regridder(data[4, 1]))
+
+
+class TestConservative:
+    def test_constant_field_and_global_mean(self):
+        src_lat, src_lon = np.linspace(-87.5, 87.5, 36), np.arange(-177.5, 180.0, 5.0)
+        dst_lat, dst_lon = np.linspace(-89.0, 89.0, 90), np.arange(0.0, 360.0, 3.0)
+        regridder = Regridder.from_coords(src_lat, src_lon, dst_lat, dst_lon, "conservative")
+        np.testing.assert_allclose(regridder(np.full((36, 72), 7.0)), 7.0)
+
+        field = np.random.default_rng(1).random((36, 72))
+
+        def area_mean(values, lat):
+            weights = np.cos(np.deg2rad(lat))[:, None] * np.ones_like(values)
+            return (values * weights).sum() / weights.sum()
+
+        out = regridder(field)
+        assert area_mean(out, dst_lat) == pytest.approx(area_mean(field, src_lat), rel=1e-3)
+
+    def test_missing_cells_are_skipped(self):
+        src, dst = np.arange(0.5, 4.0), np.array([1.0, 3.0])
+        field = np.ones((4, 4))
+        field[0, :2] = [np.nan, 4.0]
+        out = Regridder.from_coords(src, src, dst, dst, "conservative")(field)
+        assert out[0, 0] == pytest.approx(2.0, rel=1e-3)
+        np.testing.assert_allclose(out.ravel()[1:], 1.0)
+
+
+def test_weights_cached_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(regrid, "_WEIGHTS", {})
+    src_lat, src_lon = np.linspace(-80, 80, 9), np.arange(0.0, 360.0, 40.0)
+    target = _grid(np.linspace(-60, 60, 5), np.arange(0.0, 360.0, 60.0))
+    first = get_regridder(src_lat, src_lon, target, cache_dir=tmp_path)
+    assert get_regridder(src_lat, src_lon, target, cache_dir=tmp_path) is first
+    (cached,) = tmp_path.glob("bilinear_*.npz")
+
+    monkeypatch.setattr(regrid, "_WEIGHTS", {})
+    monkeypatch.setattr(Regridder, "from_coords", lambda *args: pytest.fail("weights recomputed"))
+    loaded = get_regridder(src_lat, src_lon, target, cache_dir=tmp_path)
+    assert (loaded.weights != first.weights).nnz == 0
+    np.testing.assert_array_equal(loaded.valid, first.valid)
+
+
+def test_regrid_netcdf(tmp_path):
+    src_path, dst_path = tmp_path / "delta.nc", tmp_path / "delta_era5.nc"
+    src_lat, src_lon = np.linspace(-75, 75, 7), np.arange(0.0, 360.0, 30.0)
+    with nc.Dataset(src_path, "w") as ds:
+        ds.history = "test"
+        ds.createDimension("time", None)
+        ds.createDimension("plev", 2)
+        ds.createDimension("lat", len(src_lat))
+        ds.createDimension("lon", len(src_lon))
+        ds.createDimension("bnds", 2)
+        ds.createVariable("time", "f8", ("time",))[:] = np.arange(12)
+        ds.variables["time"].units = "days since 2004-01-01"
+        ds.createVariable("plev", "f8", ("plev",))[:] = [85000.0, 50000.0]
+        ds.createVariable("lat", "f8", ("lat",))[:] = src_lat
+        ds.createVariable("lon", "f8", ("lon",))[:] = src_lon
+        ds.createVariable("lat_bnds", "f8", ("lat", "bnds"))[:] = 0.0
+        ta = ds.createVariable("ta", "f4", ("time", "plev", "lat", "lon"), fill_value=1e20)
+        ta.units = "K"
+        ta[:] = np.broadcast_to(src_lat[:, None], (12, 2, 7, 12))
+
+    target = _grid(np.linspace(60, -60, 5), np.arange(0.0, 360.0, 45.0))
+    regrid_netcdf(src_path, dst_path, target, cache_dir=tmp_path / "weights")
+
+    assert not list(tmp_path.glob("*.part"))
+    with nc.Dataset(dst_path) as ds:
+        assert ds.history == "test"
+        assert "lat_bnds" not in ds.variables
+        assert ds.variables["ta"].dimensions == ("time", "plev", "lat", "lon")
+        assert ds.variables["ta"].units == "K"
+        np.testing.assert_array_equal(ds.variables["lat"][:], target.lat)
+        np.testing.assert_array_equal(ds.variables["time"][:], np.arange(12))
+        np.testing.assert_array_equal(ds.variables["plev"][:], [85000.0, 50000.0])
+        ta = ds.variables["ta"][:]
+        assert ta.shape == (12, 2, 5, 8)
+        np.testing.assert_allclose(ta, np.broadcast_to(target.lat[:, None], ta.shape), atol=1e-4)
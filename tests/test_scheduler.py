@@ -0,0 +1,89 @@
+"""Tests for pgw4era.scheduler."""
+
+import json
+import os
+import time
+
+import pytest
+
+from pgw4era.scheduler import Task, run_tasks
+
+
+def _write(path, text):
+    path.write_text(text)
+
+
+def _flaky(path):
+    """Fail on the first attempt, succeed on the second."""
+    if not path.exists():
+        path.write_text("first attempt")
+        raise OSError("transient failure")
+    path.write_text("done")
+
+
+def _fail(message):
+    raise ValueError(message)
+
+
+def _crash():
+    os._exit(1)
+
+
+def _timed(path, seconds):
+    start = time.monotonic()
+    time.sleep(seconds)
+    path.write_text(f"{start} {time.monotonic()}")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_all_tasks_run(tmp_path, workers, capsys):
+    tasks = [Task(f"t{n}", _write, (tmp_path / f"t{n}", str(n))) for n in range(4)]
+    results = run_tasks(tasks, workers=workers, summary=tmp_path / "summary.json")
+    assert [result.name for result in results] == ["t0", "t1", "t2", "t3"]
+    assert all(result.ok and result.attempts == 1 for result in results)
+    assert (tmp_path / "t3").read_text() == "3"
+    summary = json.loads((tmp_path / "summary.json").read_text())
+    assert summary["succeeded"] == 4 and summary["failed"] == 0
+    assert "Finished: 4 of 4 task(s) succeeded" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failures_retried_and_summarised(tmp_path, workers, capsys):
+    tasks = [
+        Task("flaky", _flaky, (tmp_path / "flaky",)),
+        Task("broken", _fail, ("no data for ssp585",)),
+        Task("fine", _write, (tmp_path / "fine", "ok")),
+    ]
+    flaky, broken, fine = run_tasks(tasks, workers=workers, retries=1)
+    assert flaky.ok and flaky.attempts == 2 and flaky.error is None
+    assert not broken.ok and broken.attempts == 2
+    assert broken.error.startswith("ValueError: no data for ssp585")
+    assert fine.ok and (tmp_path / "fine").read_text() == "ok"
+    out = capsys.readouterr().out
+    assert "flaky FAILED (attempt 1), retrying" in out
+    assert "1 task(s) failed:\n  broken: ValueError: no data for ssp585" in out
+
+
+def test_memory_budget(tmp_path):
+    # The two large tasks must not overlap; the small one runs beside them
+    tasks = [
+        Task("small", _timed, (tmp_path / "small", 0.1), memory_mb=10),
+        Task("big1", _timed, (tmp_path / "big1", 0.3), memory_mb=600),
+        Task("big2", _timed, (tmp_path / "big2", 0.3), memory_mb=600),
+    ]
+    assert all(result.ok for result in run_tasks(tasks, workers=3, memory_mb=1000))
+    (start1, end1), (start2, end2) = (
+        map(float, (tmp_path / name).read_text().split()) for name in ("big1", "big2")
+    )
+    assert end1 <= start2 or end2 <= start1
+
+
+def test_worker_crash_does_not_stop_the_run(tmp_path):
+    # The budget keeps the crashing task alone in the pool, so only it fails
+    tasks = [Task("crash", _crash, memory_mb=100)] + [
+        Task(f"t{n}", _write, (tmp_path / f"t{n}", "ok"), memory_mb=1) for n in range(3)
+    ]
+    crash, *others = run_tasks(tasks, workers=2, memory_mb=100, retries=1)
+    assert not crash.ok and crash.attempts == 2
+    assert all(result.ok and result.attempts == 1 for result in others)
+    assert all((tmp_path / f"t{n}").exists() for n in range(3))
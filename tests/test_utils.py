@@ -3,8 +3,35 @@
 import datetime as dt
 
 import numpy as np
-
-from pgw4era.utils import calc_midmonth, calc_relhum
+import pytest
+
+from pgw4era.utils import (
+    calc_days,
+    calc_interp_schedule,
+    calc_interp_weights,
+    calc_midmonth,
+    calc_output_times,
+    calc_relhum,
+    compute_dtype,
+)
+
+
+def _reference_weights(proc_date: dt.datetime) -> tuple[int, int, float, int, bool]:
+    """Per-timestep branch logic formerly inlined in write_intermediate.run."""
+    midmonth = calc_midmonth(proc_date.year)
+    tdelta = np.asarray([(midmonth[i] - proc_date).total_seconds() for i in range(len(midmonth))])
+    tdelta_min = np.argmin(np.abs(tdelta))
+    if tdelta[tdelta_min] < 0:
+        i1 = (tdelta_min - 1) % 12
+        i2 = (tdelta_min) % 12
+        tdelta_before = np.abs(tdelta[tdelta_min])
+        tdelta_mid_month = (midmonth[tdelta_min + 1] - midmonth[tdelta_min]).total_seconds()
+    else:
+        i1 = (tdelta_min - 2) % 12
+        i2 = (tdelta_min - 1) % 12
+        tdelta_before = np.abs(tdelta[tdelta_min - 1])
+        tdelta_mid_month = (midmonth[tdelta_min] - midmonth[tdelta_min - 1]).total_seconds()
+    return i1, i2, tdelta_before / tdelta_mid_month, tdelta_min, np.min(np.abs(tdelta)) == 0
 
 
 class TestCalcMidmonth:
@@ -86,3 +113,89 @@ class TestCalcRelhum:
         rh_low = calc_relhum(np.array([-10.0]), t)
         rh_high = calc_relhum(np.array([15.0]), t)
         assert rh_high.item() > rh_low.item()
+
+
+class TestCalcInterpWeights:
+    def _assert_matches_reference(self, dates):
+        weights = calc_interp_weights(dates)
+        assert len(weights) == len(dates)
+        for date, rec in zip(dates, weights):
+            i1, i2, weight, nearest, exact = _reference_weights(date)
+            assert (rec["i1"], rec["i2"], rec["nearest"], rec["exact"]) == (
+                i1,
+                i2,
+                nearest,
+                exact,
+            ), date
+            # Bit-identical, not merely close
+            assert rec["weight"] == weight, date
+
+    def test_matches_reference_6hourly(self):
+        """Every 6-hourly time of a leap and two non-leap years must match."""
+        start = dt.datetime(2007, 12, 1)
+        dates = [start + dt.timedelta(hours=6 * i) for i in range(4 * (366 + 365 + 31 + 31))]
+        self._assert_matches_reference(dates)
+
+    def test_matches_reference_at_year_boundaries(self):
+        """Hourly times around 1 January exercise the mid-Dec/mid-Jan wrap."""
+        dates = []
+        for year in (2008, 2009, 2100):
+            start = dt.datetime(year - 1, 12, 15)
+            dates += [start + dt.timedelta(hours=i) for i in range(24 * 35)]
+        self._assert_matches_reference(dates)
+
+    def test_matches_reference_on_exact_midmonth(self):
+        """Times falling exactly on a mid-month take the single-month branch."""
+        dates = calc_midmonth(2009)[1:13]
+        self._assert_matches_reference(dates)
+        assert calc_interp_weights(dates)["exact"].all()
+
+    def test_first_timestep_of_year_uses_december(self):
+        rec = calc_interp_weights([dt.datetime(2009, 1, 1, 0)])[0]
+        assert rec["nearest"] == 0
+        assert (rec["i1"], rec["i2"]) == (11, 0)
+
+    def test_accepts_datetime64(self):
+        dates = [dt.datetime(2009, 6, 1, 6), dt.datetime(2009, 6, 20, 18)]
+        np.testing.assert_array_equal(
+            calc_interp_weights(np.asarray(dates, dtype="datetime64[s]")),
+            calc_interp_weights(dates),
+        )
+
+    def test_weight_in_unit_interval(self):
+        _, weights = calc_interp_schedule(2008, 1, 2010, 1)
+        assert np.all((weights["weight"] >= 0) & (weights["weight"] <= 1))
+
+
+class TestCalcOutputTimes:
+    def test_end_month_exclusive(self):
+        times = calc_output_times(2009, 6, 2009, 7)
+        assert times[0] == np.datetime64("2009-06-01T00:00:00")
+        assert times[-1] == np.datetime64("2009-06-30T21:00:00")
+        assert len(times) == 30 * 8
+
+    def test_frequency(self):
+        times = calc_output_times(2009, 12, 2010, 1, freq_hours=6)
+        assert len(times) == 31 * 4
+        assert np.all(np.diff(times) == np.timedelta64(6, "h"))
+
+
+class TestCalcDays:
+    def test_range(self):
+        days = calc_days(2009, 12, 2010, 2)
+        assert days[0] == dt.date(2009, 12, 1)
+        assert days[-1] == dt.date(2010, 1, 31)
+        assert len(days) == 62
+
+    def test_empty_when_end_not_after_start(self):
+        assert calc_days(2009, 6, 2009, 6) == []
+
+
+class TestComputeDtype:
+    def test_policies(self):
+        assert compute_dtype("float32") == np.float32
+        assert compute_dtype("float64") is None
+
+    def test_unknown_precision(self):
+        with pytest.raises(ValueError, match="precision"):
+            compute_dtype("float16")
@@ -0,0 +1,98 @@
+"""Tests for pgw4era.vinterp."""
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from pgw4era.ensemble import CMIP6_PLEVS
+from pgw4era.vinterp import VerticalInterpolator, interpolate_netcdf
+from pgw4era.wrf.write_intermediate import PLVS
+
+ERA5_PLEVS = np.array(PLVS[::-1])
+
+
+def _signal(path, data, plev=CMIP6_PLEVS):
+    ds = xr.Dataset(
+        {"ta": (("time", "plev", "lat", "lon"), data, {"units": "K"})},
+        coords={
+            "time": pd.date_range("2004-01-01", periods=data.shape[0], freq="MS"),
+            "plev": ("plev", plev, {"units": "Pa", "positive": "down"}),
+            "lat": [30.0, 0.0, -30.0],
+            "lon": [0.0, 120.0, 240.0, 300.0],
+        },
+    )
+    ds.to_netcdf(path, unlimited_dims="time")
+    return path
+
+
+@pytest.fixture()
+def data():
+    return np.random.default_rng(0).normal(size=(12, 19, 3, 4)).astype("float32")
+
+
+def test_matches_xarray_interp(data, tmp_path):
+    """The former ``fin.interp(plev=era5_plev, kwargs={"fill_value": "extrapolate"})``."""
+    target = np.concatenate([[50.0], ERA5_PLEVS, [101000.0]])
+    with xr.open_dataset(_signal(tmp_path / "ta.nc", data)) as fin:
+        expected = fin.interp(plev=target, kwargs={"fill_value": "extrapolate"}).ta.values
+    result = VerticalInterpolator(CMIP6_PLEVS, target)(data, axis=1)
+    assert result.dtype == np.float32 and result.shape == (12, 39, 3, 4)
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_log_pressure():
+    source = np.array([100000.0, 50000.0, 10000.0])
+    interpolator = VerticalInterpolator(source, [70710.678, 50000.0, 22360.68], method="log")
+    # Linear in log(p), so geometric midpoints fall halfway
+    result = interpolator(np.array([[1.0], [3.0], [7.0]]), axis=0)
+    np.testing.assert_allclose(result[:, 0], [2.0, 3.0, 5.0], rtol=1e-6)
+    with pytest.raises(ValueError, match="must be positive"):
+        VerticalInterpolator(source, [0.0], method="log")
+
+
+@pytest.mark.parametrize(
+    "option, expected", [("linear", [3.5, 0.5]), ("constant", [3.0, 1.0]), ("nan", [np.nan] * 2)]
+)
+def test_extrapolation(option, expected):
+    source = np.array([1000.0, 2000.0, 3000.0])
+    # Below the lowest level (higher pressure) and above the highest one
+    interpolator = VerticalInterpolator(source, [500.0, 3500.0], below=option, above=option)
+    result = interpolator(np.array([3.0, 2.0, 1.0]), axis=0)
+    np.testing.assert_allclose(result, expected)
+
+    mixed = VerticalInterpolator(source, [500.0, 3500.0], below="constant", above="nan")
+    np.testing.assert_allclose(mixed(np.array([3.0, 2.0, 1.0]), axis=0), [np.nan, 1.0])
+
+
+def test_missing_values():
+    source = np.array([100000.0, 92500.0, 85000.0])
+    column = np.ma.masked_invalid([np.nan, 2.0, 4.0])
+    result = VerticalInterpolator(source, [96250.0, 92500.0, 88750.0])(column, axis=0)
+    # A missing neighbour does not spoil a level that exists in the source
+    np.testing.assert_allclose(result, [np.nan, 2.0, 3.0])
+
+
+def test_invalid_options():
+    with pytest.raises(ValueError, match="Unknown interpolation method"):
+        VerticalInterpolator(CMIP6_PLEVS, ERA5_PLEVS, method="cubic")
+    with pytest.raises(ValueError, match="Unknown extrapolation"):
+        VerticalInterpolator(CMIP6_PLEVS, ERA5_PLEVS, above="zero")
+    with pytest.raises(ValueError, match="two source levels"):
+        VerticalInterpolator([85000.0], ERA5_PLEVS)
+
+
+def test_interpolate_netcdf(data, tmp_path):
+    data[0, 0, 0, 0] = np.nan
+    src = _signal(tmp_path / "ta_CC_signal.nc", data)
+    interpolate_netcdf(src, tmp_path / "ta_CC_signal_pinterp.nc", "ta", ERA5_PLEVS)
+
+    assert not list(tmp_path.glob("*.part"))
+    with xr.open_dataset(src) as fin, xr.open_dataset(tmp_path / "ta_CC_signal_pinterp.nc") as ds:
+        expected = fin.interp(plev=ERA5_PLEVS, kwargs={"fill_value": "extrapolate"}).ta.values
+        assert ds.ta.dims == ("time", "plev", "lat", "lon") and ds.ta.units == "K"
+        assert ds.plev.units == "Pa"
+        np.testing.assert_array_equal(ds.plev, ERA5_PLEVS)
+        np.testing.assert_array_equal(ds.time, fin.time)
+        np.testing.assert_allclose(ds.ta.values, expected, rtol=1e-5, atol=1e-5)
+        assert np.isnan(ds.ta.values[0, -1, 0, 0])